@@ -4,9 +4,13 @@ from flask_migrate import Migrate
 from flask_cors import CORS
 from .models import db
 from .auth import auth_bp
+from .cache_autenticacao import configurar_cache
+from .audit import configurar_auditoria
 from .routes import api_bp
 from .logs import logs_bp
 from .atividades import atividades_bp
+from .importacao_jobs import jobs_bp
+from .resumo_mensal import dashboard_bp
 import seed
 
 migrate = Migrate()
@@ -34,6 +38,52 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'dev-secret-key-change-in-production')
     
+    # Processos usados para ler vários CSVs de faturamento em paralelo (1 = sequencial)
+    app.config['CSV_PARSER_WORKERS'] = int(os.environ.get('CSV_PARSER_WORKERS', '1'))
+    
+    # Cache em disco dos CSVs já lidos, compartilhado entre processos (0 desativa)
+    app.config['CSV_CACHE_TAMANHO_MB'] = int(os.environ.get('CSV_CACHE_TAMANHO_MB', '256'))
+    app.config['CSV_CACHE_DIR'] = os.environ.get('CSV_CACHE_DIR')
+    
+    # Jobs de importação em segundo plano: threads do worker local e pasta dos uploads
+    app.config['IMPORTACAO_JOB_WORKERS'] = int(os.environ.get('IMPORTACAO_JOB_WORKERS', '2'))
+    app.config['IMPORTACAO_JOBS_DIR'] = os.environ.get('IMPORTACAO_JOBS_DIR')
+    
+    # Validade (minutos) dos previews de importação guardados no servidor até a consolidação
+    app.config['PREVIEW_IMPORTACAO_TTL_MINUTOS'] = int(os.environ.get('PREVIEW_IMPORTACAO_TTL_MINUTOS', '120'))
+    
+    # Consulta de CNPJ: endereço da API (BrasilAPI ou servidor compatível), timeout
+    # (segundos) e validade (horas) das respostas guardadas no banco (0 desativa o cache)
+    app.config['CNPJ_API_URL'] = os.environ.get('CNPJ_API_URL', 'https://brasilapi.com.br/api/cnpj/v1')
+    app.config['CNPJ_API_TIMEOUT'] = int(os.environ.get('CNPJ_API_TIMEOUT', '15'))
+    app.config['CNPJ_CACHE_TTL_HORAS'] = int(os.environ.get('CNPJ_CACHE_TTL_HORAS', '24'))
+    
+    # Atualização cadastral em lote: consultas simultâneas e limite de chamadas à API por segundo
+    app.config['CNPJ_ATUALIZACAO_CONCORRENCIA'] = int(os.environ.get('CNPJ_ATUALIZACAO_CONCORRENCIA', '4'))
+    app.config['CNPJ_ATUALIZACAO_REQUISICOES_POR_SEGUNDO'] = float(os.environ.get('CNPJ_ATUALIZACAO_REQUISICOES_POR_SEGUNDO', '3'))
+    
+    # Cache em memória dos usuários autenticados: validade (segundos; 0 desativa),
+    # quantidade máxima de usuários/tokens e cache dos tokens já verificados
+    app.config['AUTH_CACHE_TTL_SEGUNDOS'] = int(os.environ.get('AUTH_CACHE_TTL_SEGUNDOS', '60'))
+    app.config['AUTH_CACHE_TAMANHO'] = int(os.environ.get('AUTH_CACHE_TAMANHO', '1024'))
+    app.config['AUTH_CACHE_TOKENS'] = os.environ.get('AUTH_CACHE_TOKENS', '1') == '1'
+    
+    # Logs de auditoria gravados em lote por uma thread (0 grava cada log na hora):
+    # registros por lote e espera máxima (segundos) de um registro na fila
+    app.config['AUDITORIA_ASSINCRONA'] = os.environ.get('AUDITORIA_ASSINCRONA', '1') == '1'
+    app.config['AUDITORIA_LOTE_TAMANHO'] = int(os.environ.get('AUDITORIA_LOTE_TAMANHO', '200'))
+    app.config['AUDITORIA_LOTE_INTERVALO_SEGUNDOS'] = float(os.environ.get('AUDITORIA_LOTE_INTERVALO_SEGUNDOS', '1'))
+    
+    # Total das listagens de logs: validade (segundos) da contagem em cache (0 desativa)
+    # e limite da contagem (acima dele o total é informado como aproximado; 0 conta tudo)
+    app.config['LOGS_CONTAGEM_TTL_SEGUNDOS'] = int(os.environ.get('LOGS_CONTAGEM_TTL_SEGUNDOS', '60'))
+    app.config['LOGS_CONTAGEM_LIMITE'] = int(os.environ.get('LOGS_CONTAGEM_LIMITE', '100000'))
+    
+    # Arquivamento dos logs de auditoria (flask arquivar-logs): idade mínima em dias
+    # e pasta dos segmentos compactados (padrão: backend/instance/arquivo_logs)
+    app.config['AUDITORIA_ARQUIVO_DIAS'] = int(os.environ.get('AUDITORIA_ARQUIVO_DIAS', '365'))
+    app.config['AUDITORIA_ARQUIVO_DIR'] = os.environ.get('AUDITORIA_ARQUIVO_DIR')
+    
     # Configuração de DEBUG
     app.config['DEBUG'] = os.environ.get('FLASK_DEBUG') == '1'
 
@@ -46,12 +96,16 @@ def create_app():
     # Inicializa as extensões com a aplicação
     db.init_app(app)
     migrate.init_app(app, db)
+    configurar_cache(app)
+    configurar_auditoria(app)
 
     # Registra os Blueprints com prefixo de URL
     app.register_blueprint(auth_bp)
     app.register_blueprint(api_bp)
     app.register_blueprint(logs_bp)
     app.register_blueprint(atividades_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(dashboard_bp)
 
     # Registra comandos customizados do Flask (como o 'seed-db')
     seed.register_commands(app)
@@ -0,0 +1,395 @@
+"""
+Arquivamento dos logs de auditoria antigos em arquivos compactados
+
+Logs com mais de AUDITORIA_ARQUIVO_DIAS dias saem da tabela log_auditoria e
+vão para segmentos mensais em AUDITORIA_ARQUIVO_DIR: um arquivo JSON Lines
+compactado com gzip por mês (log_auditoria_AAAA-MM.jsonl.gz). Os segmentos
+só crescem: cada execução acrescenta um novo bloco gzip ao fim do arquivo do
+mês, e o gzip lê os blocos em sequência como um único arquivo.
+
+O manifesto (manifesto.json) guarda, por segmento, o tamanho confirmado do
+arquivo, a quantidade de registros, o período, a faixa de ids e as ações,
+entidades e usuários presentes, para que as consultas abram só os segmentos
+que podem ter resultados. Ele também guarda até que data os logs já foram
+arquivados (arquivado_ate).
+
+Ordem de uma execução (flask arquivar-logs):
+1. Blocos gravados depois do último manifesto confirmado (execução
+   interrompida) são descartados, truncando o arquivo ao tamanho confirmado.
+2. Logs já confirmados no manifesto que ainda estão no banco são removidos.
+3. Os logs anteriores ao novo limite são acrescentados aos segmentos, o
+   manifesto é regravado e só então os logs são removidos do banco.
+
+O resumo diário (resumo_logs) não é alterado: as estatísticas continuam
+cobrindo todo o histórico. logs.listar_logs lê os segmentos quando a página
+passa do log mais antigo que ainda está no banco.
+"""
+import os
+import gzip
+import json
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, delete, and_, not_
+from .models import db, LogAuditoria, Usuario
+from .cache_autenticacao import CacheTTL
+
+NOME_MANIFESTO = 'manifesto.json'
+
+# Logs lidos do banco por vez ao arquivar
+TAMANHO_LOTE_LEITURA = 5000
+
+COLUNAS_ARQUIVO = ('id', 'usuario_id', 'acao', 'entidade', 'entidade_id', 'detalhes', 'data_acao', 'ip_address')
+
+# Segmentos já lidos (chave: arquivo e tamanho), para a paginação não
+# descompactar o mesmo mês a cada página
+_segmentos_lidos = CacheTTL(4, 600)
+
+
+class LogArquivado:
+    """Log lido de um segmento, com os mesmos atributos e to_dict de LogAuditoria"""
+
+    __slots__ = COLUNAS_ARQUIVO + ('usuario_nome',)
+
+    def __init__(self, dados):
+        for coluna in COLUNAS_ARQUIVO:
+            setattr(self, coluna, dados.get(coluna))
+        self.data_acao = datetime.fromisoformat(self.data_acao)
+        self.usuario_nome = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'usuario_id': self.usuario_id,
+            'usuario_nome': self.usuario_nome or 'Usuário Removido',
+            'acao': self.acao,
+            'entidade': self.entidade,
+            'entidade_id': self.entidade_id,
+            'detalhes': json.loads(self.detalhes) if self.detalhes else {},
+            'data_acao': self.data_acao.isoformat(),
+            'ip_address': self.ip_address,
+            'arquivado': True
+        }
+
+
+# Pasta padrão das versões anteriores, dentro do código-fonte
+PASTA_ARQUIVO_ANTIGA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'arquivo_logs')
+
+
+def pasta_arquivo(app=None):
+    """
+    Pasta dos segmentos: AUDITORIA_ARQUIVO_DIR ou <instância>/arquivo_logs.
+    Instalações que já arquivaram na pasta antiga (backend/arquivo_logs)
+    continuam usando-a enquanto a nova não tiver manifesto
+    """
+    app = app or current_app
+    if app.config.get('AUDITORIA_ARQUIVO_DIR'):
+        return app.config['AUDITORIA_ARQUIVO_DIR']
+    pasta = os.path.join(app.instance_path, 'arquivo_logs')
+    if (not os.path.exists(os.path.join(pasta, NOME_MANIFESTO))
+            and os.path.exists(os.path.join(PASTA_ARQUIVO_ANTIGA, NOME_MANIFESTO))):
+        return PASTA_ARQUIVO_ANTIGA
+    return pasta
+
+def ler_manifesto(pasta):
+    """Manifesto da pasta (vazio se ainda não houve arquivamento)"""
+    caminho = os.path.join(pasta, NOME_MANIFESTO)
+    if not os.path.exists(caminho):
+        return {'arquivado_ate': None, 'ultimo_id': 0, 'segmentos': {}}
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+def _gravar_manifesto(pasta, manifesto):
+    # Arquivo temporário + os.replace: o manifesto nunca fica pela metade
+    caminho = os.path.join(pasta, NOME_MANIFESTO)
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(manifesto, arquivo, ensure_ascii=False, indent=2, sort_keys=True)
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+    os.replace(temporario, caminho)
+
+
+def _descartar_blocos_nao_confirmados(pasta, manifesto):
+    """Trunca os segmentos ao tamanho registrado no manifesto e remove os que ele não conhece"""
+    conhecidos = {segmento['arquivo']: segmento['tamanho'] for segmento in manifesto['segmentos'].values()}
+    for nome in os.listdir(pasta):
+        if not (nome.startswith('log_auditoria_') and nome.endswith('.jsonl.gz')):
+            continue
+        caminho = os.path.join(pasta, nome)
+        if nome not in conhecidos:
+            os.remove(caminho)
+        elif os.path.getsize(caminho) > conhecidos[nome]:
+            with open(caminho, 'r+b') as arquivo:
+                arquivo.truncate(conhecidos[nome])
+
+def _condicao_arquivados(manifesto):
+    # Logs já confirmados no manifesto: anteriores ao limite e com id até o último arquivado
+    return (
+        LogAuditoria.data_acao < datetime.fromisoformat(manifesto['arquivado_ate']),
+        LogAuditoria.id <= manifesto['ultimo_id']
+    )
+
+def filtro_nao_arquivados(manifesto):
+    """Condição que exclui do banco os logs já confirmados no manifesto (ainda não removidos)"""
+    if not manifesto['arquivado_ate']:
+        return None
+    return not_(and_(*_condicao_arquivados(manifesto)))
+
+def _remover_arquivados(manifesto):
+    if not manifesto['arquivado_ate']:
+        return 0
+    resultado = db.session.execute(delete(LogAuditoria).where(*_condicao_arquivados(manifesto)))
+    db.session.commit()
+    return resultado.rowcount
+
+
+def arquivar_logs(dias=None, simular=False):
+    """
+    Move para os segmentos os logs com mais de `dias` dias (padrão:
+    AUDITORIA_ARQUIVO_DIAS), contados em dias inteiros.
+
+    Args:
+        dias (int, optional): Horizonte; logs anteriores a (hoje - dias) são arquivados
+        simular (bool): Só conta os logs que seriam arquivados, por mês
+
+    Returns:
+        dict: Limite usado, quantidade de logs arquivados por mês e total
+    """
+    dias = current_app.config.get('AUDITORIA_ARQUIVO_DIAS', 365) if dias is None else dias
+    limite = datetime.combine((datetime.utcnow() - timedelta(days=dias)).date(), datetime.min.time())
+    pasta = pasta_arquivo()
+
+    if simular:
+        por_mes = Counter(
+            data_acao.strftime('%Y-%m') for data_acao in db.session.execute(
+                select(LogAuditoria.data_acao).where(LogAuditoria.data_acao < limite)
+                .execution_options(yield_per=TAMANHO_LOTE_LEITURA)
+            ).scalars()
+        )
+        return {'limite': limite.isoformat(), 'simulacao': True, 'por_mes': dict(sorted(por_mes.items())), 'total': sum(por_mes.values())}
+
+    os.makedirs(pasta, exist_ok=True)
+    manifesto = ler_manifesto(pasta)
+    _descartar_blocos_nao_confirmados(pasta, manifesto)
+    _remover_arquivados(manifesto)
+
+    consulta = (
+        select(*(getattr(LogAuditoria, coluna) for coluna in COLUNAS_ARQUIVO))
+        .where(LogAuditoria.data_acao < limite)
+        .order_by(LogAuditoria.data_acao, LogAuditoria.id)
+        .execution_options(yield_per=TAMANHO_LOTE_LEITURA)
+    )
+    por_mes = {}
+    valores = {}
+    ultimo_id = manifesto['ultimo_id']
+    mes_atual, saida, linhas = None, None, []
+    try:
+        for linha in db.session.execute(consulta):
+            data_acao = linha.data_acao.isoformat()
+            mes = data_acao[:7]
+            if mes != mes_atual:
+                if saida is not None:
+                    saida.writelines(linhas)
+                    saida.close()
+                    linhas = []
+                mes_atual = mes
+                segmento = manifesto['segmentos'].setdefault(mes, {
+                    'arquivo': f'log_auditoria_{mes}.jsonl.gz', 'tamanho': 0, 'registros': 0,
+                    'inicio': None, 'fim': None, 'id_min': None, 'id_max': None,
+                    'acoes': [], 'entidades': [], 'usuarios': []
+                })
+                distintos = valores.setdefault(mes, {
+                    campo: set(segmento[campo]) for campo in ('acoes', 'entidades', 'usuarios')
+                })
+                # Os logs chegam em ordem de data: o primeiro do mês nesta execução
+                # só pode mover o início de um segmento vazio
+                segmento['inicio'] = segmento['inicio'] or data_acao
+                por_mes[mes] = 0
+                # Cada execução acrescenta um novo bloco gzip ao segmento do mês
+                saida = gzip.open(os.path.join(pasta, segmento['arquivo']), 'at', encoding='utf-8', compresslevel=6)
+
+            registro = dict(linha._mapping)
+            registro['data_acao'] = data_acao
+            linhas.append(json.dumps(registro, ensure_ascii=False) + '\n')
+            if len(linhas) >= TAMANHO_LOTE_LEITURA:
+                saida.writelines(linhas)
+                linhas = []
+
+            segmento['fim'] = data_acao
+            segmento['id_min'] = linha.id if segmento['id_min'] is None else min(segmento['id_min'], linha.id)
+            segmento['id_max'] = linha.id if segmento['id_max'] is None else max(segmento['id_max'], linha.id)
+            distintos['acoes'].add(linha.acao)
+            distintos['entidades'].add(linha.entidade)
+            distintos['usuarios'].add(linha.usuario_id)
+            por_mes[mes] += 1
+            ultimo_id = max(ultimo_id, linha.id)
+        if saida is not None:
+            saida.writelines(linhas)
+    finally:
+        if saida is not None:
+            saida.close()
+
+    if not por_mes:
+        return {'limite': limite.isoformat(), 'simulacao': False, 'por_mes': {}, 'total': 0}
+
+    for mes, quantidade in por_mes.items():
+        segmento = manifesto['segmentos'][mes]
+        caminho = os.path.join(pasta, segmento['arquivo'])
+        with open(caminho, 'rb') as arquivo:
+            os.fsync(arquivo.fileno())
+        segmento['tamanho'] = os.path.getsize(caminho)
+        segmento['registros'] += quantidade
+        for campo, distintos in valores[mes].items():
+            segmento[campo] = sorted(distintos, key=lambda valor: (valor is None, valor))
+
+    anterior = manifesto['arquivado_ate']
+    manifesto['arquivado_ate'] = max(anterior, limite.isoformat()) if anterior else limite.isoformat()
+    manifesto['ultimo_id'] = ultimo_id
+    _gravar_manifesto(pasta, manifesto)
+
+    # Só depois do manifesto confirmado os logs saem do banco
+    db.session.execute(delete(LogAuditoria).where(LogAuditoria.data_acao < limite, LogAuditoria.id <= ultimo_id))
+    db.session.commit()
+    return {'limite': limite.isoformat(), 'simulacao': False, 'por_mes': por_mes, 'total': sum(por_mes.values())}
+
+
+def _ler_segmento(pasta, segmento):
+    """
+    Registros (dicionários) do segmento em ordem crescente de (data_acao,
+    id), com a lista das chaves para a busca binária da posição do cursor
+    """
+    chave = (pasta, segmento['arquivo'], segmento['tamanho'])
+    lido = _segmentos_lidos.obter(chave)
+    if lido is None:
+        caminho = os.path.join(pasta, segmento['arquivo'])
+        with open(caminho, 'rb') as bruto:
+            # Só a parte confirmada no manifesto
+            with gzip.open(_Limitado(bruto, segmento['tamanho']), 'rt', encoding='utf-8') as arquivo:
+                registros = [json.loads(linha) for linha in arquivo if linha.strip()]
+        # LogArquivado só é montado para os registros que atendem aos filtros
+        chaves = [(datetime.fromisoformat(registro['data_acao']), registro['id']) for registro in registros]
+        ordem = sorted(range(len(registros)), key=chaves.__getitem__)
+        lido = ([registros[indice] for indice in ordem], [chaves[indice] for indice in ordem])
+        _segmentos_lidos.guardar(chave, lido)
+    return lido
+
+class _Limitado:
+    """Leitura de um arquivo binário até `tamanho` bytes"""
+
+    def __init__(self, arquivo, tamanho):
+        self.arquivo = arquivo
+        self.restante = tamanho
+
+    def read(self, quantidade=-1):
+        if quantidade is None or quantidade < 0 or quantidade > self.restante:
+            quantidade = self.restante
+        dados = self.arquivo.read(quantidade)
+        self.restante -= len(dados)
+        return dados
+
+
+class ConsultaArquivo:
+    """Logs arquivados que atendem aos filtros de listar_logs"""
+
+    def __init__(self, pasta, manifesto, acao=None, entidade=None, usuario_id=None, inicio=None, fim=None):
+        """
+        Args:
+            inicio (datetime, optional): Data mínima (inclusive)
+            fim (datetime, optional): Data máxima (exclusive)
+        """
+        self.pasta = pasta
+        self.manifesto = manifesto
+        self.acao = acao
+        self.entidade = entidade
+        self.usuario_id = usuario_id
+        self.inicio = inicio
+        self.fim = fim
+        self.limite = datetime.fromisoformat(manifesto['arquivado_ate'])
+
+    def _segmentos(self, posicao=None):
+        for mes in sorted(self.manifesto['segmentos'], reverse=True):
+            segmento = self.manifesto['segmentos'][mes]
+            if not segmento['registros']:
+                continue
+            primeiro = datetime.fromisoformat(segmento['inicio'])
+            ultimo = datetime.fromisoformat(segmento['fim'])
+            if self.fim is not None and primeiro >= self.fim:
+                continue
+            if posicao is not None and primeiro > posicao[0]:
+                continue
+            if self.inicio is not None and ultimo < self.inicio:
+                break
+            if self.acao and self.acao not in segmento['acoes']:
+                continue
+            if self.entidade and self.entidade not in segmento['entidades']:
+                continue
+            if self.usuario_id and self.usuario_id not in segmento['usuarios']:
+                continue
+            yield segmento
+
+    def _atende(self, registro):
+        return (
+            (not self.acao or registro['acao'] == self.acao)
+            and (not self.entidade or registro['entidade'] == self.entidade)
+            and (not self.usuario_id or registro.get('usuario_id') == self.usuario_id)
+        )
+
+    def iterar(self, posicao=None):
+        """
+        Logs arquivados do mais recente para o mais antigo, depois da
+        posição (data_acao, id) do cursor, se houver
+        """
+        for segmento in self._segmentos(posicao):
+            registros, chaves = _ler_segmento(self.pasta, segmento)
+            # Começa logo antes do cursor (ou do fim do período), do fim para o início
+            posicao_final = len(registros)
+            if posicao is not None:
+                posicao_final = bisect_left(chaves, posicao)
+            if self.fim is not None:
+                posicao_final = min(posicao_final, bisect_left(chaves, (self.fim,)))
+            for indice in range(posicao_final - 1, -1, -1):
+                if self.inicio is not None and chaves[indice][0] < self.inicio:
+                    break
+                if self._atende(registros[indice]):
+                    yield LogArquivado(registros[indice])
+
+def consultar_arquivo(**filtros):
+    """ConsultaArquivo com os filtros, ou None se nenhum log foi arquivado"""
+    pasta = pasta_arquivo()
+    manifesto = ler_manifesto(pasta)
+    if not manifesto['arquivado_ate'] or not manifesto['segmentos']:
+        return None
+    if filtros.get('inicio') is not None and filtros['inicio'] >= datetime.fromisoformat(manifesto['arquivado_ate']):
+        return None
+    return ConsultaArquivo(pasta, manifesto, **filtros)
+
+def contar_arquivados(inicio=None, fim=None):
+    """
+    Registros arquivados entre duas datas (inclusive), no formato usado por
+    resumo_logs.contar_registros (para reconstruir o resumo diário)
+    """
+    pasta = pasta_arquivo()
+    manifesto = ler_manifesto(pasta)
+    if not manifesto['segmentos']:
+        return []
+    consulta = ConsultaArquivo(
+        pasta, manifesto,
+        inicio=datetime.combine(inicio, datetime.min.time()) if inicio else None,
+        fim=datetime.combine(fim + timedelta(days=1), datetime.min.time()) if fim else None
+    )
+    return [
+        {'data_acao': log.data_acao, 'acao': log.acao, 'entidade': log.entidade, 'usuario_id': log.usuario_id}
+        for log in consulta.iterar()
+    ]
+
+def preencher_nomes_usuarios(logs):
+    """Nome do usuário dos logs arquivados da página (uma consulta)"""
+    arquivados = [log for log in logs if isinstance(log, LogArquivado)]
+    ids = {log.usuario_id for log in arquivados}
+    if not ids:
+        return
+    nomes = dict(db.session.execute(select(Usuario.id, Usuario.nome).where(Usuario.id.in_(ids))).all())
+    for log in arquivados:
+        log.usuario_nome = nomes.get(log.usuario_id)
@@ -6,7 +6,7 @@ from .models import db, LogAuditoria, Usuario, Cliente, Processamento, Faturamen
 from .auth import token_required, admin_required
 from .audit import log_action
 from .lixeira import restaurar_da_lixeira
-from sqlalchemy import desc
+from .consulta_logs import paginar_logs, contar_logs, total_paginas
 import json
 
 atividades_bp = Blueprint('atividades', __name__, url_prefix='/api/atividades')
@@ -15,30 +15,44 @@ atividades_bp = Blueprint('atividades', __name__, url_prefix='/api/atividades')
 @token_required
 @admin_required
 def listar_atividades(current_user):
-    """Retorna o histórico de atividades relevantes (CLIENTE e FATURAMENTO)"""
+    """
+    Retorna o histórico de atividades relevantes (CLIENTE e FATURAMENTO).
+    Aceita `cursor` (proximo_cursor da página anterior) como listar_logs.
+    """
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 50, type=int)
+    cursor = request.args.get('cursor')
     
     # Filtros opcionais
     tipo = request.args.get('tipo')  # CLIENTE ou FATURAMENTO
     usuario_id = request.args.get('usuario_id', type=int)
     
     # Query base - apenas CREATE e DELETE de CLIENTE e FATURAMENTO
-    query = LogAuditoria.query.filter(
-        LogAuditoria.entidade.in_(['CLIENTE', 'FATURAMENTO']),
-        LogAuditoria.acao.in_(['CREATE', 'DELETE'])
-    ).order_by(desc(LogAuditoria.data_acao))
-    
+    entidades = ['CLIENTE', 'FATURAMENTO']
+    acoes = ['CREATE', 'DELETE']
     if tipo:
-        query = query.filter_by(entidade=tipo)
-    if usuario_id:
-        query = query.filter_by(usuario_id=usuario_id)
+        entidades = [tipo] if tipo in entidades else []
+    
+    filtros = [LogAuditoria.usuario_id == usuario_id] if usuario_id else []
+    
+    # Um par entidade/ação por consulta, cada uma em ordem pelo índice
+    particoes = [
+        [LogAuditoria.entidade == entidade, LogAuditoria.acao == acao]
+        for entidade in entidades for acao in acoes
+    ]
+    
+    try:
+        logs, proximo_cursor = paginar_logs(filtros, per_page, cursor, page, particoes)
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
     
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    total, total_exato = contar_logs(('atividades', tipo, usuario_id), filtros + [
+        LogAuditoria.entidade.in_(entidades), LogAuditoria.acao.in_(acoes)
+    ])
     
     # Formatar atividades
     atividades = []
-    for log in pagination.items:
+    for log in logs:
         atividade = log.to_dict()
         
         # Adicionar informações específicas baseadas no tipo
@@ -87,9 +101,11 @@ def listar_atividades(current_user):
     
     return jsonify({
         'atividades': atividades,
-        'total': pagination.total,
-        'total_pages': pagination.pages,
-        'current_page': pagination.page
+        'total': total,
+        'total_exato': total_exato,
+        'total_pages': total_paginas(total, per_page),
+        'current_page': page,
+        'proximo_cursor': proximo_cursor
     })
 
 
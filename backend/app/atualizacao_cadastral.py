@@ -0,0 +1,215 @@
+"""
+Atualização em lote dos dados cadastrais dos clientes PJ pela Receita Federal
+
+Os CNPJs são consultados em paralelo (ThreadPoolExecutor com
+CNPJ_ATUALIZACAO_CONCORRENCIA threads), com no máximo
+CNPJ_ATUALIZACAO_REQUISICOES_POR_SEGUNDO chamadas à API entre todas as
+threads. As consultas passam pelo cache de consulta_cnpj.py: respostas
+recentes não voltam à API, e uma atualização interrompida pode ser repetida
+sem refazer as chamadas já feitas.
+
+Cada resposta é convertida com mapear_dados_receita (o mesmo formato do
+cadastro pela tela) e comparada com as colunas do cliente; só os campos
+diferentes são gravados, com UPDATEs em lote.
+"""
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+from sqlalchemy import select, update, func
+from .models import db, Cliente
+from .consulta_cnpj import obter_servico_cnpj, mapear_dados_receita, ServicoConsultaCNPJ, CNPJNaoEncontrado
+from .busca_clientes import indexar_clientes
+
+# Colunas do cliente atualizadas com os dados da Receita. Telefones e e-mail
+# ficam de fora: costumam ser mantidos pelo escritório
+CAMPOS_RECEITA = (
+    'razao_social', 'nome_fantasia', 'data_abertura', 'situacao_cadastral', 'data_situacao',
+    'motivo_situacao', 'natureza_juridica', 'cnae_principal', 'cnae_secundarias',
+    'logradouro', 'numero', 'complemento', 'bairro', 'cep', 'municipio', 'uf',
+    'capital_social', 'porte', 'opcao_simples', 'data_opcao_simples', 'opcao_mei',
+    'situacao_especial', 'data_situacao_especial'
+)
+
+# Quantidade de linhas por UPDATE em lote
+TAMANHO_LOTE_UPDATE = 500
+
+
+class LimitadorTaxa:
+    """Espaça as chamadas para no máximo `por_segundo` por segundo, somando todas as threads"""
+
+    def __init__(self, por_segundo):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self._proxima = 0.0
+        self._lock = threading.Lock()
+
+    def aguardar(self):
+        if not self.intervalo:
+            return
+        with self._lock:
+            agora = time.monotonic()
+            espera = self._proxima - agora
+            self._proxima = max(agora, self._proxima) + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+
+class FonteLimitada:
+    """Fonte de consulta de CNPJ que respeita um LimitadorTaxa (só as chamadas à API, não o cache)"""
+
+    def __init__(self, fonte, limitador):
+        self.fonte = fonte
+        self.limitador = limitador
+
+    def consultar(self, cnpj):
+        self.limitador.aguardar()
+        return self.fonte.consultar(cnpj)
+
+
+def _filtro_clientes_pj(cliente_ids=None):
+    condicoes = [func.coalesce(Cliente.tipo_pessoa, 'PJ') == 'PJ', Cliente.cnpj_digitos.isnot(None)]
+    if cliente_ids:
+        condicoes.append(Cliente.id.in_(cliente_ids))
+    return condicoes
+
+def contar_clientes_pj(cliente_ids=None):
+    """Quantidade de clientes que atualizar_cadastros vai consultar"""
+    return db.session.execute(select(func.count(Cliente.id)).where(*_filtro_clientes_pj(cliente_ids))).scalar()
+
+def _carregar_clientes_pj(cliente_ids=None):
+    """Clientes PJ com CNPJ (id, cnpj_digitos e os campos da Receita)"""
+    return db.session.execute(
+        select(Cliente.id, Cliente.cnpj_digitos, *(getattr(Cliente, campo) for campo in CAMPOS_RECEITA))
+        .where(*_filtro_clientes_pj(cliente_ids)).order_by(Cliente.id)
+    ).all()
+
+def _valores_receita(dados_api):
+    """Valores das colunas de CAMPOS_RECEITA a partir da resposta da API"""
+    dados = mapear_dados_receita(dados_api)
+    valores = {campo: dados.get(campo) for campo in CAMPOS_RECEITA}
+    # Como no cadastro: lista de CNAEs secundários guardada como JSON
+    valores['cnae_secundarias'] = json.dumps(valores['cnae_secundarias']) if valores['cnae_secundarias'] else None
+    return valores
+
+def comparar_cadastro(cliente, valores):
+    """
+    Campos em que o cadastro difere da Receita.
+
+    Args:
+        cliente: Objeto com os atributos de CAMPOS_RECEITA
+        valores (dict): Saída de _valores_receita
+
+    Returns:
+        dict: {campo: {'antes': ..., 'depois': ...}}; vazio e None são
+            considerados iguais
+    """
+    diferencas = {}
+    for campo in CAMPOS_RECEITA:
+        antes = getattr(cliente, campo)
+        depois = valores[campo]
+        if (antes or None) != (depois or None):
+            diferencas[campo] = {'antes': antes, 'depois': depois}
+    return diferencas
+
+def _consultar(app, servico, cnpj, usar_cache):
+    # Cada thread usa a própria sessão do banco (para o cache)
+    with app.app_context():
+        return servico.consultar(cnpj, usar_cache=usar_cache)
+
+def atualizar_cadastros(cliente_ids=None, aplicar=False, usar_cache=True, limite_diferencas=200, ao_progredir=None):
+    """
+    Consulta a Receita para todos os clientes PJ (ou os informados) e compara
+    com o cadastro.
+
+    Args:
+        cliente_ids (list, optional): Restringe a atualização a esses clientes
+        aplicar (bool): Se True, grava os campos alterados (UPDATE em lote e
+            reindexação da busca de clientes). Não faz commit
+        usar_cache (bool): False consulta a API mesmo para CNPJs no cache
+        limite_diferencas (int): Quantidade máxima de clientes listados em
+            'alteracoes' e em 'erros'
+        ao_progredir (callable, optional): Chamada a cada cliente concluído
+            com a situação ('alterado', 'sem_alteracao', 'nao_encontrado' ou
+            'erro'); uma exceção lançada por ela interrompe a atualização
+
+    Returns:
+        dict: Relatório com totais e as alterações encontradas
+    """
+    app = current_app._get_current_object()
+    clientes = _carregar_clientes_pj(cliente_ids)
+
+    base = obter_servico_cnpj(app)
+    servico = ServicoConsultaCNPJ(
+        FonteLimitada(base.fonte, LimitadorTaxa(app.config.get('CNPJ_ATUALIZACAO_REQUISICOES_POR_SEGUNDO', 3))),
+        validade=base.validade,
+        validade_nao_encontrado=base.validade_nao_encontrado
+    )
+
+    alteracoes = []
+    nao_encontrados = []
+    erros = []
+    sem_alteracao = 0
+
+    executor = ThreadPoolExecutor(
+        max_workers=app.config.get('CNPJ_ATUALIZACAO_CONCORRENCIA', 4),
+        thread_name_prefix='atualizacao-cnpj'
+    )
+    try:
+        futuros = {
+            executor.submit(_consultar, app, servico, cliente.cnpj_digitos, usar_cache): cliente
+            for cliente in clientes
+        }
+        for futuro in as_completed(futuros):
+            cliente = futuros[futuro]
+            try:
+                diferencas = comparar_cadastro(cliente, _valores_receita(futuro.result()))
+            except CNPJNaoEncontrado:
+                nao_encontrados.append(cliente.id)
+                situacao = 'nao_encontrado'
+            except Exception as e:
+                erros.append({'cliente_id': cliente.id, 'cnpj': cliente.cnpj_digitos, 'erro': str(e)})
+                situacao = 'erro'
+            else:
+                if diferencas:
+                    alteracoes.append({'cliente_id': cliente.id, 'razao_social': cliente.razao_social, 'campos': diferencas})
+                    situacao = 'alterado'
+                else:
+                    sem_alteracao += 1
+                    situacao = 'sem_alteracao'
+            if ao_progredir:
+                ao_progredir(situacao)
+    finally:
+        # Em caso de interrupção, descarta as consultas que ainda não começaram
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    alteracoes.sort(key=lambda alteracao: alteracao['cliente_id'])
+    erros.sort(key=lambda erro: erro['cliente_id'])
+
+    relatorio = {
+        'aplicado': bool(aplicar),
+        'total_clientes': len(clientes),
+        'clientes_alterados': len(alteracoes),
+        'clientes_sem_alteracao': sem_alteracao,
+        'nao_encontrados': sorted(nao_encontrados),
+        'total_erros': len(erros),
+        'erros': erros[:limite_diferencas],
+        'alteracoes': alteracoes[:limite_diferencas]
+    }
+
+    if aplicar and alteracoes:
+        valores = [
+            {'id': alteracao['cliente_id'], **{campo: diferenca['depois'] for campo, diferenca in alteracao['campos'].items()}}
+            for alteracao in alteracoes
+        ]
+        for inicio in range(0, len(valores), TAMANHO_LOTE_UPDATE):
+            db.session.execute(update(Cliente), valores[inicio:inicio + TAMANHO_LOTE_UPDATE])
+
+        # O UPDATE em lote não passa pelos eventos do ORM que mantêm a busca de clientes
+        ids_alterados = [alteracao['cliente_id'] for alteracao in alteracoes]
+        indexar_clientes(db.session.connection(), db.session.execute(select(
+            Cliente.id, Cliente.tipo_pessoa, Cliente.razao_social, Cliente.nome_completo,
+            Cliente.nome_fantasia, Cliente.cnpj_digitos, Cliente.cpf_digitos, Cliente.municipio
+        ).where(Cliente.id.in_(ids_alterados))).all())
+
+    return relatorio
@@ -1,11 +1,201 @@
 """
 Módulo de auditoria para registrar logs de ações dos usuários
+
+Por padrão, log_action não grava na hora: o registro vai para uma fila em
+memória (GravadorAuditoria) e uma thread em segundo plano grava os registros
+em lote, com um único INSERT, quando a fila chega a AUDITORIA_LOTE_TAMANHO
+registros ou AUDITORIA_LOTE_INTERVALO_SEGUNDOS depois do primeiro registro
+pendente. A gravação usa uma sessão própria, então não faz commit (nem
+rollback) do que a rota ainda não confirmou. A fila é descarregada ao
+encerrar o processo; um registro leva até o intervalo configurado para
+aparecer nas consultas de logs.
+
+Para registros que devem ser confirmados (ou desfeitos) junto com a
+operação, use log_action(..., transacional=True) ou registrar_logs_em_lote,
+que gravam na transação de quem chamou.
 """
 import json
-from flask import request
+import queue
+import atexit
+import threading
+import time
+from datetime import datetime
+from flask import request, current_app
+from sqlalchemy import insert
 from .models import db, LogAuditoria
+from .resumo_logs import acumular_resumo_logs
+
+# Marcador que encerra a thread do gravador
+_PARAR = object()
+
+def montar_registro_log(usuario_id, acao, entidade, entidade_id=None, detalhes=None, ip_address=None):
+    """
+    Monta os valores de um registro de auditoria sem gravá-lo no banco.
+    Recebe os mesmos argumentos de log_action.
+    
+    Returns:
+        dict: Valores das colunas de LogAuditoria
+    """
+    # Se não foi fornecido IP, tenta pegar do request
+    if ip_address is None and request:
+        ip_address = request.remote_addr
+    
+    # Converte detalhes para JSON se for um dict
+    detalhes_json = None
+    if detalhes:
+        if isinstance(detalhes, dict):
+            detalhes_json = json.dumps(detalhes, ensure_ascii=False)
+        else:
+            detalhes_json = str(detalhes)
+    
+    return {
+        'usuario_id': usuario_id,
+        'acao': acao,
+        'entidade': entidade,
+        'entidade_id': entidade_id,
+        'detalhes': detalhes_json,
+        # Momento da ação, e não o da gravação em lote
+        'data_acao': datetime.utcnow(),
+        'ip_address': ip_address
+    }
+
 
-def log_action(usuario_id, acao, entidade, entidade_id=None, detalhes=None, ip_address=None):
+class GravadorAuditoria:
+    """
+    Fila de registros de auditoria gravados em lote por uma thread própria
+    (iniciada no primeiro registro)
+    """
+
+    def __init__(self, app, tamanho_lote=200, intervalo=1.0):
+        """
+        Args:
+            app: Aplicação Flask (a thread abre o próprio app_context)
+            tamanho_lote (int): Registros pendentes que disparam a gravação
+            intervalo (float): Segundos máximos que um registro espera na fila
+        """
+        self.app = app
+        self.tamanho_lote = max(1, tamanho_lote)
+        self.intervalo = intervalo
+        self._fila = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def registrar(self, registro):
+        """Enfileira um registro montado com montar_registro_log"""
+        self._iniciar()
+        self._fila.put(registro)
+
+    def descarregar(self, timeout=None):
+        """
+        Grava tudo o que já foi enfileirado e espera a gravação terminar.
+
+        Returns:
+            bool: False se o timeout acabou antes
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        concluido = threading.Event()
+        self._fila.put(concluido)
+        return concluido.wait(timeout)
+
+    def encerrar(self, timeout=10):
+        """Grava os registros pendentes e encerra a thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._fila.put(_PARAR)
+            thread.join(timeout)
+
+    def _iniciar(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name='gravador-auditoria', daemon=True)
+                self._thread.start()
+
+    def _executar(self):
+        lote = []
+        limite = None
+        while True:
+            espera = None if not lote else max(0.0, limite - time.monotonic())
+            try:
+                item = self._fila.get(timeout=espera)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, dict):
+                if not lote:
+                    limite = time.monotonic() + self.intervalo
+                lote.append(item)
+                if len(lote) < self.tamanho_lote:
+                    continue
+
+            # Tamanho ou tempo atingido, pedido de descarga ou encerramento
+            self.gravar(lote)
+            lote = []
+            if item is _PARAR:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def gravar(self, registros):
+        """
+        Grava os registros com um INSERT em lote, em uma transação própria,
+        junto com as contagens do resumo diário (resumo_logs).
+        Se o lote falhar, tenta um registro por vez para não perder os demais.
+        """
+        if not registros:
+            return
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(LogAuditoria), registros)
+                acumular_resumo_logs(registros)
+                db.session.commit()
+                return
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.warning(f"Falha ao gravar lote de {len(registros)} logs de auditoria: {e}")
+
+            for registro in registros:
+                try:
+                    db.session.execute(insert(LogAuditoria), [registro])
+                    acumular_resumo_logs([registro])
+                    db.session.commit()
+                except Exception as e:
+                    # Se falhar ao registrar o log, não deve quebrar a operação principal
+                    db.session.rollback()
+                    self.app.logger.error(f"Erro ao registrar log de auditoria: {e} ({registro['acao']} {registro['entidade']})")
+
+
+def configurar_auditoria(app):
+    """
+    Cria o gravador de auditoria da aplicação (AUDITORIA_LOTE_TAMANHO,
+    AUDITORIA_LOTE_INTERVALO_SEGUNDOS) e agenda a descarga da fila ao
+    encerrar o processo
+    """
+    gravador = GravadorAuditoria(
+        app,
+        tamanho_lote=app.config.get('AUDITORIA_LOTE_TAMANHO', 200),
+        intervalo=app.config.get('AUDITORIA_LOTE_INTERVALO_SEGUNDOS', 1.0)
+    )
+    app.extensions['gravador_auditoria'] = gravador
+    atexit.register(gravador.encerrar)
+    return gravador
+
+def obter_gravador(app=None):
+    """Gravador de auditoria da aplicação (criado na primeira chamada, se preciso)"""
+    app = app or current_app._get_current_object()
+    gravador = app.extensions.get('gravador_auditoria')
+    if gravador is None:
+        gravador = configurar_auditoria(app)
+    return gravador
+
+def descarregar_logs(timeout=None):
+    """Grava imediatamente os logs de auditoria que estão na fila"""
+    return obter_gravador().descarregar(timeout)
+
+def log_action(usuario_id, acao, entidade, entidade_id=None, detalhes=None, ip_address=None, transacional=False):
     """
     Registra uma ação no log de auditoria
     
@@ -16,36 +206,32 @@ def log_action(usuario_id, acao, entidade, entidade_id=None, detalhes=None, ip_a
         entidade_id (int, optional): ID da entidade afetada
         detalhes (dict, optional): Detalhes adicionais da operação
         ip_address (str, optional): Endereço IP do usuário
+        transacional (bool): Se True, grava na transação de quem chamou (sem
+            commit), junto com a operação. Se False, o registro vai para a
+            fila do gravador de auditoria (ou é gravado na hora, em transação
+            própria, com AUDITORIA_ASSINCRONA desligada)
+    """
+    registro = montar_registro_log(usuario_id, acao, entidade, entidade_id, detalhes, ip_address)
+    if transacional:
+        registrar_logs_em_lote([registro])
+        return
+
+    gravador = obter_gravador()
+    if current_app.config.get('AUDITORIA_ASSINCRONA', True):
+        gravador.registrar(registro)
+    else:
+        gravador.gravar([registro])
+
+def registrar_logs_em_lote(registros):
+    """
+    Grava vários registros de auditoria (montados com montar_registro_log) com
+    um único INSERT em lote, dentro da transação de quem chamou, e soma os
+    registros ao resumo diário (resumo_logs).
+    Não faz commit: os logs são gravados junto com a operação principal.
     """
-    try:
-        # Se não foi fornecido IP, tenta pegar do request
-        if ip_address is None and request:
-            ip_address = request.remote_addr
-        
-        # Converte detalhes para JSON se for um dict
-        detalhes_json = None
-        if detalhes:
-            if isinstance(detalhes, dict):
-                detalhes_json = json.dumps(detalhes, ensure_ascii=False)
-            else:
-                detalhes_json = str(detalhes)
-        
-        log = LogAuditoria(
-            usuario_id=usuario_id,
-            acao=acao,
-            entidade=entidade,
-            entidade_id=entidade_id,
-            detalhes=detalhes_json,
-            ip_address=ip_address
-        )
-        
-        db.session.add(log)
-        db.session.commit()
-        
-    except Exception as e:
-        # Se falhar ao registrar o log, não deve quebrar a operação principal
-        print(f"Erro ao registrar log de auditoria: {e}")
-        db.session.rollback()
+    if registros:
+        db.session.execute(insert(LogAuditoria), registros)
+        acumular_resumo_logs(registros)
 
 def log_cliente_action(usuario_id, acao, cliente_id, cliente_nome, detalhes=None):
     """Log específico para ações em clientes"""
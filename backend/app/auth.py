@@ -7,10 +7,15 @@ from flask import request, jsonify, Blueprint
 from werkzeug.security import generate_password_hash, check_password_hash
 from .models import db, Usuario
 from .audit import log_action, log_login
+from .cache_autenticacao import obter_usuario_autenticado, obter_usuario_debug, obter_token_verificado, guardar_token_verificado
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
 def token_required(f):
+    """
+    Autentica a requisição pelo token JWT e entrega às rotas um
+    UsuarioAutenticado (ver cache_autenticacao.py) como current_user
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
         # --- BYPASS DE DESENVOLVIMENTO ---
@@ -18,7 +23,7 @@ def token_required(f):
         if os.environ.get('FLASK_DEBUG') == '1':
             # Usamos o primeiro usuário do banco como o 'current_user' para as rotas.
             # Isso requer que o comando 'seed-db' tenha sido executado pelo menos uma vez.
-            dev_user = Usuario.query.first()
+            dev_user = obter_usuario_debug()
             if not dev_user:
                 return jsonify({"erro": "Modo de desenvolvimento ativo, mas nenhum usuário encontrado no banco. Execute 'flask seed-db'."}), 500
             return f(dev_user, *args, **kwargs)
@@ -33,14 +38,21 @@ def token_required(f):
             return jsonify({"erro": "Token de autenticação ausente!"}), 401
 
         try:
-            secret_key = os.environ.get('JWT_SECRET_KEY')
-            data = jwt.decode(token, secret_key, algorithms=["HS256"])
-            
-            # Converte 'sub' de string para inteiro
-            user_id = int(data['sub'])
-            current_user = Usuario.query.get(user_id)
+            # Tokens já verificados pulam a verificação da assinatura
+            user_id = obter_token_verificado(token)
+            if user_id is None:
+                secret_key = os.environ.get('JWT_SECRET_KEY')
+                data = jwt.decode(token, secret_key, algorithms=["HS256"])
+                
+                # Converte 'sub' de string para inteiro
+                user_id = int(data['sub'])
+                guardar_token_verificado(token, user_id, data.get('exp'))
+
+            current_user = obter_usuario_autenticado(user_id)
             if not current_user:
                 return jsonify({"erro": "Usuário não encontrado!"}), 401
+            if not current_user.ativo:
+                return jsonify({"erro": "Usuário inativo"}), 401
         except jwt.ExpiredSignatureError:
             return jsonify({"erro": "Token expirado!"}), 401
         except jwt.InvalidTokenError:
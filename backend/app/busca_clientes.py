@@ -0,0 +1,219 @@
+"""
+Busca textual de clientes (nome, nome fantasia, CNPJ/CPF e município)
+
+Os textos pesquisáveis de cada cliente ficam em uma tabela de busca própria,
+já normalizados (sem acentos, minúsculas) e com os documentos apenas em
+dígitos:
+
+- SQLite: tabela virtual FTS5 (rowid = id do cliente), com índice de
+  prefixos para a busca enquanto o usuário digita e ordenação por bm25
+- Outros bancos (PostgreSQL): tabela comum com a coluna "texto", consultada
+  com LIKE por início de palavra; no PostgreSQL a migração cria o índice de
+  trigramas (pg_trgm) que atende esse LIKE. Os nomes que começam pelo
+  primeiro termo vêm primeiro
+
+A tabela é mantida pelos eventos de inserção, alteração e exclusão de
+Cliente, na mesma transação. Alterações em massa feitas fora do ORM podem
+ser corrigidas com o comando "flask reconstruir-busca-clientes".
+"""
+import re
+import threading
+import weakref
+from sqlalchemy import event, text, select
+from .models import db, Cliente
+from .cnae_busca import normalizar_texto
+
+TABELA_BUSCA = 'cliente_busca'
+
+LIMITE_MAXIMO = 50
+
+# Peso de cada coluna no bm25 (SQLite): nome, nome fantasia, documento, município
+PESOS_BM25 = (10.0, 5.0, 8.0, 1.0)
+
+_DDL_SQLITE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_BUSCA} USING fts5("
+    "nome, nome_fantasia, documento, municipio, "
+    "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')"
+)
+
+_DDL_GENERICO = (
+    f"CREATE TABLE IF NOT EXISTS {TABELA_BUSCA} ("
+    "cliente_id INTEGER PRIMARY KEY, nome TEXT, nome_fantasia TEXT, "
+    "documento TEXT, municipio TEXT, texto TEXT NOT NULL)"
+)
+
+# Engines em que a tabela de busca já foi verificada/criada
+_tabelas_verificadas = weakref.WeakSet()
+_tabelas_lock = threading.Lock()
+
+
+def _fts5(conexao):
+    return conexao.dialect.name == 'sqlite'
+
+def garantir_tabela_busca(conexao):
+    """
+    Cria a tabela de busca se ela não existir (verificado uma vez por engine),
+    para bancos criados sem as migrações. O índice de trigramas do PostgreSQL
+    fica só na migração, pois exige a extensão pg_trgm
+    """
+    engine = conexao.engine
+    if engine in _tabelas_verificadas:
+        return
+    with _tabelas_lock:
+        if engine in _tabelas_verificadas:
+            return
+        conexao.execute(text(_DDL_SQLITE if _fts5(conexao) else _DDL_GENERICO))
+        _tabelas_verificadas.add(engine)
+
+
+def _textos_cliente(nome, nome_fantasia, cnpj_digitos, cpf_digitos, municipio):
+    """Colunas pesquisáveis de um cliente, normalizadas"""
+    return {
+        'nome': normalizar_texto(nome) or '',
+        'nome_fantasia': normalizar_texto(nome_fantasia) or '',
+        'documento': cnpj_digitos or cpf_digitos or '',
+        'municipio': normalizar_texto(municipio) or ''
+    }
+
+def _linha_indice(cliente_id, textos, fts5):
+    if fts5:
+        return {'id': cliente_id, **textos}
+    # Texto único, com as palavras separadas por espaço, para o LIKE por início de palavra
+    palavras = ' '.join(re.findall(r'\w+', ' '.join(textos.values())))
+    return {'id': cliente_id, **textos, 'texto': f" {palavras}"}
+
+def _remover(conexao, ids):
+    coluna = 'rowid' if _fts5(conexao) else 'cliente_id'
+    for cliente_id in ids:
+        conexao.execute(text(f"DELETE FROM {TABELA_BUSCA} WHERE {coluna} = :id"), {'id': cliente_id})
+
+def _inserir(conexao, linhas):
+    if not linhas:
+        return
+    if _fts5(conexao):
+        comando = (f"INSERT INTO {TABELA_BUSCA} (rowid, nome, nome_fantasia, documento, municipio) "
+                   "VALUES (:id, :nome, :nome_fantasia, :documento, :municipio)")
+    else:
+        comando = (f"INSERT INTO {TABELA_BUSCA} (cliente_id, nome, nome_fantasia, documento, municipio, texto) "
+                   "VALUES (:id, :nome, :nome_fantasia, :documento, :municipio, :texto)")
+    conexao.execute(text(comando), linhas)
+
+def _linhas_indice(clientes, fts5):
+    return [
+        _linha_indice(cliente.id, _textos_cliente(
+            cliente.nome_completo if cliente.tipo_pessoa == 'PF' else cliente.razao_social,
+            cliente.nome_fantasia, cliente.cnpj_digitos, cliente.cpf_digitos, cliente.municipio
+        ), fts5)
+        for cliente in clientes
+    ]
+
+def indexar_clientes(conexao, clientes):
+    """
+    (Re)indexa clientes.
+
+    Args:
+        conexao: Conexão SQLAlchemy (a transação fica a cargo de quem chama)
+        clientes (list): Objetos Cliente
+    """
+    garantir_tabela_busca(conexao)
+    linhas = _linhas_indice(clientes, _fts5(conexao))
+    _remover(conexao, [linha['id'] for linha in linhas])
+    _inserir(conexao, linhas)
+
+def reconstruir_indice_busca():
+    """Reconstrói a tabela de busca a partir de todos os clientes. Não faz commit"""
+    conexao = db.session.connection()
+    garantir_tabela_busca(conexao)
+    conexao.execute(text(f"DELETE FROM {TABELA_BUSCA}"))
+    clientes = db.session.execute(select(
+        Cliente.id, Cliente.tipo_pessoa, Cliente.razao_social, Cliente.nome_completo,
+        Cliente.nome_fantasia, Cliente.cnpj_digitos, Cliente.cpf_digitos, Cliente.municipio
+    )).all()
+    _inserir(conexao, _linhas_indice(clientes, _fts5(conexao)))
+    return len(clientes)
+
+
+@event.listens_for(Cliente, 'after_insert')
+@event.listens_for(Cliente, 'after_update')
+def _indexar_cliente(mapper, connection, cliente):
+    """Mantém a tabela de busca sincronizada com o cadastro do cliente"""
+    indexar_clientes(connection, [cliente])
+
+@event.listens_for(Cliente, 'after_delete')
+def _remover_cliente_do_indice(mapper, connection, cliente):
+    garantir_tabela_busca(connection)
+    _remover(connection, [cliente.id])
+
+
+def _termos(consulta):
+    """
+    Termos da busca, normalizados. Uma consulta só com dígitos e pontuação
+    ("11.222.333/0001") vira um único termo de documento.
+    """
+    consulta = (consulta or '').strip()
+    if re.fullmatch(r'[\d.\-/\s]+', consulta):
+        digitos = re.sub(r'\D', '', consulta)
+        return [digitos] if digitos else []
+    return re.findall(r'\w+', normalizar_texto(consulta))
+
+def buscar_clientes(consulta, limite=10, tipo_pessoa=None):
+    """
+    Busca clientes por prefixo de palavra (nome, nome fantasia, documento e
+    município), dos mais relevantes para os menos relevantes.
+
+    Args:
+        consulta (str): Texto digitado
+        limite (int): Quantidade máxima de resultados (até LIMITE_MAXIMO)
+        tipo_pessoa (str, optional): 'PF' ou 'PJ'
+
+    Returns:
+        list: Dicionários com id, tipo_pessoa, nome, nome_fantasia, documento,
+            municipio e uf
+    """
+    termos = _termos(consulta)
+    if not termos:
+        return []
+    limite = max(1, min(int(limite), LIMITE_MAXIMO))
+
+    conexao = db.session.connection()
+    garantir_tabela_busca(conexao)
+
+    filtros = ''
+    if tipo_pessoa == 'PF':
+        filtros = " AND c.tipo_pessoa = 'PF'"
+    elif tipo_pessoa == 'PJ':
+        filtros = " AND COALESCE(c.tipo_pessoa, 'PJ') = 'PJ'"
+    colunas = ("c.id, c.tipo_pessoa, c.razao_social, c.nome_completo, c.nome_fantasia, "
+               "c.cnpj, c.cpf, c.municipio, c.uf")
+
+    # O JOIN com cliente descarta entradas de clientes removidos fora do ORM
+    if _fts5(conexao):
+        # Cada termo vira uma consulta de prefixo; termos são só letras e dígitos
+        pesos = ', '.join(str(peso) for peso in PESOS_BM25)
+        linhas = conexao.execute(text(
+            f"SELECT {colunas} FROM {TABELA_BUSCA} JOIN cliente c ON c.id = {TABELA_BUSCA}.rowid "
+            f"WHERE {TABELA_BUSCA} MATCH :expressao{filtros} "
+            f"ORDER BY bm25({TABELA_BUSCA}, {pesos}) LIMIT :limite"
+        ), {'expressao': ' '.join(f'"{termo}"*' for termo in termos), 'limite': limite}).all()
+    else:
+        condicoes = ' AND '.join(f"b.texto LIKE :termo{i}" for i in range(len(termos)))
+        parametros = {f'termo{i}': f"% {termo}%" for i, termo in enumerate(termos)}
+        linhas = conexao.execute(text(
+            f"SELECT {colunas} FROM {TABELA_BUSCA} b JOIN cliente c ON c.id = b.cliente_id "
+            f"WHERE {condicoes}{filtros} "
+            "ORDER BY CASE WHEN b.nome LIKE :inicio OR b.documento LIKE :inicio THEN 0 ELSE 1 END, b.nome "
+            "LIMIT :limite"
+        ), {**parametros, 'inicio': f"{termos[0]}%", 'limite': limite}).all()
+
+    return [
+        {
+            'id': linha.id,
+            'tipo_pessoa': linha.tipo_pessoa or 'PJ',
+            'nome': linha.nome_completo if linha.tipo_pessoa == 'PF' else linha.razao_social,
+            'nome_fantasia': linha.nome_fantasia,
+            'documento': linha.cpf if linha.tipo_pessoa == 'PF' else linha.cnpj,
+            'municipio': linha.municipio,
+            'uf': linha.uf
+        }
+        for linha in linhas
+    ]
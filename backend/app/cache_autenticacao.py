@@ -0,0 +1,193 @@
+"""
+Cache em memória da autenticação (usado por auth.token_required)
+
+- Usuários: id -> UsuarioAutenticado (papel, ativo, nome e os demais dados
+  de Usuario.to_dict), por AUTH_CACHE_TTL_SEGUNDOS
+- Tokens (opcional, AUTH_CACHE_TOKENS): SHA-256 do token -> id do usuário e
+  expiração, evitando verificar a assinatura a cada requisição. A expiração
+  do próprio token continua sendo respeitada
+
+Os dois caches são LRU limitados a AUTH_CACHE_TAMANHO entradas. Qualquer
+alteração ou exclusão de um Usuario pelo ORM (ativação/desativação,
+exclusão, troca de senha, login) remove o usuário do cache assim que a
+transação é confirmada. O cache é local ao processo: com vários workers, os
+outros processos veem a alteração em até AUTH_CACHE_TTL_SEGUNDOS.
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+from .models import db, Usuario
+
+# Chave do usuário usado no modo de desenvolvimento (primeiro usuário do banco)
+CHAVE_USUARIO_DEBUG = 'debug'
+
+_CHAVE_ALTERADOS = 'usuarios_alterados_cache'
+
+
+class CacheTTL:
+    """Dicionário LRU com validade por entrada, seguro entre threads"""
+
+    def __init__(self, tamanho_maximo, validade):
+        """
+        Args:
+            tamanho_maximo (int): Quantidade máxima de entradas
+            validade (float): Segundos de vida de cada entrada
+        """
+        self.tamanho_maximo = tamanho_maximo
+        self.validade = validade
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        """Valor guardado ou None (ausente ou vencido)"""
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                return None
+            valor, vencimento = item
+            if vencimento <= time.monotonic():
+                del self._dados[chave]
+                return None
+            self._dados.move_to_end(chave)
+            return valor
+
+    def guardar(self, chave, valor, validade=None):
+        """Guarda o valor por `validade` segundos (padrão: a validade do cache)"""
+        validade = self.validade if validade is None else min(validade, self.validade)
+        with self._lock:
+            self._dados[chave] = (valor, time.monotonic() + validade)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.tamanho_maximo:
+                self._dados.popitem(last=False)
+
+    def remover(self, chave):
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+
+class UsuarioAutenticado:
+    """
+    Dados do usuário autenticado, entregues às rotas como current_user no
+    lugar do objeto Usuario (não está ligado à sessão do banco)
+    """
+
+    __slots__ = ('id', 'username', 'email', 'papel', 'nome', 'ativo', 'data_criacao', 'ultimo_login')
+
+    def __init__(self, usuario):
+        for atributo in self.__slots__:
+            setattr(self, atributo, getattr(usuario, atributo))
+
+    def to_dict(self):
+        """Mesmo formato de Usuario.to_dict"""
+        return {
+            'id': self.id,
+            'username': self.username,
+            'email': self.email,
+            'papel': self.papel,
+            'nome': self.nome,
+            'ativo': self.ativo,
+            'data_criacao': self.data_criacao.isoformat() if self.data_criacao else None,
+            'ultimo_login': self.ultimo_login.isoformat() if self.ultimo_login else None
+        }
+
+
+_usuarios = CacheTTL(1024, 60)
+_tokens = CacheTTL(1024, 60)
+
+
+def configurar_cache(app):
+    """
+    Aplica AUTH_CACHE_TAMANHO, AUTH_CACHE_TTL_SEGUNDOS (0 desativa os caches)
+    e AUTH_CACHE_TOKENS (False desativa só o cache de tokens)
+    """
+    for cache in (_usuarios, _tokens):
+        cache.tamanho_maximo = app.config.get('AUTH_CACHE_TAMANHO', 1024)
+        cache.validade = app.config.get('AUTH_CACHE_TTL_SEGUNDOS', 60)
+        cache.limpar()
+    if not app.config.get('AUTH_CACHE_TOKENS', True):
+        _tokens.validade = 0
+
+
+def _colunas_usuario():
+    return select(*(getattr(Usuario, atributo) for atributo in UsuarioAutenticado.__slots__))
+
+def obter_usuario_autenticado(usuario_id):
+    """UsuarioAutenticado do id (do cache ou do banco) ou None se não existir"""
+    usuario = _usuarios.obter(usuario_id)
+    if usuario is None:
+        linha = db.session.execute(_colunas_usuario().where(Usuario.id == usuario_id)).first()
+        if linha is None:
+            return None
+        usuario = UsuarioAutenticado(linha)
+        if _usuarios.validade:
+            _usuarios.guardar(usuario_id, usuario)
+    return usuario
+
+def obter_usuario_debug():
+    """Primeiro usuário do banco (modo de desenvolvimento) ou None"""
+    usuario = _usuarios.obter(CHAVE_USUARIO_DEBUG)
+    if usuario is None:
+        linha = db.session.execute(_colunas_usuario().order_by(Usuario.id).limit(1)).first()
+        if linha is None:
+            return None
+        usuario = UsuarioAutenticado(linha)
+        if _usuarios.validade:
+            _usuarios.guardar(CHAVE_USUARIO_DEBUG, usuario)
+    return usuario
+
+def _hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def obter_token_verificado(token, agora=None):
+    """
+    Id do usuário de um token já verificado e ainda não expirado, ou None
+    (o token precisa ser decodificado)
+    """
+    item = _tokens.obter(_hash_token(token))
+    if item is None:
+        return None
+    usuario_id, expiracao = item
+    if expiracao is not None and expiracao <= (agora or time.time()):
+        _tokens.remover(_hash_token(token))
+        return None
+    return usuario_id
+
+def guardar_token_verificado(token, usuario_id, expiracao):
+    """Guarda um token decodificado com sucesso (até a expiração dele, no máximo)"""
+    if not _tokens.validade:
+        return
+    validade = None if expiracao is None else max(0, expiracao - time.time())
+    _tokens.guardar(_hash_token(token), (usuario_id, expiracao), validade)
+
+def invalidar_usuario(usuario_id):
+    """Remove o usuário do cache (e o usuário do modo de desenvolvimento)"""
+    _usuarios.remover(usuario_id)
+    _usuarios.remover(CHAVE_USUARIO_DEBUG)
+
+
+@event.listens_for(Usuario, 'after_update')
+@event.listens_for(Usuario, 'after_delete')
+def _registrar_usuario_alterado(mapper, connection, usuario):
+    """Usuário alterado ou excluído: sai do cache agora e de novo após o commit"""
+    invalidar_usuario(usuario.id)
+    sessao = object_session(usuario)
+    if sessao is not None:
+        sessao.info.setdefault(_CHAVE_ALTERADOS, set()).add(usuario.id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidar_apos_commit(sessao):
+    # Uma requisição concorrente pode ter recolocado a versão anterior no cache
+    # entre o flush e o commit
+    for usuario_id in sessao.info.pop(_CHAVE_ALTERADOS, ()):
+        invalidar_usuario(usuario_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_alterados(sessao):
+    sessao.info.pop(_CHAVE_ALTERADOS, None)
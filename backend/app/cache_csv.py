@@ -0,0 +1,172 @@
+"""
+Cache em disco dos resultados do parser de CSV de NF-e
+
+A chave de cada entrada é o SHA-256 do conteúdo do arquivo mais a versão do
+parser (NFECSVParser.VERSAO); reenviar o mesmo arquivo pula a detecção de
+encoding/separador e a leitura, restando só as verificações no banco
+(verificar_preview_no_banco). Só resultados com status 'ok' são guardados.
+
+Cada entrada é um arquivo na pasta do cache, gravado de forma atômica
+(arquivo temporário + os.replace), de modo que vários processos do servidor
+(workers do gunicorn) podem compartilhar a mesma pasta sem coordenação. A
+data de modificação do arquivo é atualizada a cada acerto e serve como
+último acesso: quando o total da pasta passa do limite, as entradas menos
+usadas recentemente são removidas.
+
+As entradas são JSON (nunca pickle): um arquivo plantado na pasta não pode
+executar código ao ser lido. A pasta padrão fica dentro da pasta de instância
+da aplicação, é criada só com acesso do dono (0o700) e é recusada se
+pertencer a outro usuário.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from typing import BinaryIO, Dict, Optional, Union
+from .csv_parser import NFECSVParser
+
+# Bytes lidos por vez ao calcular o hash de um stream
+TAMANHO_BLOCO_HASH = 1024 * 1024
+
+# Ao passar do limite, remove entradas até a pasta ficar com esta fração dele
+FRACAO_APOS_LIMPEZA = 0.8
+
+EXTENSAO = '.json'
+
+
+class PastaCacheInsegura(Exception):
+    """A pasta do cache pertence a outro usuário"""
+
+
+def _verificar_dono(pasta: str) -> None:
+    """Recusa uma pasta de outro usuário (sem verificação onde não há os.getuid, como no Windows)"""
+    if hasattr(os, 'getuid') and os.stat(pasta).st_uid != os.getuid():
+        raise PastaCacheInsegura(f"A pasta do cache de CSV pertence a outro usuário: {pasta}")
+
+
+def calcular_hash(arquivo: Union[bytes, bytearray, BinaryIO]) -> str:
+    """SHA-256 do conteúdo (bytes ou stream posicionável; a posição do stream é restaurada)"""
+    if isinstance(arquivo, (bytes, bytearray)):
+        return hashlib.sha256(arquivo).hexdigest()
+
+    sha256 = hashlib.sha256()
+    inicio = arquivo.tell()
+    for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO_HASH), b''):
+        sha256.update(bloco)
+    arquivo.seek(inicio)
+    return sha256.hexdigest()
+
+
+class CacheResultadoCSV:
+    """Cache LRU, limitado por tamanho, de resultados de NFECSVParser em uma pasta local"""
+
+    def __init__(self, pasta: str, tamanho_maximo: int):
+        """
+        Args:
+            pasta: Pasta das entradas (criada com permissão 0o700 se não existir)
+            tamanho_maximo: Limite em bytes da soma das entradas
+
+        Raises:
+            PastaCacheInsegura: Se a pasta pertencer a outro usuário
+        """
+        self.pasta = pasta
+        self.tamanho_maximo = tamanho_maximo
+        os.makedirs(pasta, mode=0o700, exist_ok=True)
+        _verificar_dono(pasta)
+
+    def chave(self, arquivo: Union[bytes, bytearray, BinaryIO]) -> str:
+        """Chave do arquivo: hash do conteúdo e versão do parser"""
+        return f"{calcular_hash(arquivo)}-v{NFECSVParser.VERSAO}"
+
+    def _caminho(self, chave: str) -> str:
+        return os.path.join(self.pasta, chave + EXTENSAO)
+
+    def obter(self, chave: str) -> Optional[Dict]:
+        """Resultado guardado para a chave (uma cópia nova a cada chamada) ou None"""
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, 'r', encoding='utf-8') as entrada:
+                resultado = json.load(entrada)
+            os.utime(caminho)  # Marca o acesso para o LRU
+            return resultado
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Entrada corrompida ou de um formato antigo: descarta
+            self._remover(caminho)
+            return None
+
+    def gravar(self, chave: str, resultado: Dict) -> None:
+        """Guarda o resultado (apenas status 'ok') e aplica o limite de tamanho"""
+        if resultado.get('status') != 'ok':
+            return
+        try:
+            conteudo = json.dumps(resultado, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return  # Valores fora do JSON: o resultado não é guardado
+        descritor, temporario = tempfile.mkstemp(dir=self.pasta, suffix='.tmp')
+        try:
+            with os.fdopen(descritor, 'w', encoding='utf-8') as saida:
+                saida.write(conteudo)
+            os.replace(temporario, self._caminho(chave))
+        except BaseException:
+            self._remover(temporario)
+            raise
+        self._limitar_tamanho()
+
+    def _limitar_tamanho(self) -> None:
+        """Remove as entradas acessadas há mais tempo até caber no limite"""
+        entradas = []
+        total = 0
+        with os.scandir(self.pasta) as itens:
+            for item in itens:
+                if not item.name.endswith(EXTENSAO):
+                    continue
+                try:
+                    info = item.stat()
+                except FileNotFoundError:
+                    continue  # Removida por outro processo
+                entradas.append((info.st_mtime, info.st_size, item.path))
+                total += info.st_size
+
+        if total <= self.tamanho_maximo:
+            return
+
+        alvo = self.tamanho_maximo * FRACAO_APOS_LIMPEZA
+        for _, tamanho, caminho in sorted(entradas):
+            if total <= alvo:
+                break
+            self._remover(caminho)
+            total -= tamanho
+
+    @staticmethod
+    def _remover(caminho: str) -> None:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def obter_cache(app) -> Optional[CacheResultadoCSV]:
+    """
+    Cache configurado na aplicação (CSV_CACHE_DIR, padrão <instância>/cache_csv,
+    e CSV_CACHE_TAMANHO_MB), ou None se estiver desativado (tamanho 0) ou se a
+    pasta for recusada (pertence a outro usuário)
+    """
+    tamanho_mb = app.config.get('CSV_CACHE_TAMANHO_MB', 0)
+    if not tamanho_mb:
+        return None
+    pasta = app.config.get('CSV_CACHE_DIR') or os.path.join(app.instance_path, 'cache_csv')
+    with _caches_lock:
+        if pasta not in _caches:
+            try:
+                _caches[pasta] = CacheResultadoCSV(pasta, tamanho_mb * 1024 * 1024)
+            except PastaCacheInsegura as e:
+                app.logger.warning(f"Cache de CSV desativado: {e}")
+                _caches[pasta] = None
+        return _caches[pasta]
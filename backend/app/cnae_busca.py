@@ -0,0 +1,390 @@
+"""
+Busca textual de CNAEs com índice invertido em memória.
+
+O índice é construído uma única vez (no primeiro uso) a partir da tabela CNAE e
+guarda as descrições já normalizadas (sem acentos, minúsculas), os trigramas de
+caracteres de cada CNAE e o vocabulário de palavras das descrições. Uma busca
+consulta apenas os CNAEs candidatos do índice e aplica as mesmas faixas de
+pontuação da busca original (match exato, radical, palavras e similaridade).
+
+O índice é invalidado automaticamente quando a tabela CNAE é alterada pela
+aplicação e também quando a assinatura da tabela (quantidade e maior código)
+muda, o que cobre cargas feitas por scripts externos; a assinatura é
+consultada no máximo a cada INTERVALO_VERIFICACAO_ASSINATURA segundos.
+
+A similaridade (última faixa) compara o termo apenas com as palavras do
+vocabulário que têm algum trigrama em comum com ele.
+"""
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from sqlalchemy import func
+from .models import db, CNAE
+
+
+def normalizar_texto(texto):
+    """
+    Remove acentos e normaliza caracteres especiais para facilitar busca
+    Exemplos:
+    - "construção" -> "construcao"
+    - "elétrico" -> "eletrico"
+    - "açúcar" -> "acucar"
+    """
+    if not texto:
+        return texto
+
+    # Remove acentos usando unicodedata
+    texto_nfd = unicodedata.normalize('NFD', texto)
+    texto_sem_acento = ''.join(char for char in texto_nfd if unicodedata.category(char) != 'Mn')
+
+    # Converte para minúsculas
+    texto_normalizado = texto_sem_acento.lower()
+
+    return texto_normalizado
+
+def limpar_codigo(codigo):
+    """
+    Remove pontuações e espaços de códigos CNAE
+    Exemplo: "69.20-6/01" -> "6920601"
+    """
+    if not codigo:
+        return codigo
+    return codigo.replace('.', '').replace('-', '').replace('/', '').replace(' ', '')
+
+def calcular_similaridade(str1, str2):
+    """
+    Calcula similaridade entre duas strings usando distância de Levenshtein
+    Retorna um valor de 0 a 100 (100 = idênticas)
+    """
+    if not str1 or not str2:
+        return 0
+
+    # Normaliza ambas as strings
+    s1 = normalizar_texto(str1).lower()
+    s2 = normalizar_texto(str2).lower()
+
+    # Se são idênticas após normalização
+    if s1 == s2:
+        return 100
+
+    # Se uma está contida na outra
+    if s1 in s2 or s2 in s1:
+        return 90
+
+    # Calcula distância de Levenshtein
+    len1, len2 = len(s1), len(s2)
+    if len1 > len2:
+        s1, s2 = s2, s1
+        len1, len2 = len2, len1
+
+    current_row = range(len1 + 1)
+    for i in range(1, len2 + 1):
+        previous_row, current_row = current_row, [i] + [0] * len1
+        for j in range(1, len1 + 1):
+            add, delete, change = previous_row[j] + 1, current_row[j - 1] + 1, previous_row[j - 1]
+            if s1[j - 1] != s2[i - 1]:
+                change += 1
+            current_row[j] = min(add, delete, change)
+
+    # Converte distância em porcentagem de similaridade
+    distancia = current_row[len1]
+    max_len = max(len(s1), len(s2))
+    similaridade = ((max_len - distancia) / max_len) * 100
+
+    return similaridade
+
+def extrair_radical(palavra):
+    """
+    Extrai o radical básico de uma palavra (stemming simplificado)
+    Exemplos:
+    - "odontológico" -> "odont"
+    - "odontologia" -> "odont"
+    - "construção" -> "constru"
+    """
+    palavra_norm = normalizar_texto(palavra).lower()
+
+    # Remove sufixos comuns em português
+    sufixos = [
+        'mente', 'acao', 'icao', 'ador', 'ante', 'ancia', 'encia',
+        'ismo', 'ista', 'oso', 'osa', 'ivo', 'iva', 'logico', 'logica',
+        'logia', 'vel', 'dor', 'dora', 'ao', 'oes', 'ico', 'ica',
+        'eiro', 'eira', 'agem', 'ncia', 'rio', 'ria', 'torio', 'toria'
+    ]
+
+    for sufixo in sorted(sufixos, key=len, reverse=True):
+        if len(palavra_norm) > len(sufixo) + 3 and palavra_norm.endswith(sufixo):
+            return palavra_norm[:-len(sufixo)]
+
+    # Retorna pelo menos as primeiras 5 letras (ou menos se a palavra for curta)
+    return palavra_norm[:max(5, len(palavra_norm) - 3)] if len(palavra_norm) > 3 else palavra_norm
+
+
+def _trigramas(texto):
+    """Retorna o conjunto de trigramas de caracteres de um texto"""
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+def _trigramas_com_bordas(palavra):
+    """
+    Trigramas da palavra com dois espaços antes e um depois (como no pg_trgm):
+    palavras com o mesmo início ou fim também têm trigramas em comum
+    """
+    return _trigramas(f'  {palavra} ')
+
+def _distancia_limitada(s1, s2, limite):
+    """
+    Distância de Levenshtein entre s1 e s2, interrompida assim que ultrapassa
+    'limite' (nesse caso retorna limite + 1).
+    """
+    if len(s1) > len(s2):
+        s1, s2 = s2, s1
+    if len(s2) - len(s1) > limite:
+        return limite + 1
+
+    linha_atual = list(range(len(s1) + 1))
+    for i in range(1, len(s2) + 1):
+        linha_anterior, linha_atual = linha_atual, [i] + [0] * len(s1)
+        for j in range(1, len(s1) + 1):
+            custo = 0 if s1[j - 1] == s2[i - 1] else 1
+            linha_atual[j] = min(linha_anterior[j] + 1, linha_atual[j - 1] + 1, linha_anterior[j - 1] + custo)
+        if min(linha_atual) > limite:
+            return limite + 1
+    return linha_atual[len(s1)]
+
+def _similaridade_normalizada(s1, s2):
+    """
+    Mesmo resultado de calcular_similaridade para textos já normalizados,
+    descartando cedo (retorna 0) pares com similaridade abaixo de 60.
+    """
+    if s1 == s2:
+        return 100
+    if s1 in s2 or s2 in s1:
+        return 90
+
+    max_len = max(len(s1), len(s2))
+    # Similaridade >= 60 exige distância <= 40% do maior comprimento
+    distancia = _distancia_limitada(s1, s2, int(max_len * 0.4) + 1)
+    similaridade = ((max_len - distancia) / max_len) * 100
+    return similaridade if similaridade >= 60 else 0
+
+
+class IndiceCNAE:
+    """Índice invertido em memória sobre as descrições dos CNAEs"""
+
+    # Campos indexados, na ordem de prioridade das faixas de pontuação
+    CAMPOS = ('descricao', 'descricao_grupo', 'descricao_divisao', 'descricao_secao')
+
+    # Quantidade de buscas recentes mantidas em cache
+    TAMANHO_CACHE_BUSCAS = 256
+
+    def __init__(self, linhas):
+        """
+        Args:
+            linhas: Iterável de tuplas (codigo, descricao, descricao_grupo,
+                descricao_divisao, descricao_secao)
+        """
+        self.codigos = []
+        self.textos = []  # Tupla com os 4 campos normalizados de cada CNAE
+        self.trigramas = {}  # trigrama -> conjunto de posições de CNAE
+        self.palavras = {}  # palavra da descrição (4+ letras) -> conjunto de posições
+
+        for posicao, (codigo, *campos) in enumerate(linhas):
+            textos = tuple(normalizar_texto(campo or '').lower() for campo in campos)
+            self.codigos.append(codigo)
+            self.textos.append(textos)
+
+            for trigrama in set().union(*(_trigramas(texto) for texto in textos)):
+                self.trigramas.setdefault(trigrama, set()).add(posicao)
+
+            for palavra in textos[0].split():
+                if len(palavra) >= 4:
+                    self.palavras.setdefault(palavra, set()).add(posicao)
+
+        # trigrama (com as bordas da palavra) -> palavras do vocabulário, para a
+        # similaridade comparar o termo só com palavras parecidas
+        self.trigramas_palavras = {}
+        for palavra in self.palavras:
+            for trigrama in _trigramas_com_bordas(palavra):
+                self.trigramas_palavras.setdefault(trigrama, []).append(palavra)
+
+        self._cache_buscas = OrderedDict()
+        self._lock_cache = threading.Lock()
+
+    def _candidatos(self, trecho):
+        """
+        Posições dos CNAEs que podem conter o trecho em algum campo.
+        Para trechos com 3+ caracteres usa a interseção das listas de trigramas;
+        trechos menores não são filtrados.
+        """
+        trigramas = _trigramas(trecho)
+        if not trigramas:
+            return range(len(self.codigos))
+
+        listas = sorted((self.trigramas.get(t, set()) for t in trigramas), key=len)
+        candidatos = set(listas[0])
+        for lista in listas[1:]:
+            candidatos &= lista
+            if not candidatos:
+                break
+        return candidatos
+
+    def _palavras_parecidas(self, termo):
+        """Palavras do vocabulário com pelo menos um trigrama em comum com o termo"""
+        palavras = set()
+        for trigrama in _trigramas_com_bordas(termo):
+            palavras.update(self.trigramas_palavras.get(trigrama, ()))
+        return palavras
+
+    def _pontuar_trecho(self, pontuacao, trecho, scores):
+        """
+        Atribui a pontuação do primeiro campo que contém o trecho aos CNAEs
+        ainda sem pontuação. 'scores' é uma tupla com a pontuação de cada campo
+        (None para campos que não pontuam).
+        """
+        for posicao in self._candidatos(trecho):
+            if posicao in pontuacao:
+                continue
+            for texto, score in zip(self.textos[posicao], scores):
+                if score is not None and trecho in texto:
+                    pontuacao[posicao] = score
+                    break
+
+    def buscar(self, termo):
+        """
+        Busca CNAEs pela descrição.
+
+        Returns:
+            list: Tuplas (codigo, score) ordenadas por score (maior primeiro)
+                e depois por código
+        """
+        termo_normalizado = normalizar_texto(termo).lower()
+
+        with self._lock_cache:
+            if termo_normalizado in self._cache_buscas:
+                self._cache_buscas.move_to_end(termo_normalizado)
+                return self._cache_buscas[termo_normalizado]
+
+        resultado = self._buscar(termo_normalizado)
+
+        with self._lock_cache:
+            self._cache_buscas[termo_normalizado] = resultado
+            if len(self._cache_buscas) > self.TAMANHO_CACHE_BUSCAS:
+                self._cache_buscas.popitem(last=False)
+        return resultado
+
+    def _buscar(self, termo_normalizado):
+        pontuacao = {}  # posição -> score
+        radical_termo = extrair_radical(termo_normalizado)
+
+        # 1. MATCH EXATO (100 descrição, 95 grupo, 90 divisão, 85 seção)
+        if termo_normalizado:
+            self._pontuar_trecho(pontuacao, termo_normalizado, (100, 95, 90, 85))
+
+        # 2. MATCH POR RADICAL (80 descrição, 75 grupo, 70 divisão/seção)
+        if radical_termo and len(radical_termo) >= 4:
+            self._pontuar_trecho(pontuacao, radical_termo, (80, 75, 70, 70))
+
+        # 3. PALAVRAS INDIVIDUAIS (60 descrição, 55 grupo, 50 divisão/seção)
+        palavras_termo = [p for p in termo_normalizado.split() if len(p) >= 3]
+        if palavras_termo:
+            pontuacao_palavras = {}
+            for palavra in palavras_termo:
+                radical_palavra = extrair_radical(palavra)
+                faixas = [(palavra, (60, 55, 50, 50))]
+                if radical_palavra:
+                    # O radical só conta para descrição e grupo
+                    faixas.append((radical_palavra, (60, 55, None, None)))
+                for trecho, scores in faixas:
+                    encontrados = {}
+                    self._pontuar_trecho(encontrados, trecho, scores)
+                    for posicao, score in encontrados.items():
+                        if posicao not in pontuacao:
+                            pontuacao_palavras[posicao] = max(pontuacao_palavras.get(posicao, 0), score)
+            pontuacao.update(pontuacao_palavras)
+
+        # 4. SIMILARIDADE (40 para 80%+, 35 para 70%+, 30 para 60%+)
+        if len(termo_normalizado) >= 5:
+            for palavra in self._palavras_parecidas(termo_normalizado):
+                posicoes = self.palavras[palavra]
+                similaridade = _similaridade_normalizada(termo_normalizado, palavra)
+                if similaridade >= 80:
+                    score = 40
+                elif similaridade >= 70:
+                    score = 35
+                elif similaridade >= 60:
+                    score = 30
+                else:
+                    continue
+                for posicao in posicoes:
+                    if posicao not in pontuacao or (pontuacao[posicao] <= 40 and score > pontuacao[posicao]):
+                        pontuacao[posicao] = score
+
+        resultado = [(self.codigos[posicao], score) for posicao, score in pontuacao.items()]
+        resultado.sort(key=lambda item: (-item[1], item[0]))
+        return resultado
+
+
+# Intervalo mínimo (segundos) entre as verificações da assinatura da tabela.
+# Alterações feitas pela aplicação invalidam o índice na hora (eventos abaixo)
+INTERVALO_VERIFICACAO_ASSINATURA = 30
+
+_indice = None
+_assinatura_indice = None
+_proxima_verificacao = 0.0
+_lock_indice = threading.Lock()
+
+
+def _assinatura_tabela():
+    """Assinatura barata da tabela CNAE para detectar cargas externas"""
+    return tuple(db.session.query(func.count(CNAE.codigo), func.max(CNAE.codigo)).one())
+
+def invalidar_indice_cnae(*args, **kwargs):
+    """Descarta o índice atual; ele será reconstruído na próxima busca"""
+    global _indice
+    _indice = None
+
+def obter_indice_cnae():
+    """Retorna o índice de CNAEs, construindo-o se necessário"""
+    global _indice, _assinatura_indice, _proxima_verificacao
+
+    indice = _indice
+    if indice is not None and time.monotonic() < _proxima_verificacao:
+        return indice
+
+    assinatura = _assinatura_tabela()
+    if indice is not None and assinatura == _assinatura_indice:
+        _proxima_verificacao = time.monotonic() + INTERVALO_VERIFICACAO_ASSINATURA
+        return indice
+
+    with _lock_indice:
+        if _indice is None or assinatura != _assinatura_indice:
+            linhas = db.session.query(
+                CNAE.codigo,
+                CNAE.descricao,
+                CNAE.descricao_grupo,
+                CNAE.descricao_divisao,
+                CNAE.descricao_secao
+            ).all()
+            _indice = IndiceCNAE(linhas)
+            _assinatura_indice = assinatura
+            _proxima_verificacao = time.monotonic() + INTERVALO_VERIFICACAO_ASSINATURA
+        return _indice
+
+def buscar_cnaes_por_descricao(termo, limite):
+    """
+    Busca CNAEs por descrição usando o índice em memória.
+
+    Returns:
+        list: Tuplas (CNAE, score) já ordenadas, limitadas a 'limite'
+    """
+    melhores = obter_indice_cnae().buscar(termo)[:limite]
+    if not melhores:
+        return []
+
+    cnaes = {cnae.codigo: cnae for cnae in CNAE.query.filter(CNAE.codigo.in_([c for c, _ in melhores])).all()}
+    return [(cnaes[codigo], score) for codigo, score in melhores if codigo in cnaes]
+
+
+# Qualquer alteração na tabela CNAE feita pela aplicação invalida o índice
+for _evento in ('after_insert', 'after_update', 'after_delete'):
+    db.event.listen(CNAE, _evento, invalidar_indice_cnae)
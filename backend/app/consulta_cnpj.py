@@ -0,0 +1,295 @@
+"""
+Consulta de CNPJ na BrasilAPI com cache persistente
+
+- As respostas ficam na tabela consulta_cnpj por CNPJ_CACHE_TTL_HORAS
+  (CNPJs não encontrados, por VALIDADE_NAO_ENCONTRADO), de modo que consultas
+  repetidas do mesmo CNPJ, comuns no cadastro e na importação de CSV, não
+  voltam à API, mesmo em outro processo ou depois de reiniciar o servidor
+- Consultas simultâneas do mesmo CNPJ no mesmo processo são agrupadas: só a
+  primeira chama a API e as demais aguardam e recebem o mesmo resultado
+- As chamadas usam uma requests.Session com pool de conexões
+
+A fonte dos dados é um objeto com o método consultar(cnpj); a padrão é
+FonteBrasilAPI, cujo endereço vem de CNPJ_API_URL (pode apontar para um
+servidor local de testes). Erros de rede (requests.Timeout,
+requests.ConnectionError...) são repassados a quem chamou.
+"""
+import json
+import threading
+from datetime import datetime, timedelta
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from sqlalchemy import select, delete, insert
+from .models import db, ConsultaCNPJ
+
+URL_BRASILAPI = 'https://brasilapi.com.br/api/cnpj/v1'
+
+# Por quanto tempo um CNPJ não encontrado fica no cache
+VALIDADE_NAO_ENCONTRADO = timedelta(hours=1)
+
+# Conexões mantidas abertas com a API
+TAMANHO_POOL = 10
+
+
+class CNPJNaoEncontrado(Exception):
+    """A Receita Federal não tem o CNPJ consultado"""
+
+
+class ErroFonteCNPJ(Exception):
+    """A API respondeu com um status de erro (diferente de 404)"""
+
+    def __init__(self, status_code, texto=''):
+        super().__init__(f"Status {status_code}: {texto}")
+        self.status_code = status_code
+        self.texto = texto
+
+
+class FonteBrasilAPI:
+    """Consulta à BrasilAPI (ou a um servidor com a mesma interface)"""
+
+    def __init__(self, url_base=URL_BRASILAPI, timeout=15):
+        self.url_base = url_base.rstrip('/')
+        self.timeout = timeout
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=TAMANHO_POOL)
+        self.sessao.mount('https://', adaptador)
+        self.sessao.mount('http://', adaptador)
+
+    def consultar(self, cnpj):
+        """
+        Dados do CNPJ (dict no formato da BrasilAPI).
+
+        Raises:
+            CNPJNaoEncontrado: Resposta 404
+            ErroFonteCNPJ: Outro status diferente de 200
+            ValueError: Resposta que não é JSON
+        """
+        response = self.sessao.get(f"{self.url_base}/{cnpj}", timeout=self.timeout)
+        if response.status_code == 404:
+            raise CNPJNaoEncontrado(cnpj)
+        if response.status_code != 200:
+            raise ErroFonteCNPJ(response.status_code, response.text)
+        return response.json()
+
+
+class _ConsultaEmAndamento:
+    __slots__ = ('concluida', 'dados', 'erro')
+
+    def __init__(self):
+        self.concluida = threading.Event()
+        self.dados = None
+        self.erro = None
+
+
+class ServicoConsultaCNPJ:
+    """Consulta de CNPJ com cache na tabela consulta_cnpj e agrupamento de chamadas simultâneas"""
+
+    def __init__(self, fonte, validade=timedelta(hours=24), validade_nao_encontrado=VALIDADE_NAO_ENCONTRADO):
+        """
+        Args:
+            fonte: Objeto com consultar(cnpj) (ver FonteBrasilAPI)
+            validade (timedelta): Tempo de vida no cache de um CNPJ encontrado
+                (zero desativa o cache)
+            validade_nao_encontrado (timedelta): Idem, para CNPJs não encontrados
+        """
+        self.fonte = fonte
+        self.validade = validade
+        self.validade_nao_encontrado = validade_nao_encontrado
+        self._em_andamento = {}
+        self._lock = threading.Lock()
+
+    def consultar(self, cnpj, usar_cache=True):
+        """
+        Dados do CNPJ no formato da BrasilAPI. Exige contexto da aplicação.
+
+        Args:
+            cnpj (str): CNPJ com 14 dígitos, sem pontuação
+            usar_cache (bool): False ignora o que estiver no cache (a resposta
+                nova é gravada mesmo assim)
+
+        Raises:
+            CNPJNaoEncontrado, ErroFonteCNPJ, ValueError e as exceções de
+            requests vindas da fonte
+        """
+        usar_cache = usar_cache and bool(self.validade)
+        if usar_cache:
+            dados = self._ler_cache(cnpj)
+            if dados is not None:
+                return dados
+
+        with self._lock:
+            consulta = self._em_andamento.get(cnpj)
+            primeira = consulta is None
+            if primeira:
+                consulta = self._em_andamento[cnpj] = _ConsultaEmAndamento()
+
+        if not primeira:
+            consulta.concluida.wait()
+            if consulta.erro is not None:
+                raise consulta.erro
+            return consulta.dados
+
+        try:
+            # Outra consulta pode ter gravado o CNPJ entre a leitura acima e o registro desta
+            if usar_cache:
+                consulta.dados = self._ler_cache(cnpj)
+            if consulta.dados is None:
+                consulta.dados = self._consultar_fonte(cnpj)
+            return consulta.dados
+        except BaseException as e:
+            consulta.erro = e
+            raise
+        finally:
+            with self._lock:
+                del self._em_andamento[cnpj]
+            consulta.concluida.set()
+
+    def _ler_cache(self, cnpj):
+        """Dados do CNPJ no cache ou None; CNPJNaoEncontrado se ele foi guardado como não encontrado"""
+        registro = db.session.execute(
+            select(ConsultaCNPJ.encontrado, ConsultaCNPJ.dados).where(
+                ConsultaCNPJ.cnpj == cnpj,
+                ConsultaCNPJ.data_expiracao > datetime.utcnow()
+            )
+        ).first()
+        if registro is None:
+            return None
+        if not registro.encontrado:
+            raise CNPJNaoEncontrado(cnpj)
+        return json.loads(registro.dados)
+
+    def _consultar_fonte(self, cnpj):
+        try:
+            dados = self.fonte.consultar(cnpj)
+        except CNPJNaoEncontrado:
+            self._gravar(cnpj, None)
+            raise
+        self._gravar(cnpj, dados)
+        return dados
+
+    def _gravar(self, cnpj, dados):
+        """
+        Grava a resposta (dados None: CNPJ não encontrado) em uma transação
+        própria, independente da de quem chamou. Uma falha ao gravar não
+        impede que a consulta seja respondida
+        """
+        if not self.validade or dados == {}:
+            return
+        validade = self.validade if dados is not None else self.validade_nao_encontrado
+        agora = datetime.utcnow()
+        try:
+            with db.engine.begin() as conexao:
+                conexao.execute(delete(ConsultaCNPJ).where(ConsultaCNPJ.cnpj == cnpj))
+                conexao.execute(insert(ConsultaCNPJ).values(
+                    cnpj=cnpj,
+                    encontrado=dados is not None,
+                    dados=json.dumps(dados, ensure_ascii=False) if dados is not None else None,
+                    data_consulta=agora,
+                    data_expiracao=agora + validade
+                ))
+        except Exception as e:
+            current_app.logger.warning(f"Erro ao gravar consulta do CNPJ {cnpj} no cache: {e}")
+
+
+def mapear_dados_receita(dados_api):
+    """
+    Mapeia os dados da BrasilAPI para o formato usado pelo nosso frontend.
+    """
+    # Valida se dados_api não é None
+    if not dados_api or not isinstance(dados_api, dict):
+        raise ValueError("Dados da API inválidos ou vazios")
+    
+    # Formata o CNPJ com máscara
+    cnpj = dados_api.get('cnpj', '')
+    cnpj_formatado = f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:14]}" if len(cnpj) == 14 else cnpj
+    
+    # Formata a data de abertura (de YYYY-MM-DD para DD/MM/YYYY)
+    data_abertura = dados_api.get('data_inicio_atividade', '')
+    if data_abertura and len(data_abertura) == 10:
+        partes = data_abertura.split('-')
+        data_abertura = f"{partes[2]}/{partes[1]}/{partes[0]}"
+    
+    # Formata datas de situação
+    data_situacao = dados_api.get('data_situacao_cadastral', '')
+    if data_situacao and len(data_situacao) == 10:
+        partes = data_situacao.split('-')
+        data_situacao = f"{partes[2]}/{partes[1]}/{partes[0]}"
+    
+    # Formata data da situação especial
+    data_situacao_especial = dados_api.get('data_situacao_especial', '')
+    if data_situacao_especial and len(data_situacao_especial) == 10:
+        partes = data_situacao_especial.split('-')
+        data_situacao_especial = f"{partes[2]}/{partes[1]}/{partes[0]}"
+    
+    # Formata data de opção pelo Simples
+    # Verifica se opcao_pelo_simples é um dicionário antes de acessar
+    opcao_simples_obj = dados_api.get('opcao_pelo_simples') or {}
+    data_opcao_simples = opcao_simples_obj.get('data_opcao', '') if isinstance(opcao_simples_obj, dict) else ''
+    if data_opcao_simples and len(data_opcao_simples) == 10:
+        partes = data_opcao_simples.split('-')
+        data_opcao_simples = f"{partes[2]}/{partes[1]}/{partes[0]}"
+    # Se não tem data, tenta pegar do campo alternativo
+    if not data_opcao_simples:
+        data_opcao_simples = dados_api.get('data_opcao_pelo_simples', '')
+    
+    # Monta lista de CNAEs secundários
+    cnaes_secundarios = [
+        f"{cnae.get('codigo', '')} - {cnae.get('descricao', '')}"
+        for cnae in dados_api.get('cnaes_secundarios', [])
+    ]
+    
+    # Formata o capital social
+    capital_social = dados_api.get('capital_social', 0)
+    capital_social_formatado = f"R$ {float(capital_social):,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+    
+    return {
+        'cnpj': cnpj_formatado,
+        'razao_social': dados_api.get('razao_social', ''),
+        'nome_fantasia': dados_api.get('nome_fantasia', ''),
+        'data_abertura': data_abertura,
+        'situacao_cadastral': dados_api.get('descricao_situacao_cadastral', ''),
+        'data_situacao': data_situacao,
+        'motivo_situacao': dados_api.get('descricao_motivo_situacao_cadastral', ''),
+        'natureza_juridica': f"{dados_api.get('codigo_natureza_juridica', '')} - {dados_api.get('natureza_juridica', '')}",
+        'cnae_principal': f"{dados_api.get('cnae_fiscal', '')} - {dados_api.get('cnae_fiscal_descricao', '')}",
+        'cnae_secundarias': cnaes_secundarios,
+        'logradouro': dados_api.get('logradouro', ''),
+        'numero': dados_api.get('numero', ''),
+        'complemento': dados_api.get('complemento', ''),
+        'bairro': dados_api.get('bairro', ''),
+        'cep': dados_api.get('cep', ''),
+        'municipio': dados_api.get('municipio', ''),
+        'uf': dados_api.get('uf', ''),
+        'telefone1': dados_api.get('ddd_telefone_1', ''),
+        'telefone2': dados_api.get('ddd_telefone_2', ''),
+        'email': dados_api.get('email', ''),
+        'capital_social': capital_social_formatado,
+        'porte': dados_api.get('porte', ''),
+        'opcao_simples': 'SIM' if (isinstance(opcao_simples_obj, dict) and opcao_simples_obj.get('optante', False)) else 'NÃO',
+        'data_opcao_simples': data_opcao_simples,
+        'opcao_mei': 'SIM' if dados_api.get('opcao_pelo_mei') else 'NÃO',
+        'situacao_especial': dados_api.get('situacao_especial', ''),
+        'data_situacao_especial': data_situacao_especial
+    }
+
+
+_servicos = {}
+_servicos_lock = threading.Lock()
+
+
+def obter_servico_cnpj(app):
+    """Serviço configurado na aplicação (CNPJ_API_URL, CNPJ_API_TIMEOUT e CNPJ_CACHE_TTL_HORAS)"""
+    chave = (
+        app.config.get('CNPJ_API_URL') or URL_BRASILAPI,
+        app.config.get('CNPJ_API_TIMEOUT', 15),
+        app.config.get('CNPJ_CACHE_TTL_HORAS', 24)
+    )
+    with _servicos_lock:
+        servico = _servicos.get(chave)
+        if servico is None:
+            url, timeout, horas = chave
+            servico = _servicos[chave] = ServicoConsultaCNPJ(
+                FonteBrasilAPI(url, timeout), validade=timedelta(hours=horas)
+            )
+        return servico
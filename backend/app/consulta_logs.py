@@ -0,0 +1,176 @@
+"""
+Paginação dos logs de auditoria por cursor e contagem em cache
+
+As listagens (logs.listar_logs e atividades.listar_atividades) ordenam por
+(data_acao, id) decrescente e avançam com um cursor que guarda o último
+registro da página: a próxima página é lida pelos índices de log_auditoria a
+partir dele, sem OFFSET, então a página 1000 custa o mesmo que a primeira.
+O parâmetro `page` continua aceito sem cursor (OFFSET), para links antigos.
+
+Filtros que o índice (entidade, acao, data_acao) não entrega em ordem (só a
+entidade, ou listas de entidades e ações) são divididos em um par
+entidade/ação por consulta, intercalados por data.
+
+O total das atividades é contado no máximo até LOGS_CONTAGEM_LIMITE (acima
+disso a resposta traz o limite e total_exato=False) e guardado por
+LOGS_CONTAGEM_TTL_SEGUNDOS; logs novos podem levar esse tempo para entrar no
+total. listar_logs soma o resumo diário (resumo_logs), que também cobre os
+logs arquivados.
+"""
+import heapq
+import base64
+from itertools import islice
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, func, or_
+from sqlalchemy.orm import selectinload
+from .models import db, LogAuditoria
+from .cache_autenticacao import CacheTTL
+
+# Quantidade máxima de registros por página
+MAXIMO_POR_PAGINA = 200
+
+# A validade de cada contagem vem de LOGS_CONTAGEM_TTL_SEGUNDOS
+_contagens = CacheTTL(256, 24 * 3600)
+
+
+def codificar_cursor(log):
+    """Cursor (texto opaco) que aponta para depois do registro informado"""
+    texto = f"{log.data_acao.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+def decodificar_cursor(cursor):
+    """
+    Lê um cursor gerado por codificar_cursor.
+
+    Returns:
+        tuple: (data_acao, id)
+
+    Raises:
+        ValueError: Se o cursor for inválido
+    """
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        data_acao, log_id = texto.split('|')
+        return datetime.fromisoformat(data_acao), int(log_id)
+    except ValueError as e:  # Inclui erros de base64 e de UTF-8
+        raise ValueError("Cursor inválido") from e
+
+
+def acoes_da_entidade(entidade):
+    """
+    Ações registradas para uma entidade, lidas pelo índice (entidade, acao,
+    data_acao) com uma busca por ação, sem percorrer os logs da entidade
+    """
+    acoes = []
+    while True:
+        condicoes = [LogAuditoria.entidade == entidade]
+        if acoes:
+            condicoes.append(LogAuditoria.acao > acoes[-1])
+        acao = db.session.execute(select(func.min(LogAuditoria.acao)).where(*condicoes)).scalar()
+        if acao is None:
+            return acoes
+        acoes.append(acao)
+
+
+def _ordem(log):
+    return (log.data_acao, log.id)
+
+def _consulta_pagina(condicoes, limite, cursor=None, inicio=0):
+    consulta = (
+        select(LogAuditoria).options(selectinload(LogAuditoria.usuario))
+        .where(*condicoes)
+        .order_by(LogAuditoria.data_acao.desc(), LogAuditoria.id.desc())
+    )
+    if cursor:
+        data_acao, log_id = cursor
+        # A condição em data_acao sozinha delimita a faixa lida do índice
+        consulta = consulta.where(
+            LogAuditoria.data_acao <= data_acao,
+            or_(LogAuditoria.data_acao < data_acao, LogAuditoria.id < log_id)
+        )
+    if inicio:
+        consulta = consulta.offset(inicio)
+    return db.session.execute(consulta.limit(limite)).scalars().all()
+
+def paginar_logs(condicoes, por_pagina=50, cursor=None, pagina=1, particoes=None, arquivo=None):
+    """
+    Uma página de logs, do mais recente para o mais antigo.
+
+    Args:
+        condicoes (list): Filtros sobre LogAuditoria
+        por_pagina (int): Registros por página (até MAXIMO_POR_PAGINA)
+        cursor (str, optional): proximo_cursor da página anterior
+        pagina (int): Página (OFFSET), usada só quando não há cursor
+        particoes (list, optional): Listas de condições somadas a
+            `condicoes`, uma por parte do resultado (ex.: uma por par
+            entidade/ação, no lugar de um IN). Cada partição é lida
+            em ordem pelo próprio índice e os resultados são intercalados,
+            em vez de ordenar todos os registros de um filtro com IN
+        arquivo (ConsultaArquivo, optional): Logs arquivados com os mesmos
+            filtros (arquivo_logs), intercalados quando a página passa do
+            log mais antigo do banco ou do limite do arquivamento
+
+    Returns:
+        tuple: (lista de LogAuditoria, proximo_cursor ou None na última página)
+
+    Raises:
+        ValueError: Se o cursor for inválido
+    """
+    por_pagina = max(1, min(por_pagina, MAXIMO_POR_PAGINA))
+    posicao = decodificar_cursor(cursor) if cursor else None
+    inicio = (pagina - 1) * por_pagina if not cursor and pagina and pagina > 1 else 0
+
+    # Um registro a mais indica se existe próxima página
+    necessarios = inicio + por_pagina + 1
+    if particoes is None and arquivo is None:
+        logs = _consulta_pagina(condicoes, por_pagina + 1, posicao, inicio)
+    else:
+        logs = list(islice(heapq.merge(
+            *(_consulta_pagina(condicoes + particao, necessarios, posicao) for particao in (particoes or [[]])),
+            key=_ordem, reverse=True
+        ), necessarios))
+        # Os logs arquivados são anteriores ao limite do arquivamento: só
+        # entram quando o banco não completa a página antes desse limite
+        if arquivo is not None and (len(logs) < necessarios or logs[-1].data_acao < arquivo.limite):
+            logs = list(islice(heapq.merge(logs, arquivo.iterar(posicao), key=_ordem, reverse=True), necessarios))
+        logs = logs[inicio:]
+
+    if len(logs) > por_pagina:
+        logs = logs[:por_pagina]
+        return logs, codificar_cursor(logs[-1])
+    return logs, None
+
+
+def contar_logs(chave, condicoes):
+    """
+    Total de logs que atendem aos filtros, limitado a LOGS_CONTAGEM_LIMITE e
+    guardado em cache.
+
+    Args:
+        chave (tuple): Identifica a listagem e os valores dos filtros
+        condicoes (list): Filtros sobre LogAuditoria
+
+    Returns:
+        tuple: (total, exato); exato é False quando o total passou do limite
+    """
+    validade = current_app.config.get('LOGS_CONTAGEM_TTL_SEGUNDOS', 60)
+    if validade:
+        resultado = _contagens.obter(chave)
+        if resultado is not None:
+            return resultado
+
+    limite = current_app.config.get('LOGS_CONTAGEM_LIMITE', 100000)
+    consulta = select(LogAuditoria.id).where(*condicoes)
+    if limite:
+        consulta = consulta.limit(limite + 1)
+    total = db.session.execute(select(func.count()).select_from(consulta.subquery())).scalar()
+    resultado = (limite, False) if limite and total > limite else (total, True)
+
+    if validade:
+        _contagens.guardar(chave, resultado, validade)
+    return resultado
+
+def total_paginas(total, por_pagina):
+    por_pagina = max(1, min(por_pagina, MAXIMO_POR_PAGINA))
+    return (total + por_pagina - 1) // por_pagina
@@ -4,10 +4,17 @@ Processa arquivos CSV no formato da Prefeitura/SEFAZ
 """
 import pandas as pd
 import io
+import os
+import codecs
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from decimal import Decimal
 import re
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, BinaryIO
 
 
 class NFECSVParser:
@@ -56,6 +63,29 @@ class NFECSVParser:
         ]
     }
     
+    # Formatos de data aceitos, na ordem em que são tentados
+    FORMATOS_DATA = [
+        '%d/%m/%Y %H:%M',
+        '%d/%m/%Y',
+        '%Y-%m-%d %H:%M:%S',
+        '%Y-%m-%d'
+    ]
+    
+    # Separadores e encodings tentados na leitura, em ordem de preferência
+    SEPARADORES = [';', '\t', ',']  # Ponto e vírgula é o mais comum no Brasil
+    ENCODINGS = ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']
+    
+    # Bytes do início do arquivo usados para detectar separador e encoding
+    TAMANHO_AMOSTRA = 16 * 1024
+    
+    # Linhas lidas por vez na leitura em streaming (limita o pico de memória)
+    TAMANHO_CHUNK = 20000
+    
+    # Versão do formato do resultado. Deve ser incrementada sempre que uma
+    # mudança no parser alterar o resultado de um mesmo arquivo: invalida o
+    # cache de resultados (ver cache_csv.py)
+    VERSAO = 1
+    
     @staticmethod
     def encontrar_coluna(df_columns: list, possiveis_nomes: list) -> Optional[str]:
         """
@@ -87,21 +117,14 @@ class NFECSVParser:
         except:
             return Decimal('0')
     
-    @staticmethod
-    def parse_data(data_str: str) -> Optional[datetime]:
+    @classmethod
+    def parse_data(cls, data_str: str) -> Optional[datetime]:
         """Converte string de data para datetime"""
         if pd.isna(data_str) or data_str == '':
             return None
         
         # Tenta vários formatos comuns
-        formatos = [
-            '%d/%m/%Y %H:%M',
-            '%d/%m/%Y',
-            '%Y-%m-%d %H:%M:%S',
-            '%Y-%m-%d'
-        ]
-        
-        for formato in formatos:
+        for formato in cls.FORMATOS_DATA:
             try:
                 return datetime.strptime(str(data_str).strip(), formato)
             except:
@@ -114,6 +137,34 @@ class NFECSVParser:
         """
         Valida se o CSV tem a estrutura esperada
         
+        Returns:
+            Tuple[bool, str, dict]: (válido, mensagem_erro, mapeamento_colunas)
+        """
+        valido, erro, mapeamento = cls.mapear_colunas(df.columns.tolist())
+        if not valido:
+            return False, erro, {}
+        
+        # Remove linhas de totalizador
+        df_limpo = cls._remover_linhas_totalizadoras(df)
+        
+        if len(df_limpo) == 0:
+            return False, cls._erro_sem_dados(), {}
+        
+        return True, "", mapeamento
+    
+    @staticmethod
+    def _erro_sem_dados() -> str:
+        """Mensagem de erro para CSV sem linhas de notas"""
+        erro = "❌ CSV não contém dados válidos.\n"
+        erro += "O arquivo parece conter apenas linhas de total/subtotal ou está vazio.\n\n"
+        erro += "💡 Solução: Certifique-se de que o CSV exportado da Prefeitura contém as notas fiscais."
+        return erro
+    
+    @classmethod
+    def mapear_colunas(cls, colunas: list) -> Tuple[bool, str, dict]:
+        """
+        Mapeia as colunas do cabeçalho do CSV para os campos relevantes
+        
         Returns:
             Tuple[bool, str, dict]: (válido, mensagem_erro, mapeamento_colunas)
         """
@@ -126,7 +177,7 @@ class NFECSVParser:
         
         # Tenta encontrar cada coluna essencial
         for chave in colunas_essenciais:
-            coluna_encontrada = cls.encontrar_coluna(df.columns.tolist(), cls.COLUNAS_RELEVANTES[chave])
+            coluna_encontrada = cls.encontrar_coluna(colunas, cls.COLUNAS_RELEVANTES[chave])
             if coluna_encontrada:
                 mapeamento[chave] = coluna_encontrada
             else:
@@ -142,28 +193,19 @@ class NFECSVParser:
             erro = "❌ Colunas obrigatórias não encontradas no CSV:\n"
             erro += "\n".join(campos_faltando)
             erro += "\n\n📋 Colunas encontradas no arquivo:\n"
-            erro += ", ".join(df.columns.tolist()[:15])
-            if len(df.columns) > 15:
-                erro += f"... (+ {len(df.columns) - 15} colunas)"
+            erro += ", ".join(colunas[:15])
+            if len(colunas) > 15:
+                erro += f"... (+ {len(colunas) - 15} colunas)"
             erro += "\n\n💡 Solução: Certifique-se de exportar o CSV completo da Prefeitura/SEFAZ com todas as colunas."
             
             return False, erro, {}
         
         # Tenta encontrar as colunas opcionais
         for chave in ['numero_nf', 'razao_social_prestador', 'razao_social_tomador', 'data_cancelamento']:
-            coluna_encontrada = cls.encontrar_coluna(df.columns.tolist(), cls.COLUNAS_RELEVANTES[chave])
+            coluna_encontrada = cls.encontrar_coluna(colunas, cls.COLUNAS_RELEVANTES[chave])
             if coluna_encontrada:
                 mapeamento[chave] = coluna_encontrada
         
-        # Remove linhas de totalizador
-        df_limpo = cls._remover_linhas_totalizadoras(df)
-        
-        if len(df_limpo) == 0:
-            erro = "❌ CSV não contém dados válidos.\n"
-            erro += "O arquivo parece conter apenas linhas de total/subtotal ou está vazio.\n\n"
-            erro += "💡 Solução: Certifique-se de que o CSV exportado da Prefeitura contém as notas fiscais."
-            return False, erro, {}
-        
         return True, "", mapeamento
     
     @staticmethod
@@ -196,9 +238,19 @@ class NFECSVParser:
             return False, "Coluna de CNPJ não encontrada", None
         
         # Limpa CNPJs
-        cnpjs = df[col_cnpj].dropna().apply(cls.limpar_cnpj)
+        cnpjs = cls.limpar_cnpjs_vetorizado(df[col_cnpj].dropna())
         cnpjs_unicos = cnpjs[cnpjs != ''].unique()
         
+        return cls._validar_cnpjs_encontrados(list(cnpjs_unicos))
+    
+    @staticmethod
+    def _validar_cnpjs_encontrados(cnpjs_unicos: list) -> Tuple[bool, str, Optional[str]]:
+        """
+        Valida a lista de CNPJs distintos (já limpos, na ordem em que aparecem) do arquivo
+        
+        Returns:
+            Tuple[bool, str, Optional[str]]: (válido, mensagem_erro, cnpj)
+        """
         if len(cnpjs_unicos) == 0:
             return False, "❌ Nenhum CNPJ encontrado no arquivo.\n\n💡 Solução: Verifique se a coluna 'CPF/CNPJ do Prestador' está preenchida.", None
         
@@ -275,6 +327,132 @@ class NFECSVParser:
         
         return competencias
     
+    @classmethod
+    def parse_datas_vetorizado(cls, serie: pd.Series) -> pd.Series:
+        """
+        Converte uma coluna de datas para datetime de forma vetorizada.
+        Aplica os mesmos formatos de parse_data em cascata: cada formato só é
+        tentado nas linhas que os formatos anteriores não conseguiram converter.
+        """
+        textos = serie.fillna('').astype(str).str.strip()
+        datas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+
+        for formato in cls.FORMATOS_DATA:
+            pendentes = datas.isna() & (textos != '')
+            if not pendentes.any():
+                break
+            datas[pendentes] = pd.to_datetime(textos[pendentes], format=formato, errors='coerce')
+
+        return datas
+
+    @staticmethod
+    def limpar_valores_vetorizado(serie: pd.Series) -> pd.Series:
+        """
+        Converte uma coluna de valores no formato brasileiro ("1.790,00") para
+        centavos inteiros de forma vetorizada. Valores vazios ou inválidos viram 0,
+        como em limpar_valor.
+        """
+        textos = (
+            serie.fillna('').astype(str).str.strip()
+            .str.replace('.', '', regex=False)
+            .str.replace(',', '.', regex=False)
+        )
+        valores = pd.to_numeric(textos, errors='coerce').fillna(0)
+        return (valores * 100).round().astype('int64')
+
+    @staticmethod
+    def limpar_cnpjs_vetorizado(serie: pd.Series) -> pd.Series:
+        """Remove a formatação de uma coluna de CNPJs de forma vetorizada"""
+        return serie.fillna('').astype(str).str.replace(r'[^\d]', '', regex=True)
+
+    @classmethod
+    def detectar_competencias_colunar(cls, df: pd.DataFrame, mapeamento: dict) -> pd.DataFrame:
+        """
+        Versão colunar de detectar_competencias, baseada em operações vetorizadas
+        do pandas ao invés de iterrows.
+
+        Returns:
+            DataFrame com uma linha por nota válida (não cancelada e com data),
+            com as colunas numero_nf, cnpj_prestador, razao_social_prestador,
+            razao_social_tomador, valor_centavos, competencia_mes e competencia_ano
+        """
+        df = cls._remover_linhas_totalizadoras(df)
+
+        col_data_cancelamento = mapeamento.get('data_cancelamento')
+        if col_data_cancelamento:
+            canceladas = df[col_data_cancelamento].fillna('').astype(str).str.strip() != ''
+            df = df[~canceladas]
+
+        datas = cls.parse_datas_vetorizado(df[mapeamento['data_competencia']])
+        com_data = datas.notna()
+        df = df[com_data]
+        datas = datas[com_data]
+
+        def coluna_texto(chave):
+            coluna = mapeamento.get(chave)
+            if coluna:
+                return df[coluna].astype(str)
+            return pd.Series('', index=df.index, dtype=object)
+
+        return pd.DataFrame({
+            'numero_nf': coluna_texto('numero_nf'),
+            'cnpj_prestador': cls.limpar_cnpjs_vetorizado(df[mapeamento['cnpj_prestador']]),
+            'razao_social_prestador': coluna_texto('razao_social_prestador'),
+            'razao_social_tomador': coluna_texto('razao_social_tomador'),
+            'valor_centavos': cls.limpar_valores_vetorizado(df[mapeamento['valor_servicos']]),
+            'competencia_mes': datas.dt.month.astype('int64'),
+            'competencia_ano': datas.dt.year.astype('int64'),
+        }, index=df.index)
+
+    @classmethod
+    def _montar_competencias_colunar(cls, notas_df: pd.DataFrame) -> List[Dict]:
+        """
+        Agrupa as notas por competência com groupby, preservando a ordem em que
+        as competências aparecem no arquivo, e monta a lista de competências.
+        """
+        acumulado = {}
+        cls._acumular_competencias(acumulado, notas_df)
+        return cls._finalizar_competencias(acumulado)
+
+    @staticmethod
+    def _acumular_competencias(acumulado: Dict, notas_df: pd.DataFrame) -> None:
+        """
+        Soma as notas de um DataFrame (saída de detectar_competencias_colunar)
+        ao acumulado por competência {(mes, ano): {'total_centavos', 'notas'}}.
+        Competências novas entram na ordem em que aparecem.
+        """
+        agrupado = notas_df.groupby(['competencia_mes', 'competencia_ano'], sort=False)
+
+        for (mes, ano), grupo in agrupado:
+            competencia = acumulado.setdefault((int(mes), int(ano)), {'total_centavos': 0, 'notas': []})
+            competencia['total_centavos'] += int(grupo['valor_centavos'].sum())
+            competencia['notas'].extend(
+                {
+                    'numero_nf': numero_nf,
+                    'valor': valor_centavos / 100,
+                    'razao_social_tomador': tomador
+                }
+                for numero_nf, valor_centavos, tomador in zip(
+                    grupo['numero_nf'].tolist(),
+                    grupo['valor_centavos'].tolist(),
+                    grupo['razao_social_tomador'].tolist()
+                )
+            )
+
+    @staticmethod
+    def _finalizar_competencias(acumulado: Dict) -> List[Dict]:
+        """Monta a lista de competências a partir do acumulado de _acumular_competencias"""
+        return [
+            {
+                'mes': mes,
+                'ano': ano,
+                'total_notas': len(competencia['notas']),
+                'faturamento_total': float(Decimal(competencia['total_centavos']).scaleb(-2)),
+                'notas': competencia['notas']
+            }
+            for (mes, ano), competencia in acumulado.items()
+        ]
+
     @classmethod
     def _extrair_dados_nota(cls, row: pd.Series, mapeamento: dict) -> Dict:
         """
@@ -292,35 +470,56 @@ class NFECSVParser:
             'valor': cls.limpar_valor(row.get(mapeamento.get('valor_servicos', ''), 0))
         }
     
+    @staticmethod
+    def _montar_competencias(competencias_dict: Dict[Tuple[int, int], List[Dict]]) -> List[Dict]:
+        """Monta a lista de competências a partir do resultado de detectar_competencias"""
+        competencias = []
+        for (mes, ano), notas in competencias_dict.items():
+            total_competencia = sum(nota['valor'] for nota in notas)
+            
+            competencias.append({
+                'mes': mes,
+                'ano': ano,
+                'total_notas': len(notas),
+                'faturamento_total': float(total_competencia),
+                'notas': [
+                    {
+                        'numero_nf': nota['numero_nf'],
+                        'valor': float(nota['valor']),
+                        'razao_social_tomador': nota['razao_social_tomador']
+                    }
+                    for nota in notas
+                ]
+            })
+        return competencias
+    
     @classmethod
-    def processar_arquivo(cls, arquivo_bytes: bytes, nome_arquivo: str) -> Dict:
+    def processar_arquivo(cls, arquivo_bytes: bytes, nome_arquivo: str, colunar: bool = True) -> Dict:
         """
         Processa um arquivo CSV de NF-e
         
+        Args:
+            arquivo_bytes: Conteúdo do arquivo
+            nome_arquivo: Nome original do arquivo
+            colunar: Se True (padrão), usa a leitura em streaming com o
+                pipeline vetorizado do pandas (ver processar_stream);
+                se False, lê o arquivo inteiro e processa linha a linha com iterrows
+        
         Returns:
             Dict com dados processados e validados
         """
-        resultado = {
-            'nome_arquivo': nome_arquivo,
-            'status': 'ok',
-            'cnpj': None,
-            'razao_social': None,
-            'competencias': [],
-            'total_notas': 0,
-            'total_faturamento': Decimal('0'),
-            'avisos': [],
-            'erros': [],
-            'colunas_encontradas': []  # Para debug
-        }
+        if colunar:
+            return cls.processar_stream(io.BytesIO(arquivo_bytes), nome_arquivo)
+        
+        resultado = cls._novo_resultado(nome_arquivo)
         
         try:
             # Lê o CSV
             # Tenta diferentes separadores e encodings
             df = None
-            separadores = [';', '\t', ',']  # Ponto e vírgula é o mais comum no Brasil
             
-            for separador in separadores:
-                for encoding in ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']:
+            for separador in cls.SEPARADORES:
+                for encoding in cls.ENCODINGS:
                     try:
                         df = pd.read_csv(
                             io.BytesIO(arquivo_bytes),
@@ -338,13 +537,7 @@ class NFECSVParser:
                     break
             
             if df is None or len(df.columns) <= 1:
-                erro = "❌ Não foi possível ler o arquivo CSV.\n\n"
-                erro += "Possíveis causas:\n"
-                erro += "• Arquivo corrompido\n"
-                erro += "• Formato inválido\n"
-                erro += "• Separador não suportado\n\n"
-                erro += "💡 Solução: Exporte novamente o CSV da Prefeitura/SEFAZ e tente novamente."
-                raise ValueError(erro)
+                raise ValueError(cls._erro_leitura())
             
             # Adiciona colunas encontradas para debug
             resultado['colunas_encontradas'] = df.columns.tolist()[:20]  # Primeiras 20
@@ -372,86 +565,391 @@ class NFECSVParser:
             
             # Detecta competências
             competencias_dict = cls.detectar_competencias(df, mapeamento)
+            competencias = cls._montar_competencias(competencias_dict)
+            total_faturamento = sum(
+                (nota['valor'] for notas in competencias_dict.values() for nota in notas), Decimal('0')
+            )
             
-            if not competencias_dict:
-                resultado['status'] = 'erro'
-                erro = "❌ Nenhuma competência válida encontrada no arquivo.\n\n"
-                erro += "Possíveis causas:\n"
-                erro += "• Coluna de data está vazia\n"
-                erro += "• Formato de data inválido\n"
-                erro += "• Todas as notas foram canceladas\n\n"
-                erro += "💡 Solução: Verifique se a coluna 'Data de Competência' está preenchida no formato DD/MM/YYYY."
-                resultado['erros'].append(erro)
-                return resultado
+            cls._preencher_competencias(resultado, competencias, total_faturamento)
+            
+        except Exception as e:
+            cls._registrar_excecao(resultado, e)
+        
+        return resultado
+    
+    @classmethod
+    def processar_stream(cls, arquivo: BinaryIO, nome_arquivo: str) -> Dict:
+        """
+        Processa um arquivo CSV de NF-e em streaming
+        
+        O separador e o encoding são detectados a partir dos primeiros KB do
+        arquivo (TAMANHO_AMOSTRA). Em seguida o arquivo é lido em blocos de
+        TAMANHO_CHUNK linhas, apenas com as colunas usadas, e os totais e notas
+        de cada competência são acumulados bloco a bloco. Assim o pico de memória
+        do pandas depende do tamanho do bloco e não do tamanho do arquivo.
+        
+        Args:
+            arquivo: Arquivo binário posicionável (seek), como o stream de um upload
+            nome_arquivo: Nome original do arquivo
+        
+        Returns:
+            Dict com dados processados e validados (mesmo formato de processar_arquivo)
+        """
+        resultado = cls._novo_resultado(nome_arquivo)
+        
+        try:
+            inicio = arquivo.tell()
+            amostra = arquivo.read(cls.TAMANHO_AMOSTRA)
+            encodings = list(cls.ENCODINGS)
             
-            # Monta resultado por competência
-            for (mes, ano), notas in competencias_dict.items():
-                total_competencia = sum(nota['valor'] for nota in notas)
+            while True:
+                separador, encoding, colunas = cls.detectar_formato(amostra, encodings)
                 
-                competencia_info = {
-                    'mes': mes,
-                    'ano': ano,
-                    'total_notas': len(notas),
-                    'faturamento_total': float(total_competencia),
-                    'notas': [
-                        {
-                            'numero_nf': nota['numero_nf'],
-                            'valor': float(nota['valor']),
-                            'razao_social_tomador': nota['razao_social_tomador']
-                        }
-                        for nota in notas
-                    ]
-                }
+                # Adiciona colunas encontradas para debug
+                resultado['colunas_encontradas'] = colunas[:20]  # Primeiras 20
+                
+                # Valida estrutura e obtém mapeamento de colunas
+                valido, msg_erro, mapeamento = cls.mapear_colunas(colunas)
+                if not valido:
+                    resultado['status'] = 'erro'
+                    resultado['erros'].append(msg_erro)
+                    return resultado
                 
-                resultado['competencias'].append(competencia_info)
-                resultado['total_notas'] += len(notas)
-                resultado['total_faturamento'] += total_competencia
+                arquivo.seek(inicio)
+                try:
+                    leitura = cls._ler_em_chunks(arquivo, separador, encoding, colunas, mapeamento)
+                    break
+                except UnicodeDecodeError:
+                    # A amostra era válida no encoding detectado, mas o restante
+                    # do arquivo não: tenta novamente com os próximos encodings
+                    encodings = encodings[encodings.index(encoding) + 1:]
+                    if not encodings:
+                        raise
+            
+            if leitura['linhas'] == 0:
+                resultado['status'] = 'erro'
+                resultado['erros'].append(cls._erro_sem_dados())
+                return resultado
             
-            # Converte total para float
-            resultado['total_faturamento'] = float(resultado['total_faturamento'])
+            # Valida CNPJ único
+            valido, msg_erro, cnpj = cls._validar_cnpjs_encontrados(list(leitura['cnpjs']))
+            if not valido:
+                resultado['status'] = 'erro'
+                resultado['erros'].append(msg_erro)
+                return resultado
             
-            # Avisos
-            if len(competencias_dict) > 1:
-                resultado['avisos'].append(
-                    f"Arquivo contém notas de {len(competencias_dict)} competências diferentes"
-                )
+            resultado['cnpj'] = cnpj
+            resultado['razao_social'] = leitura['razao_social']
+            
+            competencias = cls._finalizar_competencias(leitura['competencias'])
+            total_faturamento = Decimal(leitura['total_centavos']).scaleb(-2)
+            
+            cls._preencher_competencias(resultado, competencias, total_faturamento)
             
         except Exception as e:
-            resultado['status'] = 'erro'
-            resultado['erros'].append(f"Erro ao processar arquivo: {str(e)}")
-            import traceback
-            resultado['erros'].append(f"Detalhes: {traceback.format_exc()}")
+            cls._registrar_excecao(resultado, e)
         
         return resultado
+    
+    @classmethod
+    def detectar_formato(cls, amostra: bytes, encodings: Optional[list] = None) -> Tuple[str, str, list]:
+        """
+        Detecta separador e encoding a partir de uma amostra do início do arquivo,
+        tentando as combinações na mesma ordem da leitura completa
+        
+        Args:
+            amostra: Primeiros bytes do arquivo
+            encodings: Encodings a tentar (padrão: ENCODINGS)
+        
+        Returns:
+            Tuple[str, str, list]: (separador, encoding, colunas do cabeçalho)
+        """
+        amostra_parcial = len(amostra) >= cls.TAMANHO_AMOSTRA
+        detectado = None
+        
+        for separador in cls.SEPARADORES:
+            for encoding in encodings or cls.ENCODINGS:
+                try:
+                    # O decoder incremental tolera um caractere cortado no fim da amostra
+                    texto = codecs.getincrementaldecoder(encoding)().decode(amostra, final=not amostra_parcial)
+                    if amostra_parcial and '\n' in texto:
+                        # Descarta a última linha, que pode ter sido cortada
+                        texto = texto[:texto.rindex('\n')]
+                    df = pd.read_csv(io.StringIO(texto), sep=separador, dtype=str)
+                except (UnicodeDecodeError, pd.errors.ParserError):
+                    continue
+                
+                detectado = (separador, encoding, df.columns.tolist())
+                # Verifica se leu corretamente (deve ter múltiplas colunas)
+                if len(df.columns) > 10:
+                    return detectado
+        
+        if detectado is None or len(detectado[2]) <= 1:
+            raise ValueError(cls._erro_leitura())
+        
+        return detectado
+    
+    @classmethod
+    def _ler_em_chunks(cls, arquivo: BinaryIO, separador: str, encoding: str, colunas: list, mapeamento: dict) -> Dict:
+        """
+        Lê o arquivo em blocos e acumula o que é necessário para o resultado
+        
+        Returns:
+            Dict com linhas (notas não totalizadoras), cnpjs (distintos, em ordem),
+            razao_social, competencias (acumulado) e total_centavos
+        """
+        # Lê apenas as colunas mapeadas e a primeira (usada para achar os totalizadores)
+        colunas_usadas = list(dict.fromkeys([colunas[0]] + list(mapeamento.values())))
+        
+        leitura = {
+            'linhas': 0,
+            'cnpjs': {},
+            'razao_social': None,
+            'competencias': {},
+            'total_centavos': 0
+        }
+        
+        leitor = pd.read_csv(
+            arquivo,
+            sep=separador,
+            encoding=encoding,
+            dtype=str,
+            usecols=colunas_usadas,
+            chunksize=cls.TAMANHO_CHUNK
+        )
+        
+        for chunk in leitor:
+            # Mantém a ordem original das colunas (a primeira identifica totalizadores)
+            chunk = cls._remover_linhas_totalizadoras(chunk[[c for c in colunas if c in colunas_usadas]])
+            if len(chunk) == 0:
+                continue
+            
+            if leitura['linhas'] == 0 and mapeamento.get('razao_social_prestador'):
+                leitura['razao_social'] = str(chunk[mapeamento['razao_social_prestador']].iloc[0])
+            leitura['linhas'] += len(chunk)
+            
+            cnpjs = cls.limpar_cnpjs_vetorizado(chunk[mapeamento['cnpj_prestador']].dropna())
+            for cnpj in cnpjs[cnpjs != ''].unique():
+                leitura['cnpjs'].setdefault(cnpj, None)
+            
+            # Com mais de um CNPJ o arquivo será rejeitado: só continua contando CNPJs
+            if len(leitura['cnpjs']) > 1:
+                leitura['competencias'].clear()
+                continue
+            
+            notas_df = cls.detectar_competencias_colunar(chunk, mapeamento)
+            cls._acumular_competencias(leitura['competencias'], notas_df)
+            leitura['total_centavos'] += int(notas_df['valor_centavos'].sum())
+        
+        return leitura
+    
+    @staticmethod
+    def _novo_resultado(nome_arquivo: str) -> Dict:
+        """Estrutura inicial do resultado do processamento de um arquivo"""
+        return {
+            'nome_arquivo': nome_arquivo,
+            'status': 'ok',
+            'cnpj': None,
+            'razao_social': None,
+            'competencias': [],
+            'total_notas': 0,
+            'total_faturamento': Decimal('0'),
+            'avisos': [],
+            'erros': [],
+            'colunas_encontradas': []  # Para debug
+        }
+    
+    @staticmethod
+    def _erro_leitura() -> str:
+        """Mensagem de erro para CSV que não pôde ser lido"""
+        erro = "❌ Não foi possível ler o arquivo CSV.\n\n"
+        erro += "Possíveis causas:\n"
+        erro += "• Arquivo corrompido\n"
+        erro += "• Formato inválido\n"
+        erro += "• Separador não suportado\n\n"
+        erro += "💡 Solução: Exporte novamente o CSV da Prefeitura/SEFAZ e tente novamente."
+        return erro
+    
+    @staticmethod
+    def _preencher_competencias(resultado: Dict, competencias: List[Dict], total_faturamento: Decimal) -> None:
+        """Preenche o resultado com as competências detectadas (ou o erro, se não houver nenhuma)"""
+        if not competencias:
+            resultado['status'] = 'erro'
+            erro = "❌ Nenhuma competência válida encontrada no arquivo.\n\n"
+            erro += "Possíveis causas:\n"
+            erro += "• Coluna de data está vazia\n"
+            erro += "• Formato de data inválido\n"
+            erro += "• Todas as notas foram canceladas\n\n"
+            erro += "💡 Solução: Verifique se a coluna 'Data de Competência' está preenchida no formato DD/MM/YYYY."
+            resultado['erros'].append(erro)
+            return
+        
+        resultado['competencias'] = competencias
+        resultado['total_notas'] = sum(c['total_notas'] for c in competencias)
+        resultado['total_faturamento'] = float(total_faturamento)
+        
+        # Avisos
+        if len(competencias) > 1:
+            resultado['avisos'].append(
+                f"Arquivo contém notas de {len(competencias)} competências diferentes"
+            )
+    
+    @staticmethod
+    def _registrar_excecao(resultado: Dict, e: Exception) -> None:
+        """Marca o resultado como erro a partir de uma exceção inesperada"""
+        resultado['status'] = 'erro'
+        resultado['erros'].append(f"Erro ao processar arquivo: {str(e)}")
+        import traceback
+        resultado['erros'].append(f"Detalhes: {traceback.format_exc()}")
+
+
+# Pool de processos reaproveitado entre chamadas de processar_multiplos_arquivos
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def _obter_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Retorna o pool de processos compartilhado, recriando-o se o número de workers mudou"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # 'spawn' evita herdar locks/threads do servidor (e é o padrão no Windows)
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = max_workers
+        return _pool
 
 
-def processar_multiplos_arquivos(arquivos: List[Tuple[bytes, str]]) -> Dict:
+def _processar_em_processo(arquivo, nome_arquivo: str) -> Dict:
+    """
+    Processa um arquivo dentro de um processo do pool.
+    'arquivo' é o conteúdo em bytes ou o caminho de um arquivo temporário.
+    """
+    if isinstance(arquivo, (bytes, bytearray)):
+        return NFECSVParser.processar_arquivo(arquivo, nome_arquivo)
+    with open(arquivo, 'rb') as f:
+        return NFECSVParser.processar_stream(f, nome_arquivo)
+
+
+def _processar_em_paralelo(arquivos: List[Tuple[object, str]], max_workers: int, ao_concluir_arquivo=None) -> List[Dict]:
+    """
+    Processa os arquivos em um pool de processos, devolvendo os resultados na
+    mesma ordem da entrada. Streams são copiados para arquivos temporários (os
+    processos recebem apenas o caminho) e a falha de um arquivo não afeta os demais.
+    """
+    temporarios = []
+    try:
+        entradas = []
+        for arquivo, nome_arquivo in arquivos:
+            if isinstance(arquivo, (bytes, bytearray)):
+                entradas.append((arquivo, nome_arquivo))
+                continue
+            with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as temporario:
+                shutil.copyfileobj(arquivo, temporario)
+            temporarios.append(temporario.name)
+            entradas.append((temporario.name, nome_arquivo))
+
+        pool = _obter_pool(max_workers)
+        futuros = [pool.submit(_processar_em_processo, arquivo, nome_arquivo) for arquivo, nome_arquivo in entradas]
+
+        resultados = []
+        try:
+            for indice, (futuro, (_, nome_arquivo)) in enumerate(zip(futuros, entradas)):
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    # Erro fora do parser (ex.: processo do pool encerrado)
+                    resultado = NFECSVParser._novo_resultado(nome_arquivo)
+                    NFECSVParser._registrar_excecao(resultado, e)
+                resultados.append(resultado)
+                if ao_concluir_arquivo:
+                    ao_concluir_arquivo(indice, resultado)
+        except BaseException:
+            # Interrompido (ex.: job cancelado): descarta os arquivos ainda na fila
+            for futuro in futuros:
+                futuro.cancel()
+            raise
+        return resultados
+    finally:
+        for caminho in temporarios:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+
+def _processar_arquivos(arquivos: List[Tuple[object, str]], max_workers: int, ao_concluir_arquivo=None) -> List[Dict]:
+    """Processa os arquivos em sequência ou em paralelo, devolvendo os resultados na ordem da entrada"""
+    if max_workers > 1 and len(arquivos) > 1:
+        return _processar_em_paralelo(arquivos, min(max_workers, len(arquivos)), ao_concluir_arquivo)
+
+    resultados = []
+    for indice, (arquivo, nome_arquivo) in enumerate(arquivos):
+        if isinstance(arquivo, (bytes, bytearray)):
+            resultado = NFECSVParser.processar_arquivo(arquivo, nome_arquivo)
+        else:
+            resultado = NFECSVParser.processar_stream(arquivo, nome_arquivo)
+        resultados.append(resultado)
+        if ao_concluir_arquivo:
+            ao_concluir_arquivo(indice, resultado)
+    return resultados
+
+
+def processar_multiplos_arquivos(arquivos: List[Tuple[object, str]], max_workers: int = 1, ao_concluir_arquivo=None, cache=None) -> Dict:
     """
     Processa múltiplos arquivos CSV
     
     Args:
-        arquivos: Lista de tuplas (bytes_arquivo, nome_arquivo)
+        arquivos: Lista de tuplas (arquivo, nome_arquivo), onde arquivo é o
+            conteúdo em bytes ou um arquivo binário posicionável (lido em streaming)
+        max_workers: Número de processos para processar os arquivos em paralelo.
+            Com 1 (padrão) os arquivos são processados em sequência no processo atual
+        ao_concluir_arquivo: Chamada opcional ao_concluir_arquivo(indice, resultado)
+            a cada arquivo concluído: primeiro os encontrados no cache, depois os
+            demais na ordem da entrada
+        cache: Cache de resultados (cache_csv.CacheResultadoCSV), opcional.
+            Arquivos com o mesmo conteúdo de um já processado não são lidos de novo
     
     Returns:
         Dict com resultado do processamento de todos os arquivos
     """
-    parser = NFECSVParser()
+    resultados = [None] * len(arquivos)
+    chaves = [None] * len(arquivos)
+    
+    if cache is not None:
+        for indice, (arquivo, nome_arquivo) in enumerate(arquivos):
+            chaves[indice] = cache.chave(arquivo)
+            resultado = cache.obter(chaves[indice])
+            if resultado is not None:
+                resultado['nome_arquivo'] = nome_arquivo
+                resultados[indice] = resultado
+                if ao_concluir_arquivo:
+                    ao_concluir_arquivo(indice, resultado)
+    
+    pendentes = [indice for indice, resultado in enumerate(resultados) if resultado is None]
+    if pendentes:
+        processados = _processar_arquivos(
+            [arquivos[indice] for indice in pendentes],
+            max_workers,
+            (lambda posicao, resultado: ao_concluir_arquivo(pendentes[posicao], resultado)) if ao_concluir_arquivo else None
+        )
+        for indice, resultado in zip(pendentes, processados):
+            resultados[indice] = resultado
+            if cache is not None:
+                cache.gravar(chaves[indice], resultado)
     
-    resultados = []
     total_arquivos_ok = 0
     total_arquivos_erro = 0
     total_geral = Decimal('0')
     
-    for arquivo_bytes, nome_arquivo in arquivos:
-        resultado = parser.processar_arquivo(arquivo_bytes, nome_arquivo)
-        
+    for resultado in resultados:
         if resultado['status'] == 'ok':
             total_arquivos_ok += 1
             total_geral += Decimal(str(resultado['total_faturamento']))
         else:
             total_arquivos_erro += 1
-        
-        resultados.append(resultado)
     
     return {
         'arquivos_processados': resultados,
@@ -462,4 +960,3 @@ def processar_multiplos_arquivos(arquivos: List[Tuple[bytes, str]]) -> Dict:
             'total_importar': float(total_geral)
         }
     }
-
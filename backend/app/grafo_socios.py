@@ -0,0 +1,140 @@
+"""
+Carregamento do quadro societário (sócios das empresas e empresas dos sócios)
+
+Os sócios de uma ou de várias empresas vêm em uma única consulta, com o JOIN
+entre socio e cliente, em vez de um Cliente.query.get por sócio. Apenas as
+colunas usadas nas telas e nos contratos são lidas, e cada sócio vira um
+SocioResumo. A consulta inversa (empresas de que uma pessoa é sócia) usa o
+índice idx_socio_socio_id.
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import contains_eager
+from .models import db, Cliente, Socio
+
+# Colunas do cliente sócio que compõem o endereço completo, na ordem de exibição
+CAMPOS_ENDERECO = ('logradouro', 'numero', 'complemento', 'bairro', 'municipio', 'uf')
+
+
+def montar_endereco(logradouro, numero, complemento, bairro, municipio, uf, cep):
+    """Endereço em uma linha, sem as partes vazias"""
+    partes = [parte for parte in (logradouro, numero, complemento, bairro, municipio, uf) if parte]
+    if cep:
+        partes.append(f"CEP {cep}")
+    return ", ".join(partes)
+
+
+class SocioResumo:
+    """Sócio de uma empresa com os dados do cliente PF já resolvidos"""
+
+    __slots__ = ('id', 'empresa_id', 'cliente_id', 'nome', 'cpf', 'rg', 'email', 'telefone',
+                 'endereco_completo', 'percentual_participacao', 'data_entrada', 'cargo')
+
+    def __init__(self, linha):
+        self.id = linha.id
+        self.empresa_id = linha.empresa_id
+        self.cliente_id = linha.socio_id
+        self.nome = linha.nome_completo
+        self.cpf = linha.cpf
+        self.rg = linha.rg
+        self.email = linha.email
+        self.telefone = linha.telefone1
+        self.endereco_completo = montar_endereco(
+            *(getattr(linha, campo) for campo in CAMPOS_ENDERECO), linha.cep
+        )
+        self.percentual_participacao = linha.percentual_participacao
+        self.data_entrada = linha.data_entrada
+        self.cargo = linha.cargo
+
+    def to_dict(self):
+        """Formato usado pelas rotas de empresa e de contratos"""
+        return {
+            'id': self.id,
+            'cliente_id': self.cliente_id,
+            'nome': self.nome,
+            'cpf': self.cpf,
+            'rg': self.rg,
+            'email': self.email,
+            'telefone': self.telefone,
+            'endereco_completo': self.endereco_completo,
+            'participacao_percentual': float(self.percentual_participacao or 0),
+            'data_entrada': self.data_entrada,
+            'cargo': self.cargo
+        }
+
+
+def _consulta_socios():
+    # INNER JOIN: vínculos cujo cliente sócio não existe mais são ignorados
+    return select(
+        Socio.id, Socio.empresa_id, Socio.socio_id, Socio.percentual_participacao,
+        Socio.data_entrada, Socio.cargo,
+        Cliente.nome_completo, Cliente.cpf, Cliente.rg, Cliente.email, Cliente.telefone1,
+        *(getattr(Cliente, campo) for campo in CAMPOS_ENDERECO), Cliente.cep
+    ).join(Cliente, Cliente.id == Socio.socio_id).order_by(Socio.empresa_id, Socio.id)
+
+def carregar_socios_empresas(empresa_ids):
+    """
+    Sócios de várias empresas em uma única consulta.
+
+    Args:
+        empresa_ids (iterable): IDs das empresas (clientes PJ)
+
+    Returns:
+        dict: {empresa_id: [SocioResumo, ...]}, com todas as empresas pedidas
+            (lista vazia para as que não têm sócios)
+    """
+    empresa_ids = list(dict.fromkeys(empresa_ids))
+    socios_por_empresa = {empresa_id: [] for empresa_id in empresa_ids}
+    if not empresa_ids:
+        return socios_por_empresa
+
+    linhas = db.session.execute(_consulta_socios().where(Socio.empresa_id.in_(empresa_ids)))
+    for linha in linhas:
+        socios_por_empresa[linha.empresa_id].append(SocioResumo(linha))
+    return socios_por_empresa
+
+def carregar_socios_empresa(empresa_id):
+    """Sócios de uma empresa (lista de SocioResumo)"""
+    return carregar_socios_empresas([empresa_id])[empresa_id]
+
+def carregar_vinculos_empresa(empresa_id):
+    """
+    Objetos Socio de uma empresa com o cliente sócio (Socio.socio) já
+    carregado, para quem precisa do modelo (Socio.to_dict)
+    """
+    return db.session.execute(
+        select(Socio).join(Socio.socio).options(contains_eager(Socio.socio))
+        .where(Socio.empresa_id == empresa_id).order_by(Socio.id)
+    ).scalars().all()
+
+def carregar_empresas_do_socio(socio_id):
+    """
+    Empresas de que uma pessoa é sócia.
+
+    Args:
+        socio_id (int): ID do cliente PF
+
+    Returns:
+        list: Dicionários com o vínculo (id, percentual, cargo, data de
+            entrada) e os dados básicos da empresa
+    """
+    linhas = db.session.execute(
+        select(
+            Socio.id, Socio.empresa_id, Socio.percentual_participacao, Socio.data_entrada, Socio.cargo,
+            Cliente.razao_social, Cliente.nome_fantasia, Cliente.cnpj, Cliente.situacao_cadastral
+        ).join(Cliente, Cliente.id == Socio.empresa_id)
+        .where(Socio.socio_id == socio_id).order_by(Cliente.razao_social, Socio.id)
+    )
+    return [
+        {
+            'id': linha.id,
+            'empresa_id': linha.empresa_id,
+            'razao_social': linha.razao_social,
+            'nome_fantasia': linha.nome_fantasia,
+            'cnpj': linha.cnpj,
+            'situacao_cadastral': linha.situacao_cadastral,
+            'participacao_percentual': float(linha.percentual_participacao or 0),
+            'data_entrada': linha.data_entrada,
+            'cargo': linha.cargo
+        }
+        for linha in linhas
+    ]
@@ -0,0 +1,549 @@
+"""
+Jobs assíncronos de importação de CSV (preview e consolidação) e de
+atualização cadastral dos clientes pela Receita Federal
+
+Os jobs ficam registrados na tabela job_importacao e são executados por um
+pool de threads local ao processo (sem broker externo). O andamento é gravado
+no banco por arquivo e competência, em transações curtas e independentes da
+transação do job, para que qualquer processo da aplicação possa consultá-lo.
+O cancelamento é um pedido gravado no job e verificado pelo worker a cada
+atualização de progresso.
+
+Como o pool é local ao processo, cada job guarda o processo que o executa
+("host:pid") e um heartbeat, renovado por esse processo a cada
+INTERVALO_HEARTBEAT segundos (e a cada gravação de progresso) enquanto o job
+estiver PENDENTE ou EXECUTANDO. Um job ativo com o heartbeat vencido há mais
+de PRAZO_HEARTBEAT segundos ficou sem worker (reinício ou queda do processo):
+qualquer processo que use os jobs o finaliza como ERRO (ou CANCELADO, se o
+cancelamento tinha sido pedido), e ele pode ser reenviado. Jobs de processos
+vivos, inclusive os de outros workers do gunicorn, nunca são tocados.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, jsonify, current_app
+from sqlalchemy import update, select, and_, func
+from .models import db, JobImportacao
+from .auth import token_required
+from .csv_parser import processar_multiplos_arquivos
+from .cache_csv import obter_cache
+from .services import verificar_preview_no_banco, consolidar_faturamento_lote, resumir_consolidacao
+from .preview_importacao import armazenar_preview, carregar_previews, descartar_previews
+from .atualizacao_cadastral import atualizar_cadastros, contar_clientes_pj
+from .audit import montar_registro_log, registrar_logs_em_lote
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/importacao/jobs')
+
+# Intervalo mínimo (segundos) entre gravações de progresso no banco
+INTERVALO_PROGRESSO = 0.5
+
+# Intervalo (segundos) de renovação do heartbeat dos jobs ativos de cada processo;
+# sem renovação por PRAZO_HEARTBEAT segundos, o job é considerado abandonado
+INTERVALO_HEARTBEAT = 15
+PRAZO_HEARTBEAT = 4 * INTERVALO_HEARTBEAT
+
+STATUS_ATIVOS = ('PENDENTE', 'EXECUTANDO')
+
+# Mensagem gravada nos jobs interrompidos por um reinício do servidor
+MENSAGEM_JOB_INTERROMPIDO = 'Job interrompido: o servidor foi reiniciado antes da conclusão. Envie novamente.'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Thread que renova o heartbeat dos jobs deste processo (e a aplicação que ela usa)
+_heartbeat = None
+_app_heartbeat = None
+
+_proxima_verificacao_orfaos = 0.0
+_orfaos_lock = threading.Lock()
+
+
+class JobCancelado(Exception):
+    """Lançada dentro do worker quando o cancelamento do job foi solicitado"""
+
+
+def _identificacao_processo():
+    """Processo atual ("host:pid"); calculado a cada uso, pois o gunicorn cria os workers com fork"""
+    return f"{socket.gethostname()}:{os.getpid()}"[:100]
+
+def _renovar_heartbeat():
+    """Renova o heartbeat dos jobs ativos deste processo (transação própria)"""
+    tabela = JobImportacao.__table__
+    with db.engine.begin() as conexao:
+        conexao.execute(
+            update(tabela)
+            .where(tabela.c.processo == _identificacao_processo(), tabela.c.status.in_(STATUS_ATIVOS))
+            .values(heartbeat=datetime.utcnow())
+        )
+
+def _manter_heartbeat():
+    """Laço da thread de heartbeat (daemon: termina com o processo)"""
+    while True:
+        time.sleep(INTERVALO_HEARTBEAT)
+        app = _app_heartbeat
+        try:
+            with app.app_context():
+                _renovar_heartbeat()
+        except Exception:
+            app.logger.warning("Falha ao renovar o heartbeat dos jobs de importação", exc_info=True)
+
+def _obter_executor(app):
+    """Retorna o pool de threads dos jobs, criando-o (e a thread de heartbeat) no primeiro uso"""
+    global _executor, _heartbeat, _app_heartbeat
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config.get('IMPORTACAO_JOB_WORKERS', 2),
+                thread_name_prefix='job-importacao'
+            )
+        _app_heartbeat = app
+        if _heartbeat is None or not _heartbeat.is_alive():
+            _heartbeat = threading.Thread(target=_manter_heartbeat, name='job-importacao-heartbeat', daemon=True)
+            _heartbeat.start()
+        return _executor
+
+def _pasta_job(app, job_id):
+    """Pasta onde ficam os arquivos enviados para um job de preview"""
+    return os.path.join(app.config.get('IMPORTACAO_JOBS_DIR') or os.path.join(tempfile.gettempdir(), 'sistema_contabil_jobs'), job_id)
+
+
+class ProgressoJob:
+    """
+    Andamento de um job por arquivo e competência.
+
+    As alterações ficam em memória e são gravadas no banco no máximo a cada
+    INTERVALO_PROGRESSO segundos (ou quando forçado), em uma transação própria,
+    junto com o heartbeat. A cada gravação o pedido de cancelamento é verificado.
+    """
+
+    def __init__(self, job_id, arquivos):
+        """
+        Args:
+            job_id (str): ID do job
+            arquivos (list): Tuplas (nome_arquivo, competencias), onde competencias
+                é a lista de rótulos "MM/AAAA" já conhecidos (pode ser vazia)
+        """
+        self.job_id = job_id
+        self.arquivos = [
+            {
+                'nome_arquivo': nome_arquivo,
+                'status': 'pendente',
+                'competencias': [{'competencia': rotulo, 'status': 'pendente'} for rotulo in competencias]
+            }
+            for nome_arquivo, competencias in arquivos
+        ]
+        self.total = sum(max(len(arquivo['competencias']), 1) for arquivo in self.arquivos)
+        self.processados = 0
+        self._ultima_gravacao = 0
+
+    def arquivo_concluido(self, indice, status, competencias=None):
+        """Marca um arquivo inteiro como concluído (preview)"""
+        arquivo = self.arquivos[indice]
+        arquivo['status'] = status
+        if competencias is not None:
+            arquivo['competencias'] = [{'competencia': rotulo, 'status': 'lida'} for rotulo in competencias]
+        self.processados += 1
+        self.salvar()
+
+    def competencia_processada(self, indice_arquivo, indice_competencia):
+        """Marca uma competência como processada (consolidação)"""
+        arquivo = self.arquivos[indice_arquivo]
+        arquivo['status'] = 'processando'
+        arquivo['competencias'][indice_competencia]['status'] = 'processada'
+        self.processados += 1
+        self.salvar()
+
+    def dados(self):
+        """Conteúdo gravado na coluna progresso do job"""
+        return {'arquivos': self.arquivos}
+
+    def salvar(self, forcar=False):
+        """Grava o progresso no banco e lança JobCancelado se o cancelamento foi pedido"""
+        agora = time.monotonic()
+        if not forcar and agora - self._ultima_gravacao < INTERVALO_PROGRESSO:
+            return
+        self._ultima_gravacao = agora
+
+        # Conexão própria: não interfere na transação em andamento do job
+        with db.engine.begin() as conexao:
+            conexao.execute(
+                update(JobImportacao.__table__)
+                .where(JobImportacao.__table__.c.id == self.job_id)
+                .values(
+                    progresso=json.dumps(self.dados(), ensure_ascii=False),
+                    total_itens=self.total,
+                    itens_processados=min(self.processados, self.total),
+                    heartbeat=datetime.utcnow()
+                )
+            )
+            cancelar = conexao.execute(
+                select(JobImportacao.__table__.c.cancelamento_solicitado)
+                .where(JobImportacao.__table__.c.id == self.job_id)
+            ).scalar()
+
+        if cancelar:
+            raise JobCancelado()
+
+
+class ProgressoAtualizacaoCadastral(ProgressoJob):
+    """Andamento da atualização cadastral: quantidade de clientes por situação"""
+
+    def __init__(self, job_id, total):
+        super().__init__(job_id, [])
+        self.total = total
+        self.clientes = {}
+
+    def cliente_concluido(self, situacao):
+        self.clientes[situacao] = self.clientes.get(situacao, 0) + 1
+        self.processados += 1
+        self.salvar()
+
+    def dados(self):
+        return {'clientes': self.clientes}
+
+
+def _executar_preview(job, parametros):
+    """Executa o preview dos arquivos salvos na pasta do job"""
+    app = current_app._get_current_object()
+    pasta = _pasta_job(app, job.id)
+    arquivos = parametros['arquivos']
+
+    progresso = ProgressoJob(job.id, [(nome_arquivo, []) for nome_arquivo, _ in arquivos])
+    progresso.salvar(forcar=True)
+
+    def ao_concluir_arquivo(indice, resultado):
+        progresso.arquivo_concluido(
+            indice,
+            'concluido' if resultado['status'] == 'ok' else 'erro',
+            [f"{c['mes']:02d}/{c['ano']}" for c in resultado['competencias']]
+        )
+
+    abertos = [open(os.path.join(pasta, nome_salvo), 'rb') for _, nome_salvo in arquivos]
+    try:
+        resultado = processar_multiplos_arquivos(
+            [(arquivo, nome_arquivo) for arquivo, (nome_arquivo, _) in zip(abertos, arquivos)],
+            max_workers=app.config.get('CSV_PARSER_WORKERS', 1),
+            ao_concluir_arquivo=ao_concluir_arquivo,
+            cache=obter_cache(app)
+        )
+    finally:
+        for arquivo in abertos:
+            arquivo.close()
+
+    verificar_preview_no_banco(resultado)
+    armazenar_preview(resultado, job.usuario_id)
+    # O progresso só é gravado depois do commit (ver _executar_consolidacao)
+    db.session.commit()
+
+    progresso.salvar(forcar=True)
+    return resultado
+
+def _executar_consolidacao(job, parametros):
+    """Executa a consolidação dos previews guardados no servidor"""
+    ids_temporarios = parametros['ids_temporarios']
+    arquivos = carregar_previews(ids_temporarios, job.usuario_id)
+
+    progresso = ProgressoJob(job.id, [
+        (
+            arquivo.get('nome_arquivo', 'desconhecido'),
+            [f"{c['mes']:02d}/{c['ano']}" for c in arquivo.get('competencias', [])]
+        )
+        for arquivo in arquivos
+    ])
+    progresso.salvar(forcar=True)
+
+    resultados = consolidar_faturamento_lote(
+        arquivos,
+        parametros.get('substituicoes', {}),
+        job.usuario_id,
+        ao_progredir=progresso.competencia_processada
+    )
+    descartar_previews(arquivos)
+    # O progresso só é gravado depois do commit: no SQLite uma segunda conexão
+    # ficaria bloqueada pela escrita ainda aberta na sessão
+    db.session.commit()
+
+    for arquivo in progresso.arquivos:
+        arquivo['status'] = 'concluido'
+    progresso.processados = progresso.total
+    progresso.salvar(forcar=True)
+    return resumir_consolidacao(resultados)
+
+def _executar_atualizacao_cadastral(job, parametros):
+    """Atualiza os dados cadastrais dos clientes PJ pela Receita Federal"""
+    cliente_ids = parametros.get('cliente_ids')
+    aplicar = parametros.get('aplicar', False)
+    progresso = ProgressoAtualizacaoCadastral(job.id, contar_clientes_pj(cliente_ids))
+    progresso.salvar(forcar=True)
+
+    relatorio = atualizar_cadastros(
+        cliente_ids,
+        aplicar=aplicar,
+        usar_cache=parametros.get('usar_cache', True),
+        ao_progredir=progresso.cliente_concluido
+    )
+    if aplicar:
+        registrar_logs_em_lote([montar_registro_log(job.usuario_id, 'ATUALIZACAO_CADASTRAL', 'CLIENTE', detalhes={
+            'clientes_alterados': relatorio['clientes_alterados'],
+            'total_clientes': relatorio['total_clientes'],
+            'job_id': job.id
+        })])
+    # O progresso só é gravado depois do commit (ver _executar_consolidacao)
+    db.session.commit()
+
+    progresso.total = progresso.processados
+    progresso.salvar(forcar=True)
+    return relatorio
+
+EXECUTORES = {
+    'PREVIEW': _executar_preview,
+    'CONSOLIDACAO': _executar_consolidacao,
+    'ATUALIZACAO_CNPJ': _executar_atualizacao_cadastral
+}
+
+
+def _finalizar_job(job_id, status, resultado=None, erro=None):
+    """Grava o status final do job (se ele já não foi finalizado por recuperar_jobs_orfaos)"""
+    job = db.session.get(JobImportacao, job_id)
+    if job.status not in STATUS_ATIVOS:
+        return
+    job.status = status
+    job.data_fim = datetime.utcnow()
+    job.parametros = None  # Os dados de entrada não são mais necessários
+    if resultado is not None:
+        job.resultado = json.dumps(resultado, ensure_ascii=False, default=str)
+    if erro:
+        job.erro = erro
+    db.session.commit()
+
+def _executar_job(app, job_id):
+    """Ponto de entrada do worker: executa um job dentro do contexto da aplicação"""
+    with app.app_context():
+        try:
+            job = db.session.get(JobImportacao, job_id)
+            if job is None or job.status != 'PENDENTE':
+                return
+            if job.cancelamento_solicitado:
+                _finalizar_job(job_id, 'CANCELADO')
+                return
+
+            job.status = 'EXECUTANDO'
+            job.data_inicio = datetime.utcnow()
+            db.session.commit()
+
+            parametros = json.loads(job.parametros or '{}')
+            resultado = EXECUTORES[job.tipo](job, parametros)
+            _finalizar_job(job_id, 'CONCLUIDO', resultado=resultado)
+            app.logger.info(f"Job de importação {job_id} ({job.tipo}) concluído")
+
+        except JobCancelado:
+            db.session.rollback()
+            _finalizar_job(job_id, 'CANCELADO')
+            app.logger.info(f"Job de importação {job_id} cancelado")
+
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Erro no job de importação {job_id}: {str(e)}", exc_info=True)
+            try:
+                _finalizar_job(job_id, 'ERRO', erro=str(e))
+            except Exception:
+                db.session.rollback()
+
+        finally:
+            shutil.rmtree(_pasta_job(app, job_id), ignore_errors=True)
+            db.session.remove()
+
+
+def recuperar_jobs_orfaos(app=None):
+    """
+    Finaliza os jobs PENDENTE ou EXECUTANDO cujo heartbeat venceu (mais de
+    PRAZO_HEARTBEAT segundos sem renovação): o processo que os executava não
+    existe mais, e nenhum worker vai executá-los nem ler o pedido de
+    cancelamento. Jobs com heartbeat em dia, de qualquer processo, não são
+    tocados. Cada job é finalizado com um UPDATE condicional, para não
+    disputar com um processo que renove o heartbeat no mesmo instante.
+
+    Returns:
+        int: Quantidade de jobs finalizados
+    """
+    app = app or current_app._get_current_object()
+    agora = datetime.utcnow()
+    # Jobs anteriores à coluna heartbeat usam a data de criação
+    abandonado = and_(
+        JobImportacao.status.in_(STATUS_ATIVOS),
+        func.coalesce(JobImportacao.heartbeat, JobImportacao.data_criacao) < agora - timedelta(seconds=PRAZO_HEARTBEAT)
+    )
+    candidatos = db.session.execute(
+        select(JobImportacao.id, JobImportacao.cancelamento_solicitado).where(abandonado)
+    ).all()
+
+    finalizados = []
+    for job_id, cancelamento_solicitado in candidatos:
+        if cancelamento_solicitado:
+            valores = {'status': 'CANCELADO'}
+        else:
+            valores = {'status': 'ERRO', 'erro': MENSAGEM_JOB_INTERROMPIDO}
+        resultado = db.session.execute(
+            update(JobImportacao).where(JobImportacao.id == job_id, abandonado)
+            .values(data_fim=agora, parametros=None, **valores)
+            .execution_options(synchronize_session=False)
+        )
+        if resultado.rowcount:
+            finalizados.append(job_id)
+    db.session.commit()
+
+    # Só a pasta dos jobs efetivamente finalizados aqui (nenhum processo vivo os executa)
+    for job_id in finalizados:
+        shutil.rmtree(_pasta_job(app, job_id), ignore_errors=True)
+    if finalizados:
+        app.logger.warning(f"{len(finalizados)} job(s) de importação sem heartbeat finalizado(s)")
+    return len(finalizados)
+
+def _verificar_jobs_orfaos():
+    """Executa recuperar_jobs_orfaos no máximo uma vez a cada INTERVALO_HEARTBEAT segundos por processo"""
+    global _proxima_verificacao_orfaos
+    if time.monotonic() < _proxima_verificacao_orfaos:
+        return
+    with _orfaos_lock:
+        if time.monotonic() < _proxima_verificacao_orfaos:
+            return
+        _proxima_verificacao_orfaos = time.monotonic() + INTERVALO_HEARTBEAT
+        recuperar_jobs_orfaos()
+
+
+def _submeter_job(tipo, usuario_id, parametros, job_id=None):
+    """Registra o job no banco e o coloca na fila do worker local"""
+    app = current_app._get_current_object()
+    _verificar_jobs_orfaos()
+    job = JobImportacao(
+        id=job_id or str(uuid.uuid4()),
+        tipo=tipo,
+        status='PENDENTE',
+        usuario_id=usuario_id,
+        parametros=json.dumps(parametros, ensure_ascii=False, default=str),
+        total_itens=0,
+        itens_processados=0,
+        cancelamento_solicitado=False,
+        processo=_identificacao_processo(),
+        heartbeat=datetime.utcnow()
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    _obter_executor(app).submit(_executar_job, app, job.id)
+    return job
+
+def submeter_job_preview(usuario_id, arquivos):
+    """
+    Cria um job de preview. Os arquivos enviados são copiados para a pasta do
+    job, pois o worker os lê depois que a requisição já terminou.
+
+    Args:
+        usuario_id (int): Usuário que enviou os arquivos
+        arquivos (list): Tuplas (stream, nome_arquivo) dos uploads
+
+    Returns:
+        JobImportacao: Job criado (status PENDENTE)
+    """
+    job_id = str(uuid.uuid4())
+    pasta = _pasta_job(current_app, job_id)
+    os.makedirs(pasta, exist_ok=True)
+
+    salvos = []
+    for indice, (stream, nome_arquivo) in enumerate(arquivos):
+        nome_salvo = f"{indice}.csv"
+        with open(os.path.join(pasta, nome_salvo), 'wb') as destino:
+            shutil.copyfileobj(stream, destino)
+        salvos.append((nome_arquivo, nome_salvo))
+
+    return _submeter_job('PREVIEW', usuario_id, {'arquivos': salvos}, job_id=job_id)
+
+def submeter_job_consolidacao(usuario_id, ids_temporarios, substituicoes):
+    """
+    Cria um job de consolidação dos previews guardados no servidor
+
+    Args:
+        usuario_id (int): Usuário dono dos previews
+        ids_temporarios (list): IDs dos arquivos do preview
+        substituicoes (dict): {id_temporario: {"mes_ano": bool}}
+
+    Returns:
+        JobImportacao: Job criado (status PENDENTE)
+    """
+    return _submeter_job('CONSOLIDACAO', usuario_id, {
+        'ids_temporarios': ids_temporarios,
+        'substituicoes': substituicoes
+    })
+
+
+def submeter_job_atualizacao_cadastral(usuario_id, cliente_ids=None, aplicar=False, usar_cache=True):
+    """
+    Cria um job de atualização dos dados cadastrais pela Receita Federal
+    (ver atualizacao_cadastral.py)
+
+    Args:
+        usuario_id (int): Usuário que pediu a atualização
+        cliente_ids (list, optional): Restringe a atualização a esses clientes
+        aplicar (bool): Grava as alterações (False apenas as lista)
+        usar_cache (bool): False consulta a API mesmo para CNPJs no cache
+
+    Returns:
+        JobImportacao: Job criado (status PENDENTE)
+    """
+    return _submeter_job('ATUALIZACAO_CNPJ', usuario_id, {
+        'cliente_ids': cliente_ids,
+        'aplicar': aplicar,
+        'usar_cache': usar_cache
+    })
+
+
+@jobs_bp.before_request
+def _antes_das_rotas_de_jobs():
+    _verificar_jobs_orfaos()
+
+def _obter_job_do_usuario(current_user, job_id):
+    """Busca o job, permitindo acesso apenas ao dono ou a administradores"""
+    job = db.session.get(JobImportacao, job_id)
+    if not job or (job.usuario_id != current_user.id and current_user.papel != 'ADMIN'):
+        return None
+    return job
+
+@jobs_bp.route("/", methods=["GET"])
+@token_required
+def listar_jobs(current_user):
+    """Lista os últimos jobs de importação do usuário"""
+    jobs = JobImportacao.query.filter_by(
+        usuario_id=current_user.id
+    ).order_by(JobImportacao.data_criacao.desc()).limit(50).all()
+    return jsonify([job.to_dict() for job in jobs])
+
+@jobs_bp.route("/<string:job_id>", methods=["GET"])
+@token_required
+def obter_job(current_user, job_id):
+    """Retorna status e progresso do job (e o resultado, quando concluído)"""
+    job = _obter_job_do_usuario(current_user, job_id)
+    if not job:
+        return jsonify({"erro": "Job não encontrado"}), 404
+    return jsonify(job.to_dict(incluir_resultado=job.status == 'CONCLUIDO'))
+
+@jobs_bp.route("/<string:job_id>/cancelar", methods=["POST"])
+@token_required
+def cancelar_job(current_user, job_id):
+    """Solicita o cancelamento de um job pendente ou em execução"""
+    job = _obter_job_do_usuario(current_user, job_id)
+    if not job:
+        return jsonify({"erro": "Job não encontrado"}), 404
+
+    if job.status not in ('PENDENTE', 'EXECUTANDO'):
+        return jsonify({"erro": f"Job já finalizado (status: {job.status})"}), 400
+
+    job.cancelamento_solicitado = True
+    db.session.commit()
+    return jsonify(job.to_dict())
@@ -0,0 +1,178 @@
+"""
+Listagem de clientes com projeção de campos, filtros e paginação por chave
+
+As consultas selecionam apenas as colunas pedidas (select do Core, sem
+carregar objetos Cliente) e a paginação usa a posição do último item
+(valor da ordenação, id) em vez de OFFSET: cada página custa o mesmo,
+qualquer que seja a sua posição na lista.
+
+Parâmetros aceitos (query string das rotas de listagem):
+    fields: campos separados por vírgula (padrão: campos básicos de PF/PJ)
+    tipo_pessoa: PF ou PJ
+    regime: regime tributário
+    uf: sigla do estado
+    ativo: true/false (situação cadastral ATIVA)
+    ordenar: id, nome, razao_social, nome_completo, cnpj, cpf, municipio, uf
+        ou regime_tributario; ordem: asc ou desc
+    limite: tamanho da página (sem limite, a lista inteira é devolvida)
+    cursor: proximo_cursor devolvido pela página anterior
+"""
+import json
+import base64
+import binascii
+from sqlalchemy import select, func, tuple_
+from .models import db, Cliente
+
+LIMITE_MAXIMO = 500
+
+# Colunas que não são expostas pela listagem
+COLUNAS_INTERNAS = {'cnpj_digitos', 'cpf_digitos'}
+
+CAMPOS_DISPONIVEIS = {
+    coluna.key: coluna for coluna in Cliente.__table__.columns if coluna.key not in COLUNAS_INTERNAS
+}
+
+# Campos devolvidos sem fields=, conforme o tipo de pessoa
+CAMPOS_BASICOS = ('id', 'tipo_pessoa', 'valor_honorarios')
+CAMPOS_BASICOS_PF = ('nome_completo', 'cpf', 'email', 'telefone1')
+CAMPOS_BASICOS_PJ = ('razao_social', 'cnpj', 'regime_tributario')
+
+ORDENACOES = {
+    'id': Cliente.id,
+    'nome': func.coalesce(Cliente.razao_social, Cliente.nome_completo, ''),
+    'razao_social': func.coalesce(Cliente.razao_social, ''),
+    'nome_completo': func.coalesce(Cliente.nome_completo, ''),
+    'cnpj': func.coalesce(Cliente.cnpj_digitos, ''),
+    'cpf': func.coalesce(Cliente.cpf_digitos, ''),
+    'municipio': func.coalesce(Cliente.municipio, ''),
+    'uf': func.coalesce(Cliente.uf, ''),
+    'regime_tributario': func.coalesce(Cliente.regime_tributario, '')
+}
+
+
+class ParametroInvalido(ValueError):
+    """Parâmetro de listagem desconhecido ou mal formatado"""
+
+
+def _codificar_cursor(valor, cliente_id):
+    return base64.urlsafe_b64encode(json.dumps([valor, cliente_id]).encode()).decode()
+
+def _decodificar_cursor(cursor):
+    try:
+        valor, cliente_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return valor, int(cliente_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise ParametroInvalido("Cursor inválido")
+
+def _ler_campos(fields):
+    """Lista de campos pedidos (sempre com o id) ou None para os campos básicos"""
+    if not fields:
+        return None
+    campos = [campo.strip() for campo in fields.split(',') if campo.strip()]
+    desconhecidos = [campo for campo in campos if campo not in CAMPOS_DISPONIVEIS]
+    if desconhecidos:
+        raise ParametroInvalido(f"Campos desconhecidos: {', '.join(desconhecidos)}")
+    return ['id'] + [campo for campo in dict.fromkeys(campos) if campo != 'id']
+
+def _ler_booleano(valor):
+    if valor.lower() in ('1', 'true', 'sim'):
+        return True
+    if valor.lower() in ('0', 'false', 'nao', 'não'):
+        return False
+    raise ParametroInvalido(f"Valor booleano inválido: {valor}")
+
+def _formatar_valor(campo, valor):
+    """Mesma representação de Cliente.to_dict"""
+    if campo == 'valor_honorarios':
+        return float(valor) if valor else None
+    if campo == 'cnae_secundarias':
+        return json.loads(valor) if valor else []
+    return valor
+
+def _montar_item(linha, campos):
+    if campos is not None:
+        return {campo: _formatar_valor(campo, linha[campo]) for campo in campos}
+
+    item = {campo: _formatar_valor(campo, linha[campo]) for campo in CAMPOS_BASICOS}
+    item['tipo_pessoa'] = item['tipo_pessoa'] or 'PJ'
+    especificos = CAMPOS_BASICOS_PF if linha['tipo_pessoa'] == 'PF' else CAMPOS_BASICOS_PJ
+    item.update({campo: linha[campo] for campo in especificos})
+    return item
+
+def listar_clientes(parametros):
+    """
+    Lista clientes conforme os parâmetros da query string.
+
+    Args:
+        parametros (Mapping): request.args (ou dict equivalente)
+
+    Returns:
+        tuple: (itens, proximo_cursor); proximo_cursor é None na última página
+            ou quando não há limite
+
+    Raises:
+        ParametroInvalido: Campo, filtro, ordenação, limite ou cursor inválido
+    """
+    campos = _ler_campos(parametros.get('fields'))
+    colunas_lidas = campos or (CAMPOS_BASICOS + CAMPOS_BASICOS_PF + CAMPOS_BASICOS_PJ)
+
+    nome_ordenacao = parametros.get('ordenar') or 'id'
+    if nome_ordenacao not in ORDENACOES:
+        raise ParametroInvalido(f"Ordenação desconhecida: {nome_ordenacao}")
+    ordenacao = ORDENACOES[nome_ordenacao]
+    decrescente = (parametros.get('ordem') or 'asc').lower() == 'desc'
+
+    consulta = select(
+        *(CAMPOS_DISPONIVEIS[campo] for campo in colunas_lidas),
+        ordenacao.label('_ordenacao')
+    )
+
+    # Filtros
+    tipo_pessoa = parametros.get('tipo_pessoa')
+    if tipo_pessoa:
+        tipo_pessoa = tipo_pessoa.upper()
+        if tipo_pessoa not in ('PF', 'PJ'):
+            raise ParametroInvalido("tipo_pessoa deve ser PF ou PJ")
+        # Registros antigos podem ter tipo_pessoa nulo; são tratados como PJ
+        consulta = consulta.where(
+            Cliente.tipo_pessoa == 'PF' if tipo_pessoa == 'PF'
+            else func.coalesce(Cliente.tipo_pessoa, 'PJ') == 'PJ'
+        )
+    if parametros.get('regime'):
+        consulta = consulta.where(Cliente.regime_tributario == parametros['regime'])
+    if parametros.get('uf'):
+        consulta = consulta.where(Cliente.uf == parametros['uf'].upper())
+    if parametros.get('ativo'):
+        ativa = func.upper(func.coalesce(Cliente.situacao_cadastral, '')) == 'ATIVA'
+        consulta = consulta.where(ativa if _ler_booleano(parametros['ativo']) else ~ativa)
+
+    # Paginação por chave: (ordenação, id) do último item da página anterior
+    if parametros.get('cursor'):
+        valor, ultimo_id = _decodificar_cursor(parametros['cursor'])
+        chave = tuple_(ordenacao, Cliente.id)
+        consulta = consulta.where(chave < tuple_(valor, ultimo_id) if decrescente else chave > tuple_(valor, ultimo_id))
+
+    if decrescente:
+        consulta = consulta.order_by(ordenacao.desc(), Cliente.id.desc())
+    else:
+        consulta = consulta.order_by(ordenacao, Cliente.id)
+
+    limite = None
+    if parametros.get('limite'):
+        try:
+            limite = int(parametros['limite'])
+        except ValueError:
+            raise ParametroInvalido("limite deve ser um número inteiro")
+        if not 1 <= limite <= LIMITE_MAXIMO:
+            raise ParametroInvalido(f"limite deve estar entre 1 e {LIMITE_MAXIMO}")
+        # Uma linha a mais indica se existe próxima página
+        consulta = consulta.limit(limite + 1)
+
+    linhas = db.session.execute(consulta).mappings().all()
+
+    proximo_cursor = None
+    if limite is not None and len(linhas) > limite:
+        linhas = linhas[:limite]
+        proximo_cursor = _codificar_cursor(linhas[-1]['_ordenacao'], linhas[-1]['id'])
+
+    return [_montar_item(linha, campos) for linha in linhas], proximo_cursor
@@ -1,52 +1,91 @@
 """
 Módulo para gerenciar logs de auditoria
 """
+from datetime import date, datetime, timedelta
 from flask import Blueprint, jsonify, request
-from .models import db, LogAuditoria, Usuario
+from .models import LogAuditoria
 from .auth import token_required, admin_required
+from .consulta_logs import paginar_logs, total_paginas, acoes_da_entidade
+from .resumo_logs import valores_distintos, total_pelo_resumo, estatisticas_logs as calcular_estatisticas_logs
+from .arquivo_logs import consultar_arquivo, preencher_nomes_usuarios, pasta_arquivo, ler_manifesto, filtro_nao_arquivados
 
 logs_bp = Blueprint('logs', __name__, url_prefix='/api/logs')
 
+def _ler_periodo():
+    """data_inicio e data_fim (AAAA-MM-DD) da query string; ValueError se inválidas"""
+    inicio = date.fromisoformat(request.args['data_inicio']) if request.args.get('data_inicio') else None
+    fim = date.fromisoformat(request.args['data_fim']) if request.args.get('data_fim') else None
+    return inicio, fim
+
 @logs_bp.route("/", methods=["GET"])
 @token_required
 @admin_required
 def listar_logs(current_user):
-    """Lista logs de auditoria com paginação e filtros"""
+    """
+    Lista logs de auditoria com filtros, do mais recente para o mais antigo.
+    Para avançar, envie o proximo_cursor da resposta como `cursor` (`page`
+    sem cursor continua funcionando, mas fica lento nas páginas profundas).
+    Logs já arquivados (arquivo_logs) aparecem depois dos que estão no banco.
+    """
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 50, type=int)
+    cursor = request.args.get('cursor')
     acao = request.args.get('acao')
     entidade = request.args.get('entidade')
     usuario_id = request.args.get('usuario_id', type=int)
+    try:
+        data_inicio, data_fim = _ler_periodo()
+    except ValueError:
+        return jsonify({"erro": "Data inválida. Use o formato AAAA-MM-DD"}), 400
     
-    # Query base
-    query = LogAuditoria.query
+    # Período em dias inteiros: [início do primeiro dia, início do dia seguinte ao último)
+    inicio = datetime.combine(data_inicio, datetime.min.time()) if data_inicio else None
+    fim = datetime.combine(data_fim + timedelta(days=1), datetime.min.time()) if data_fim else None
     
     # Aplicar filtros
+    condicoes = []
     if acao:
-        query = query.filter(LogAuditoria.acao == acao)
+        condicoes.append(LogAuditoria.acao == acao)
     if entidade:
-        query = query.filter(LogAuditoria.entidade == entidade)
+        condicoes.append(LogAuditoria.entidade == entidade)
     if usuario_id:
-        query = query.filter(LogAuditoria.usuario_id == usuario_id)
+        condicoes.append(LogAuditoria.usuario_id == usuario_id)
+    if inicio:
+        condicoes.append(LogAuditoria.data_acao >= inicio)
+    if fim:
+        condicoes.append(LogAuditoria.data_acao < fim)
+    # Logs arquivados e ainda não removidos do banco (execução interrompida)
+    # aparecem só pelo arquivo
+    nao_arquivados = filtro_nao_arquivados(ler_manifesto(pasta_arquivo()))
+    if nao_arquivados is not None:
+        condicoes.append(nao_arquivados)
+    
+    # Só a entidade: uma consulta por ação, cada uma em ordem pelo índice
+    particoes = None
+    if entidade and not acao:
+        particoes = [[LogAuditoria.acao == acao_entidade] for acao_entidade in acoes_da_entidade(entidade)]
+    
+    arquivo = consultar_arquivo(acao=acao, entidade=entidade, usuario_id=usuario_id, inicio=inicio, fim=fim)
     
-    # Ordenar por data mais recente primeiro
-    query = query.order_by(LogAuditoria.data_acao.desc())
+    try:
+        logs, proximo_cursor = paginar_logs(condicoes, per_page, cursor, page, particoes, arquivo)
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    preencher_nomes_usuarios(logs)
     
-    # Paginação
-    logs_paginados = query.paginate(
-        page=page, 
-        per_page=per_page, 
-        error_out=False
-    )
+    # Pelo resumo diário: exato e inclui os logs arquivados
+    total = total_pelo_resumo(acao, entidade, usuario_id, data_inicio, data_fim)
     
     return jsonify({
-        'logs': [log.to_dict() for log in logs_paginados.items],
-        'total': logs_paginados.total,
-        'pages': logs_paginados.pages,
+        'logs': [log.to_dict() for log in logs],
+        'total': total,
+        'total_exato': True,
+        'pages': total_paginas(total, per_page),
         'current_page': page,
         'per_page': per_page,
-        'has_next': logs_paginados.has_next,
-        'has_prev': logs_paginados.has_prev
+        'has_next': proximo_cursor is not None,
+        'has_prev': page > 1,
+        'proximo_cursor': proximo_cursor
     })
 
 @logs_bp.route("/acoes", methods=["GET"])
@@ -54,61 +93,26 @@ def listar_logs(current_user):
 @admin_required
 def listar_acoes(current_user):
     """Lista todas as ações disponíveis nos logs"""
-    acoes = db.session.query(LogAuditoria.acao).distinct().all()
-    return jsonify([acao[0] for acao in acoes])
+    return jsonify(valores_distintos('acao'))
 
 @logs_bp.route("/entidades", methods=["GET"])
 @token_required
 @admin_required
 def listar_entidades(current_user):
     """Lista todas as entidades disponíveis nos logs"""
-    entidades = db.session.query(LogAuditoria.entidade).distinct().all()
-    return jsonify([entidade[0] for entidade in entidades])
+    return jsonify(valores_distintos('entidade'))
 
 @logs_bp.route("/estatisticas", methods=["GET"])
 @token_required
 @admin_required
 def estatisticas_logs(current_user):
-    """Retorna estatísticas dos logs"""
-    from sqlalchemy import func, desc
-    
-    # Logs por ação
-    logs_por_acao = db.session.query(
-        LogAuditoria.acao, 
-        func.count(LogAuditoria.id).label('total')
-    ).group_by(LogAuditoria.acao).order_by(desc('total')).all()
-    
-    # Logs por entidade
-    logs_por_entidade = db.session.query(
-        LogAuditoria.entidade, 
-        func.count(LogAuditoria.id).label('total')
-    ).group_by(LogAuditoria.entidade).order_by(desc('total')).all()
+    """
+    Retorna estatísticas dos logs (todo o histórico ou o período entre
+    data_inicio e data_fim, no formato AAAA-MM-DD), a partir do resumo diário
+    """
+    try:
+        inicio, fim = _ler_periodo()
+    except ValueError:
+        return jsonify({"erro": "Data inválida. Use o formato AAAA-MM-DD"}), 400
     
-    # Logs por usuário (últimos 30 dias)
-    from datetime import datetime, timedelta
-    data_limite = datetime.utcnow() - timedelta(days=30)
-    
-    logs_por_usuario = db.session.query(
-        LogAuditoria.usuario_id,
-        func.count(LogAuditoria.id).label('total')
-    ).filter(LogAuditoria.data_acao >= data_limite).group_by(LogAuditoria.usuario_id).order_by(desc('total')).limit(10).all()
-    
-    # Buscar nomes dos usuários
-    usuarios_ativos = {}
-    for log in logs_por_usuario:
-        usuario = Usuario.query.get(log[0])
-        if usuario:
-            usuarios_ativos[log[0]] = usuario.nome
-    
-    return jsonify({
-        'logs_por_acao': [{'acao': acao, 'total': total} for acao, total in logs_por_acao],
-        'logs_por_entidade': [{'entidade': entidade, 'total': total} for entidade, total in logs_por_entidade],
-        'logs_por_usuario_30_dias': [
-            {
-                'usuario_id': user_id, 
-                'usuario_nome': usuarios_ativos.get(user_id, 'Usuário Removido'), 
-                'total': total
-            } 
-            for user_id, total in logs_por_usuario
-        ]
-    })
+    return jsonify(calcular_estatisticas_logs(inicio, fim))
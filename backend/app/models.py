@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import re
 
 db = SQLAlchemy()
 
@@ -219,6 +220,16 @@ class Cliente(db.Model):
     # Valor de Honorários
     valor_honorarios = db.Column(db.Numeric(10, 2))
     
+    # Documentos normalizados (apenas dígitos) para buscas indexadas.
+    # Mantidos automaticamente a partir de cnpj/cpf (ver _sincronizar_documentos_cliente)
+    cnpj_digitos = db.Column(db.String(14))
+    cpf_digitos = db.Column(db.String(11))
+    
+    __table_args__ = (
+        db.Index('idx_cliente_cnpj_digitos', 'cnpj_digitos'),
+        db.Index('idx_cliente_cpf_digitos', 'cpf_digitos'),
+    )
+    
     def to_dict(self):
         """Converte o objeto Cliente para um dicionário"""
         import json
@@ -266,6 +277,19 @@ class Cliente(db.Model):
             'valor_honorarios': float(self.valor_honorarios) if self.valor_honorarios else None
         }
 
+def _somente_digitos(documento):
+    """Remove a formatação de um documento; retorna None se não houver dígitos"""
+    if not documento:
+        return None
+    return re.sub(r'[^\d]', '', str(documento)) or None
+
+@db.event.listens_for(Cliente, 'before_insert')
+@db.event.listens_for(Cliente, 'before_update')
+def _sincronizar_documentos_cliente(mapper, connection, cliente):
+    """Mantém cnpj_digitos/cpf_digitos sincronizados com cnpj/cpf em toda inserção ou atualização"""
+    cliente.cnpj_digitos = _somente_digitos(cliente.cnpj)
+    cliente.cpf_digitos = _somente_digitos(cliente.cpf)
+
 class Socio(db.Model):
     """
     Relacionamento entre clientes PJ (empresas) e PF (sócios).
@@ -288,6 +312,8 @@ class Socio(db.Model):
     # Constraint única: uma PF não pode ser sócia da mesma PJ duas vezes
     __table_args__ = (
         db.UniqueConstraint('empresa_id', 'socio_id', name='uq_empresa_socio'),
+        # A constraint acima atende a busca por empresa; este índice, a busca inversa
+        db.Index('idx_socio_socio_id', 'socio_id'),
     )
     
     def to_dict(self, incluir_dados_completos=False):
@@ -332,11 +358,18 @@ class Socio(db.Model):
         
         return dados_basicos
 
+def _competencia_padrao(contexto):
+    """Valor padrão da coluna competencia (ano * 12 + mes - 1) a partir de ano e mês do INSERT"""
+    parametros = contexto.get_current_parameters()
+    return int(parametros['ano']) * 12 + int(parametros['mes']) - 1
+
 class Processamento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False)
     mes = db.Column(db.Integer, nullable=False)
     ano = db.Column(db.Integer, nullable=False)
+    # Chave inteira da competência (ano * 12 + mes - 1) para filtros de período por faixa
+    competencia = db.Column(db.Integer, nullable=False, default=_competencia_padrao)
     faturamento_total = db.Column(db.Numeric(10, 2), nullable=False)
     imposto_calculado = db.Column(db.Numeric(10, 2), nullable=False)
     nome_arquivo_original = db.Column(db.String(255), nullable=False)
@@ -346,13 +379,92 @@ class Processamento(db.Model):
     detalhes = db.relationship('FaturamentoDetalhe', backref='processamento', lazy=True, cascade="all, delete-orphan")
 
     # Garante que só pode haver um processamento por cliente/mês/ano
-    __table_args__ = (db.UniqueConstraint('cliente_id', 'mes', 'ano', name='_cliente_mes_ano_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('cliente_id', 'mes', 'ano', name='_cliente_mes_ano_uc'),
+        db.Index('idx_processamento_cliente_competencia', 'cliente_id', 'competencia'),
+    )
+
+class ResumoMensalCliente(db.Model):
+    """
+    Resumo materializado de cada competência processada de um cliente.
+    Mantido por app.resumo_mensal sempre que um Processamento é criado,
+    substituído, excluído ou restaurado da lixeira.
+    """
+    __tablename__ = 'resumo_mensal_cliente'
+
+    id = db.Column(db.Integer, primary_key=True)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id', ondelete='CASCADE'), nullable=False)
+    processamento_id = db.Column(db.Integer, db.ForeignKey('processamento.id', ondelete='CASCADE'))
+    ano = db.Column(db.Integer, nullable=False)
+    mes = db.Column(db.Integer, nullable=False)
+    competencia = db.Column(db.Integer, nullable=False)  # ano * 12 + mes - 1
+    faturamento_total = db.Column(db.Numeric(10, 2), nullable=False)
+    imposto_calculado = db.Column(db.Numeric(10, 2), nullable=False)
+    rbt12 = db.Column(db.Numeric(14, 2), nullable=False)  # Receita dos 12 meses anteriores
+    rbt12_futuro = db.Column(db.Numeric(14, 2), nullable=False)  # Receita dos 12 meses até o próprio mês
+    aliquota_efetiva = db.Column(db.Numeric(12, 10), nullable=False)
+    aliquota_futura = db.Column(db.Numeric(12, 10), nullable=False)
+    fator_r = db.Column(db.Numeric(14, 2), nullable=False)
+    data_atualizacao = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('cliente_id', 'competencia', name='_resumo_cliente_competencia_uc'),
+        db.Index('idx_resumo_mensal_cliente_competencia', 'competencia'),
+    )
+
+    def to_dict(self):
+        return {
+            'cliente_id': self.cliente_id,
+            'processamento_id': self.processamento_id,
+            'mes': self.mes,
+            'ano': self.ano,
+            'faturamento_total': self.faturamento_total,
+            'imposto_calculado': self.imposto_calculado,
+            'rbt12': self.rbt12,
+            'rbt12_futuro': self.rbt12_futuro,
+            'aliquota_efetiva': self.aliquota_efetiva,
+            'aliquota_futura': self.aliquota_futura,
+            'fator_r': self.fator_r,
+            'data_atualizacao': self.data_atualizacao.isoformat() if self.data_atualizacao else None
+        }
 
 class FaturamentoDetalhe(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     processamento_id = db.Column(db.Integer, db.ForeignKey('processamento.id'), nullable=False)
     descricao_servico = db.Column(db.String(300), nullable=False)
     valor = db.Column(db.Numeric(10, 2), nullable=False)
+    # Número da NF importada do CSV (descrição no formato "NF {numero} - {tomador}").
+    # Preenchido automaticamente a partir da descrição (ver _preencher_numero_nf)
+    numero_nf = db.Column(db.String(50))
+
+    __table_args__ = (
+        db.Index('idx_faturamento_detalhe_processamento_nf', 'processamento_id', 'numero_nf'),
+    )
+
+_PADRAO_NUMERO_NF = re.compile(r'^NF (.+?)(?: - |$)')
+
+def extrair_numero_nf(descricao_servico):
+    """
+    Extrai o número da NF de uma descrição no formato "NF {numero} - {tomador}".
+    Retorna None se a descrição não seguir esse formato.
+    """
+    if not descricao_servico:
+        return None
+    encontrado = _PADRAO_NUMERO_NF.match(descricao_servico)
+    if not encontrado:
+        return None
+    return encontrado.group(1).strip()[:50] or None
+
+@db.event.listens_for(Processamento, 'before_update')
+def _atualizar_competencia(mapper, connection, objeto):
+    """Mantém a competência coerente quando ano ou mês são alterados pelo ORM"""
+    objeto.competencia = int(objeto.ano) * 12 + int(objeto.mes) - 1
+
+@db.event.listens_for(FaturamentoDetalhe, 'before_insert')
+def _preencher_numero_nf(mapper, connection, detalhe):
+    """Preenche numero_nf a partir da descrição quando não foi informado"""
+    if detalhe.numero_nf is None:
+        detalhe.numero_nf = extrair_numero_nf(detalhe.descricao_servico)
 
 class LogAuditoria(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -366,6 +478,13 @@ class LogAuditoria(db.Model):
     
     usuario = db.relationship('Usuario')
     
+    # Listagem por data (paginação por data_acao, id) com e sem filtros
+    __table_args__ = (
+        db.Index('ix_log_auditoria_data_acao', 'data_acao'),
+        db.Index('idx_log_auditoria_entidade_acao_data', 'entidade', 'acao', 'data_acao'),
+        db.Index('idx_log_auditoria_usuario_data', 'usuario_id', 'data_acao'),
+    )
+    
     def to_dict(self):
         import json
         return {
@@ -380,6 +499,24 @@ class LogAuditoria(db.Model):
             'ip_address': self.ip_address
         }
 
+class ResumoLogAuditoria(db.Model):
+    """
+    Quantidade de logs de auditoria por dia, ação, entidade e usuário.
+    Mantido por app.resumo_logs a cada gravação de LogAuditoria.
+    """
+    __tablename__ = 'resumo_log_auditoria'
+
+    id = db.Column(db.Integer, primary_key=True)
+    dia = db.Column(db.Date, nullable=False)
+    acao = db.Column(db.String(100), nullable=False)
+    entidade = db.Column(db.String(50), nullable=False)
+    usuario_id = db.Column(db.Integer, nullable=False)  # Sem FK: as contagens ficam após excluir o usuário
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('dia', 'acao', 'entidade', 'usuario_id', name='_resumo_log_auditoria_uc'),
+    )
+
 class Contador(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(200), nullable=False)
@@ -418,6 +555,7 @@ class Recibo(db.Model):
     contador_id = db.Column(db.Integer, db.ForeignKey('contador.id'), nullable=False)
     mes = db.Column(db.Integer, nullable=False)
     ano = db.Column(db.Integer, nullable=False)
+    competencia = db.Column(db.Integer, nullable=False, default=_competencia_padrao)  # ano * 12 + mes - 1
     valor = db.Column(db.Numeric(10, 2), nullable=False)
     tipo_servico = db.Column(db.String(50), nullable=False, default='honorarios')  # 'honorarios' ou 'outros'
     descricao_servico = db.Column(db.String(300))  # Usado quando tipo_servico = 'outros'
@@ -429,6 +567,10 @@ class Recibo(db.Model):
     contador = db.relationship('Contador')
     usuario_emitente = db.relationship('Usuario')
     
+    __table_args__ = (
+        db.Index('idx_recibo_cliente_competencia', 'cliente_id', 'competencia'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -447,6 +589,8 @@ class Recibo(db.Model):
             'usuario_emitente_nome': self.usuario_emitente.nome if self.usuario_emitente else None
         }
 
+db.event.listen(Recibo, 'before_update', _atualizar_competencia)
+
 class ItemExcluido(db.Model):
     """Armazena itens excluídos para permitir recuperação (lixeira)"""
     __tablename__ = 'itens_excluidos'
@@ -667,4 +811,95 @@ class TemplateRelatorio(db.Model):
             'data_criacao': self.data_criacao.isoformat() if self.data_criacao else None,
             'data_atualizacao': self.data_atualizacao.isoformat() if self.data_atualizacao else None,
             'ativo': self.ativo
-        }
\ No newline at end of file
+        }
+
+
+class JobImportacao(db.Model):
+    """
+    Job assíncrono de importação de CSV (preview ou consolidação), executado
+    em segundo plano pelo worker local (ver importacao_jobs.py)
+    """
+    __tablename__ = 'job_importacao'
+    
+    id = db.Column(db.String(36), primary_key=True)  # UUID
+    tipo = db.Column(db.String(20), nullable=False)  # PREVIEW, CONSOLIDACAO, ATUALIZACAO_CNPJ
+    status = db.Column(db.String(20), nullable=False, default='PENDENTE')  # PENDENTE, EXECUTANDO, CONCLUIDO, ERRO, CANCELADO
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    parametros = db.Column(db.Text)  # JSON com os dados de entrada do job
+    progresso = db.Column(db.Text)  # JSON com o andamento por arquivo e competência
+    total_itens = db.Column(db.Integer, default=0, nullable=False)
+    itens_processados = db.Column(db.Integer, default=0, nullable=False)
+    resultado = db.Column(db.Text)  # JSON com a mesma resposta do endpoint síncrono
+    erro = db.Column(db.Text)
+    cancelamento_solicitado = db.Column(db.Boolean, default=False, nullable=False)
+    processo = db.Column(db.String(100))  # "host:pid" do processo que executa o job
+    heartbeat = db.Column(db.DateTime)  # Último sinal de vida desse processo
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    data_inicio = db.Column(db.DateTime)
+    data_fim = db.Column(db.DateTime)
+    
+    usuario = db.relationship('Usuario')
+    
+    __table_args__ = (
+        db.Index('idx_job_importacao_usuario_data', 'usuario_id', 'data_criacao'),
+        # Busca dos jobs abandonados (status ativo e heartbeat vencido)
+        db.Index('idx_job_importacao_status_heartbeat', 'status', 'heartbeat'),
+    )
+    
+    def to_dict(self, incluir_resultado=False):
+        import json
+        dados = {
+            'id': self.id,
+            'tipo': self.tipo,
+            'status': self.status,
+            'usuario_id': self.usuario_id,
+            'progresso': json.loads(self.progresso) if self.progresso else {},
+            'total_itens': self.total_itens,
+            'itens_processados': self.itens_processados,
+            'percentual': round(100 * self.itens_processados / self.total_itens, 1) if self.total_itens else 0,
+            'erro': self.erro,
+            'cancelamento_solicitado': self.cancelamento_solicitado,
+            'data_criacao': self.data_criacao.isoformat() if self.data_criacao else None,
+            'data_inicio': self.data_inicio.isoformat() if self.data_inicio else None,
+            'data_fim': self.data_fim.isoformat() if self.data_fim else None
+        }
+        if incluir_resultado:
+            dados['resultado'] = json.loads(self.resultado) if self.resultado else None
+        return dados
+
+
+class PreviewImportacao(db.Model):
+    """
+    Arquivo lido no preview da importação de CSV, guardado no servidor até a
+    consolidação (ou até expirar). O id é o id_temporario devolvido no preview;
+    a consolidação recebe apenas esses IDs e usa as notas gravadas aqui
+    (ver preview_importacao.py)
+    """
+    __tablename__ = 'preview_importacao'
+    
+    id = db.Column(db.String(36), primary_key=True)  # id_temporario (UUID)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    nome_arquivo = db.Column(db.String(255))
+    cnpj = db.Column(db.String(18))
+    dados = db.Column(db.Text, nullable=False)  # JSON do arquivo no preview (competências e notas)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    data_expiracao = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.Index('idx_preview_importacao_expiracao', 'data_expiracao'),
+    )
+
+
+class ConsultaCNPJ(db.Model):
+    """
+    Resposta da BrasilAPI para um CNPJ, guardada até data_expiracao para que
+    consultas repetidas não voltem à API (ver consulta_cnpj.py). CNPJs não
+    encontrados também são guardados (encontrado = False, sem dados)
+    """
+    __tablename__ = 'consulta_cnpj'
+    
+    cnpj = db.Column(db.String(14), primary_key=True)  # Apenas dígitos
+    encontrado = db.Column(db.Boolean, nullable=False)
+    dados = db.Column(db.Text)  # JSON devolvido pela API
+    data_consulta = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    data_expiracao = db.Column(db.DateTime, nullable=False)
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+Armazenamento no servidor dos previews de importação de CSV
+
+Cada arquivo lido no preview é gravado na tabela preview_importacao com o seu
+id_temporario e um prazo de validade (PREVIEW_IMPORTACAO_TTL_MINUTOS). Na
+consolidação o navegador envia apenas os IDs e as decisões de substituição:
+as notas e os valores vêm do que foi gravado aqui, e não do corpo da
+requisição. O cliente de cada arquivo é resolvido novamente pelo CNPJ no
+momento da consolidação (ele pode ter sido cadastrado depois do preview).
+
+Os previews consolidados são removidos na mesma transação da consolidação;
+os expirados são removidos sempre que um novo preview é gravado.
+"""
+import json
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import insert, delete, select
+from .models import db, PreviewImportacao
+from .services import resolver_clientes_por_cnpj
+from .validators import limpar_documento
+
+# Status do preview que podem ser consolidados (nao_cadastrado pode virar ok
+# se o cliente for cadastrado antes da consolidação)
+STATUS_ARMAZENADOS = ('ok', 'nao_cadastrado')
+
+
+class PreviewNaoEncontrado(Exception):
+    """Um ou mais IDs de preview não existem, expiraram ou pertencem a outro usuário"""
+
+    def __init__(self, ids):
+        super().__init__(f"Preview não encontrado ou expirado: {', '.join(ids)}")
+        self.ids = ids
+
+
+def _validade():
+    """Tempo de vida de um preview gravado"""
+    return timedelta(minutes=current_app.config.get('PREVIEW_IMPORTACAO_TTL_MINUTOS', 120))
+
+def limpar_previews_expirados(agora=None):
+    """Remove os previews vencidos. Não faz commit. Retorna a quantidade removida"""
+    resultado = db.session.execute(
+        delete(PreviewImportacao).where(PreviewImportacao.data_expiracao < (agora or datetime.utcnow()))
+    )
+    return resultado.rowcount
+
+def armazenar_preview(resultado, usuario_id):
+    """
+    Grava os arquivos do preview (já verificados com verificar_preview_no_banco)
+    e informa em resultado['expira_em'] até quando eles podem ser consolidados.
+    Não faz commit.
+
+    Args:
+        resultado (dict): Saída de verificar_preview_no_banco (alterada no lugar)
+        usuario_id (int): Usuário dono do preview
+
+    Returns:
+        dict: O próprio resultado
+    """
+    agora = datetime.utcnow()
+    expiracao = agora + _validade()
+    limpar_previews_expirados(agora)
+
+    linhas = [
+        {
+            'id': arquivo['id_temporario'],
+            'usuario_id': usuario_id,
+            'nome_arquivo': arquivo.get('nome_arquivo'),
+            'cnpj': arquivo.get('cnpj'),
+            'dados': json.dumps({
+                'nome_arquivo': arquivo.get('nome_arquivo'),
+                'cnpj': arquivo.get('cnpj'),
+                'competencias': arquivo.get('competencias', [])
+            }, ensure_ascii=False, default=str),
+            'data_criacao': agora,
+            'data_expiracao': expiracao
+        }
+        for arquivo in resultado['arquivos_processados']
+        if arquivo.get('status') in STATUS_ARMAZENADOS
+    ]
+    if linhas:
+        db.session.execute(insert(PreviewImportacao), linhas)
+
+    resultado['expira_em'] = expiracao.isoformat()
+    return resultado
+
+def _consulta_previews_validos(colunas, ids, usuario_id):
+    return select(*colunas).where(
+        PreviewImportacao.id.in_(ids),
+        PreviewImportacao.usuario_id == usuario_id,
+        PreviewImportacao.data_expiracao >= datetime.utcnow()
+    )
+
+def previews_nao_encontrados(ids, usuario_id):
+    """IDs (na ordem recebida) sem preview válido para o usuário"""
+    encontrados = set(db.session.execute(
+        _consulta_previews_validos((PreviewImportacao.id,), ids, usuario_id)
+    ).scalars())
+    return [id_temporario for id_temporario in ids if id_temporario not in encontrados]
+
+def carregar_previews(ids, usuario_id):
+    """
+    Monta a lista de arquivos aceita por consolidar_faturamento_lote a partir
+    dos previews gravados.
+
+    Args:
+        ids (list): IDs temporários devolvidos pelo preview
+        usuario_id (int): Usuário que está consolidando
+
+    Returns:
+        list: Arquivos (id_temporario, nome_arquivo, cnpj, cliente_info,
+            competencias) na ordem dos IDs; cliente_info é None quando o CNPJ
+            continua sem cadastro
+
+    Raises:
+        PreviewNaoEncontrado: Se algum ID não tiver preview válido para o usuário
+    """
+    ids = list(dict.fromkeys(ids))
+    dados_por_id = dict(db.session.execute(
+        _consulta_previews_validos((PreviewImportacao.id, PreviewImportacao.dados), ids, usuario_id)
+    ).all())
+
+    faltantes = [id_temporario for id_temporario in ids if id_temporario not in dados_por_id]
+    if faltantes:
+        raise PreviewNaoEncontrado(faltantes)
+
+    arquivos = []
+    for id_temporario in ids:
+        arquivo = json.loads(dados_por_id[id_temporario])
+        arquivo['id_temporario'] = id_temporario
+        arquivos.append(arquivo)
+
+    clientes_por_cnpj = resolver_clientes_por_cnpj([arquivo['cnpj'] for arquivo in arquivos])
+    for arquivo in arquivos:
+        cliente = clientes_por_cnpj.get(limpar_documento(arquivo['cnpj'] or ''))
+        arquivo['cliente_info'] = {
+            'id': cliente.id,
+            'razao_social': cliente.razao_social,
+            'cnpj_formatado': cliente.cnpj
+        } if cliente else None
+
+    return arquivos
+
+def descartar_previews(arquivos):
+    """
+    Remove os previews consolidados. Não faz commit.
+
+    Arquivos cujo cliente continua sem cadastro são mantidos, para que possam
+    ser consolidados depois do cadastro.
+
+    Args:
+        arquivos (list): Arquivos devolvidos por carregar_previews
+    """
+    ids = [arquivo['id_temporario'] for arquivo in arquivos if arquivo.get('cliente_info')]
+    if ids:
+        db.session.execute(delete(PreviewImportacao).where(PreviewImportacao.id.in_(ids)))
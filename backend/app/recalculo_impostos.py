@@ -0,0 +1,157 @@
+"""
+Recálculo vetorizado do imposto de todos os processamentos
+
+Usado quando as tabelas de alíquotas ou o regime/anexo de um cliente mudam.
+Todos os processamentos são lidos em uma consulta e carregados em vetores
+NumPy ordenados por (cliente, competência). O RBT12 de cada linha sai de
+somas acumuladas (em centavos, sem erro de arredondamento): a soma dos 12
+meses anteriores é a diferença entre duas posições do vetor acumulado,
+localizadas por busca binária. As alíquotas são aplicadas por anexo com
+TabelaAnexo.aliquotas_efetivas e o resultado é gravado com UPDATEs em lote.
+"""
+from decimal import Decimal
+import numpy as np
+from sqlalchemy import select, update
+from .models import db, Cliente, Processamento
+from .services import calcular_impostos, tributado_pelo_simples
+from .simples_nacional import obter_tabela, resolver_anexos_clientes
+from .resumo_mensal import reconstruir_resumo_mensal
+
+# Quantidade de linhas por UPDATE em lote
+TAMANHO_LOTE_UPDATE = 1000
+
+# Multiplicador da chave (cliente, competência): maior que qualquer índice de competência
+_FATOR_CHAVE_CLIENTE = 10 ** 6
+
+
+def _reais(centavos):
+    """Converte um valor inteiro em centavos para Decimal com duas casas"""
+    return Decimal(int(centavos)).scaleb(-2)
+
+def _carregar_processamentos(cliente_ids=None):
+    """Lê todos os processamentos (ou dos clientes informados) em vetores NumPy"""
+    consulta = select(
+        Processamento.id,
+        Processamento.cliente_id,
+        Processamento.competencia,
+        Processamento.faturamento_total,
+        Processamento.imposto_calculado,
+        Cliente.regime_tributario
+    ).join(Cliente, Cliente.id == Processamento.cliente_id)
+    if cliente_ids:
+        consulta = consulta.where(Processamento.cliente_id.in_(cliente_ids))
+
+    linhas = db.session.execute(consulta).all()
+    regimes = {cliente_id: regime for _, cliente_id, _, _, _, regime in linhas}
+
+    def vetor(posicao, tipo):
+        return np.fromiter((linha[posicao] for linha in linhas), dtype=tipo, count=len(linhas))
+
+    def centavos(posicao):
+        return np.fromiter(
+            (int((Decimal(linha[posicao] or 0) * 100).to_integral_value()) for linha in linhas),
+            dtype=np.int64, count=len(linhas)
+        )
+
+    dados = {
+        'id': vetor(0, np.int64),
+        'cliente_id': vetor(1, np.int64),
+        'competencia': vetor(2, np.int64),
+        'faturamento': centavos(3),
+        'imposto': centavos(4)
+    }
+
+    # Ordena por (cliente, competência)
+    ordem = np.lexsort((dados['competencia'], dados['cliente_id']))
+    return {nome: valores[ordem] for nome, valores in dados.items()}, regimes
+
+def calcular_rbt12_vetorizado(cliente_ids, competencias, faturamentos):
+    """
+    RBT12 (soma dos 12 meses anteriores) de cada linha, com somas acumuladas.
+
+    Args:
+        cliente_ids, competencias, faturamentos: Vetores alinhados, ordenados
+            por (cliente, competência), com uma linha por cliente e competência
+
+    Returns:
+        numpy.ndarray: RBT12 de cada linha, na mesma unidade de faturamentos
+    """
+    chaves = cliente_ids * _FATOR_CHAVE_CLIENTE + competencias
+    acumulado = np.concatenate(([0], np.cumsum(faturamentos)))
+    # Primeira linha do mesmo cliente com competência >= M-12
+    inicio_janela = np.searchsorted(chaves, chaves - 12, side='left')
+    posicoes = np.arange(len(chaves))
+    return acumulado[posicoes] - acumulado[inicio_janela]
+
+def recalcular_impostos(cliente_ids=None, aplicar=False, limite_diferencas=200):
+    """
+    Recalcula o imposto de todos os processamentos e compara com o gravado.
+
+    Args:
+        cliente_ids (list, optional): Restringe o recálculo a esses clientes
+        aplicar (bool): Se True, grava os novos valores (UPDATE em lote e
+            reconstrução do resumo mensal dos clientes alterados). Não faz commit
+        limite_diferencas (int): Quantidade máxima de diferenças listadas no relatório
+
+    Returns:
+        dict: Relatório com totais e a lista das diferenças encontradas
+    """
+    dados, regimes = _carregar_processamentos(cliente_ids)
+    total = len(dados['id'])
+    novos = np.zeros(total, dtype=np.int64)
+    rbt12 = calcular_rbt12_vetorizado(dados['cliente_id'], dados['competencia'], dados['faturamento'])
+    faturamento = dados['faturamento'].astype(np.float64)
+
+    # Mesma regra da consolidação (services.tributado_pelo_simples): um grupo
+    # por anexo do Simples e um por regime tributado por calcular_impostos
+    anexos = resolver_anexos_clientes(regimes.keys())
+    grupos = {}
+    for cliente_id, regime in regimes.items():
+        chave = (None, anexos[cliente_id]) if tributado_pelo_simples(regime) else (regime, None)
+        grupos.setdefault(chave, []).append(cliente_id)
+
+    for (regime, anexo), clientes_grupo in grupos.items():
+        mascara = np.isin(dados['cliente_id'], clientes_grupo)
+        if regime is not None:
+            novos[mascara] = np.round(calcular_impostos(faturamento[mascara], regime)).astype(np.int64)
+        else:
+            aliquotas = obter_tabela(anexo).aliquotas_efetivas(rbt12[mascara] / 100.0)
+            novos[mascara] = np.round(faturamento[mascara] * aliquotas).astype(np.int64)
+
+    alterados = np.nonzero(novos != dados['imposto'])[0]
+    clientes_alterados = sorted({int(c) for c in dados['cliente_id'][alterados]})
+
+    relatorio = {
+        'aplicado': bool(aplicar),
+        'total_processamentos': total,
+        'total_clientes': len(regimes),
+        'processamentos_alterados': len(alterados),
+        'clientes_alterados': len(clientes_alterados),
+        'imposto_atual': _reais(dados['imposto'].sum()),
+        'imposto_recalculado': _reais(novos.sum()),
+        'diferencas': [
+            {
+                'processamento_id': int(dados['id'][i]),
+                'cliente_id': int(dados['cliente_id'][i]),
+                'mes': int(dados['competencia'][i] % 12 + 1),
+                'ano': int(dados['competencia'][i] // 12),
+                'rbt12': _reais(rbt12[i]),
+                'imposto_atual': _reais(dados['imposto'][i]),
+                'imposto_recalculado': _reais(novos[i])
+            }
+            for i in alterados[:limite_diferencas]
+        ]
+    }
+
+    if aplicar and len(alterados):
+        valores = [
+            {'id': int(dados['id'][i]), 'imposto_calculado': _reais(novos[i])}
+            for i in alterados
+        ]
+        for inicio in range(0, len(valores), TAMANHO_LOTE_UPDATE):
+            db.session.execute(update(Processamento), valores[inicio:inicio + TAMANHO_LOTE_UPDATE])
+
+        # O UPDATE em lote não passa pelos eventos do ORM
+        reconstruir_resumo_mensal(clientes_alterados)
+
+    return relatorio
@@ -0,0 +1,190 @@
+"""
+Contagem diária dos logs de auditoria (tabela resumo_log_auditoria)
+
+Cada combinação de dia, ação, entidade e usuário tem uma linha com a
+quantidade de logs. As estatísticas de logs somam essas linhas (algumas
+centenas por mês) em vez de agrupar a tabela de logs inteira, e qualquer
+período sai pelo mesmo custo.
+
+As contagens são atualizadas na mesma transação em que os logs são gravados
+(gravador em lote e registrar_logs_em_lote, em audit.py), com um INSERT ...
+ON CONFLICT que soma ao total do dia. O arquivamento (arquivo_logs) não
+altera as contagens. Para recriar a tabela a partir dos logs do banco e dos
+arquivados (instalação nova ou correção), use `flask reconstruir-resumo-logs`.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, delete, func, desc
+from sqlalchemy.dialects import sqlite, postgresql
+from .models import db, LogAuditoria, ResumoLogAuditoria, Usuario
+from .arquivo_logs import pasta_arquivo, ler_manifesto, filtro_nao_arquivados, contar_arquivados
+
+# Colunas que identificam uma linha do resumo
+CHAVE_RESUMO = ('dia', 'acao', 'entidade', 'usuario_id')
+
+# Quantidade de usuários no ranking das estatísticas
+LIMITE_USUARIOS = 10
+
+_INSERT_POR_DIALETO = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def contar_registros(registros):
+    """
+    Agrupa registros de auditoria (montados com montar_registro_log) pela
+    chave do resumo.
+
+    Returns:
+        list: Linhas de resumo_log_auditoria ({dia, acao, entidade, usuario_id, total})
+    """
+    contagem = Counter(
+        ((registro.get('data_acao') or datetime.utcnow()).date(), registro['acao'], registro['entidade'], registro['usuario_id'])
+        for registro in registros
+    )
+    return [dict(zip(CHAVE_RESUMO, chave), total=total) for chave, total in contagem.items()]
+
+def acumular_resumo_logs(registros, sessao=None):
+    """
+    Soma os registros às contagens do resumo. Não faz commit: deve rodar na
+    transação que grava os próprios logs.
+    """
+    _somar_linhas(sessao or db.session, contar_registros(registros))
+
+def _somar_linhas(sessao, linhas):
+    """Soma as linhas (dia, acao, entidade, usuario_id, total) às que já existem"""
+    if not linhas:
+        return
+
+    insercao = _INSERT_POR_DIALETO.get(sessao.get_bind().dialect.name)
+    if insercao is not None:
+        comando = insercao(ResumoLogAuditoria)
+        sessao.execute(comando.on_conflict_do_update(
+            index_elements=list(CHAVE_RESUMO),
+            set_={'total': ResumoLogAuditoria.total + comando.excluded.total}
+        ), linhas)
+        return
+
+    # Bancos sem ON CONFLICT: UPDATE e, se a linha não existir, INSERT
+    for linha in linhas:
+        resultado = sessao.execute(
+            update(ResumoLogAuditoria)
+            .where(*(getattr(ResumoLogAuditoria, coluna) == linha[coluna] for coluna in CHAVE_RESUMO))
+            .values(total=ResumoLogAuditoria.total + linha['total'])
+        )
+        if not resultado.rowcount:
+            sessao.execute(insert(ResumoLogAuditoria), [linha])
+
+
+def reconstruir_resumo_logs(inicio=None, fim=None, sessao=None):
+    """
+    Recalcula o resumo a partir da tabela de logs e dos logs arquivados,
+    inteiro ou entre duas datas (inclusive). Não faz commit.
+
+    Returns:
+        int: Quantidade de linhas gravadas (as do banco e as do arquivo,
+            somadas mesmo quando caem no mesmo dia)
+    """
+    sessao = sessao or db.session
+    dia = func.date(LogAuditoria.data_acao)
+    consulta = select(
+        dia, LogAuditoria.acao, LogAuditoria.entidade, LogAuditoria.usuario_id, func.count()
+    ).group_by(dia, LogAuditoria.acao, LogAuditoria.entidade, LogAuditoria.usuario_id)
+    remocao = delete(ResumoLogAuditoria)
+
+    if inicio is not None:
+        consulta = consulta.where(LogAuditoria.data_acao >= datetime.combine(inicio, datetime.min.time()))
+        remocao = remocao.where(ResumoLogAuditoria.dia >= inicio)
+    if fim is not None:
+        consulta = consulta.where(LogAuditoria.data_acao < datetime.combine(fim + timedelta(days=1), datetime.min.time()))
+        remocao = remocao.where(ResumoLogAuditoria.dia <= fim)
+
+    # Logs arquivados e ainda não removidos do banco são contados só pelo arquivo
+    nao_arquivados = filtro_nao_arquivados(ler_manifesto(pasta_arquivo()))
+    if nao_arquivados is not None:
+        consulta = consulta.where(nao_arquivados)
+
+    sessao.execute(remocao)
+    resultado = sessao.execute(insert(ResumoLogAuditoria).from_select(
+        ['dia', 'acao', 'entidade', 'usuario_id', 'total'], consulta
+    ))
+    arquivadas = contar_registros(contar_arquivados(inicio, fim))
+    _somar_linhas(sessao, arquivadas)
+    return resultado.rowcount + len(arquivadas)
+
+
+def _filtro_periodo(inicio=None, fim=None):
+    condicoes = []
+    if inicio is not None:
+        condicoes.append(ResumoLogAuditoria.dia >= inicio)
+    if fim is not None:
+        condicoes.append(ResumoLogAuditoria.dia <= fim)
+    return condicoes
+
+def totais_por(coluna, inicio=None, fim=None, limite=None):
+    """
+    Quantidade de logs por valor de uma coluna do resumo ('acao', 'entidade'
+    ou 'usuario_id') no período, do maior para o menor.
+
+    Returns:
+        list: Tuplas (valor, total)
+    """
+    campo = getattr(ResumoLogAuditoria, coluna)
+    total = func.sum(ResumoLogAuditoria.total).label('total')
+    consulta = (
+        select(campo, total).where(*_filtro_periodo(inicio, fim))
+        .group_by(campo).order_by(desc('total'), campo)
+    )
+    if limite:
+        consulta = consulta.limit(limite)
+    return [(valor, int(quantidade)) for valor, quantidade in db.session.execute(consulta)]
+
+def total_pelo_resumo(acao=None, entidade=None, usuario_id=None, inicio=None, fim=None):
+    """Quantidade de logs (no banco e arquivados) com os filtros de listar_logs"""
+    condicoes = _filtro_periodo(inicio, fim)
+    if acao:
+        condicoes.append(ResumoLogAuditoria.acao == acao)
+    if entidade:
+        condicoes.append(ResumoLogAuditoria.entidade == entidade)
+    if usuario_id:
+        condicoes.append(ResumoLogAuditoria.usuario_id == usuario_id)
+    return int(db.session.execute(select(func.coalesce(func.sum(ResumoLogAuditoria.total), 0)).where(*condicoes)).scalar())
+
+def valores_distintos(coluna):
+    """Valores de 'acao' ou 'entidade' já registrados nos logs"""
+    campo = getattr(ResumoLogAuditoria, coluna)
+    return db.session.execute(select(campo).distinct().order_by(campo)).scalars().all()
+
+def estatisticas_logs(inicio=None, fim=None):
+    """
+    Estatísticas de /api/logs/estatisticas a partir do resumo.
+
+    Args:
+        inicio (date, optional): Primeiro dia do período
+        fim (date, optional): Último dia do período
+
+    Returns:
+        dict: Totais por ação, por entidade e por usuário no período, e o
+            ranking de usuários dos últimos 30 dias
+    """
+    por_usuario = totais_por('usuario_id', inicio, fim, LIMITE_USUARIOS)
+    inicio_30_dias = (datetime.utcnow() - timedelta(days=30)).date()
+    por_usuario_30_dias = totais_por('usuario_id', inicio_30_dias, None, LIMITE_USUARIOS)
+
+    ids = {usuario_id for usuario_id, _ in por_usuario + por_usuario_30_dias}
+    nomes = dict(db.session.execute(select(Usuario.id, Usuario.nome).where(Usuario.id.in_(ids))).all()) if ids else {}
+
+    def ranking(totais):
+        return [
+            {'usuario_id': usuario_id, 'usuario_nome': nomes.get(usuario_id, 'Usuário Removido'), 'total': total}
+            for usuario_id, total in totais
+        ]
+
+    return {
+        'periodo': {
+            'data_inicio': inicio.isoformat() if inicio else None,
+            'data_fim': fim.isoformat() if fim else None
+        },
+        'logs_por_acao': [{'acao': acao, 'total': total} for acao, total in totais_por('acao', inicio, fim)],
+        'logs_por_entidade': [{'entidade': entidade, 'total': total} for entidade, total in totais_por('entidade', inicio, fim)],
+        'logs_por_usuario': ranking(por_usuario),
+        'logs_por_usuario_30_dias': ranking(por_usuario_30_dias)
+    }
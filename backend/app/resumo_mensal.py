@@ -0,0 +1,321 @@
+"""
+Resumo mensal materializado por cliente (tabela resumo_mensal_cliente)
+
+Cada competência processada de um cliente tem uma linha com faturamento,
+imposto, RBT12, RBT12 futuro, alíquota efetiva, alíquota futura e Fator R já
+calculados. Relatórios e o painel do escritório leem essas linhas em vez de
+recalcular tudo a partir dos processamentos.
+
+A manutenção é incremental: eventos da sessão registram quais competências
+de quais clientes foram alteradas (Processamento criado, substituído,
+excluído ou restaurado da lixeira) e, antes do commit, somente a faixa
+afetada é recalculada. Uma alteração no mês M muda o próprio M e o RBT12 dos
+12 meses seguintes. Inserções em lote via Core (que não disparam eventos do
+ORM) devem chamar marcar_resumo_pendente explicitamente.
+"""
+from decimal import Decimal
+from datetime import datetime
+from itertools import chain
+from flask import Blueprint, jsonify, request
+from sqlalchemy import event, inspect, select, delete, insert, func
+from sqlalchemy.orm import Session
+from .models import db, Cliente, Processamento, ResumoMensalCliente
+from .auth import token_required
+from .services import (
+    _indice_competencia, _competencia_do_indice, calcular_rbt12_janela
+)
+from .simples_nacional import FATOR_R_MINIMO, obter_tabela, resolver_anexo_cliente, resolver_anexos_clientes
+
+dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/api/dashboard')
+
+# Chave em Session.info com as competências pendentes: {cliente_id: set(indices)}
+_CHAVE_PENDENTES = 'resumo_mensal_pendente'
+
+CENTAVOS = Decimal('0.01')
+CASAS_ALIQUOTA = Decimal('0.0000000001')
+
+
+def calcular_fator_r(rbt12):
+    """Fator R = (RBT12 / 12) * 0.28: folha mensal mínima para o Fator R de 28%"""
+    rbt12 = Decimal(rbt12)
+    media_mensal_12m = rbt12 / Decimal('12') if rbt12 > 0 else Decimal('0')
+    return media_mensal_12m * FATOR_R_MINIMO
+
+def calcular_indicadores_mensais(rbt12, rbt12_futuro, anexo=None):
+    """
+    Calcula os indicadores de uma competência a partir do RBT12 e do RBT12 futuro.
+
+    Returns:
+        tuple: (aliquota_efetiva, aliquota_futura, fator_r) como Decimal
+    """
+    tabela = obter_tabela(anexo)
+    return tabela.aliquota_efetiva(rbt12), tabela.aliquota_efetiva(rbt12_futuro), calcular_fator_r(rbt12)
+
+
+def _decimal_aliquota(valor):
+    """Converte uma alíquota calculada em float para o Decimal gravado no resumo"""
+    return Decimal(repr(float(valor))).quantize(CASAS_ALIQUOTA)
+
+def _montar_linhas(cliente_id, processamentos, totais_mensais, anexo, agora):
+    """
+    Monta as linhas do resumo para os processamentos informados.
+
+    Args:
+        processamentos (list): Tuplas (id, ano, mes, faturamento_total, imposto_calculado)
+        totais_mensais (dict): {indice: Decimal} com os 12 meses anteriores ao primeiro processamento
+        anexo (str): Anexo do Simples Nacional do cliente
+    """
+    competencias = [(ano, mes) for _, ano, mes, _, _ in processamentos]
+    rbt12_por_competencia = calcular_rbt12_janela(totais_mensais, competencias)
+    rbt12s = [rbt12_por_competencia[competencia] for competencia in competencias]
+
+    # Alíquotas de todas as competências do cliente em uma chamada vetorizada
+    tabela = obter_tabela(anexo)
+    efetivas = tabela.aliquotas_efetivas(rbt12 for rbt12, _ in rbt12s)
+    futuras = tabela.aliquotas_efetivas(futuro for _, futuro in rbt12s)
+
+    linhas = []
+    for i, (processamento_id, ano, mes, faturamento_total, imposto_calculado) in enumerate(processamentos):
+        rbt12, rbt12_futuro = rbt12s[i]
+        linhas.append({
+            'cliente_id': cliente_id,
+            'processamento_id': processamento_id,
+            'ano': ano,
+            'mes': mes,
+            'competencia': _indice_competencia(ano, mes),
+            'faturamento_total': Decimal(faturamento_total or 0),
+            'imposto_calculado': Decimal(imposto_calculado or 0),
+            'rbt12': rbt12.quantize(CENTAVOS),
+            'rbt12_futuro': rbt12_futuro.quantize(CENTAVOS),
+            'aliquota_efetiva': _decimal_aliquota(efetivas[i]),
+            'aliquota_futura': _decimal_aliquota(futuras[i]),
+            'fator_r': calcular_fator_r(rbt12).quantize(CENTAVOS),
+            'data_atualizacao': agora
+        })
+    return linhas
+
+def recalcular_resumo_cliente(cliente_id, indice_inicial=None, indice_final=None, sessao=None):
+    """
+    Recalcula as linhas do resumo de um cliente entre dois índices de
+    competência (inclusive). Sem índices, recalcula o cliente inteiro.
+
+    Usa uma consulta para os processamentos da faixa (mais os 12 meses
+    anteriores, para o RBT12) e substitui as linhas da faixa com um DELETE e
+    um INSERT em lote. Não faz commit.
+
+    Returns:
+        int: Quantidade de linhas gravadas
+    """
+    sessao = sessao or db.session
+    consulta = select(
+        Processamento.id,
+        Processamento.ano,
+        Processamento.mes,
+        Processamento.faturamento_total,
+        Processamento.imposto_calculado
+    ).where(Processamento.cliente_id == cliente_id)
+    remocao = delete(ResumoMensalCliente).where(ResumoMensalCliente.cliente_id == cliente_id)
+
+    if indice_inicial is not None:
+        consulta = consulta.where(Processamento.competencia.between(indice_inicial - 12, indice_final))
+        remocao = remocao.where(ResumoMensalCliente.competencia.between(indice_inicial, indice_final))
+
+    totais = {}
+    processamentos = []
+    for linha in sessao.execute(consulta.order_by(Processamento.competencia)):
+        indice = _indice_competencia(linha.ano, linha.mes)
+        totais[indice] = totais.get(indice, Decimal('0')) + Decimal(linha.faturamento_total or 0)
+        if indice_inicial is None or indice >= indice_inicial:
+            processamentos.append(tuple(linha))
+
+    sessao.execute(remocao)
+    linhas = _montar_linhas(cliente_id, processamentos, totais, resolver_anexo_cliente(cliente_id), datetime.utcnow())
+    if linhas:
+        sessao.execute(insert(ResumoMensalCliente), linhas)
+    return len(linhas)
+
+def reconstruir_resumo_mensal(cliente_ids=None, sessao=None):
+    """
+    Reconstrói o resumo mensal de todos os clientes (ou dos informados) com
+    uma única leitura dos processamentos. Não faz commit.
+
+    Returns:
+        int: Quantidade de linhas gravadas
+    """
+    sessao = sessao or db.session
+    consulta = select(
+        Processamento.cliente_id,
+        Processamento.id,
+        Processamento.ano,
+        Processamento.mes,
+        Processamento.faturamento_total,
+        Processamento.imposto_calculado
+    ).order_by(Processamento.cliente_id, Processamento.competencia)
+    remocao = delete(ResumoMensalCliente)
+    if cliente_ids is not None:
+        consulta = consulta.where(Processamento.cliente_id.in_(cliente_ids))
+        remocao = remocao.where(ResumoMensalCliente.cliente_id.in_(cliente_ids))
+
+    por_cliente = {}
+    for cliente_id, *processamento in sessao.execute(consulta):
+        por_cliente.setdefault(cliente_id, []).append(tuple(processamento))
+
+    sessao.execute(remocao)
+    anexos = resolver_anexos_clientes(por_cliente.keys())
+    agora = datetime.utcnow()
+    total = 0
+    for cliente_id, processamentos in por_cliente.items():
+        totais = {}
+        for _, ano, mes, faturamento_total, _ in processamentos:
+            indice = _indice_competencia(ano, mes)
+            totais[indice] = totais.get(indice, Decimal('0')) + Decimal(faturamento_total or 0)
+        linhas = _montar_linhas(cliente_id, processamentos, totais, anexos[cliente_id], agora)
+        sessao.execute(insert(ResumoMensalCliente), linhas)
+        total += len(linhas)
+    return total
+
+
+def marcar_resumo_pendente(cliente_id, competencias, sessao=None):
+    """
+    Registra competências (tuplas (ano, mes)) de um cliente cujo resumo deve
+    ser recalculado no próximo commit da sessão.
+    """
+    sessao = sessao or db.session
+    pendentes = sessao.info.setdefault(_CHAVE_PENDENTES, {})
+    pendentes.setdefault(cliente_id, set()).update(
+        _indice_competencia(ano, mes) for ano, mes in competencias
+    )
+
+def _valores_do_atributo(estado, atributo):
+    """Valores atual e anterior de um atributo (para detectar mudança de competência)"""
+    historico = estado.attrs[atributo].history
+    return {valor for valor in historico.sum() if valor is not None}
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_processamentos_alterados(sessao, contexto_flush):
+    """Coleta as competências dos processamentos gravados neste flush"""
+    for objeto in chain(sessao.new, sessao.dirty, sessao.deleted):
+        if not isinstance(objeto, Processamento):
+            continue
+        estado = inspect(objeto)
+        anos = _valores_do_atributo(estado, 'ano')
+        meses = _valores_do_atributo(estado, 'mes')
+        for cliente_id in _valores_do_atributo(estado, 'cliente_id'):
+            marcar_resumo_pendente(cliente_id, [(ano, mes) for ano in anos for mes in meses], sessao)
+
+@event.listens_for(Session, 'before_commit')
+def _atualizar_resumo_antes_do_commit(sessao):
+    """Recalcula, dentro da mesma transação, as faixas afetadas de cada cliente"""
+    if sessao.new or sessao.dirty or sessao.deleted:
+        sessao.flush()
+    pendentes = sessao.info.pop(_CHAVE_PENDENTES, None)
+    if not pendentes:
+        return
+    for cliente_id, indices in pendentes.items():
+        if indices:
+            recalcular_resumo_cliente(cliente_id, min(indices), max(indices) + 12, sessao)
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_pendentes(sessao):
+    """Alterações desfeitas não precisam de recálculo"""
+    sessao.info.pop(_CHAVE_PENDENTES, None)
+
+
+def carregar_resumo_cliente(cliente_id, filtro=None):
+    """
+    Carrega as linhas do resumo de um cliente em ordem cronológica.
+
+    Args:
+        filtro: Expressão adicional sobre as colunas de ResumoMensalCliente
+    """
+    consulta = ResumoMensalCliente.query.filter(ResumoMensalCliente.cliente_id == cliente_id)
+    if filtro is not None:
+        consulta = consulta.filter(filtro)
+    return consulta.order_by(ResumoMensalCliente.competencia).all()
+
+
+def _ler_competencia(valor, padrao):
+    """Converte 'YYYY-MM' em índice de competência"""
+    if not valor:
+        return padrao
+    data = datetime.strptime(valor, '%Y-%m')
+    return _indice_competencia(data.year, data.month)
+
+@dashboard_bp.route("/faturamento", methods=["GET"])
+@token_required
+def painel_faturamento(current_user):
+    """
+    Painel do escritório: faturamento e imposto de todos os clientes por mês,
+    lidos do resumo mensal (agregação no banco, sem varrer processamentos).
+
+    Query params:
+        inicio, fim: Competências 'YYYY-MM' (padrão: últimos 12 meses)
+        limite: Quantidade de clientes no ranking (padrão 10)
+    """
+    hoje = datetime.today()
+    try:
+        fim = _ler_competencia(request.args.get('fim'), _indice_competencia(hoje.year, hoje.month) - 1)
+        inicio = _ler_competencia(request.args.get('inicio'), fim - 11)
+    except ValueError:
+        return jsonify({"erro": "Formato de competência inválido. Use YYYY-MM."}), 400
+    if inicio > fim:
+        return jsonify({"erro": "A competência inicial deve ser anterior à final"}), 400
+    limite = min(request.args.get('limite', 10, type=int), 100)
+
+    periodo = ResumoMensalCliente.competencia.between(inicio, fim)
+
+    por_mes = db.session.query(
+        ResumoMensalCliente.competencia,
+        func.sum(ResumoMensalCliente.faturamento_total),
+        func.sum(ResumoMensalCliente.imposto_calculado),
+        func.count(ResumoMensalCliente.id)
+    ).filter(periodo).group_by(ResumoMensalCliente.competencia).order_by(ResumoMensalCliente.competencia).all()
+
+    meses = []
+    for competencia, faturamento, imposto, clientes in por_mes:
+        ano, mes = _competencia_do_indice(competencia)
+        faturamento = Decimal(faturamento or 0)
+        imposto = Decimal(imposto or 0)
+        meses.append({
+            'mes': mes,
+            'ano': ano,
+            'faturamento_total': faturamento,
+            'imposto_total': imposto,
+            'aliquota_media': (imposto / faturamento).quantize(CASAS_ALIQUOTA) if faturamento > 0 else Decimal('0'),
+            'clientes_com_faturamento': clientes
+        })
+
+    faturamento_cliente = func.sum(ResumoMensalCliente.faturamento_total)
+    maiores = db.session.query(
+        ResumoMensalCliente.cliente_id,
+        Cliente.razao_social,
+        Cliente.nome_completo,
+        faturamento_cliente,
+        func.sum(ResumoMensalCliente.imposto_calculado)
+    ).join(Cliente, Cliente.id == ResumoMensalCliente.cliente_id).filter(periodo).group_by(
+        ResumoMensalCliente.cliente_id, Cliente.razao_social, Cliente.nome_completo
+    ).order_by(faturamento_cliente.desc()).limit(limite).all()
+
+    faturamento_periodo = sum((m['faturamento_total'] for m in meses), Decimal('0'))
+    imposto_periodo = sum((m['imposto_total'] for m in meses), Decimal('0'))
+    ano_inicio, mes_inicio = _competencia_do_indice(inicio)
+    ano_fim, mes_fim = _competencia_do_indice(fim)
+
+    return jsonify({
+        'periodo': {
+            'inicio': f"{ano_inicio}-{mes_inicio:02d}",
+            'fim': f"{ano_fim}-{mes_fim:02d}"
+        },
+        'faturamento_total': faturamento_periodo,
+        'imposto_total': imposto_periodo,
+        'meses': meses,
+        'maiores_clientes': [
+            {
+                'cliente_id': cliente_id,
+                'nome': razao_social or nome_completo,
+                'faturamento_total': Decimal(faturamento or 0),
+                'imposto_total': Decimal(imposto or 0)
+            }
+            for cliente_id, razao_social, nome_completo, faturamento, imposto in maiores
+        ]
+    })
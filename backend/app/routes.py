@@ -4,16 +4,23 @@ import jwt
 from datetime import datetime
 import requests
 import json
-from .models import db, Cliente, Processamento, FaturamentoDetalhe, Contador, Recibo, ItemExcluido, CNAE, Socio, TemplateContrato, Contrato, PessoaJuridica, PessoaFisica, TemplateRelatorio
-from sqlalchemy.orm import joinedload
+from .models import db, Cliente, Processamento, Contador, Recibo, ItemExcluido, CNAE, Socio, TemplateContrato, Contrato, PessoaJuridica, PessoaFisica, TemplateRelatorio
 from sqlalchemy import or_, func
-from .auth import token_required
-from .services import processar_arquivo_faturamento, gerar_relatorio_faturamento, calcular_imposto_simples_nacional
-from .audit import log_action
+from .auth import token_required, admin_required
+from .services import processar_arquivo_faturamento, gerar_relatorio_faturamento, resolver_cliente_por_cnpj, resolver_cliente_por_cpf, consolidar_faturamento_lote, resumir_consolidacao, verificar_preview_no_banco
+from .audit import log_action, montar_registro_log, registrar_logs_em_lote
+from .recalculo_impostos import recalcular_impostos
 from .lixeira import salvar_na_lixeira
 from .validators import validar_cpf, validar_cnpj, formatar_cpf, formatar_cnpj, limpar_documento, validar_email, validar_telefone
 from .pdf_generator import gerar_pdf_contrato
-import unicodedata
+from .cnae_busca import limpar_codigo, buscar_cnaes_por_descricao
+from .importacao_jobs import submeter_job_preview, submeter_job_consolidacao, submeter_job_atualizacao_cadastral
+from .busca_clientes import buscar_clientes
+from .listagem_clientes import listar_clientes, ParametroInvalido, CAMPOS_DISPONIVEIS
+from .preview_importacao import armazenar_preview, carregar_previews, descartar_previews, previews_nao_encontrados, PreviewNaoEncontrado
+from .consulta_cnpj import obter_servico_cnpj, mapear_dados_receita, CNPJNaoEncontrado, ErroFonteCNPJ
+from .atualizacao_cadastral import atualizar_cadastros
+from .grafo_socios import carregar_socios_empresa, carregar_vinculos_empresa, carregar_empresas_do_socio
 import re
 
 api_bp = Blueprint('api', __name__, url_prefix='/api') # Blueprint principal da API
@@ -95,102 +102,6 @@ def obter_pessoa_fisica(current_user, pessoa_id):
         current_app.logger.error(f"Erro ao obter pessoa física {pessoa_id}: {e}", exc_info=True)
         return jsonify({"erro": "Erro ao buscar pessoa física"}), 500
 
-def normalizar_texto(texto):
-    """
-    Remove acentos e normaliza caracteres especiais para facilitar busca
-    Exemplos: 
-    - "construção" -> "construcao"
-    - "elétrico" -> "eletrico"
-    - "açúcar" -> "acucar"
-    """
-    if not texto:
-        return texto
-    
-    # Remove acentos usando unicodedata
-    texto_nfd = unicodedata.normalize('NFD', texto)
-    texto_sem_acento = ''.join(char for char in texto_nfd if unicodedata.category(char) != 'Mn')
-    
-    # Converte para minúsculas
-    texto_normalizado = texto_sem_acento.lower()
-    
-    return texto_normalizado
-
-def limpar_codigo(codigo):
-    """
-    Remove pontuações e espaços de códigos CNAE
-    Exemplo: "69.20-6/01" -> "6920601"
-    """
-    if not codigo:
-        return codigo
-    return codigo.replace('.', '').replace('-', '').replace('/', '').replace(' ', '')
-
-def calcular_similaridade(str1, str2):
-    """
-    Calcula similaridade entre duas strings usando distância de Levenshtein
-    Retorna um valor de 0 a 100 (100 = idênticas)
-    """
-    if not str1 or not str2:
-        return 0
-    
-    # Normaliza ambas as strings
-    s1 = normalizar_texto(str1).lower()
-    s2 = normalizar_texto(str2).lower()
-    
-    # Se são idênticas após normalização
-    if s1 == s2:
-        return 100
-    
-    # Se uma está contida na outra
-    if s1 in s2 or s2 in s1:
-        return 90
-    
-    # Calcula distância de Levenshtein
-    len1, len2 = len(s1), len(s2)
-    if len1 > len2:
-        s1, s2 = s2, s1
-        len1, len2 = len2, len1
-    
-    current_row = range(len1 + 1)
-    for i in range(1, len2 + 1):
-        previous_row, current_row = current_row, [i] + [0] * len1
-        for j in range(1, len1 + 1):
-            add, delete, change = previous_row[j] + 1, current_row[j - 1] + 1, previous_row[j - 1]
-            if s1[j - 1] != s2[i - 1]:
-                change += 1
-            current_row[j] = min(add, delete, change)
-    
-    # Converte distância em porcentagem de similaridade
-    distancia = current_row[len1]
-    max_len = max(len(s1), len(s2))
-    similaridade = ((max_len - distancia) / max_len) * 100
-    
-    return similaridade
-
-def extrair_radical(palavra):
-    """
-    Extrai o radical básico de uma palavra (stemming simplificado)
-    Exemplos:
-    - "odontológico" -> "odont"
-    - "odontologia" -> "odont"
-    - "construção" -> "constru"
-    """
-    palavra_norm = normalizar_texto(palavra).lower()
-    
-    # Remove sufixos comuns em português
-    sufixos = [
-        'mente', 'acao', 'icao', 'ador', 'ante', 'ancia', 'encia', 
-        'ismo', 'ista', 'oso', 'osa', 'ivo', 'iva', 'logico', 'logica',
-        'logia', 'vel', 'dor', 'dora', 'ao', 'oes', 'ico', 'ica',
-        'eiro', 'eira', 'agem', 'ncia', 'rio', 'ria', 'torio', 'toria'
-    ]
-    
-    for sufixo in sorted(sufixos, key=len, reverse=True):
-        if len(palavra_norm) > len(sufixo) + 3 and palavra_norm.endswith(sufixo):
-            return palavra_norm[:-len(sufixo)]
-    
-    # Retorna pelo menos as primeiras 5 letras (ou menos se a palavra for curta)
-    return palavra_norm[:max(5, len(palavra_norm) - 3)] if len(palavra_norm) > 3 else palavra_norm
-
 @api_bp.route("/clientes", methods=["POST"])
 @token_required
 def create_cliente(current_user):
@@ -253,38 +164,29 @@ def create_cliente(current_user):
         "cliente": novo_cliente.to_dict()
     }), 201
 
+def _responder_listagem_clientes(parametros):
+    """
+    Resposta das rotas de listagem de clientes (ver listagem_clientes.py):
+    a lista, ou {itens, proximo_cursor} quando há o parâmetro limite
+    """
+    try:
+        itens, proximo_cursor = listar_clientes(parametros)
+    except ParametroInvalido as e:
+        return jsonify({"erro": str(e)}), 400
+
+    if parametros.get('limite'):
+        return jsonify({"itens": itens, "proximo_cursor": proximo_cursor}), 200
+    return jsonify(itens), 200
+
 @api_bp.route("/clientes", methods=["GET"])
 @token_required
 def get_clientes(current_user):
-    """Retorna lista de todos os clientes (PJ e PF) com campos básicos"""
-    clientes = Cliente.query.all()
-    resultado = []
-    
-    for c in clientes:
-        cliente_data = {
-            "id": c.id,
-            "tipo_pessoa": c.tipo_pessoa or 'PJ',
-            "valor_honorarios": float(c.valor_honorarios) if c.valor_honorarios else None
-        }
-        
-        # Adiciona campos específicos de PF ou PJ
-        if c.tipo_pessoa == 'PF':
-            cliente_data.update({
-                "nome_completo": c.nome_completo,
-                "cpf": c.cpf,
-                "email": c.email,
-                "telefone1": c.telefone1
-            })
-        else:
-            cliente_data.update({
-                "razao_social": c.razao_social,
-                "cnpj": c.cnpj,
-                "regime_tributario": c.regime_tributario
-            })
-        
-        resultado.append(cliente_data)
-    
-    return jsonify(resultado)
+    """
+    Retorna a lista de clientes (PJ e PF) com campos básicos.
+    Aceita fields, filtros (tipo_pessoa, regime, uf, ativo), ordenar/ordem
+    e paginação com limite/cursor
+    """
+    return _responder_listagem_clientes(request.args)
 
 @api_bp.route("/clientes/<int:cliente_id>", methods=["GET"])
 @token_required
@@ -321,6 +223,7 @@ def delete_cliente(current_user, cliente_id):
         num_processamentos = len(processamentos)
         
         # Remove processamentos relacionados primeiro (salva cada um na lixeira)
+        logs = []
         for proc in processamentos:
             # Conta o número de notas (detalhes) do processamento
             total_notas = len(proc.detalhes) if proc.detalhes else 0
@@ -328,15 +231,15 @@ def delete_cliente(current_user, cliente_id):
             # Salva processamento na lixeira
             salvar_na_lixeira('PROCESSAMENTO', proc, current_user.id, 'Excluído junto com o cliente')
             
-            # Registra log de exclusão
-            log_action(current_user.id, 'DELETE', 'FATURAMENTO', proc.id, {
+            # Registra log de exclusão (na mesma transação da exclusão)
+            logs.append(montar_registro_log(current_user.id, 'DELETE', 'FATURAMENTO', proc.id, {
                 'cliente_id': cliente_id,
                 'cliente_nome': identificacao,
                 'mes': proc.mes,
                 'ano': proc.ano,
                 'total_notas': total_notas,
                 'motivo': 'Excluído junto com o cliente (salvo na lixeira)'
-            })
+            }))
             
             # Remove do banco
             db.session.delete(proc)
@@ -347,6 +250,7 @@ def delete_cliente(current_user, cliente_id):
         
         # Deleta o cliente do banco principal
         db.session.delete(cliente)
+        registrar_logs_em_lote(logs)
         db.session.commit()
         
         # Registra log de exclusão do cliente
@@ -515,8 +419,17 @@ def update_cliente(current_user, cliente_id):
 @token_required
 def get_processamentos(current_user):
     # Inicia a query base
-    # Otimização: usa joinedload para evitar o problema N+1
-    query = Processamento.query.options(joinedload(Processamento.cliente))
+    # Otimização: seleciona apenas as colunas exibidas, com o nome do cliente via JOIN
+    query = db.session.query(
+        Processamento.id,
+        Processamento.cliente_id,
+        Cliente.razao_social,
+        Processamento.mes,
+        Processamento.ano,
+        Processamento.faturamento_total,
+        Processamento.imposto_calculado,
+        Processamento.data_processamento
+    ).join(Cliente, Cliente.id == Processamento.cliente_id)
     # Obtém os parâmetros de filtro da URL (ex: ?cliente_id=1&ano=2024)
     cliente_id = request.args.get('cliente_id')
     mes = request.args.get('mes')
@@ -524,19 +437,19 @@ def get_processamentos(current_user):
 
     # Aplica os filtros se eles forem fornecidos
     if cliente_id:
-        query = query.filter_by(cliente_id=cliente_id)
+        query = query.filter(Processamento.cliente_id == cliente_id)
     if mes:
-        query = query.filter_by(mes=mes)
+        query = query.filter(Processamento.mes == mes)
     if ano:
-        query = query.filter_by(ano=ano)
+        query = query.filter(Processamento.ano == ano)
 
     # Ordena os resultados para uma visualização consistente
-    processamentos = query.order_by(Processamento.ano.desc(), Processamento.mes.desc()).all()
+    processamentos = query.order_by(Processamento.competencia.desc()).all()
 
     resultado = [{
         "id": p.id,
         "cliente_id": p.cliente_id,
-        "razao_social_cliente": p.cliente.razao_social, # Adicionando o nome do cliente para clareza
+        "razao_social_cliente": p.razao_social, # Adicionando o nome do cliente para clareza
         "mes": p.mes,
         "ano": p.ano,
         "faturamento_total": float(p.faturamento_total),
@@ -618,6 +531,36 @@ def processar_faturamento(current_user):
         current_app.logger.error(f"Erro inesperado ao processar faturamento: {e}")
         return jsonify({"erro": "Ocorreu um erro interno ao processar o arquivo."}), 500
 
+@api_bp.route("/faturamento/recalcular-impostos", methods=["POST"])
+@token_required
+@admin_required
+def recalcular_impostos_faturamento(current_user):
+    """
+    Recalcula o imposto de todos os processamentos (ou dos clientes informados).
+
+    Body (JSON, opcional):
+        aplicar (bool): Grava os novos valores. Padrão: false (apenas simula e
+            devolve as diferenças)
+        cliente_ids (list): Restringe o recálculo a esses clientes
+    """
+    data = request.get_json(silent=True) or {}
+    aplicar = bool(data.get('aplicar', False))
+    try:
+        relatorio = recalcular_impostos(data.get('cliente_ids') or None, aplicar=aplicar)
+        if aplicar:
+            registrar_logs_em_lote([montar_registro_log(current_user.id, 'RECALCULO', 'FATURAMENTO', detalhes={
+                'processamentos_alterados': relatorio['processamentos_alterados'],
+                'clientes_alterados': relatorio['clientes_alterados'],
+                'imposto_atual': float(relatorio['imposto_atual']),
+                'imposto_recalculado': float(relatorio['imposto_recalculado'])
+            }, ip_address=request.remote_addr)])
+            db.session.commit()
+        return jsonify(relatorio)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erro ao recalcular impostos: {e}", exc_info=True)
+        return jsonify({"erro": "Erro ao recalcular impostos"}), 500
+
 @api_bp.route("/cnpj/<string:cnpj>", methods=["GET"])
 @token_required
 def consultar_cnpj(current_user, cnpj):
@@ -636,23 +579,16 @@ def consultar_cnpj(current_user, cnpj):
             current_app.logger.warning(f"CNPJ inválido (tamanho): {cnpj_limpo}")
             return jsonify({"erro": "CNPJ inválido. Deve conter 14 dígitos."}), 400
         
-        # Consulta a BrasilAPI
-        url = f"https://brasilapi.com.br/api/cnpj/v1/{cnpj_limpo}"
-        current_app.logger.info(f"Fazendo requisição para: {url}")
-        
-        response = requests.get(url, timeout=15)
-        
-        current_app.logger.info(f"Status da resposta: {response.status_code}")
-        
-        if response.status_code == 404:
+        # Consulta a BrasilAPI (com cache e agrupamento de consultas simultâneas)
+        try:
+            dados_receita = obter_servico_cnpj(current_app).consultar(cnpj_limpo)
+        except CNPJNaoEncontrado:
             current_app.logger.warning(f"CNPJ não encontrado: {cnpj_limpo}")
             return jsonify({"erro": "CNPJ não encontrado na Receita Federal."}), 404
+        except ErroFonteCNPJ as e:
+            current_app.logger.error(f"Erro da BrasilAPI - Status {e.status_code}: {e.texto}")
+            return jsonify({"erro": f"Erro ao consultar a Receita Federal (Status: {e.status_code}). Tente novamente."}), 502
         
-        if response.status_code != 200:
-            current_app.logger.error(f"Erro da BrasilAPI - Status {response.status_code}: {response.text}")
-            return jsonify({"erro": f"Erro ao consultar a Receita Federal (Status: {response.status_code}). Tente novamente."}), 502
-        
-        dados_receita = response.json()
         current_app.logger.info(f"Dados recebidos da API para CNPJ {cnpj_limpo}: {dados_receita}")
         
         # Valida se os dados não estão vazios
@@ -687,88 +623,44 @@ def consultar_cnpj(current_user, cnpj):
         current_app.logger.error(f"Erro inesperado ao consultar CNPJ: {e}", exc_info=True)
         return jsonify({"erro": f"Erro interno: {str(e)}"}), 500
 
-def mapear_dados_receita(dados_api):
+@api_bp.route("/clientes/atualizar-cadastros", methods=["POST"])
+@token_required
+@admin_required
+def atualizar_cadastros_clientes(current_user):
     """
-    Mapeia os dados da BrasilAPI para o formato usado pelo nosso frontend.
+    Atualiza os dados cadastrais (situação, Simples, CNAEs, endereço...) dos
+    clientes PJ com os dados da Receita Federal (ver atualizacao_cadastral.py).
+
+    Body (JSON, opcional):
+        aplicar (bool): Grava as alterações. Padrão: false (apenas lista as
+            diferenças)
+        cliente_ids (list): Restringe a atualização a esses clientes
+        usar_cache (bool): Padrão: true; false consulta a API para todos os CNPJs
+
+    Com ?assincrono=1 a atualização é feita por um job em segundo plano
+    (recomendado para todos os clientes), acompanhado em /api/importacao/jobs/<id>
     """
-    import json
-    
-    # Valida se dados_api não é None
-    if not dados_api or not isinstance(dados_api, dict):
-        raise ValueError("Dados da API inválidos ou vazios")
-    
-    # Formata o CNPJ com máscara
-    cnpj = dados_api.get('cnpj', '')
-    cnpj_formatado = f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:14]}" if len(cnpj) == 14 else cnpj
-    
-    # Formata a data de abertura (de YYYY-MM-DD para DD/MM/YYYY)
-    data_abertura = dados_api.get('data_inicio_atividade', '')
-    if data_abertura and len(data_abertura) == 10:
-        partes = data_abertura.split('-')
-        data_abertura = f"{partes[2]}/{partes[1]}/{partes[0]}"
-    
-    # Formata datas de situação
-    data_situacao = dados_api.get('data_situacao_cadastral', '')
-    if data_situacao and len(data_situacao) == 10:
-        partes = data_situacao.split('-')
-        data_situacao = f"{partes[2]}/{partes[1]}/{partes[0]}"
-    
-    # Formata data da situação especial
-    data_situacao_especial = dados_api.get('data_situacao_especial', '')
-    if data_situacao_especial and len(data_situacao_especial) == 10:
-        partes = data_situacao_especial.split('-')
-        data_situacao_especial = f"{partes[2]}/{partes[1]}/{partes[0]}"
-    
-    # Formata data de opção pelo Simples
-    # Verifica se opcao_pelo_simples é um dicionário antes de acessar
-    opcao_simples_obj = dados_api.get('opcao_pelo_simples') or {}
-    data_opcao_simples = opcao_simples_obj.get('data_opcao', '') if isinstance(opcao_simples_obj, dict) else ''
-    if data_opcao_simples and len(data_opcao_simples) == 10:
-        partes = data_opcao_simples.split('-')
-        data_opcao_simples = f"{partes[2]}/{partes[1]}/{partes[0]}"
-    # Se não tem data, tenta pegar do campo alternativo
-    if not data_opcao_simples:
-        data_opcao_simples = dados_api.get('data_opcao_pelo_simples', '')
-    
-    # Monta lista de CNAEs secundários
-    cnaes_secundarios = [
-        f"{cnae.get('codigo', '')} - {cnae.get('descricao', '')}"
-        for cnae in dados_api.get('cnaes_secundarios', [])
-    ]
-    
-    # Formata o capital social
-    capital_social = dados_api.get('capital_social', 0)
-    capital_social_formatado = f"R$ {float(capital_social):,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-    
-    return {
-        'cnpj': cnpj_formatado,
-        'razao_social': dados_api.get('razao_social', ''),
-        'nome_fantasia': dados_api.get('nome_fantasia', ''),
-        'data_abertura': data_abertura,
-        'situacao_cadastral': dados_api.get('descricao_situacao_cadastral', ''),
-        'data_situacao': data_situacao,
-        'motivo_situacao': dados_api.get('descricao_motivo_situacao_cadastral', ''),
-        'natureza_juridica': f"{dados_api.get('codigo_natureza_juridica', '')} - {dados_api.get('natureza_juridica', '')}",
-        'cnae_principal': f"{dados_api.get('cnae_fiscal', '')} - {dados_api.get('cnae_fiscal_descricao', '')}",
-        'cnae_secundarias': cnaes_secundarios,
-        'logradouro': dados_api.get('logradouro', ''),
-        'numero': dados_api.get('numero', ''),
-        'complemento': dados_api.get('complemento', ''),
-        'bairro': dados_api.get('bairro', ''),
-        'cep': dados_api.get('cep', ''),
-        'municipio': dados_api.get('municipio', ''),
-        'uf': dados_api.get('uf', ''),
-        'telefone1': dados_api.get('ddd_telefone_1', ''),
-        'telefone2': dados_api.get('ddd_telefone_2', ''),
-        'email': dados_api.get('email', ''),
-        'capital_social': capital_social_formatado,
-        'porte': dados_api.get('porte', ''),
-        'opcao_simples': 'SIM' if (isinstance(opcao_simples_obj, dict) and opcao_simples_obj.get('optante', False)) else 'NÃO',
-        'data_opcao_simples': data_opcao_simples,
-        'opcao_mei': 'SIM' if dados_api.get('opcao_pelo_mei') else 'NÃO',
-        'situacao_especial': dados_api.get('situacao_especial', ''),
-        'data_situacao_especial': data_situacao_especial
-    }
+    data = request.get_json(silent=True) or {}
+    aplicar = bool(data.get('aplicar', False))
+    usar_cache = bool(data.get('usar_cache', True))
+    cliente_ids = data.get('cliente_ids') or None
+    try:
+        if request.args.get('assincrono') in ('1', 'true'):
+            job = submeter_job_atualizacao_cadastral(current_user.id, cliente_ids, aplicar=aplicar, usar_cache=usar_cache)
+            return jsonify(job.to_dict()), 202
+
+        relatorio = atualizar_cadastros(cliente_ids, aplicar=aplicar, usar_cache=usar_cache)
+        if aplicar:
+            registrar_logs_em_lote([montar_registro_log(current_user.id, 'ATUALIZACAO_CADASTRAL', 'CLIENTE', detalhes={
+                'clientes_alterados': relatorio['clientes_alterados'],
+                'total_clientes': relatorio['total_clientes']
+            }, ip_address=request.remote_addr)])
+            db.session.commit()
+        return jsonify(relatorio)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erro ao atualizar cadastros: {e}", exc_info=True)
+        return jsonify({"erro": "Erro ao atualizar cadastros"}), 500
 
 # ==========================
 # CONSULTA CEP (ViaCEP)
@@ -970,8 +862,8 @@ def listar_socios_empresa(current_user, empresa_id):
         # Parâmetro para incluir dados completos
         incluir_completos = request.args.get('completos', 'false').lower() == 'true'
         
-        # Busca os sócios
-        socios = Socio.query.filter_by(empresa_id=empresa_id).all()
+        # Busca os sócios (com os dados do cliente sócio na mesma consulta)
+        socios = carregar_vinculos_empresa(empresa_id)
         
         return jsonify([s.to_dict(incluir_dados_completos=incluir_completos) for s in socios]), 200
         
@@ -1105,22 +997,38 @@ def remover_socio(current_user, empresa_id, socio_id):
         return jsonify({"erro": "Erro ao remover sócio"}), 500
 
 
+@api_bp.route("/clientes/<int:cliente_id>/empresas", methods=["GET"])
+@token_required
+def listar_empresas_do_socio(current_user, cliente_id):
+    """
+    Lista as empresas de que um cliente PF é sócio.
+    """
+    try:
+        cliente = Cliente.query.get(cliente_id)
+        if not cliente:
+            return jsonify({"erro": "Cliente não encontrado"}), 404
+
+        if cliente.tipo_pessoa != 'PF':
+            return jsonify({"erro": "Cliente deve ser uma pessoa física"}), 400
+
+        return jsonify(carregar_empresas_do_socio(cliente_id)), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Erro ao listar empresas do sócio {cliente_id}: {e}", exc_info=True)
+        return jsonify({"erro": "Erro ao buscar empresas do sócio"}), 500
+
+
 @api_bp.route("/clientes/pessoa-fisica", methods=["GET"])
 @token_required
 def listar_todos_clientes_pf(current_user):
     """
     Retorna lista completa de clientes Pessoa Física com todos os dados.
+    Aceita os mesmos parâmetros de GET /clientes.
     """
-    try:
-        clientes_pf = Cliente.query.filter_by(tipo_pessoa='PF').all()
-        
-        resultado = [c.to_dict() for c in clientes_pf]
-        
-        return jsonify(resultado), 200
-        
-    except Exception as e:
-        current_app.logger.error(f"Erro ao listar todos clientes PF: {e}", exc_info=True)
-        return jsonify({"erro": "Erro ao buscar clientes PF"}), 500
+    parametros = request.args.to_dict()
+    parametros['tipo_pessoa'] = 'PF'
+    parametros.setdefault('fields', ','.join(CAMPOS_DISPONIVEIS))
+    return _responder_listagem_clientes(parametros)
 
 
 @api_bp.route("/clientes/pessoa-fisica/lista", methods=["GET"])
@@ -1128,22 +1036,12 @@ def listar_todos_clientes_pf(current_user):
 def listar_clientes_pf(current_user):
     """
     Retorna lista simplificada de clientes Pessoa Física para seleção de sócios.
+    Aceita os mesmos parâmetros de GET /clientes.
     """
-    try:
-        clientes_pf = Cliente.query.filter_by(tipo_pessoa='PF').all()
-        
-        resultado = [{
-            'id': c.id,
-            'nome_completo': c.nome_completo,
-            'cpf': c.cpf,
-            'email': c.email
-        } for c in clientes_pf]
-        
-        return jsonify(resultado), 200
-        
-    except Exception as e:
-        current_app.logger.error(f"Erro ao listar clientes PF: {e}", exc_info=True)
-        return jsonify({"erro": "Erro ao buscar clientes PF"}), 500
+    parametros = request.args.to_dict()
+    parametros['tipo_pessoa'] = 'PF'
+    parametros.setdefault('fields', 'id,nome_completo,cpf,email')
+    return _responder_listagem_clientes(parametros)
 
 
 # ============================================
@@ -1156,9 +1054,12 @@ def upload_preview_csv(current_user):
     """
     Recebe múltiplos arquivos CSV e retorna preview dos dados
     sem salvar no banco
+    
+    Com ?assincrono=1 o processamento é feito por um job em segundo plano:
+    a resposta (202) traz o job, acompanhado em /api/importacao/jobs/<id>
     """
     from .csv_parser import processar_multiplos_arquivos
-    import uuid
+    from .cache_csv import obter_cache
     
     try:
         # Verifica se há arquivos no request
@@ -1180,118 +1081,36 @@ def upload_preview_csv(current_user):
             if arquivo.filename == '':
                 continue
             
-            # Lê o conteúdo do arquivo
-            arquivo_bytes = arquivo.read()
-            arquivos_para_processar.append((arquivo_bytes, arquivo.filename))
+            # Passa o stream do upload: o parser lê o arquivo em blocos
+            arquivos_para_processar.append((arquivo.stream, arquivo.filename))
         
         if len(arquivos_para_processar) == 0:
             return jsonify({
                 'erro': '❌ Nenhum arquivo válido foi encontrado.\n\nVerifique se:\n• Os arquivos são do tipo CSV\n• Os arquivos não estão vazios\n• Os arquivos têm conteúdo válido'
             }), 400
         
+        if request.args.get('assincrono') in ('1', 'true'):
+            job = submeter_job_preview(current_user.id, arquivos_para_processar)
+            return jsonify(job.to_dict()), 202
+        
         # Processa todos os arquivos
-        resultado = processar_multiplos_arquivos(arquivos_para_processar)
+        resultado = processar_multiplos_arquivos(
+            arquivos_para_processar,
+            max_workers=current_app.config.get('CSV_PARSER_WORKERS', 1),
+            cache=obter_cache(current_app)
+        )
         
-        # Para cada arquivo processado com sucesso, verifica se o cliente existe
-        # e se a competência já existe no banco
-        for arquivo_result in resultado['arquivos_processados']:
-            if arquivo_result['status'] != 'ok':
-                continue
-            
-            cnpj = arquivo_result['cnpj']
-            
-            # Busca o cliente no banco (sem formatação, apenas dígitos)
-            # Remove qualquer formatação do CNPJ para comparação
-            import re
-            cnpj_limpo = re.sub(r'[^\d]', '', cnpj)
-            
-            # Busca compatível com SQLite e PostgreSQL
-            # Busca todos e filtra no Python (mais compatível)
-            cliente = None
-            for c in Cliente.query.all():
-                cnpj_db_limpo = re.sub(r'[^\d]', '', c.cnpj or '')
-                if cnpj_db_limpo == cnpj_limpo:
-                    cliente = c
-                    break
-            
-            if not cliente:
-                arquivo_result['status'] = 'nao_cadastrado'
-                arquivo_result['avisos'].append(
-                    f"Cliente com CNPJ {cnpj_limpo} não está cadastrado."
-                )
-                arquivo_result['cliente_info'] = None
-                arquivo_result['precisa_cadastrar'] = True
-                continue
-            
-            # Adiciona informações do cliente
-            arquivo_result['cliente_info'] = {
-                'id': cliente.id,
-                'razao_social': cliente.razao_social,
-                'cnpj_formatado': cliente.cnpj
-            }
-            
-            # Para cada competência, verifica se já existe no banco
-            for competencia in arquivo_result['competencias']:
-                mes = competencia['mes']
-                ano = competencia['ano']
-                
-                processamento_existente = Processamento.query.filter_by(
-                    cliente_id=cliente.id,
-                    mes=mes,
-                    ano=ano
-                ).first()
-                
-                competencia['ja_existe'] = processamento_existente is not None
-                
-                if processamento_existente:
-                    arquivo_result['avisos'].append(
-                        f"Competência {mes:02d}/{ano} já existe no sistema"
-                    )
-                    competencia['faturamento_anterior'] = float(processamento_existente.faturamento_total)
-                    
-                    # Verifica notas duplicadas
-                    notas_duplicadas = []
-                    for nota in competencia['notas']:
-                        numero_nf = nota.get('numero_nf', '')
-                        if numero_nf:
-                            # Busca se esta NF já existe para este cliente e competência
-                            detalhe_existente = db.session.query(FaturamentoDetalhe).join(
-                                Processamento
-                            ).filter(
-                                Processamento.cliente_id == cliente.id,
-                                Processamento.mes == mes,
-                                Processamento.ano == ano,
-                                FaturamentoDetalhe.descricao_servico.contains(f"NF {numero_nf}")
-                            ).first()
-                            
-                            if detalhe_existente:
-                                notas_duplicadas.append({
-                                    'numero_nf': numero_nf,
-                                    'valor': nota['valor'],
-                                    'tomador': nota.get('razao_social_tomador', '')
-                                })
-                    
-                    if notas_duplicadas:
-                        competencia['notas_duplicadas'] = notas_duplicadas
-                        competencia['total_duplicadas'] = len(notas_duplicadas)
-                        arquivo_result['avisos'].append(
-                            f"⚠️ {len(notas_duplicadas)} nota(s) duplicada(s) encontrada(s) em {mes:02d}/{ano}"
-                        )
-                    else:
-                        competencia['notas_duplicadas'] = []
-                        competencia['total_duplicadas'] = 0
-                else:
-                    competencia['faturamento_anterior'] = 0
-                    competencia['notas_duplicadas'] = []
-                    competencia['total_duplicadas'] = 0
-        
-        # Gera IDs temporários para cada arquivo
-        for arquivo_result in resultado['arquivos_processados']:
-            arquivo_result['id_temporario'] = str(uuid.uuid4())
+        # Identifica clientes, competências já existentes e notas duplicadas
+        verificar_preview_no_banco(resultado)
+        
+        # Guarda as notas no servidor: a consolidação recebe apenas os IDs
+        armazenar_preview(resultado, current_user.id)
+        db.session.commit()
         
         return jsonify(resultado), 200
         
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Erro no upload preview: {str(e)}", exc_info=True)
         return jsonify({'erro': f"Erro ao processar arquivos: {str(e)}"}), 500
 
@@ -1312,16 +1131,10 @@ def cadastrar_cliente_csv(current_user):
         cnpj = data['cnpj']
         
         # Limpa o CNPJ
-        import re
-        cnpj_limpo = re.sub(r'[^\d]', '', cnpj)
+        cnpj_limpo = limpar_documento(cnpj)
         
-        # Verifica se já existe (compatível com SQLite e PostgreSQL)
-        cliente_existente = None
-        for c in Cliente.query.all():
-            cnpj_db_limpo = re.sub(r'[^\d]', '', c.cnpj or '')
-            if cnpj_db_limpo == cnpj_limpo:
-                cliente_existente = c
-                break
+        # Verifica se já existe (busca indexada por cnpj_digitos)
+        cliente_existente = resolver_cliente_por_cnpj(cnpj_limpo)
         
         if cliente_existente:
             return jsonify({
@@ -1336,23 +1149,17 @@ def cadastrar_cliente_csv(current_user):
         
         # Busca na API da Receita Federal
         try:
-            response = requests.get(
-                f'https://brasilapi.com.br/api/cnpj/v1/{cnpj_limpo}',
-                timeout=15
-            )
-            
-            if response.status_code == 404:
+            try:
+                dados_api = obter_servico_cnpj(current_app).consultar(cnpj_limpo)
+            except CNPJNaoEncontrado:
                 return jsonify({
                     'erro': f'❌ CNPJ {cnpj_limpo[:2]}.{cnpj_limpo[2:5]}.{cnpj_limpo[5:8]}/{cnpj_limpo[8:12]}-{cnpj_limpo[12:]} não encontrado na Receita Federal.\n\n💡 Solução: Verifique se o CNPJ está correto e ativo.'
                 }), 404
-            
-            if response.status_code != 200:
+            except ErroFonteCNPJ as e:
                 return jsonify({
-                    'erro': f'❌ Erro ao consultar a Receita Federal (Status {response.status_code}).\n\n💡 Solução: A Receita Federal pode estar fora do ar. Tente novamente em alguns minutos.'
+                    'erro': f'❌ Erro ao consultar a Receita Federal (Status {e.status_code}).\n\n💡 Solução: A Receita Federal pode estar fora do ar. Tente novamente em alguns minutos.'
                 }), 502
             
-            dados_api = response.json()
-            
             # Cria o cliente com dados da API
             import json
             
@@ -1429,189 +1236,54 @@ def cadastrar_cliente_csv(current_user):
 @token_required
 def consolidar_csv(current_user):
     """
-    Consolida os dados do CSV no banco de dados
-    Recebe os dados já processados do preview
+    Consolida no banco os arquivos de um preview
+    
+    Corpo: {"ids_temporarios": [...], "substituicoes": {id_temporario: {"mes_ano": bool}}}
+    As notas vêm do preview guardado no servidor (ver preview_importacao.py);
+    para clientes antigos, "arquivos" com objetos do preview também é aceito,
+    mas só o id_temporario de cada um é usado.
+    
+    Com ?assincrono=1 a consolidação é feita por um job em segundo plano:
+    a resposta (202) traz o job, acompanhado em /api/importacao/jobs/<id>
     """
     try:
         data = request.get_json()
         
-        if not data or 'arquivos' not in data:
+        if not data:
             return jsonify({'erro': 'Dados inválidos'}), 400
         
-        arquivos_para_consolidar = data['arquivos']
-        # Agora recebe substituicoes por competência
-        substituicoes = data.get('substituicoes', {})  # Dict: {arquivo_id: {mes_ano: bool}}
-        
-        resultados = []
-        
-        for arquivo_data in arquivos_para_consolidar:
-            try:
-                cnpj = arquivo_data['cnpj']
-                cliente_id = arquivo_data['cliente_info']['id']
-                
-                # Busca o cliente
-                cliente = Cliente.query.get(cliente_id)
-                if not cliente:
-                    resultados.append({
-                        'arquivo': arquivo_data['nome_arquivo'],
-                        'status': 'erro',
-                        'mensagem': f"Cliente ID {cliente_id} não encontrado"
-                    })
-                    continue
-                
-                # Processa cada competência
-                for competencia in arquivo_data['competencias']:
-                    mes = competencia['mes']
-                    ano = competencia['ano']
-                    chave_competencia = f"{mes}_{ano}"
-                    
-                    # Verifica se já existe
-                    processamento_existente = Processamento.query.filter_by(
-                        cliente_id=cliente_id,
-                        mes=mes,
-                        ano=ano
-                    ).first()
-                    
-                    if processamento_existente:
-                        # Verifica se deve substituir esta competência específica
-                        arquivo_id = arquivo_data.get('id_temporario')
-                        deve_substituir = substituicoes.get(arquivo_id, {}).get(chave_competencia, False)
-                        
-                        if deve_substituir:
-                            # Conta o número de notas antes de deletar
-                            total_notas_antigo = len(processamento_existente.detalhes) if processamento_existente.detalhes else 0
-                            
-                            # Salva o processamento na lixeira antes de substituir
-                            salvar_na_lixeira('PROCESSAMENTO', processamento_existente, current_user.id, 
-                                            'Substituído por nova importação')
-                            
-                            # Registra log da exclusão (substituição)
-                            log_action(current_user.id, 'DELETE', 'FATURAMENTO', processamento_existente.id, {
-                                'cliente_id': cliente_id,
-                                'cliente_nome': cliente.razao_social,
-                                'mes': mes,
-                                'ano': ano,
-                                'total_notas': total_notas_antigo,
-                                'motivo': 'Substituído por nova importação (salvo na lixeira)'
-                            })
-                            
-                            # Remove o processamento antigo e suas notas
-                            FaturamentoDetalhe.query.filter_by(
-                                processamento_id=processamento_existente.id
-                            ).delete()
-                            db.session.delete(processamento_existente)
-                            db.session.flush()
-                            
-                            current_app.logger.info(f"Competência {mes:02d}/{ano} substituída para cliente {cliente_id}")
-                        else:
-                            # Pula esta competência
-                            resultados.append({
-                                'arquivo': arquivo_data['nome_arquivo'],
-                                'competencia': f"{mes:02d}/{ano}",
-                                'status': 'ignorado',
-                                'mensagem': 'Competência já existe e não foi marcada para substituição'
-                            })
-                            continue
-                    
-                    # Cria novo processamento seguindo o padrão do seed
-                    from decimal import Decimal
-                    
-                    faturamento_total = sum(nota['valor'] for nota in competencia['notas'])
-                    
-                    # Prepara as notas detalhadas (usando descricao_servico, igual ao seed)
-                    detalhes_mes = []
-                    for nota in competencia['notas']:
-                        # Inclui número da NF na descrição para verificação de duplicatas
-                        numero_nf = nota.get('numero_nf', '')
-                        tomador = nota.get('razao_social_tomador', 'Serviço Prestado')
-                        
-                        if numero_nf:
-                            descricao = f"NF {numero_nf} - {tomador}"[:200]
-                        else:
-                            descricao = tomador[:200]
-                        
-                        detalhe = FaturamentoDetalhe(
-                            descricao_servico=descricao,
-                            valor=Decimal(str(nota['valor']))
-                        )
-                        detalhes_mes.append(detalhe)
-                    
-                    # Calcula o imposto usando a função do services (igual ao seed)
-                    # A função retorna um Decimal diretamente
-                    try:
-                        imposto_calculado_valor = calcular_imposto_simples_nacional(
-                            cliente_id=cliente_id,
-                            mes_calculo=mes,
-                            ano_calculo=ano,
-                            faturamento_mes_atual=float(faturamento_total)
-                        )
-                        
-                        imposto_calculado = Decimal(str(imposto_calculado_valor)).quantize(Decimal('0.01'))
-                        
-                        current_app.logger.info(f"Imposto calculado para competência {mes:02d}/{ano}: R$ {imposto_calculado}")
-                    except Exception as e:
-                        current_app.logger.error(f"Erro ao calcular imposto: {str(e)}", exc_info=True)
-                        imposto_calculado = Decimal('0.00')
-                    
-                    # Cria o processamento com os detalhes (igual ao seed)
-                    novo_processamento = Processamento(
-                        cliente_id=cliente_id,
-                        mes=mes,
-                        ano=ano,
-                        faturamento_total=Decimal(str(faturamento_total)),
-                        imposto_calculado=imposto_calculado,
-                        nome_arquivo_original=arquivo_data['nome_arquivo'],
-                        detalhes=detalhes_mes  # Relationship do SQLAlchemy
-                    )
-                    
-                    db.session.add(novo_processamento)
-                    # Commit individual para que o próximo cálculo tenha os dados corretos (igual ao seed)
-                    db.session.commit()
-                    
-                    # Registra log de auditoria da importação
-                    log_action(current_user.id, 'CREATE', 'FATURAMENTO', novo_processamento.id, {
-                        'cliente_id': cliente_id,
-                        'cliente_nome': cliente.razao_social,
-                        'mes': mes,
-                        'ano': ano,
-                        'total_notas': len(competencia['notas']),
-                        'faturamento_total': float(faturamento_total)
-                    })
-                    
-                    resultados.append({
-                        'arquivo': arquivo_data['nome_arquivo'],
-                        'competencia': f"{mes:02d}/{ano}",
-                        'status': 'sucesso',
-                        'mensagem': f"{competencia['total_notas']} notas importadas",
-                        'faturamento_total': faturamento_total
-                    })
-                
-            except Exception as e:
-                current_app.logger.error(f"Erro ao consolidar arquivo {arquivo_data.get('nome_arquivo')}: {str(e)}", exc_info=True)
-                resultados.append({
-                    'arquivo': arquivo_data.get('nome_arquivo', 'desconhecido'),
-                    'status': 'erro',
-                    'mensagem': str(e)
-                })
-                # Não faz rollback ainda, continua processando outros arquivos
-        
-        # Commit de tudo de uma vez
+        ids_temporarios = data.get('ids_temporarios') or [
+            arquivo.get('id_temporario') for arquivo in data.get('arquivos', [])
+            if isinstance(arquivo, dict)
+        ]
+        ids_temporarios = [str(id_temporario) for id_temporario in ids_temporarios if id_temporario]
+        if not ids_temporarios:
+            return jsonify({'erro': 'Nenhum arquivo do preview foi informado'}), 400
+        
+        substituicoes = data.get('substituicoes', {})  # Dict: {id_temporario: {mes_ano: bool}}
+        
+        if request.args.get('assincrono') in ('1', 'true'):
+            nao_encontrados = previews_nao_encontrados(ids_temporarios, current_user.id)
+            if nao_encontrados:
+                raise PreviewNaoEncontrado(nao_encontrados)
+            job = submeter_job_consolidacao(current_user.id, ids_temporarios, substituicoes)
+            return jsonify(job.to_dict()), 202
+        
+        # Consolida todos os arquivos em lote e grava tudo em um único commit,
+        # junto com a remoção dos previews usados
+        arquivos_para_consolidar = carregar_previews(ids_temporarios, current_user.id)
+        resultados = consolidar_faturamento_lote(arquivos_para_consolidar, substituicoes, current_user.id)
+        descartar_previews(arquivos_para_consolidar)
         db.session.commit()
         
-        # Conta sucessos e erros
-        total_sucesso = len([r for r in resultados if r['status'] == 'sucesso'])
-        total_erro = len([r for r in resultados if r['status'] == 'erro'])
-        total_ignorado = len([r for r in resultados if r['status'] == 'ignorado'])
+        return jsonify(resumir_consolidacao(resultados)), 200
         
+    except PreviewNaoEncontrado as e:
+        db.session.rollback()
         return jsonify({
-            'resultados': resultados,
-            'resumo': {
-                'total_processado': len(resultados),
-                'sucesso': total_sucesso,
-                'erro': total_erro,
-                'ignorado': total_ignorado
-            }
-        }), 200
+            'erro': '❌ O preview de um ou mais arquivos expirou ou não foi encontrado.\n\n💡 Solução: Envie os arquivos novamente para gerar um novo preview.',
+            'ids_nao_encontrados': e.ids
+        }), 404
         
     except Exception as e:
         db.session.rollback()
@@ -2067,90 +1739,11 @@ def buscar_cnae(current_user):
         else:
             current_app.logger.info(f"[CNAE] Busca por descrição: {termo_busca}")
             
-            # Normalizar o termo de busca (remove acentos)
-            termo_normalizado = normalizar_texto(termo_busca).lower()
-            
-            current_app.logger.info(f"[CNAE] Termo normalizado: {termo_normalizado}")
-            
-            # Extrai radical do termo para buscar palavras relacionadas
-            radical_termo = extrair_radical(termo_normalizado)
-            current_app.logger.info(f"[CNAE] Radical extraído: {radical_termo}")
-            
-            # Busca todos os CNAEs e calcula score de relevância
-            todos_cnaes = CNAE.query.all()
-            
-            resultados_com_score = []
-            
-            for cnae in todos_cnaes:
-                score = 0
-                descricao_norm = normalizar_texto(cnae.descricao or '').lower()
-                desc_grupo_norm = normalizar_texto(cnae.descricao_grupo or '').lower()
-                desc_divisao_norm = normalizar_texto(cnae.descricao_divisao or '').lower()
-                desc_secao_norm = normalizar_texto(cnae.descricao_secao or '').lower()
-                
-                # 1. MATCH EXATO (score mais alto: 100)
-                if termo_normalizado in descricao_norm:
-                    score = 100
-                elif termo_normalizado in desc_grupo_norm:
-                    score = 95
-                elif termo_normalizado in desc_divisao_norm:
-                    score = 90
-                elif termo_normalizado in desc_secao_norm:
-                    score = 85
-                
-                # 2. MATCH POR RADICAL (score alto: 80-70)
-                elif radical_termo and len(radical_termo) >= 4:
-                    # Verifica se o radical está presente
-                    if radical_termo in descricao_norm:
-                        score = 80
-                    elif radical_termo in desc_grupo_norm:
-                        score = 75
-                    elif radical_termo in desc_divisao_norm or radical_termo in desc_secao_norm:
-                        score = 70
-                
-                # 3. BUSCA POR PALAVRAS INDIVIDUAIS (score médio: 60-50)
-                if score == 0:
-                    palavras_termo = [p for p in termo_normalizado.split() if len(p) >= 3]
-                    for palavra in palavras_termo:
-                        radical_palavra = extrair_radical(palavra)
-                        if palavra in descricao_norm or (radical_palavra and radical_palavra in descricao_norm):
-                            score = max(score, 60)
-                        elif palavra in desc_grupo_norm or (radical_palavra and radical_palavra in desc_grupo_norm):
-                            score = max(score, 55)
-                        elif palavra in desc_divisao_norm or palavra in desc_secao_norm:
-                            score = max(score, 50)
-                
-                # 4. FUZZY MATCHING - SIMILARIDADE (score baixo: 40-30)
-                if score == 0 and len(termo_normalizado) >= 5:
-                    # Calcula similaridade com as palavras da descrição
-                    palavras_desc = descricao_norm.split()
-                    max_similaridade = 0
-                    
-                    for palavra_desc in palavras_desc:
-                        if len(palavra_desc) >= 4:
-                            similaridade = calcular_similaridade(termo_normalizado, palavra_desc)
-                            max_similaridade = max(max_similaridade, similaridade)
-                            
-                            # Similaridade alta (80%+) - provavelmente erro de digitação
-                            if similaridade >= 80:
-                                score = 40
-                                break
-                            # Similaridade média (70%+) - palavras parecidas
-                            elif similaridade >= 70:
-                                score = max(score, 35)
-                            # Similaridade razoável (60%+)
-                            elif similaridade >= 60:
-                                score = max(score, 30)
-                
-                # Se teve algum match, adiciona aos resultados
-                if score > 0:
-                    resultados_com_score.append((cnae, score))
-            
-            # Ordena por score (maior primeiro) e depois por código
-            resultados_com_score.sort(key=lambda x: (-x[1], x[0].codigo))
+            # Busca no índice em memória (descrições já normalizadas e indexadas)
+            resultados_com_score = buscar_cnaes_por_descricao(termo_busca, limite)
             
-            # Pega apenas os CNAEs (remove o score) limitando ao número solicitado
-            resultados = [cnae for cnae, score in resultados_com_score[:limite]]
+            # Pega apenas os CNAEs (remove o score)
+            resultados = [cnae for cnae, score in resultados_com_score]
             
             current_app.logger.info(f"[CNAE] Top 5 scores: {[(c.codigo, s) for c, s in resultados_com_score[:5]]}")
         
@@ -2499,51 +2092,15 @@ def criar_contrato(current_user):
                 socios_atual_descricao = ""
                 
                 try:
-                    socios_db = Socio.query.filter_by(empresa_id=data['empresa_id']).all()
+                    socios_db = carregar_socios_empresa(data['empresa_id'])
                     current_app.logger.info(f"[CONTRATO] Buscando sócios para empresa_id={data['empresa_id']}, encontrados: {len(socios_db)}")
                     
                     for socio in socios_db:
-                        cliente_socio = Cliente.query.get(socio.socio_id)
-                        if cliente_socio:
-                            # Monta endereço completo do sócio
-                            endereco_parts = []
-                            if cliente_socio.logradouro:
-                                endereco_parts.append(cliente_socio.logradouro)
-                            if cliente_socio.numero:
-                                endereco_parts.append(cliente_socio.numero)
-                            if cliente_socio.complemento:
-                                endereco_parts.append(cliente_socio.complemento)
-                            if cliente_socio.bairro:
-                                endereco_parts.append(cliente_socio.bairro)
-                            if cliente_socio.municipio:
-                                endereco_parts.append(cliente_socio.municipio)
-                            if cliente_socio.uf:
-                                endereco_parts.append(cliente_socio.uf)
-                            if cliente_socio.cep:
-                                endereco_parts.append(f"CEP {cliente_socio.cep}")
-                            
-                            endereco_completo = ", ".join(endereco_parts) if endereco_parts else ""
-                            
-                            socios_existentes.append({
-                                'id': socio.id,
-                                'cliente_id': cliente_socio.id,
-                                'nome': cliente_socio.nome_completo,
-                                'cpf': cliente_socio.cpf,
-                                'rg': cliente_socio.rg,
-                                'email': cliente_socio.email,
-                                'telefone': cliente_socio.telefone1,
-                                'endereco_completo': endereco_completo,
-                                'participacao_percentual': float(socio.percentual_participacao or 0),
-                                'cargo': socio.cargo
-                            })
-                            
-                            # Calcula capital social (R$ 1000 por 1% como placeholder)
-                            valor_participacao = (socio.percentual_participacao or 0) * 1000
-                            capital_social_atual += valor_participacao
-                            
-                            current_app.logger.info(f"[CONTRATO] Sócio encontrado: {cliente_socio.nome_completo} ({cliente_socio.cpf}) - {socio.percentual_participacao}%")
-                        else:
-                            current_app.logger.warning(f"[CONTRATO] Cliente não encontrado para socio_id: {socio.socio_id}")
+                        socios_existentes.append(socio.to_dict())
+                        
+                        # Calcula capital social (R$ 1000 por 1% como placeholder)
+                        valor_participacao = (socio.percentual_participacao or 0) * 1000
+                        capital_social_atual += valor_participacao
                     
                     # Gera descrição dos sócios para o contrato
                     socios_descricao = []
@@ -2853,6 +2410,29 @@ def gerar_pdf_contrato_endpoint(current_user, contrato_id):
         return jsonify({"erro": "Erro ao gerar PDF"}), 500
 
 
+@api_bp.route('/clientes/buscar', methods=['GET'])
+@token_required
+def buscar_clientes_texto(current_user):
+    """
+    Busca de clientes enquanto o usuário digita (nome, nome fantasia,
+    CNPJ/CPF ou município), por prefixo e ordenada por relevância
+    Parâmetros de query:
+    - q: Texto digitado
+    - limite: Número máximo de resultados (padrão: 10, máximo: 50)
+    - tipo_pessoa: PF ou PJ (opcional)
+    """
+    try:
+        limite = int(request.args.get('limite', 10))
+    except ValueError:
+        return jsonify({"erro": "limite deve ser um número inteiro"}), 400
+
+    resultados = buscar_clientes(
+        request.args.get('q', ''),
+        limite=limite,
+        tipo_pessoa=(request.args.get('tipo_pessoa') or '').upper() or None
+    )
+    return jsonify({"resultados": resultados, "total": len(resultados)}), 200
+
 @api_bp.route('/clientes/buscar-cpf', methods=['GET'])
 @token_required
 def buscar_cliente_por_cpf(current_user):
@@ -2884,10 +2464,7 @@ def buscar_cliente_por_cpf(current_user):
         
         # Buscar clientes por CPF (busca exata)
         clientes = Cliente.query.filter(
-            func.replace(
-                func.replace(Cliente.cpf, '.', ''),
-                '-', ''
-            ) == cpf_limpo
+            Cliente.cpf_digitos == cpf_limpo
         ).limit(limite).all()
         
         # Converter para formato de resposta
@@ -2953,56 +2530,11 @@ def buscar_socios_empresa(current_user, empresa_id):
         if empresa.tipo_pessoa != 'PJ':
             return jsonify({"erro": "Cliente deve ser uma pessoa jurídica"}), 400
         
-        # Busca sócios relacionados à empresa
-        # Assumindo que existe uma tabela de relacionamento ou campo que indica sócios
-        # Por enquanto, vou buscar todos os clientes PF que podem ser sócios
-        # Em um sistema real, você teria uma tabela específica de sócios
-        
-        # Busca sócios na tabela Socio
+        # Busca sócios na tabela Socio (uma consulta, com os dados dos clientes)
         socios = []
         try:
-            socios_db = Socio.query.filter_by(empresa_id=empresa_id).all()
-            current_app.logger.info(f"[EMPRESA] Buscando sócios para empresa_id={empresa_id}, encontrados: {len(socios_db)}")
-            
-            for socio in socios_db:
-                # Busca dados completos do cliente
-                cliente_socio = Cliente.query.get(socio.socio_id)
-                if cliente_socio:
-                    # Monta endereço completo do sócio
-                    endereco_parts = []
-                    if cliente_socio.logradouro:
-                        endereco_parts.append(cliente_socio.logradouro)
-                    if cliente_socio.numero:
-                        endereco_parts.append(cliente_socio.numero)
-                    if cliente_socio.complemento:
-                        endereco_parts.append(cliente_socio.complemento)
-                    if cliente_socio.bairro:
-                        endereco_parts.append(cliente_socio.bairro)
-                    if cliente_socio.municipio:
-                        endereco_parts.append(cliente_socio.municipio)
-                    if cliente_socio.uf:
-                        endereco_parts.append(cliente_socio.uf)
-                    if cliente_socio.cep:
-                        endereco_parts.append(f"CEP {cliente_socio.cep}")
-                    
-                    endereco_completo = ", ".join(endereco_parts) if endereco_parts else ""
-                    
-                    socios.append({
-                        'id': socio.id,
-                        'cliente_id': cliente_socio.id,
-                        'nome': cliente_socio.nome_completo,
-                        'cpf': cliente_socio.cpf,
-                        'rg': cliente_socio.rg,
-                        'email': cliente_socio.email,
-                        'telefone': cliente_socio.telefone1,
-                        'endereco_completo': endereco_completo,
-                        'participacao_percentual': float(socio.percentual_participacao or 0),
-                        'data_entrada': socio.data_entrada,
-                        'cargo': socio.cargo
-                    })
-                    current_app.logger.info(f"[EMPRESA] Sócio encontrado: {cliente_socio.nome_completo} ({cliente_socio.cpf})")
-                else:
-                    current_app.logger.warning(f"[EMPRESA] Cliente não encontrado para socio_id: {socio.socio_id}")
+            socios = [socio.to_dict() for socio in carregar_socios_empresa(empresa_id)]
+            current_app.logger.info(f"[EMPRESA] Buscando sócios para empresa_id={empresa_id}, encontrados: {len(socios)}")
         except Exception as e:
             current_app.logger.error(f"[EMPRESA] Erro ao buscar sócios: {e}")
             socios = []
@@ -3074,47 +2606,8 @@ def buscar_dados_completos_empresa(current_user, empresa_id):
         # Busca sócios existentes
         socios_existentes = []
         try:
-            socios_db = Socio.query.filter_by(empresa_id=empresa_id).all()
-            current_app.logger.info(f"[EMPRESA] Buscando sócios para empresa_id={empresa_id}, encontrados: {len(socios_db)}")
-            
-            for socio in socios_db:
-                cliente_socio = Cliente.query.get(socio.socio_id)
-                if cliente_socio:
-                    # Monta endereço completo do sócio
-                    endereco_parts = []
-                    if cliente_socio.logradouro:
-                        endereco_parts.append(cliente_socio.logradouro)
-                    if cliente_socio.numero:
-                        endereco_parts.append(cliente_socio.numero)
-                    if cliente_socio.complemento:
-                        endereco_parts.append(cliente_socio.complemento)
-                    if cliente_socio.bairro:
-                        endereco_parts.append(cliente_socio.bairro)
-                    if cliente_socio.municipio:
-                        endereco_parts.append(cliente_socio.municipio)
-                    if cliente_socio.uf:
-                        endereco_parts.append(cliente_socio.uf)
-                    if cliente_socio.cep:
-                        endereco_parts.append(f"CEP {cliente_socio.cep}")
-                    
-                    endereco_completo = ", ".join(endereco_parts) if endereco_parts else ""
-                    
-                    socios_existentes.append({
-                        'id': socio.id,
-                        'cliente_id': cliente_socio.id,
-                        'nome': cliente_socio.nome_completo,
-                        'cpf': cliente_socio.cpf,
-                        'rg': cliente_socio.rg,
-                        'email': cliente_socio.email,
-                        'telefone': cliente_socio.telefone1,
-                        'endereco_completo': endereco_completo,
-                        'participacao_percentual': float(socio.percentual_participacao or 0),
-                        'data_entrada': socio.data_entrada,
-                        'cargo': socio.cargo
-                    })
-                    current_app.logger.info(f"[EMPRESA] Sócio encontrado: {cliente_socio.nome_completo} ({cliente_socio.cpf})")
-                else:
-                    current_app.logger.warning(f"[EMPRESA] Cliente não encontrado para socio_id: {socio.socio_id}")
+            socios_existentes = [socio.to_dict() for socio in carregar_socios_empresa(empresa_id)]
+            current_app.logger.info(f"[EMPRESA] Buscando sócios para empresa_id={empresa_id}, encontrados: {len(socios_existentes)}")
         except Exception as e:
             current_app.logger.error(f"[EMPRESA] Erro ao buscar sócios: {e}")
         
@@ -3136,7 +2629,7 @@ def buscar_dados_completos_empresa(current_user, empresa_id):
                 'nome': socio['nome'],
                 'percentual': socio['participacao_percentual'],
                 'quotas': int((socio['participacao_percentual'] / 100) * (capital_social_atual or 1000)),
-                'valor': socio['valor_participacao']
+                'valor': socio.get('valor_participacao', 0)
             })
         
         return jsonify({
@@ -3205,49 +2698,14 @@ def criar_contrato_alteracao_socios(current_user):
         socios_atual_descricao = ""
         
         try:
-            socios_db = Socio.query.filter_by(empresa_id=data['empresa_id']).all()
+            socios_db = carregar_socios_empresa(data['empresa_id'])
             current_app.logger.info(f"[CONTRATO] Buscando sócios para empresa_id={data['empresa_id']}, encontrados: {len(socios_db)}")
             
             for socio in socios_db:
-                cliente_socio = Cliente.query.get(socio.socio_id)
-                if cliente_socio:
-                    # Monta endereço completo do sócio
-                    endereco_parts = []
-                    if cliente_socio.logradouro:
-                        endereco_parts.append(cliente_socio.logradouro)
-                    if cliente_socio.numero:
-                        endereco_parts.append(cliente_socio.numero)
-                    if cliente_socio.complemento:
-                        endereco_parts.append(cliente_socio.complemento)
-                    if cliente_socio.bairro:
-                        endereco_parts.append(cliente_socio.bairro)
-                    if cliente_socio.municipio:
-                        endereco_parts.append(cliente_socio.municipio)
-                    if cliente_socio.uf:
-                        endereco_parts.append(cliente_socio.uf)
-                    if cliente_socio.cep:
-                        endereco_parts.append(f"CEP {cliente_socio.cep}")
-                    
-                    endereco_completo = ", ".join(endereco_parts) if endereco_parts else ""
-                    
-                    socios_existentes.append({
-                        'id': socio.id,
-                        'cliente_id': cliente_socio.id,
-                        'nome': cliente_socio.nome_completo,
-                        'cpf': cliente_socio.cpf,
-                        'rg': cliente_socio.rg,
-                        'email': cliente_socio.email,
-                        'telefone': cliente_socio.telefone1,
-                        'endereco_completo': endereco_completo,
-                        'participacao_percentual': float(socio.percentual_participacao or 0),
-                        'cargo': socio.cargo
-                    })
-                    # Calcula valor baseado no percentual (assumindo capital social padrão)
-                    valor_participacao = (socio.percentual_participacao or 0) * 1000  # R$ 1000 por 1%
-                    capital_social_atual += valor_participacao
-                    current_app.logger.info(f"[CONTRATO] Sócio encontrado: {cliente_socio.nome_completo} ({cliente_socio.cpf}) - {socio.percentual_participacao}%")
-                else:
-                    current_app.logger.warning(f"[CONTRATO] Cliente não encontrado para socio_id: {socio.socio_id}")
+                socios_existentes.append(socio.to_dict())
+                # Calcula valor baseado no percentual (assumindo capital social padrão)
+                valor_participacao = (socio.percentual_participacao or 0) * 1000  # R$ 1000 por 1%
+                capital_social_atual += valor_participacao
             
             # Gera descrição dos sócios atuais
             socios_descricao = []
@@ -3273,12 +2731,7 @@ def criar_contrato_alteracao_socios(current_user):
         for socio_sai in alteracoes_socios.get('socios_saem', []):
             if socio_sai.get('cpf'):
                 # Busca dados do sócio pelo CPF
-                cliente_socio = Cliente.query.filter(
-                    func.replace(
-                        func.replace(Cliente.cpf, '.', ''),
-                        '-', ''
-                    ) == limpar_documento(socio_sai['cpf'])
-                ).first()
+                cliente_socio = resolver_cliente_por_cpf(socio_sai['cpf'])
                 
                 if cliente_socio:
                     socios_envolvidos.append({
@@ -3299,12 +2752,7 @@ Cláusula {len(alteracoes_conteudo) + 1}° - O SÓCIO {cliente_socio.nome_comple
         for socio_entra in alteracoes_socios.get('socios_entram', []):
             if socio_entra.get('cpf'):
                 # Busca dados do sócio pelo CPF
-                cliente_socio = Cliente.query.filter(
-                    func.replace(
-                        func.replace(Cliente.cpf, '.', ''),
-                        '-', ''
-                    ) == limpar_documento(socio_entra['cpf'])
-                ).first()
+                cliente_socio = resolver_cliente_por_cpf(socio_entra['cpf'])
                 
                 if cliente_socio:
                     socios_envolvidos.append({
@@ -3368,12 +2816,7 @@ Cláusula {len(alteracoes_conteudo) + 1}° - Admitir-se como sócio da sociedade
         # Adiciona novos sócios
         for socio_entra in alteracoes_socios.get('socios_entram', []):
             if socio_entra.get('cpf'):
-                cliente_socio = Cliente.query.filter(
-                    func.replace(
-                        func.replace(Cliente.cpf, '.', ''),
-                        '-', ''
-                    ) == limpar_documento(socio_entra['cpf'])
-                ).first()
+                cliente_socio = resolver_cliente_por_cpf(socio_entra['cpf'])
                 
                 if cliente_socio:
                     distribuicao_capital_tabela.append({
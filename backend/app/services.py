@@ -1,36 +1,116 @@
 # d:\Dev\Sistema-Contabil\backend\app\services.py
 
+import uuid
 import pandas as pd
 from decimal import Decimal
 from datetime import datetime, timedelta
-from .models import db, Cliente, Processamento, FaturamentoDetalhe
-from sqlalchemy import func, and_, or_
-
-def _filtro_periodo(ano_col, mes_col, data_inicial, data_final):
+from .models import db, Cliente, Processamento, FaturamentoDetalhe, ResumoMensalCliente
+from .validators import limpar_documento
+from .audit import montar_registro_log, registrar_logs_em_lote
+from .lixeira import salvar_na_lixeira
+from .simples_nacional import aliquota_efetiva, resolver_anexo_cliente, resolver_anexos_clientes
+from flask import current_app
+from sqlalchemy import func, insert
+
+# Tamanho máximo de cada lote de parâmetros em consultas IN
+# (mantém a consulta abaixo do limite de variáveis do SQLite)
+TAMANHO_LOTE_IN = 500
+
+# Regimes tributados por calcular_impostos (ver tributado_pelo_simples)
+REGIMES_FORA_DO_SIMPLES = ('Lucro Presumido', 'Lucro Real')
+
+def _filtro_periodo(competencia_col, data_inicial, data_final):
     """
-    Cria um filtro de período compatível com SQLite e PostgreSQL.
-    Compara ano e mês separadamente ao invés de usar make_date.
+    Cria um filtro de período sobre a coluna inteira de competência
+    (ano * 12 + mes - 1): uma faixa simples, que usa o índice (cliente_id, competencia).
     """
-    ano_inicial = data_inicial.year
-    mes_inicial = data_inicial.month
-    ano_final = data_final.year
-    mes_final = data_final.month
-    
-    # Caso simples: mesmo ano
-    if ano_inicial == ano_final:
-        return and_(
-            ano_col == ano_inicial,
-            mes_col >= mes_inicial,
-            mes_col <= mes_final
-        )
-    
-    # Caso complexo: anos diferentes
-    return or_(
-        and_(ano_col == ano_inicial, mes_col >= mes_inicial),
-        and_(ano_col > ano_inicial, ano_col < ano_final),
-        and_(ano_col == ano_final, mes_col <= mes_final)
+    return competencia_col.between(
+        _indice_competencia(data_inicial.year, data_inicial.month),
+        _indice_competencia(data_final.year, data_final.month)
     )
 
+def resolver_clientes_por_cnpj(cnpjs):
+    """
+    Resolve uma lista de CNPJs (com ou sem formatação) para clientes usando a
+    coluna indexada cnpj_digitos, com uma consulta IN por lote.
+
+    Returns:
+        dict: {cnpj_apenas_digitos: Cliente} somente para os CNPJs encontrados
+    """
+    digitos = sorted({limpar_documento(cnpj) for cnpj in cnpjs if cnpj})
+    clientes = {}
+    for i in range(0, len(digitos), TAMANHO_LOTE_IN):
+        lote = digitos[i:i + TAMANHO_LOTE_IN]
+        for cliente in Cliente.query.filter(Cliente.cnpj_digitos.in_(lote)).all():
+            clientes[cliente.cnpj_digitos] = cliente
+    return clientes
+
+def resolver_cliente_por_cnpj(cnpj):
+    """Busca um único cliente pelo CNPJ (com ou sem formatação)"""
+    return resolver_clientes_por_cnpj([cnpj]).get(limpar_documento(cnpj)) if cnpj else None
+
+def resolver_cliente_por_cpf(cpf):
+    """Busca um único cliente pelo CPF (com ou sem formatação)"""
+    if not cpf:
+        return None
+    return Cliente.query.filter(Cliente.cpf_digitos == limpar_documento(cpf)).first()
+
+def _indice_competencia(ano, mes):
+    """Converte (ano, mês) em um índice linear de meses (jan/ano 0 = 0)."""
+    return int(ano) * 12 + (int(mes) - 1)
+
+def _competencia_do_indice(indice):
+    """Converte um índice linear de meses de volta para (ano, mês)."""
+    return indice // 12, indice % 12 + 1
+
+def calcular_rbt12_janela(totais_mensais, competencias):
+    """
+    Calcula o RBT12 e o RBT12 futuro de cada competência usando uma janela
+    deslizante de 12 meses sobre os totais mensais já carregados em memória.
+
+    - RBT12 do mês M: soma dos 12 meses anteriores a M (M-12 até M-1)
+    - RBT12 futuro do mês M: soma de M-11 até M (inclui o próprio mês)
+
+    Args:
+        totais_mensais (dict): {indice_competencia: Decimal} com ao menos os
+            12 meses anteriores à primeira competência
+        competencias (list): Lista de tuplas (ano, mes)
+
+    Returns:
+        dict: {(ano, mes): (rbt12, rbt12_futuro)}
+    """
+    if not competencias:
+        return {}
+
+    indices = {(ano, mes): _indice_competencia(ano, mes) for ano, mes in competencias}
+    inicio = min(indices.values()) - 12
+    fim = max(indices.values())
+
+    # Percorre os meses em ordem mantendo a soma da janela [k-12, k-1]
+    rbt12_por_indice = {}
+    janela = Decimal('0')
+    for k in range(inicio, fim + 1):
+        if k - 12 >= inicio:
+            rbt12_por_indice[k] = janela
+            janela -= totais_mensais.get(k - 12, Decimal('0'))
+        janela += totais_mensais.get(k, Decimal('0'))
+    # Após o último mês, a janela corresponde ao RBT12 futuro de 'fim'
+    rbt12_por_indice[fim + 1] = janela
+
+    # O RBT12 futuro de M é o RBT12 de M+1
+    return {
+        competencia: (rbt12_por_indice[k], rbt12_por_indice[k + 1])
+        for competencia, k in indices.items()
+    }
+
+def tributado_pelo_simples(regime_tributario):
+    """
+    Se o regime é tributado pelo Simples Nacional (anexo e RBT12). Só os
+    regimes de REGIMES_FORA_DO_SIMPLES usam calcular_impostos; os demais,
+    inclusive clientes sem regime informado, seguem o Simples Nacional
+    """
+    return regime_tributario not in REGIMES_FORA_DO_SIMPLES
+
 def calcular_impostos(faturamento, regime_tributario):
     """Calcula o imposto com base no regime tributário (simplificado)."""
     if regime_tributario == 'Lucro Presumido':
@@ -39,63 +119,435 @@ def calcular_impostos(faturamento, regime_tributario):
         return faturamento * 0.34  # Exemplo de alíquota
     return 0
 
-def calcular_imposto_simples_nacional(cliente_id, mes_calculo, ano_calculo, faturamento_mes_atual, rbt12_fornecido=None):
+def calcular_imposto_simples_nacional(cliente_id, mes_calculo, ano_calculo, faturamento_mes_atual, rbt12_fornecido=None, anexo=None):
     """
     Calcula o imposto do Simples Nacional com base na receita bruta dos últimos 12 meses (RBT12).
-    Pode receber um RBT12 pré-calculado para cenários específicos (como cálculo de alíquota futura).
+    Pode receber um RBT12 pré-calculado para cenários específicos (como cálculo de alíquota futura)
+    e o anexo já resolvido (por padrão, o anexo do CNAE principal do cliente).
     """
     if rbt12_fornecido is not None:
         rbt12 = Decimal(rbt12_fornecido)
     else:
-        # 1. Definir o período de 12 meses anteriores se não for fornecido
-        # data_final é o último dia do mês anterior ao mês de cálculo.
-        data_final = datetime(ano_calculo, mes_calculo, 1) - timedelta(days=1)
-        
-        # data_inicial é o primeiro dia do mesmo mês, mas no ano anterior.
-        # Evita usar replace(year=) para não ter problemas com anos bissextos (29 fev)
-        ano_inicial_calc = ano_calculo - 1
-        mes_inicial_calc = mes_calculo
-        data_inicial = datetime(ano_inicial_calc, mes_inicial_calc, 1)
+        # 1. Período de 12 meses anteriores ao mês de cálculo (M-12 até M-1)
+        indice_calculo = _indice_competencia(ano_calculo, mes_calculo)
 
         # 2. Consultar o faturamento acumulado (RBT12)
         resultado = db.session.query(
             func.sum(Processamento.faturamento_total)
         ).filter(
             Processamento.cliente_id == cliente_id,
-            _filtro_periodo(Processamento.ano, Processamento.mes, data_inicial, data_final)
+            Processamento.competencia.between(indice_calculo - 12, indice_calculo - 1)
         ).scalar()
 
         rbt12 = Decimal(resultado or 0)
 
-    # 3. Definir as faixas de alíquota do Anexo III (exemplo)
-    faixas = [
-        {"limite": Decimal("180000.00"), "aliquota": Decimal("0.06"), "deducao": Decimal("0")},
-        {"limite": Decimal("360000.00"), "aliquota": Decimal("0.112"), "deducao": Decimal("9360.00")},
-        {"limite": Decimal("720000.00"), "aliquota": Decimal("0.135"), "deducao": Decimal("17640.00")},
-        {"limite": Decimal("1800000.00"), "aliquota": Decimal("0.16"), "deducao": Decimal("35640.00")},
-        {"limite": Decimal("3600000.00"), "aliquota": Decimal("0.21"), "deducao": Decimal("125640.00")},
-        {"limite": Decimal("4800000.00"), "aliquota": Decimal("0.33"), "deducao": Decimal("648000.00")}
-    ]
-
-    # 4. Encontrar a faixa correta e calcular a alíquota efetiva
-    aliquota_efetiva = Decimal("0.06") # Alíquota mínima
-    for faixa in faixas:
-        if rbt12 <= faixa["limite"]:
-            aliquota_nominal = faixa["aliquota"]
-            parcela_a_deduzir = faixa["deducao"]
-            if rbt12 > 0:
-                aliquota_efetiva = ((rbt12 * aliquota_nominal) - parcela_a_deduzir) / rbt12
-            else: # Se não houver faturamento anterior, usa a alíquota da primeira faixa
-                aliquota_efetiva = faixas[0]['aliquota']
-            break
-    else: # Se RBT12 for maior que o limite máximo
-        ultima_faixa = faixas[-1]
-        aliquota_efetiva = ((rbt12 * ultima_faixa["aliquota"]) - ultima_faixa["deducao"]) / rbt12
-
-    # 5. Calcular o imposto do mês
-    imposto_do_mes = Decimal(faturamento_mes_atual) * aliquota_efetiva
+    # 3. Alíquota efetiva pela tabela do anexo do cliente
+    if anexo is None:
+        anexo = resolver_anexo_cliente(cliente_id)
+    aliquota = aliquota_efetiva(rbt12, anexo)
+
+    # 4. Calcular o imposto do mês
+    imposto_do_mes = Decimal(faturamento_mes_atual) * aliquota
     return float(imposto_do_mes.quantize(Decimal('0.01')))
 
+def carregar_competencias_existentes(cliente_id, competencias):
+    """
+    Carrega os processamentos já existentes de um cliente para um conjunto de
+    competências e os números de NF já importados em cada um, usando uma
+    consulta para os processamentos e outra (pelo índice processamento_id +
+    numero_nf) para as notas.
+
+    Args:
+        cliente_id (int): ID do cliente
+        competencias (list): Lista de tuplas (ano, mes)
+
+    Returns:
+        dict: {(ano, mes): (Processamento, set(numeros_nf))} apenas para as
+            competências que já existem
+    """
+    competencias = set(competencias)
+    if not competencias:
+        return {}
+
+    processamentos = Processamento.query.filter(
+        Processamento.cliente_id == cliente_id,
+        Processamento.competencia.in_([_indice_competencia(ano, mes) for ano, mes in competencias])
+    ).all()
+    if not processamentos:
+        return {}
+
+    numeros_por_processamento = {processamento.id: set() for processamento in processamentos}
+    linhas = db.session.query(
+        FaturamentoDetalhe.processamento_id,
+        FaturamentoDetalhe.numero_nf
+    ).filter(
+        FaturamentoDetalhe.processamento_id.in_(list(numeros_por_processamento)),
+        FaturamentoDetalhe.numero_nf.isnot(None)
+    ).all()
+    for processamento_id, numero_nf in linhas:
+        numeros_por_processamento[processamento_id].add(numero_nf)
+
+    return {
+        (processamento.ano, processamento.mes): (processamento, numeros_por_processamento[processamento.id])
+        for processamento in processamentos
+    }
+
+def verificar_preview_no_banco(resultado):
+    """
+    Completa o resultado de processar_multiplos_arquivos com os dados do banco:
+    cliente de cada arquivo, competências já existentes e notas duplicadas.
+    Também gera o id_temporario de cada arquivo.
+
+    Args:
+        resultado (dict): Saída de csv_parser.processar_multiplos_arquivos (alterada no lugar)
+
+    Returns:
+        dict: O próprio resultado
+    """
+    # Resolve os clientes de todos os arquivos com uma única consulta
+    # pela coluna indexada cnpj_digitos
+    clientes_por_cnpj = resolver_clientes_por_cnpj([
+        arquivo_result['cnpj']
+        for arquivo_result in resultado['arquivos_processados']
+        if arquivo_result['status'] == 'ok'
+    ])
+
+    # Para cada arquivo processado com sucesso, verifica se o cliente existe
+    # e se a competência já existe no banco
+    for arquivo_result in resultado['arquivos_processados']:
+        if arquivo_result['status'] != 'ok':
+            continue
+
+        cnpj_limpo = limpar_documento(arquivo_result['cnpj'])
+        cliente = clientes_por_cnpj.get(cnpj_limpo)
+
+        if not cliente:
+            arquivo_result['status'] = 'nao_cadastrado'
+            arquivo_result['avisos'].append(
+                f"Cliente com CNPJ {cnpj_limpo} não está cadastrado."
+            )
+            arquivo_result['cliente_info'] = None
+            arquivo_result['precisa_cadastrar'] = True
+            continue
+
+        # Adiciona informações do cliente
+        arquivo_result['cliente_info'] = {
+            'id': cliente.id,
+            'razao_social': cliente.razao_social,
+            'cnpj_formatado': cliente.cnpj
+        }
+
+        # Carrega de uma vez as competências já existentes do cliente e
+        # os números de NF já importados em cada uma
+        existentes = carregar_competencias_existentes(cliente.id, [
+            (competencia['ano'], competencia['mes'])
+            for competencia in arquivo_result['competencias']
+        ])
+
+        # Para cada competência, verifica se já existe no banco
+        for competencia in arquivo_result['competencias']:
+            mes = competencia['mes']
+            ano = competencia['ano']
+
+            processamento_existente, numeros_existentes = existentes.get((ano, mes), (None, set()))
+
+            competencia['ja_existe'] = processamento_existente is not None
+
+            if processamento_existente:
+                arquivo_result['avisos'].append(
+                    f"Competência {mes:02d}/{ano} já existe no sistema"
+                )
+                competencia['faturamento_anterior'] = float(processamento_existente.faturamento_total)
+
+                # Verifica notas duplicadas (NF já importada para este cliente e competência)
+                notas_duplicadas = [
+                    {
+                        'numero_nf': nota.get('numero_nf', ''),
+                        'valor': nota['valor'],
+                        'tomador': nota.get('razao_social_tomador', '')
+                    }
+                    for nota in competencia['notas']
+                    if nota.get('numero_nf') and str(nota['numero_nf']) in numeros_existentes
+                ]
+
+                if notas_duplicadas:
+                    competencia['notas_duplicadas'] = notas_duplicadas
+                    competencia['total_duplicadas'] = len(notas_duplicadas)
+                    arquivo_result['avisos'].append(
+                        f"⚠️ {len(notas_duplicadas)} nota(s) duplicada(s) encontrada(s) em {mes:02d}/{ano}"
+                    )
+                else:
+                    competencia['notas_duplicadas'] = []
+                    competencia['total_duplicadas'] = 0
+            else:
+                competencia['faturamento_anterior'] = 0
+                competencia['notas_duplicadas'] = []
+                competencia['total_duplicadas'] = 0
+
+    # Gera IDs temporários para cada arquivo
+    for arquivo_result in resultado['arquivos_processados']:
+        arquivo_result['id_temporario'] = str(uuid.uuid4())
+
+    return resultado
+
+def _descricao_nota(nota):
+    """Monta a descrição do FaturamentoDetalhe de uma nota importada do CSV"""
+    # Inclui número da NF na descrição para verificação de duplicatas
+    numero_nf = nota.get('numero_nf', '')
+    tomador = nota.get('razao_social_tomador', 'Serviço Prestado')
+
+    if numero_nf:
+        return f"NF {numero_nf} - {tomador}"[:200]
+    return tomador[:200]
+
+def consolidar_faturamento_lote(arquivos, substituicoes, usuario_id, ao_progredir=None):
+    """
+    Consolida no banco as competências de vários arquivos do preview em uma
+    única transação.
+
+    As competências de cada cliente são processadas em ordem cronológica e o
+    RBT12 é calculado em memória: os totais mensais dos 12 meses anteriores são
+    carregados uma vez e cada competência consolidada passa a compor o RBT12
+    das seguintes. Processamentos, notas e logs de auditoria são gravados com
+    INSERTs em lote. A função não faz commit; isso fica a cargo de quem chama.
+
+    Args:
+        arquivos (list): Arquivos do preview (cnpj, cliente_info, competencias...),
+            como devolvidos por preview_importacao.carregar_previews
+        substituicoes (dict): {id_temporario: {"mes_ano": bool}} competências a substituir
+        usuario_id (int): Usuário responsável pela importação
+        ao_progredir (callable, optional): Chamada como ao_progredir(indice_arquivo,
+            indice_competencia) antes de cada competência ser processada.
+            Pode lançar uma exceção para interromper a consolidação antes da gravação
+
+    Returns:
+        list: Resultado de cada competência, na ordem em que foram enviadas
+    """
+    resultados = []  # Tuplas (ordem, resultado) para devolver na ordem original
+
+    ids_clientes = {
+        arquivo.get('cliente_info', {}).get('id') for arquivo in arquivos
+        if isinstance(arquivo.get('cliente_info'), dict)
+    }
+    ids_clientes.discard(None)
+    clientes = {cliente.id: cliente for cliente in Cliente.query.filter(Cliente.id.in_(ids_clientes)).all()} if ids_clientes else {}
+    anexos = resolver_anexos_clientes(clientes.keys())
+
+    # 1. Agrupa as competências por cliente
+    competencias_por_cliente = {}
+    for ordem_arquivo, arquivo_data in enumerate(arquivos):
+        try:
+            if not arquivo_data.get('cliente_info'):
+                resultados.append(((ordem_arquivo, -1), {
+                    'arquivo': arquivo_data['nome_arquivo'],
+                    'status': 'erro',
+                    'mensagem': f"Cliente com CNPJ {arquivo_data.get('cnpj')} não está cadastrado"
+                }))
+                continue
+
+            cliente_id = arquivo_data['cliente_info']['id']
+            if cliente_id not in clientes:
+                resultados.append(((ordem_arquivo, -1), {
+                    'arquivo': arquivo_data['nome_arquivo'],
+                    'status': 'erro',
+                    'mensagem': f"Cliente ID {cliente_id} não encontrado"
+                }))
+                continue
+
+            itens = []
+            for ordem_competencia, competencia in enumerate(arquivo_data['competencias']):
+                indice = _indice_competencia(competencia['ano'], competencia['mes'])
+                itens.append((indice, (ordem_arquivo, ordem_competencia), arquivo_data, competencia))
+            competencias_por_cliente.setdefault(cliente_id, []).extend(itens)
+        except Exception as e:
+            current_app.logger.error(f"Erro ao consolidar arquivo {arquivo_data.get('nome_arquivo')}: {str(e)}", exc_info=True)
+            resultados.append(((ordem_arquivo, -1), {
+                'arquivo': arquivo_data.get('nome_arquivo', 'desconhecido'),
+                'status': 'erro',
+                'mensagem': str(e)
+            }))
+
+    substituidos = []  # Processamentos existentes a remover
+    novos = []  # (dados do processamento, notas, dados do log, resultado)
+
+    # 2. Planeja cada cliente em ordem cronológica, com o RBT12 em memória
+    for cliente_id, itens in competencias_por_cliente.items():
+        cliente = clientes[cliente_id]
+        itens.sort(key=lambda item: (item[0], item[1]))
+        indice_inicial = itens[0][0]
+        indice_final = itens[-1][0]
+
+        # Uma consulta traz os 12 meses anteriores (RBT12) e as competências já existentes
+        processamentos = Processamento.query.filter(
+            Processamento.cliente_id == cliente_id,
+            Processamento.competencia.between(indice_inicial - 12, indice_final)
+        ).all()
+
+        totais_mensais = {}
+        existentes = {}
+        for processamento in processamentos:
+            indice = _indice_competencia(processamento.ano, processamento.mes)
+            totais_mensais[indice] = Decimal(processamento.faturamento_total or 0)
+            existentes[indice] = processamento
+
+        planejados = {}  # indice -> item de 'novos' já planejado neste lote
+        for indice, ordem, arquivo_data, competencia in itens:
+            if ao_progredir:
+                ao_progredir(*ordem)
+
+            mes = competencia['mes']
+            ano = competencia['ano']
+
+            if indice in existentes or indice in planejados:
+                # Verifica se deve substituir esta competência específica
+                arquivo_id = arquivo_data.get('id_temporario')
+                deve_substituir = substituicoes.get(arquivo_id, {}).get(f"{mes}_{ano}", False)
+
+                if not deve_substituir:
+                    resultados.append((ordem, {
+                        'arquivo': arquivo_data['nome_arquivo'],
+                        'competencia': f"{mes:02d}/{ano}",
+                        'status': 'ignorado',
+                        'mensagem': 'Competência já existe e não foi marcada para substituição'
+                    }))
+                    continue
+
+                if indice in planejados:
+                    # A mesma competência veio em outro arquivo deste lote: vale a última
+                    anterior = planejados.pop(indice)
+                    novos.remove(anterior)
+                    ordem_anterior, resultado_anterior = anterior[3]
+                    resultados.append((ordem_anterior, {
+                        'arquivo': resultado_anterior['arquivo'],
+                        'competencia': resultado_anterior['competencia'],
+                        'status': 'ignorado',
+                        'mensagem': 'Competência substituída por outro arquivo do mesmo lote'
+                    }))
+                else:
+                    substituidos.append((existentes.pop(indice), cliente))
+
+            faturamento_total = sum(nota['valor'] for nota in competencia['notas'])
+            rbt12 = sum((totais_mensais.get(k, Decimal('0')) for k in range(indice - 12, indice)), Decimal('0'))
+
+            try:
+                if tributado_pelo_simples(cliente.regime_tributario):
+                    imposto_calculado_valor = calcular_imposto_simples_nacional(
+                        cliente_id=cliente_id,
+                        mes_calculo=mes,
+                        ano_calculo=ano,
+                        faturamento_mes_atual=float(faturamento_total),
+                        rbt12_fornecido=rbt12,
+                        anexo=anexos[cliente_id]
+                    )
+                else:
+                    imposto_calculado_valor = calcular_impostos(float(faturamento_total), cliente.regime_tributario)
+                imposto_calculado = Decimal(str(imposto_calculado_valor)).quantize(Decimal('0.01'))
+            except Exception as e:
+                current_app.logger.error(f"Erro ao calcular imposto: {str(e)}", exc_info=True)
+                imposto_calculado = Decimal('0.00')
+
+            # A competência consolidada passa a compor o RBT12 das seguintes
+            totais_mensais[indice] = Decimal(str(faturamento_total)).quantize(Decimal('0.01'))
+
+            item = (
+                {
+                    'cliente_id': cliente_id,
+                    'mes': mes,
+                    'ano': ano,
+                    'faturamento_total': Decimal(str(faturamento_total)),
+                    'imposto_calculado': imposto_calculado,
+                    'nome_arquivo_original': arquivo_data['nome_arquivo']
+                },
+                [
+                    {
+                        'descricao_servico': _descricao_nota(nota),
+                        'valor': Decimal(str(nota['valor'])),
+                        'numero_nf': str(nota.get('numero_nf') or '')[:50] or None
+                    }
+                    for nota in competencia['notas']
+                ],
+                {
+                    'cliente_id': cliente_id,
+                    'cliente_nome': cliente.razao_social,
+                    'mes': mes,
+                    'ano': ano,
+                    'total_notas': len(competencia['notas']),
+                    'faturamento_total': float(faturamento_total)
+                },
+                (ordem, {
+                    'arquivo': arquivo_data['nome_arquivo'],
+                    'competencia': f"{mes:02d}/{ano}",
+                    'status': 'sucesso',
+                    'mensagem': f"{competencia['total_notas']} notas importadas",
+                    'faturamento_total': faturamento_total
+                })
+            )
+            planejados[indice] = item
+            novos.append(item)
+
+    # 3. Grava tudo na sessão atual (sem commit)
+    logs = []
+
+    for processamento_existente, cliente in substituidos:
+        total_notas_antigo = len(processamento_existente.detalhes) if processamento_existente.detalhes else 0
+
+        # Salva o processamento na lixeira antes de substituir
+        salvar_na_lixeira('PROCESSAMENTO', processamento_existente, usuario_id,
+                          'Substituído por nova importação')
+
+        logs.append(montar_registro_log(usuario_id, 'DELETE', 'FATURAMENTO', processamento_existente.id, {
+            'cliente_id': cliente.id,
+            'cliente_nome': cliente.razao_social,
+            'mes': processamento_existente.mes,
+            'ano': processamento_existente.ano,
+            'total_notas': total_notas_antigo,
+            'motivo': 'Substituído por nova importação (salvo na lixeira)'
+        }))
+
+        # As notas (já carregadas acima) são removidas pelo cascade do relacionamento
+        db.session.delete(processamento_existente)
+
+    if substituidos:
+        # Remove os antigos antes de inserir os novos (restrição única cliente/mês/ano)
+        db.session.flush()
+
+    if novos:
+        ids_processamentos = db.session.scalars(
+            insert(Processamento).returning(Processamento.id, sort_by_parameter_order=True),
+            [dados for dados, _, _, _ in novos]
+        ).all()
+
+        detalhes = []
+        for processamento_id, (_, notas, dados_log, resultado) in zip(ids_processamentos, novos):
+            detalhes.extend({**nota, 'processamento_id': processamento_id} for nota in notas)
+            logs.append(montar_registro_log(usuario_id, 'CREATE', 'FATURAMENTO', processamento_id, dados_log))
+            resultados.append(resultado)
+
+        if detalhes:
+            db.session.execute(insert(FaturamentoDetalhe), detalhes)
+
+        # O INSERT em lote não dispara eventos do ORM: o resumo mensal é marcado aqui
+        from .resumo_mensal import marcar_resumo_pendente
+        for dados, _, _, _ in novos:
+            marcar_resumo_pendente(dados['cliente_id'], [(dados['ano'], dados['mes'])])
+
+    registrar_logs_em_lote(logs)
+
+    resultados.sort(key=lambda item: item[0])
+    return [resultado for _, resultado in resultados]
+
+def resumir_consolidacao(resultados):
+    """Monta a resposta do endpoint de consolidação (resultados + resumo por status)"""
+    return {
+        'resultados': resultados,
+        'resumo': {
+            'total_processado': len(resultados),
+            'sucesso': len([r for r in resultados if r['status'] == 'sucesso']),
+            'erro': len([r for r in resultados if r['status'] == 'erro']),
+            'ignorado': len([r for r in resultados if r['status'] == 'ignorado'])
+        }
+    }
+
 def processar_arquivo_faturamento(arquivo, cliente_id, mes, ano):
     """
     Processa um arquivo CSV de faturamento, calcula os impostos e salva no banco.
@@ -116,7 +568,7 @@ def processar_arquivo_faturamento(arquivo, cliente_id, mes, ano):
 
     faturamento_total = Decimal(df['valor'].sum()).quantize(Decimal('0.01'))
 
-    if cliente.regime_tributario == 'Simples Nacional':
+    if tributado_pelo_simples(cliente.regime_tributario):
         imposto_calculado = calcular_imposto_simples_nacional(cliente_id, mes, ano, float(faturamento_total))
     else:
         imposto_calculado = calcular_impostos(float(faturamento_total), cliente.regime_tributario)
@@ -147,186 +599,56 @@ def gerar_relatorio_faturamento(params):
     data_inicio_str = params.get('data_inicio')
     data_fim_str = params.get('data_fim')
 
-    # Seleciona o escopo conforme o tipo de filtro
-    query = Processamento.query.filter(Processamento.cliente_id == cliente_id)
+    from .resumo_mensal import carregar_resumo_cliente
 
-    # Lógica de filtragem por período
+    # Lógica de filtragem por período, sobre o resumo mensal materializado
+    # (RBT12, alíquotas e Fator R já calculados para cada competência)
+    filtro = None
     if tipo_filtro == 'mes' and ano is not None and mes is not None:
-        query = query.filter(
-            Processamento.ano == ano,
-            Processamento.mes == mes
-        )
+        filtro = ResumoMensalCliente.competencia == _indice_competencia(ano, mes)
     elif tipo_filtro in ['ultimos_12_meses', 'ultimos_13_meses']:
         num_meses = 13 if tipo_filtro == 'ultimos_12_meses' else 14
         hoje = datetime.today()
-        # O período começa no primeiro dia de N-1 meses atrás
-        # Ex: hoje é 15/07/2024, ultimos 12 meses começa em 01/08/2023
-        data_inicial = (hoje.replace(day=1) - timedelta(days=1)).replace(day=1) # Vai para o último dia do mês anterior, depois para o primeiro dia
-        for _ in range(num_meses - 1):
-            data_inicial = (data_inicial - timedelta(days=1)).replace(day=1)
-        
-        # O período termina no último dia do mês passado
-        data_final = hoje.replace(day=1) - timedelta(days=1)
-
-        query = query.filter(
-            _filtro_periodo(Processamento.ano, Processamento.mes, data_inicial, data_final)
-        )
+        # O período começa N meses antes do mês atual e termina no mês passado
+        # Ex: hoje é 15/07/2024, ultimos 12 meses vai de 06/2023 a 06/2024
+        indice_final = _indice_competencia(hoje.year, hoje.month) - 1
+        filtro = ResumoMensalCliente.competencia.between(indice_final - num_meses + 1, indice_final)
     elif tipo_filtro == 'periodo' and data_inicio_str and data_fim_str:
         try:
             # Converte as strings YYYY-MM para objetos datetime
             data_inicio_dt = datetime.strptime(data_inicio_str, '%Y-%m')
             data_fim_dt = datetime.strptime(data_fim_str, '%Y-%m')
-            
-            # data_inicio é o primeiro dia do mês
-            data_inicio = data_inicio_dt.date()
-            
-            # data_fim é o último dia do mês
-            # Vai para o primeiro dia do próximo mês e subtrai 1 dia
-            if data_fim_dt.month == 12:
-                primeiro_dia_prox_mes = datetime(data_fim_dt.year + 1, 1, 1)
-            else:
-                primeiro_dia_prox_mes = datetime(data_fim_dt.year, data_fim_dt.month + 1, 1)
-            data_fim = (primeiro_dia_prox_mes - timedelta(days=1))
-            
-            query = query.filter(
-                _filtro_periodo(Processamento.ano, Processamento.mes, data_inicio, data_fim)
-            )
         except ValueError:
             raise ValueError("Formato de data inválido para o período. Use YYYY-MM.")
+        filtro = _filtro_periodo(ResumoMensalCliente.competencia, data_inicio_dt, data_fim_dt)
     elif ano is not None:
-        query = query.filter(Processamento.ano == ano)
+        filtro = ResumoMensalCliente.ano == ano
 
-    # Ordena cronologicamente
-    processamentos = query.order_by(Processamento.ano, Processamento.mes).all()
+    # Linhas já em ordem cronológica
+    resumos = carregar_resumo_cliente(cliente_id, filtro)
 
-    if not processamentos:
+    if not resumos:
         return None
 
     detalhamento_mensal = []
     faturamento_total_periodo = 0
     imposto_total_periodo = 0
 
-    # Precisamos calcular o RBT12 para cada mês do relatório
-    for p in processamentos:
-        faturamento_total_periodo += p.faturamento_total
-        imposto_total_periodo += p.imposto_calculado
+    for r in resumos:
+        faturamento_total_periodo += r.faturamento_total
+        imposto_total_periodo += r.imposto_calculado
 
-        # Cálculo do RBT12 para o mês p
-        # data_final é o último dia do mês anterior ao mês do processamento
-        data_final_rbt12 = datetime(p.ano, p.mes, 1) - timedelta(days=1)
-        
-        # data_inicial é o primeiro dia do mesmo mês, mas 12 meses antes
-        # Evita usar replace(year=) para não ter problemas com anos bissextos (29 fev)
-        # Exemplo: março/2024 -> calcula de março/2023 até fev/2024
-        ano_inicial_rbt12 = p.ano - 1
-        mes_inicial_rbt12 = p.mes
-        data_inicial_rbt12 = datetime(ano_inicial_rbt12, mes_inicial_rbt12, 1)
-        rbt12_query_result = db.session.query(
-            func.sum(Processamento.faturamento_total)
-        ).filter(
-            Processamento.cliente_id == cliente_id,
-            _filtro_periodo(Processamento.ano, Processamento.mes, data_inicial_rbt12, data_final_rbt12)
-        ).scalar()
-        rbt12 = Decimal(rbt12_query_result or 0)
-
-        # Cálculo da alíquota efetiva para o mês p
-        # IMPORTANTE: Não usar p.imposto_calculado pois ele foi calculado na época do processamento
-        # com um RBT12 diferente. Precisamos recalcular baseado no RBT12 atual.
-        aliquota_efetiva = Decimal(0)
-        if rbt12 > 0:
-            # Definir as faixas de alíquota do Anexo III (mesmo que em calcular_imposto_simples_nacional)
-            faixas_sn = [
-                {"limite": Decimal("180000.00"), "aliquota": Decimal("0.06"), "deducao": Decimal("0")},
-                {"limite": Decimal("360000.00"), "aliquota": Decimal("0.112"), "deducao": Decimal("9360.00")},
-                {"limite": Decimal("720000.00"), "aliquota": Decimal("0.135"), "deducao": Decimal("17640.00")},
-                {"limite": Decimal("1800000.00"), "aliquota": Decimal("0.16"), "deducao": Decimal("35640.00")},
-                {"limite": Decimal("3600000.00"), "aliquota": Decimal("0.21"), "deducao": Decimal("125640.00")},
-                {"limite": Decimal("4800000.00"), "aliquota": Decimal("0.33"), "deducao": Decimal("648000.00")}
-            ]
-            
-            # Encontrar a faixa correta e calcular a alíquota efetiva
-            for faixa in faixas_sn:
-                if rbt12 <= faixa["limite"]:
-                    aliquota_nominal = faixa["aliquota"]
-                    parcela_a_deduzir = faixa["deducao"]
-                    aliquota_efetiva = ((rbt12 * aliquota_nominal) - parcela_a_deduzir) / rbt12
-                    break
-            else: # Se RBT12 for maior que o limite máximo
-                ultima_faixa = faixas_sn[-1]
-                aliquota_efetiva = ((rbt12 * ultima_faixa["aliquota"]) - ultima_faixa["deducao"]) / rbt12
-        else:
-            # Se não houver faturamento anterior, usa a alíquota da primeira faixa
-            aliquota_efetiva = Decimal("0.06")
-
-        # --- CÁLCULO DA ALÍQUOTA FUTURA ---
-        # O RBT12 para o próximo mês inclui o faturamento do mês atual.
-        # Período: 11 meses anteriores + mês atual.
-        
-        # data_final_futura é o último dia do mês atual do processamento
-        if p.mes == 12:
-            primeiro_dia_prox_mes_fut = datetime(p.ano + 1, 1, 1)
-        else:
-            primeiro_dia_prox_mes_fut = datetime(p.ano, p.mes + 1, 1)
-        data_final_futura = primeiro_dia_prox_mes_fut - timedelta(days=1)
-        
-        # data_inicial_futura é o primeiro dia de 11 meses antes do mês atual
-        # Exemplo: março/2024 (mês 3) -> de abril/2023 (mês 4) até março/2024 = 12 meses
-        # Cálculo: março + 1 = abril, ano - 1 = 2023
-        if p.mes < 12:
-            ano_inicial_fut = p.ano - 1
-            mes_inicial_fut = p.mes + 1
-        else:  # Dezembro
-            ano_inicial_fut = p.ano
-            mes_inicial_fut = 1
-        data_inicial_futura = datetime(ano_inicial_fut, mes_inicial_fut, 1)
-
-        rbt12_futuro_result = db.session.query(
-            func.sum(Processamento.faturamento_total)
-        ).filter(
-            Processamento.cliente_id == cliente_id,
-            _filtro_periodo(Processamento.ano, Processamento.mes, data_inicial_futura, data_final_futura)
-        ).scalar()
-        rbt12_futuro = Decimal(rbt12_futuro_result or 0)
-
-        # --- CÁLCULO DA ALÍQUOTA FUTURA (LÓGICA DEDICADA) ---
-        faixas_sn = [
-            {"limite": Decimal("180000.00"), "aliquota": Decimal("0.06"), "deducao": Decimal("0")},
-            {"limite": Decimal("360000.00"), "aliquota": Decimal("0.112"), "deducao": Decimal("9360.00")},
-            {"limite": Decimal("720000.00"), "aliquota": Decimal("0.135"), "deducao": Decimal("17640.00")},
-            {"limite": Decimal("1800000.00"), "aliquota": Decimal("0.16"), "deducao": Decimal("35640.00")},
-            {"limite": Decimal("3600000.00"), "aliquota": Decimal("0.21"), "deducao": Decimal("125640.00")},
-            {"limite": Decimal("4800000.00"), "aliquota": Decimal("0.33"), "deducao": Decimal("648000.00")}
-        ]
-
-        aliquota_futura = Decimal("0.06") # Alíquota mínima
-        for faixa in faixas_sn:
-            if rbt12_futuro <= faixa["limite"]:
-                aliquota_nominal = faixa["aliquota"]
-                parcela_a_deduzir = faixa["deducao"]
-                if rbt12_futuro > 0:
-                    aliquota_futura = ((rbt12_futuro * aliquota_nominal) - parcela_a_deduzir) / rbt12_futuro
-                else:
-                    aliquota_futura = faixas_sn[0]['aliquota']
-                break
-        else: # Se RBT12 for maior que o limite máximo
-            ultima_faixa = faixas_sn[-1]
-            aliquota_futura = ((rbt12_futuro * ultima_faixa["aliquota"]) - ultima_faixa["deducao"]) / rbt12_futuro
-
-
-        # Calcula o Fator R
-        # Fator R = (RBT12 / 12) * 0.28
-        media_mensal_12m = rbt12 / Decimal('12') if rbt12 > 0 else Decimal('0')
-        fator_r = media_mensal_12m * Decimal('0.28')
-        
+        # A alíquota efetiva vem do RBT12 atual do resumo, e não de
+        # imposto_calculado, que foi calculado na época do processamento
         detalhamento_mensal.append({
-            'mes': p.mes,
-            'ano': p.ano,
-            'faturamento_total': p.faturamento_total,
-            'faturamento_acumulado': rbt12,
-            'fator_r': fator_r,
-            'aliquota': aliquota_efetiva,
-            'aliquota_futura': aliquota_futura,
-            'imposto_calculado': p.imposto_calculado,
+            'mes': r.mes,
+            'ano': r.ano,
+            'faturamento_total': r.faturamento_total,
+            'faturamento_acumulado': r.rbt12,
+            'fator_r': r.fator_r,
+            'aliquota': r.aliquota_efetiva,
+            'aliquota_futura': r.aliquota_futura,
+            'imposto_calculado': r.imposto_calculado,
         })
 
     # --- PREPARAÇÃO DOS DADOS PARA OS GRÁFICOS ---
@@ -384,34 +706,30 @@ def gerar_relatorio_faturamento(params):
                 a -= 1
             meses_anos.append((a, m))
 
-        # Busca os processamentos desses 13 meses
-        proc_13m = (
-            db.session.query(Processamento)
-            .filter(
-                Processamento.cliente_id == cliente_id,
-                db.tuple_(Processamento.ano, Processamento.mes).in_(meses_anos)
-            )
-            .all()
+        # Busca o resumo desses 13 meses (faixa contínua de competências)
+        indice_mes = _indice_competencia(ano_atual, mes_atual)
+        resumo_13m = carregar_resumo_cliente(
+            cliente_id, ResumoMensalCliente.competencia.between(indice_mes - 12, indice_mes)
         )
 
         # Indexa por (ano, mes) para preservar ordem de meses_anos
-        chave = {(p.ano, p.mes): p for p in proc_13m}
+        chave = {(r.ano, r.mes): r for r in resumo_13m}
 
         meses_hist = [f"{m:02d}/{a}" for (a, m) in meses_anos]
         fatur_hist = []
         imposto_hist = []
         aliq_hist = []
         for (a, m) in meses_anos:
-            p = chave.get((a, m))
-            if p is None:
+            r = chave.get((a, m))
+            if r is None:
                 fatur_hist.append(0)
                 imposto_hist.append(0)
                 aliq_hist.append(0)
             else:
-                fatur_hist.append(float(p.faturamento_total))
-                imposto_hist.append(float(p.imposto_calculado))
-                if p.faturamento_total and float(p.faturamento_total) > 0:
-                    aliq_hist.append(float(p.imposto_calculado) / float(p.faturamento_total))
+                fatur_hist.append(float(r.faturamento_total))
+                imposto_hist.append(float(r.imposto_calculado))
+                if r.faturamento_total and float(r.faturamento_total) > 0:
+                    aliq_hist.append(float(r.imposto_calculado) / float(r.faturamento_total))
                 else:
                     aliq_hist.append(0)
 
@@ -425,8 +743,7 @@ def gerar_relatorio_faturamento(params):
         # Notas fiscais (detalhes) do mês selecionado
         proc_mes = db.session.query(Processamento).filter(
             Processamento.cliente_id == cliente_id,
-            Processamento.ano == ano,
-            Processamento.mes == mes
+            Processamento.competencia == _indice_competencia(ano, mes)
         ).first()
 
         if proc_mes:
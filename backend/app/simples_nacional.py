@@ -0,0 +1,239 @@
+"""
+Motor de alíquotas do Simples Nacional (Anexos I a V da LC 123/2006)
+
+As tabelas de faixas são montadas uma única vez, são imutáveis e a faixa de
+um RBT12 é encontrada por busca binária sobre os limites. Há duas formas de
+cálculo que compartilham as mesmas tabelas:
+
+- aliquota_efetiva(rbt12, anexo): um valor, em Decimal (cálculo do imposto)
+- aliquotas_efetivas(valores, anexo): vários valores de uma vez, com NumPy
+  (relatórios e recálculos em lote)
+
+O anexo de cada cliente vem do CNAE principal (CNAE.anexo_simples e
+CNAE.tem_fator_r). Sem CNAE cadastrado ou sem anexo informado, vale o
+Anexo III, usado pelo sistema antes da escolha por atividade.
+"""
+import re
+from bisect import bisect_left
+from decimal import Decimal
+import numpy as np
+from sqlalchemy import func
+from .models import db, Cliente, CNAE
+
+ANEXO_PADRAO = 'III'
+
+# Fator R mínimo (folha de 12 meses / RBT12) para tributar pelo Anexo III
+# atividades que, abaixo dele, são tributadas pelo Anexo V
+FATOR_R_MINIMO = Decimal('0.28')
+
+
+class TabelaAnexo:
+    """Faixas de um anexo: limites de RBT12, alíquotas nominais e parcelas a deduzir"""
+
+    __slots__ = ('anexo', 'limites', 'aliquotas', 'deducoes', '_limites_np', '_aliquotas_np', '_deducoes_np')
+
+    def __init__(self, anexo, faixas):
+        """
+        Args:
+            anexo (str): Nome do anexo ('I' a 'V')
+            faixas (iterable): Tuplas (limite, aliquota_nominal, parcela_a_deduzir)
+                em ordem crescente de limite
+        """
+        limites, aliquotas, deducoes = zip(*((Decimal(l), Decimal(a), Decimal(d)) for l, a, d in faixas))
+        setter = super().__setattr__
+        setter('anexo', anexo)
+        setter('limites', limites)
+        setter('aliquotas', aliquotas)
+        setter('deducoes', deducoes)
+        for nome, valores in (('_limites_np', limites), ('_aliquotas_np', aliquotas), ('_deducoes_np', deducoes)):
+            vetor = np.array([float(v) for v in valores], dtype=np.float64)
+            vetor.flags.writeable = False
+            setter(nome, vetor)
+
+    def __setattr__(self, nome, valor):
+        raise AttributeError("TabelaAnexo é imutável")
+
+    def __repr__(self):
+        return f"<TabelaAnexo {self.anexo}>"
+
+    def indice_faixa(self, rbt12):
+        """Índice da faixa do RBT12 (acima do limite máximo, a última faixa)"""
+        return min(bisect_left(self.limites, rbt12), len(self.limites) - 1)
+
+    def aliquota_efetiva(self, rbt12):
+        """
+        Alíquota efetiva = (RBT12 × alíquota nominal − parcela a deduzir) / RBT12.
+        Sem faturamento anterior (RBT12 <= 0) vale a alíquota nominal da primeira faixa.
+        """
+        rbt12 = Decimal(rbt12)
+        if rbt12 <= 0:
+            return self.aliquotas[0]
+        indice = self.indice_faixa(rbt12)
+        return ((rbt12 * self.aliquotas[indice]) - self.deducoes[indice]) / rbt12
+
+    def aliquotas_efetivas(self, valores):
+        """
+        Versão vetorizada de aliquota_efetiva.
+
+        Args:
+            valores (iterable | numpy.ndarray): Valores de RBT12 (Decimal, float ou int)
+
+        Returns:
+            numpy.ndarray: Alíquotas efetivas (float64), na ordem recebida
+        """
+        if isinstance(valores, np.ndarray):
+            rbt12 = valores.astype(np.float64, copy=False)
+        else:
+            rbt12 = np.fromiter((float(v) for v in valores), dtype=np.float64)
+        indices = np.minimum(np.searchsorted(self._limites_np, rbt12, side='left'), len(self.limites) - 1)
+        positivos = rbt12 > 0
+        divisor = np.where(positivos, rbt12, 1.0)
+        efetivas = (rbt12 * self._aliquotas_np[indices] - self._deducoes_np[indices]) / divisor
+        return np.where(positivos, efetivas, self._aliquotas_np[0])
+
+
+# Faixas vigentes desde 2018 (LC 155/2016): (limite, alíquota nominal, parcela a deduzir)
+TABELAS = {
+    'I': TabelaAnexo('I', (  # Comércio
+        ("180000.00", "0.04", "0"),
+        ("360000.00", "0.073", "5940.00"),
+        ("720000.00", "0.095", "13860.00"),
+        ("1800000.00", "0.107", "22500.00"),
+        ("3600000.00", "0.143", "87300.00"),
+        ("4800000.00", "0.19", "378000.00"),
+    )),
+    'II': TabelaAnexo('II', (  # Indústria
+        ("180000.00", "0.045", "0"),
+        ("360000.00", "0.078", "5940.00"),
+        ("720000.00", "0.10", "13860.00"),
+        ("1800000.00", "0.112", "22500.00"),
+        ("3600000.00", "0.147", "85500.00"),
+        ("4800000.00", "0.30", "720000.00"),
+    )),
+    'III': TabelaAnexo('III', (  # Serviços (inclusive Fator R >= 28%)
+        ("180000.00", "0.06", "0"),
+        ("360000.00", "0.112", "9360.00"),
+        ("720000.00", "0.135", "17640.00"),
+        ("1800000.00", "0.16", "35640.00"),
+        ("3600000.00", "0.21", "125640.00"),
+        ("4800000.00", "0.33", "648000.00"),
+    )),
+    'IV': TabelaAnexo('IV', (  # Serviços com CPP fora do DAS
+        ("180000.00", "0.045", "0"),
+        ("360000.00", "0.09", "8100.00"),
+        ("720000.00", "0.102", "12420.00"),
+        ("1800000.00", "0.14", "39780.00"),
+        ("3600000.00", "0.22", "183780.00"),
+        ("4800000.00", "0.33", "828000.00"),
+    )),
+    'V': TabelaAnexo('V', (  # Serviços (Fator R < 28%)
+        ("180000.00", "0.155", "0"),
+        ("360000.00", "0.18", "4500.00"),
+        ("720000.00", "0.195", "9900.00"),
+        ("1800000.00", "0.205", "17100.00"),
+        ("3600000.00", "0.23", "62100.00"),
+        ("4800000.00", "0.305", "540000.00"),
+    )),
+}
+
+
+def obter_tabela(anexo=None):
+    """Tabela de um anexo ('I' a 'V'); anexo vazio ou desconhecido usa o padrão"""
+    return TABELAS.get((anexo or ANEXO_PADRAO).strip().upper(), TABELAS[ANEXO_PADRAO])
+
+def aliquota_efetiva(rbt12, anexo=None):
+    """Alíquota efetiva (Decimal) de um RBT12 no anexo informado"""
+    return obter_tabela(anexo).aliquota_efetiva(rbt12)
+
+def aliquotas_efetivas(valores, anexo=None):
+    """Alíquotas efetivas (numpy.ndarray) de vários RBT12 no anexo informado"""
+    return obter_tabela(anexo).aliquotas_efetivas(valores)
+
+
+_PADRAO_ANEXO = re.compile(r'\b(IV|V|III|II|I)\b')
+
+def definir_anexo(anexo_simples, tem_fator_r=False, folha_12m=None, rbt12=None):
+    """
+    Define o anexo a partir dos dados do CNAE.
+
+    Para atividades sujeitas ao Fator R, o anexo é III quando a folha de
+    salários dos últimos 12 meses for ao menos 28% do RBT12 e V caso
+    contrário. Sem a folha informada, assume-se o Anexo III (o relatório
+    exibe o Fator R como a folha mensal mínima para manter essa condição).
+
+    Args:
+        anexo_simples (str): Valor de CNAE.anexo_simples ("III", "III ou V", ...)
+        tem_fator_r (bool): Valor de CNAE.tem_fator_r
+        folha_12m, rbt12: Folha de salários e receita dos últimos 12 meses (opcionais)
+
+    Returns:
+        str: 'I', 'II', 'III', 'IV' ou 'V'
+    """
+    anexos = _PADRAO_ANEXO.findall((anexo_simples or '').upper())
+    if tem_fator_r:
+        if folha_12m is not None and rbt12:
+            return 'III' if Decimal(folha_12m) / Decimal(rbt12) >= FATOR_R_MINIMO else 'V'
+        return 'III'
+    return anexos[0] if anexos else ANEXO_PADRAO
+
+
+def _classe_cnae(cnae_principal):
+    """Código da classe CNAE (5 dígitos) a partir de "6201501 - Descrição" ou "62.01-5-01" """
+    if not cnae_principal:
+        return None
+    digitos = re.sub(r'\D', '', cnae_principal.split(' - ')[0])
+    return digitos[:5] if len(digitos) >= 5 else None
+
+def _codigo_cnae_limpo():
+    """Expressão SQL do código CNAE sem pontuação"""
+    return func.replace(func.replace(func.replace(CNAE.codigo, '.', ''), '-', ''), '/', '')
+
+def resolver_anexo_cliente(cliente):
+    """
+    Anexo do Simples Nacional de um cliente, pelo CNAE principal cadastrado.
+
+    Args:
+        cliente (Cliente | int): Cliente ou ID do cliente
+
+    Returns:
+        str: Anexo ('I' a 'V'); ANEXO_PADRAO quando não for possível determinar
+    """
+    if not isinstance(cliente, Cliente):
+        cliente = db.session.get(Cliente, cliente) if cliente is not None else None
+    classe = _classe_cnae(cliente.cnae_principal) if cliente else None
+    if not classe:
+        return ANEXO_PADRAO
+
+    linha = db.session.query(CNAE.anexo_simples, CNAE.tem_fator_r).filter(
+        _codigo_cnae_limpo() == classe
+    ).first()
+    return definir_anexo(*linha) if linha else ANEXO_PADRAO
+
+def resolver_anexos_clientes(cliente_ids):
+    """
+    Anexo de vários clientes com duas consultas (clientes e CNAEs com anexo).
+
+    Returns:
+        dict: {cliente_id: anexo} para todos os IDs informados
+    """
+    cliente_ids = list(cliente_ids)
+    if not cliente_ids:
+        return {}
+
+    classes = {
+        cliente_id: _classe_cnae(cnae_principal)
+        for cliente_id, cnae_principal in db.session.query(Cliente.id, Cliente.cnae_principal).filter(
+            Cliente.id.in_(cliente_ids)
+        )
+    }
+    anexos_por_classe = {}
+    if any(classes.values()):
+        for codigo, anexo_simples, tem_fator_r in db.session.query(
+            _codigo_cnae_limpo(), CNAE.anexo_simples, CNAE.tem_fator_r
+        ).filter(CNAE.anexo_simples.isnot(None)):
+            anexos_por_classe[codigo] = definir_anexo(anexo_simples, tem_fator_r)
+
+    return {
+        cliente_id: anexos_por_classe.get(classes.get(cliente_id), ANEXO_PADRAO)
+        for cliente_id in cliente_ids
+    }
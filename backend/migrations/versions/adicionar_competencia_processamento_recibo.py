@@ -0,0 +1,36 @@
+"""adicionar competencia inteira a processamento e recibo
+
+Revision ID: add_competencia_processamento
+Revises: criar_resumo_mensal
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_competencia_processamento'
+down_revision = 'criar_resumo_mensal'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for tabela in ('processamento', 'recibo'):
+        with op.batch_alter_table(tabela, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('competencia', sa.Integer(), nullable=True))
+
+        # Chave inteira da competência: ano * 12 + mes - 1
+        op.execute(f"UPDATE {tabela} SET competencia = ano * 12 + mes - 1")
+
+        with op.batch_alter_table(tabela, schema=None) as batch_op:
+            batch_op.alter_column('competencia', existing_type=sa.Integer(), nullable=False)
+            batch_op.create_index(f'idx_{tabela}_cliente_competencia', ['cliente_id', 'competencia'])
+
+
+def downgrade():
+    for tabela in ('recibo', 'processamento'):
+        with op.batch_alter_table(tabela, schema=None) as batch_op:
+            batch_op.drop_index(f'idx_{tabela}_cliente_competencia')
+            batch_op.drop_column('competencia')
@@ -0,0 +1,52 @@
+"""adicionar documentos normalizados ao cliente
+
+Revision ID: add_documentos_normalizados
+Revises: criar_tabelas_contratos
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import re
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_documentos_normalizados'
+down_revision = 'criar_tabelas_contratos'
+branch_labels = None
+depends_on = None
+
+
+def _somente_digitos(documento):
+    if not documento:
+        return None
+    return re.sub(r'[^\d]', '', str(documento)) or None
+
+
+def upgrade():
+    # Adiciona as colunas com CNPJ/CPF apenas com dígitos
+    with op.batch_alter_table('cliente', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cnpj_digitos', sa.String(length=14), nullable=True))
+        batch_op.add_column(sa.Column('cpf_digitos', sa.String(length=11), nullable=True))
+
+    # Preenche as colunas a partir dos documentos já cadastrados
+    conn = op.get_bind()
+    clientes = conn.execute(sa.text("SELECT id, cnpj, cpf FROM cliente")).fetchall()
+    for cliente_id, cnpj, cpf in clientes:
+        conn.execute(
+            sa.text("UPDATE cliente SET cnpj_digitos = :cnpj, cpf_digitos = :cpf WHERE id = :id"),
+            {'cnpj': _somente_digitos(cnpj), 'cpf': _somente_digitos(cpf), 'id': cliente_id}
+        )
+
+    # Índices para busca por documento
+    op.create_index('idx_cliente_cnpj_digitos', 'cliente', ['cnpj_digitos'])
+    op.create_index('idx_cliente_cpf_digitos', 'cliente', ['cpf_digitos'])
+
+
+def downgrade():
+    op.drop_index('idx_cliente_cpf_digitos', table_name='cliente')
+    op.drop_index('idx_cliente_cnpj_digitos', table_name='cliente')
+
+    with op.batch_alter_table('cliente', schema=None) as batch_op:
+        batch_op.drop_column('cpf_digitos')
+        batch_op.drop_column('cnpj_digitos')
@@ -0,0 +1,30 @@
+"""adicionar processo e heartbeat ao job_importacao
+
+Revision ID: add_heartbeat_job_importacao
+Revises: criar_resumo_log_auditoria
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_heartbeat_job_importacao'
+down_revision = 'criar_resumo_log_auditoria'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job_importacao', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('processo', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('heartbeat', sa.DateTime(), nullable=True))
+        batch_op.create_index('idx_job_importacao_status_heartbeat', ['status', 'heartbeat'])
+
+
+def downgrade():
+    with op.batch_alter_table('job_importacao', schema=None) as batch_op:
+        batch_op.drop_index('idx_job_importacao_status_heartbeat')
+        batch_op.drop_column('heartbeat')
+        batch_op.drop_column('processo')
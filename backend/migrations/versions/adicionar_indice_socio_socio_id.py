@@ -0,0 +1,26 @@
+"""adicionar indice de socio_id na tabela socio
+
+Revision ID: add_indice_socio_socio_id
+Revises: criar_busca_clientes
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_indice_socio_socio_id'
+down_revision = 'criar_busca_clientes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('socio', schema=None) as batch_op:
+        batch_op.create_index('idx_socio_socio_id', ['socio_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('socio', schema=None) as batch_op:
+        batch_op.drop_index('idx_socio_socio_id')
@@ -0,0 +1,31 @@
+"""adicionar indices compostos de log_auditoria
+
+Revision ID: add_indices_log_auditoria
+Revises: criar_consulta_cnpj
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_indices_log_auditoria'
+down_revision = 'criar_consulta_cnpj'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('log_auditoria', schema=None) as batch_op:
+        batch_op.create_index('idx_log_auditoria_entidade_acao_data', ['entidade', 'acao', 'data_acao'])
+        batch_op.create_index('idx_log_auditoria_usuario_data', ['usuario_id', 'data_acao'])
+        # Coberto pelo índice (usuario_id, data_acao)
+        batch_op.drop_index('ix_log_auditoria_usuario_id')
+
+
+def downgrade():
+    with op.batch_alter_table('log_auditoria', schema=None) as batch_op:
+        batch_op.create_index('ix_log_auditoria_usuario_id', ['usuario_id'])
+        batch_op.drop_index('idx_log_auditoria_usuario_data')
+        batch_op.drop_index('idx_log_auditoria_entidade_acao_data')
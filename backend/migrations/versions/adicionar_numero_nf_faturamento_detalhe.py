@@ -0,0 +1,59 @@
+"""adicionar numero_nf ao faturamento_detalhe
+
+Revision ID: add_numero_nf_detalhe
+Revises: add_documentos_normalizados
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import re
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_numero_nf_detalhe'
+down_revision = 'add_documentos_normalizados'
+branch_labels = None
+depends_on = None
+
+
+_PADRAO_NUMERO_NF = re.compile(r'^NF (.+?)(?: - |$)')
+
+
+def _extrair_numero_nf(descricao_servico):
+    if not descricao_servico:
+        return None
+    encontrado = _PADRAO_NUMERO_NF.match(descricao_servico)
+    if not encontrado:
+        return None
+    return encontrado.group(1).strip()[:50] or None
+
+
+def upgrade():
+    with op.batch_alter_table('faturamento_detalhe', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('numero_nf', sa.String(length=50), nullable=True))
+
+    # Preenche o número da NF a partir das descrições já importadas ("NF {numero} - {tomador}")
+    conn = op.get_bind()
+    detalhes = conn.execute(sa.text(
+        "SELECT id, descricao_servico FROM faturamento_detalhe WHERE descricao_servico LIKE 'NF %'"
+    )).fetchall()
+    atualizacoes = [
+        {'numero_nf': _extrair_numero_nf(descricao), 'id': detalhe_id}
+        for detalhe_id, descricao in detalhes
+        if _extrair_numero_nf(descricao)
+    ]
+    if atualizacoes:
+        conn.execute(
+            sa.text("UPDATE faturamento_detalhe SET numero_nf = :numero_nf WHERE id = :id"),
+            atualizacoes
+        )
+
+    op.create_index('idx_faturamento_detalhe_processamento_nf', 'faturamento_detalhe', ['processamento_id', 'numero_nf'])
+
+
+def downgrade():
+    op.drop_index('idx_faturamento_detalhe_processamento_nf', table_name='faturamento_detalhe')
+
+    with op.batch_alter_table('faturamento_detalhe', schema=None) as batch_op:
+        batch_op.drop_column('numero_nf')
@@ -0,0 +1,82 @@
+"""criar tabela de busca textual de clientes
+
+Revision ID: criar_busca_clientes
+Revises: criar_preview_importacao
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+import re
+import unicodedata
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'criar_busca_clientes'
+down_revision = 'criar_preview_importacao'
+branch_labels = None
+depends_on = None
+
+
+def _normalizar(texto):
+    if not texto:
+        return ''
+    texto = unicodedata.normalize('NFD', texto)
+    return ''.join(c for c in texto if unicodedata.category(c) != 'Mn').lower()
+
+
+def upgrade():
+    conexao = op.get_bind()
+    sqlite = conexao.dialect.name == 'sqlite'
+
+    if sqlite:
+        op.execute(
+            "CREATE VIRTUAL TABLE cliente_busca USING fts5("
+            "nome, nome_fantasia, documento, municipio, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')"
+        )
+    else:
+        op.create_table('cliente_busca',
+            sa.Column('cliente_id', sa.Integer(), nullable=False),
+            sa.Column('nome', sa.Text(), nullable=True),
+            sa.Column('nome_fantasia', sa.Text(), nullable=True),
+            sa.Column('documento', sa.Text(), nullable=True),
+            sa.Column('municipio', sa.Text(), nullable=True),
+            sa.Column('texto', sa.Text(), nullable=False),
+            sa.PrimaryKeyConstraint('cliente_id')
+        )
+        if conexao.dialect.name == 'postgresql':
+            op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            op.execute("CREATE INDEX idx_cliente_busca_texto_trgm ON cliente_busca USING gin (texto gin_trgm_ops)")
+
+    # Carga inicial com os clientes existentes
+    linhas = []
+    for cliente_id, tipo_pessoa, razao_social, nome_completo, nome_fantasia, cnpj, cpf, municipio in conexao.execute(sa.text(
+        "SELECT id, tipo_pessoa, razao_social, nome_completo, nome_fantasia, cnpj, cpf, municipio FROM cliente"
+    )):
+        textos = {
+            'nome': _normalizar(nome_completo if tipo_pessoa == 'PF' else razao_social),
+            'nome_fantasia': _normalizar(nome_fantasia),
+            'documento': re.sub(r'\D', '', cnpj or '') or re.sub(r'\D', '', cpf or ''),
+            'municipio': _normalizar(municipio)
+        }
+        linha = {'id': cliente_id, **textos}
+        if not sqlite:
+            linha['texto'] = ' ' + ' '.join(re.findall(r'\w+', ' '.join(textos.values())))
+        linhas.append(linha)
+
+    if linhas:
+        if sqlite:
+            comando = ("INSERT INTO cliente_busca (rowid, nome, nome_fantasia, documento, municipio) "
+                       "VALUES (:id, :nome, :nome_fantasia, :documento, :municipio)")
+        else:
+            comando = ("INSERT INTO cliente_busca (cliente_id, nome, nome_fantasia, documento, municipio, texto) "
+                       "VALUES (:id, :nome, :nome_fantasia, :documento, :municipio, :texto)")
+        conexao.execute(sa.text(comando), linhas)
+
+
+def downgrade():
+    conexao = op.get_bind()
+    if conexao.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS idx_cliente_busca_texto_trgm")
+    op.execute("DROP TABLE cliente_busca")
@@ -0,0 +1,31 @@
+"""criar tabela de cache das consultas de CNPJ
+
+Revision ID: criar_consulta_cnpj
+Revises: add_indice_socio_socio_id
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'criar_consulta_cnpj'
+down_revision = 'add_indice_socio_socio_id'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('consulta_cnpj',
+        sa.Column('cnpj', sa.String(length=14), nullable=False),
+        sa.Column('encontrado', sa.Boolean(), nullable=False),
+        sa.Column('dados', sa.Text(), nullable=True),
+        sa.Column('data_consulta', sa.DateTime(), nullable=False),
+        sa.Column('data_expiracao', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('cnpj')
+    )
+
+
+def downgrade():
+    op.drop_table('consulta_cnpj')
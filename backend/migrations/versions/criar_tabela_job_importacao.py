@@ -0,0 +1,43 @@
+"""criar tabela job_importacao
+
+Revision ID: criar_job_importacao
+Revises: add_numero_nf_detalhe
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'criar_job_importacao'
+down_revision = 'add_numero_nf_detalhe'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_importacao',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('tipo', sa.String(length=20), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('usuario_id', sa.Integer(), nullable=False),
+        sa.Column('parametros', sa.Text(), nullable=True),
+        sa.Column('progresso', sa.Text(), nullable=True),
+        sa.Column('total_itens', sa.Integer(), nullable=False),
+        sa.Column('itens_processados', sa.Integer(), nullable=False),
+        sa.Column('resultado', sa.Text(), nullable=True),
+        sa.Column('erro', sa.Text(), nullable=True),
+        sa.Column('cancelamento_solicitado', sa.Boolean(), nullable=False),
+        sa.Column('data_criacao', sa.DateTime(), nullable=False),
+        sa.Column('data_inicio', sa.DateTime(), nullable=True),
+        sa.Column('data_fim', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['usuario_id'], ['usuario.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_job_importacao_usuario_data', 'job_importacao', ['usuario_id', 'data_criacao'])
+
+
+def downgrade():
+    op.drop_index('idx_job_importacao_usuario_data', table_name='job_importacao')
+    op.drop_table('job_importacao')
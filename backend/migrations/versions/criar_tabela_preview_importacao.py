@@ -0,0 +1,36 @@
+"""criar tabela preview_importacao
+
+Revision ID: criar_preview_importacao
+Revises: add_competencia_processamento
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'criar_preview_importacao'
+down_revision = 'add_competencia_processamento'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('preview_importacao',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('usuario_id', sa.Integer(), nullable=False),
+        sa.Column('nome_arquivo', sa.String(length=255), nullable=True),
+        sa.Column('cnpj', sa.String(length=18), nullable=True),
+        sa.Column('dados', sa.Text(), nullable=False),
+        sa.Column('data_criacao', sa.DateTime(), nullable=False),
+        sa.Column('data_expiracao', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['usuario_id'], ['usuario.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_preview_importacao_expiracao', 'preview_importacao', ['data_expiracao'])
+
+
+def downgrade():
+    op.drop_index('idx_preview_importacao_expiracao', table_name='preview_importacao')
+    op.drop_table('preview_importacao')
@@ -0,0 +1,40 @@
+"""criar tabela resumo_log_auditoria
+
+Revision ID: criar_resumo_log_auditoria
+Revises: add_indices_log_auditoria
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'criar_resumo_log_auditoria'
+down_revision = 'add_indices_log_auditoria'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('resumo_log_auditoria',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('dia', sa.Date(), nullable=False),
+        sa.Column('acao', sa.String(length=100), nullable=False),
+        sa.Column('entidade', sa.String(length=50), nullable=False),
+        sa.Column('usuario_id', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('dia', 'acao', 'entidade', 'usuario_id', name='_resumo_log_auditoria_uc')
+    )
+
+    # Contagens dos logs já existentes
+    op.execute(
+        "INSERT INTO resumo_log_auditoria (dia, acao, entidade, usuario_id, total) "
+        "SELECT date(data_acao), acao, entidade, usuario_id, count(*) FROM log_auditoria "
+        "GROUP BY date(data_acao), acao, entidade, usuario_id"
+    )
+
+
+def downgrade():
+    op.drop_table('resumo_log_auditoria')
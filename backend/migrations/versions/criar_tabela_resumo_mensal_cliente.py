@@ -0,0 +1,103 @@
+"""criar tabela resumo_mensal_cliente
+
+Revision ID: criar_resumo_mensal
+Revises: criar_job_importacao
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+from decimal import Decimal
+
+
+# revision identifiers, used by Alembic.
+revision = 'criar_resumo_mensal'
+down_revision = 'criar_job_importacao'
+branch_labels = None
+depends_on = None
+
+
+# Faixas do Anexo III vigentes quando a tabela foi criada (limite, alíquota, dedução)
+_FAIXAS = (
+    (Decimal("180000.00"), Decimal("0.06"), Decimal("0")),
+    (Decimal("360000.00"), Decimal("0.112"), Decimal("9360.00")),
+    (Decimal("720000.00"), Decimal("0.135"), Decimal("17640.00")),
+    (Decimal("1800000.00"), Decimal("0.16"), Decimal("35640.00")),
+    (Decimal("3600000.00"), Decimal("0.21"), Decimal("125640.00")),
+    (Decimal("4800000.00"), Decimal("0.33"), Decimal("648000.00")),
+)
+
+
+def _aliquota(rbt12):
+    if rbt12 <= 0:
+        return _FAIXAS[0][1]
+    for limite, aliquota, deducao in _FAIXAS:
+        if rbt12 <= limite:
+            break
+    return ((rbt12 * aliquota) - deducao) / rbt12
+
+
+def upgrade():
+    resumo = op.create_table('resumo_mensal_cliente',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('cliente_id', sa.Integer(), nullable=False),
+        sa.Column('processamento_id', sa.Integer(), nullable=True),
+        sa.Column('ano', sa.Integer(), nullable=False),
+        sa.Column('mes', sa.Integer(), nullable=False),
+        sa.Column('competencia', sa.Integer(), nullable=False),
+        sa.Column('faturamento_total', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column('imposto_calculado', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column('rbt12', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('rbt12_futuro', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('aliquota_efetiva', sa.Numeric(precision=12, scale=10), nullable=False),
+        sa.Column('aliquota_futura', sa.Numeric(precision=12, scale=10), nullable=False),
+        sa.Column('fator_r', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('data_atualizacao', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['cliente_id'], ['cliente.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['processamento_id'], ['processamento.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('cliente_id', 'competencia', name='_resumo_cliente_competencia_uc')
+    )
+    op.create_index('idx_resumo_mensal_cliente_competencia', 'resumo_mensal_cliente', ['competencia'])
+
+    # Preenche o resumo com os processamentos existentes
+    conn = op.get_bind()
+    processamentos = conn.execute(sa.text(
+        "SELECT cliente_id, id, ano, mes, faturamento_total, imposto_calculado "
+        "FROM processamento ORDER BY cliente_id, ano, mes"
+    )).fetchall()
+
+    totais = {}
+    for cliente_id, _, ano, mes, faturamento_total, _ in processamentos:
+        totais[(cliente_id, ano * 12 + mes - 1)] = Decimal(str(faturamento_total or 0))
+
+    agora = datetime.utcnow()
+    linhas = []
+    for cliente_id, processamento_id, ano, mes, faturamento_total, imposto_calculado in processamentos:
+        competencia = ano * 12 + mes - 1
+        rbt12 = sum((totais.get((cliente_id, k), Decimal('0')) for k in range(competencia - 12, competencia)), Decimal('0'))
+        rbt12_futuro = rbt12 - totais.get((cliente_id, competencia - 12), Decimal('0')) + totais[(cliente_id, competencia)]
+        fator_r = (rbt12 / Decimal('12') if rbt12 > 0 else Decimal('0')) * Decimal('0.28')
+        linhas.append({
+            'cliente_id': cliente_id,
+            'processamento_id': processamento_id,
+            'ano': ano,
+            'mes': mes,
+            'competencia': competencia,
+            'faturamento_total': Decimal(str(faturamento_total or 0)),
+            'imposto_calculado': Decimal(str(imposto_calculado or 0)),
+            'rbt12': rbt12.quantize(Decimal('0.01')),
+            'rbt12_futuro': rbt12_futuro.quantize(Decimal('0.01')),
+            'aliquota_efetiva': _aliquota(rbt12).quantize(Decimal('0.0000000001')),
+            'aliquota_futura': _aliquota(rbt12_futuro).quantize(Decimal('0.0000000001')),
+            'fator_r': fator_r.quantize(Decimal('0.01')),
+            'data_atualizacao': agora
+        })
+    if linhas:
+        op.bulk_insert(resumo, linhas)
+
+
+def downgrade():
+    op.drop_index('idx_resumo_mensal_cliente_competencia', table_name='resumo_mensal_cliente')
+    op.drop_table('resumo_mensal_cliente')
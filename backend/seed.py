@@ -10,8 +10,8 @@ import os
 from werkzeug.security import generate_password_hash
 
 # Corrigindo a importação circular: importar 'db' diretamente de 'models'
-from app.models import db, Usuario, Cliente, Processamento, FaturamentoDetalhe
-from app.services import calcular_impostos, calcular_imposto_simples_nacional
+from app.models import db, Usuario, Cliente, Processamento, FaturamentoDetalhe, ResumoMensalCliente
+from app.services import calcular_impostos, calcular_imposto_simples_nacional, tributado_pelo_simples
 
 # --- FUNÇÕES DO SCRIPT ---
 
@@ -39,6 +39,7 @@ def limpar_dados():
     """Apaga todos os dados das tabelas relacionadas para evitar duplicatas."""
     print("Limpando dados antigos...", flush=True)
     FaturamentoDetalhe.query.delete()
+    ResumoMensalCliente.query.delete()
     Processamento.query.delete()
     Cliente.query.delete()
     db.session.commit()
@@ -98,7 +99,7 @@ def gerar_faturamento_massivo(clientes):
                     detalhes_mes.append(FaturamentoDetalhe(descricao_servico=descricao, valor=valor))
                     faturamento_total_mes += valor
 
-                if cliente.regime_tributario == 'Simples Nacional':
+                if tributado_pelo_simples(cliente.regime_tributario):
                     imposto_calculado = calcular_imposto_simples_nacional(cliente.id, mes, ano, float(faturamento_total_mes))
                 else:
                     imposto_calculado = calcular_impostos(float(faturamento_total_mes), cliente.regime_tributario)
@@ -196,6 +197,117 @@ def seed_db_command():
     gerar_faturamento_especifico() # 4. Gera os dados específicos para o cliente de teste
     print("Banco de dados populado com sucesso!", flush=True)
 
+@click.command('reconstruir-resumo-mensal')
+@click.option('--cliente-id', type=int, multiple=True, help='Reconstrói apenas os clientes informados.')
+@with_appcontext
+def reconstruir_resumo_mensal_command(cliente_id):
+    """Recalcula a tabela de resumo mensal a partir dos processamentos."""
+    from app.resumo_mensal import reconstruir_resumo_mensal
+    total = reconstruir_resumo_mensal(list(cliente_id) or None)
+    db.session.commit()
+    print(f"Resumo mensal reconstruído: {total} competências.", flush=True)
+
+@click.command('recalcular-impostos')
+@click.option('--cliente-id', type=int, multiple=True, help='Recalcula apenas os clientes informados.')
+@click.option('--dry-run/--aplicar', default=True, help='Apenas mostra as diferenças (padrão) ou grava os novos valores.')
+@with_appcontext
+def recalcular_impostos_command(cliente_id, dry_run):
+    """Recalcula o imposto de todos os processamentos com as tabelas atuais."""
+    from app.recalculo_impostos import recalcular_impostos
+    relatorio = recalcular_impostos(list(cliente_id) or None, aplicar=not dry_run, limite_diferencas=50)
+    for diferenca in relatorio['diferencas']:
+        print(
+            f"Cliente {diferenca['cliente_id']} {diferenca['mes']:02d}/{diferenca['ano']}: "
+            f"{diferenca['imposto_atual']} -> {diferenca['imposto_recalculado']} (RBT12 {diferenca['rbt12']})",
+            flush=True
+        )
+    print(
+        f"{relatorio['processamentos_alterados']} de {relatorio['total_processamentos']} processamentos "
+        f"com diferença em {relatorio['clientes_alterados']} clientes. "
+        f"Imposto total: {relatorio['imposto_atual']} -> {relatorio['imposto_recalculado']}",
+        flush=True
+    )
+    if dry_run:
+        print("Simulação: nada foi gravado (use --aplicar para gravar).", flush=True)
+    else:
+        db.session.commit()
+        print("Novos valores gravados.", flush=True)
+
+@click.command('reconstruir-busca-clientes')
+@with_appcontext
+def reconstruir_busca_clientes_command():
+    """Reconstrói o índice da busca textual de clientes."""
+    from app.busca_clientes import reconstruir_indice_busca
+    total = reconstruir_indice_busca()
+    db.session.commit()
+    print(f"Índice de busca reconstruído: {total} clientes.", flush=True)
+
+@click.command('atualizar-cadastros-cnpj')
+@click.option('--cliente-id', type=int, multiple=True, help='Atualiza apenas os clientes informados.')
+@click.option('--dry-run/--aplicar', default=True, help='Apenas mostra as diferenças (padrão) ou grava os novos dados.')
+@click.option('--sem-cache', is_flag=True, help='Consulta a API mesmo para CNPJs consultados recentemente.')
+@with_appcontext
+def atualizar_cadastros_cnpj_command(cliente_id, dry_run, sem_cache):
+    """Atualiza os dados cadastrais dos clientes PJ pela Receita Federal."""
+    from app.atualizacao_cadastral import atualizar_cadastros
+    relatorio = atualizar_cadastros(list(cliente_id) or None, aplicar=not dry_run, usar_cache=not sem_cache, limite_diferencas=50)
+    for alteracao in relatorio['alteracoes']:
+        campos = ', '.join(
+            f"{campo}: {diferenca['antes']!r} -> {diferenca['depois']!r}"
+            for campo, diferenca in alteracao['campos'].items()
+        )
+        print(f"Cliente {alteracao['cliente_id']} ({alteracao['razao_social']}): {campos}", flush=True)
+    for erro in relatorio['erros']:
+        print(f"Cliente {erro['cliente_id']} ({erro['cnpj']}): erro {erro['erro']}", flush=True)
+    print(
+        f"{relatorio['clientes_alterados']} de {relatorio['total_clientes']} clientes com alterações; "
+        f"{len(relatorio['nao_encontrados'])} não encontrados e {relatorio['total_erros']} erros.",
+        flush=True
+    )
+    if dry_run:
+        print("Simulação: nada foi gravado (use --aplicar para gravar).", flush=True)
+    else:
+        db.session.commit()
+        print("Novos dados gravados.", flush=True)
+
+@click.command('reconstruir-resumo-logs')
+@click.option('--inicio', type=click.DateTime(formats=['%Y-%m-%d']), help='Primeiro dia a recalcular (AAAA-MM-DD).')
+@click.option('--fim', type=click.DateTime(formats=['%Y-%m-%d']), help='Último dia a recalcular (AAAA-MM-DD).')
+@with_appcontext
+def reconstruir_resumo_logs_command(inicio, fim):
+    """Recalcula as contagens diárias dos logs de auditoria a partir dos logs."""
+    from app.resumo_logs import reconstruir_resumo_logs
+    total = reconstruir_resumo_logs(inicio.date() if inicio else None, fim.date() if fim else None)
+    db.session.commit()
+    print(f"Resumo dos logs reconstruído: {total} linhas.", flush=True)
+
+@click.command('arquivar-logs')
+@click.option('--dias', type=int, help='Arquiva os logs com mais de N dias (padrão: AUDITORIA_ARQUIVO_DIAS).')
+@click.option('--dry-run/--aplicar', default=True, help='Apenas conta os logs que seriam arquivados (padrão) ou arquiva.')
+@click.option('--compactar', is_flag=True, help='Depois de arquivar, compacta o banco SQLite (VACUUM).')
+@with_appcontext
+def arquivar_logs_command(dias, dry_run, compactar):
+    """Move os logs de auditoria antigos para arquivos mensais compactados."""
+    from app.arquivo_logs import arquivar_logs, pasta_arquivo
+    relatorio = arquivar_logs(dias, simular=dry_run)
+    for mes, total in relatorio['por_mes'].items():
+        print(f"{mes}: {total} logs", flush=True)
+    print(f"{relatorio['total']} logs anteriores a {relatorio['limite']}.", flush=True)
+    if dry_run:
+        print("Simulação: nada foi arquivado (use --aplicar para arquivar).", flush=True)
+        return
+    print(f"Logs arquivados em {pasta_arquivo()}.", flush=True)
+    if compactar and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conexao:
+            conexao.exec_driver_sql('VACUUM')
+        print("Banco compactado.", flush=True)
+
 def register_commands(app):
     """Registra os comandos CLI no aplicativo Flask."""
-    app.cli.add_command(seed_db_command)
\ No newline at end of file
+    app.cli.add_command(seed_db_command)
+    app.cli.add_command(reconstruir_resumo_mensal_command)
+    app.cli.add_command(recalcular_impostos_command)
+    app.cli.add_command(reconstruir_busca_clientes_command)
+    app.cli.add_command(atualizar_cadastros_cnpj_command)
+    app.cli.add_command(reconstruir_resumo_logs_command)
+    app.cli.add_command(arquivar_logs_command)
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+Fixtures compartilhadas: aplicação com banco SQLite (em memória ou em arquivo)
+"""
+import jwt
+import pytest
+from app import create_app
+from app.models import db, Usuario
+
+CHAVE_JWT_TESTES = 'chave-dos-testes'
+
+
+def _criar_app(monkeypatch, tmp_path, database_url):
+    monkeypatch.setenv('DATABASE_URL', database_url)
+    monkeypatch.setenv('JWT_SECRET_KEY', CHAVE_JWT_TESTES)
+    monkeypatch.delenv('FLASK_DEBUG', raising=False)
+    monkeypatch.setenv('AUDITORIA_ASSINCRONA', '0')
+    monkeypatch.setenv('CSV_CACHE_DIR', str(tmp_path / 'cache_csv'))
+    monkeypatch.setenv('IMPORTACAO_JOBS_DIR', str(tmp_path / 'jobs'))
+    monkeypatch.setenv('AUDITORIA_ARQUIVO_DIR', str(tmp_path / 'arquivo_logs'))
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    """Aplicação com as tabelas criadas em um banco SQLite em memória (logs gravados na hora)"""
+    app = _criar_app(monkeypatch, tmp_path, 'sqlite://')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def app_arquivo(monkeypatch, tmp_path):
+    """
+    Como `app`, mas com o banco em arquivo: para os jobs, que usam várias
+    conexões em threads diferentes (como em produção)
+    """
+    app = _criar_app(monkeypatch, tmp_path, f"sqlite:///{tmp_path / 'teste.db'}")
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def usuario_admin(app_arquivo):
+    usuario = Usuario(username='admin', email='admin@teste.com', senha_hash='x', papel='ADMIN', nome='Admin')
+    db.session.add(usuario)
+    db.session.commit()
+    return usuario
+
+@pytest.fixture
+def cabecalho_admin(usuario_admin):
+    """Cabeçalho Authorization com um token do usuário administrador"""
+    token = jwt.encode({'sub': str(usuario_admin.id)}, CHAVE_JWT_TESTES, algorithm='HS256')
+    return {'Authorization': f'Bearer {token}'}
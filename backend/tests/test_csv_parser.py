@@ -1,9 +1,10 @@
 """
 Testes para o parser de CSV de Notas Fiscais
 """
+import io
 import pytest
 from decimal import Decimal
-from app.csv_parser import NFECSVParser
+from app.csv_parser import NFECSVParser, processar_multiplos_arquivos
 
 
 def test_limpar_cnpj():
@@ -146,6 +147,118 @@ def test_datas_do_csv_real():
         assert data.year == 2025
 
 
+def test_processamento_colunar_equivale_ao_linha_a_linha():
+    """Testa se o modo colunar produz o mesmo resultado do processamento com iterrows"""
+    cabecalho = [
+        'Tipo de Registro', 'Nº da Nota Fiscal Eletrônica', 'Status da Nota Fiscal',
+        'Código de Verificação NF', 'Data Hora da Emissão da Nota Fiscal',
+        'CPF/CNPJ do Prestador', 'Razão Social do Prestador', 'Razão Social do Tomador',
+        'Valor dos Serviços', 'Data de Competência', 'Data de Cancelamento',
+        'Discriminação dos Serviços'
+    ]
+    linhas = [
+        ['2', '101', 'N', 'A1', '', '31.710.936/0001-30', 'Empresa', 'Tomador A', '1.790,00', '26/09/2025 15:52', '', 'Serviço'],
+        ['2', '102', 'N', 'A2', '', '31.710.936/0001-30', 'Empresa', 'Tomador B', '5.710,92', '05/09/2025', '', 'Serviço'],
+        ['2', '103', 'C', 'A3', '', '31.710.936/0001-30', 'Empresa', 'Tomador C', '70', '04/09/2025', '10/09/2025', 'Serviço'],
+        ['2', '104', 'N', 'A4', '', '31.710.936/0001-30', 'Empresa', 'Tomador D', '10.059,97', '2025-08-03', '', 'Serviço'],
+        ['2', '105', 'N', 'A5', '', '31.710.936/0001-30', 'Empresa', 'Tomador E', '', 'data inválida', '', 'Serviço'],
+        ['Total', '', '', '', '', '', '', '', '17.630,89', '', '', ''],
+    ]
+    conteudo = "\n".join(";".join(linha) for linha in [cabecalho] + linhas).encode('utf-8')
+
+    resultado_linhas = NFECSVParser.processar_arquivo(conteudo, 'teste.csv', colunar=False)
+    resultado_colunar = NFECSVParser.processar_arquivo(conteudo, 'teste.csv')
+
+    assert resultado_colunar == resultado_linhas
+    assert resultado_colunar['status'] == 'ok'
+    assert resultado_colunar['total_notas'] == 3
+    assert resultado_colunar['total_faturamento'] == 17560.89
+    assert [(c['mes'], c['ano']) for c in resultado_colunar['competencias']] == [(9, 2025), (8, 2025)]
+
+
+
+def test_processamento_em_streaming_com_amostra_e_chunks_pequenos(monkeypatch):
+    """Testa a leitura em streaming (latin-1) com amostra e blocos menores que o arquivo"""
+    monkeypatch.setattr(NFECSVParser, 'TAMANHO_AMOSTRA', 2048)
+    monkeypatch.setattr(NFECSVParser, 'TAMANHO_CHUNK', 7)
+
+    cabecalho = [
+        'Tipo de Registro', 'Nota', 'Status da Nota Fiscal', 'Codigo', 'Data Emissao',
+        'CNPJ Prestador', 'Razao Social Prestador', 'Razao Social Tomador',
+        'Valor', 'Data de Competência', 'Data de Cancelamento', 'Discriminacao'
+    ]
+    linhas = [
+        ['2', str(i), 'N', 'A', '', '31.710.936/0001-30', 'Empresa', f'Tomador {i}',
+         '1.000,50', f'{(i % 28) + 1:02d}/{(i % 3) + 1:02d}/2025', '', 'Serviço' if i == 99 else 'Servico']
+        for i in range(100)
+    ]
+    conteudo = "\n".join(";".join(linha) for linha in [cabecalho] + linhas).encode('latin-1')
+
+    resultado = NFECSVParser.processar_stream(io.BytesIO(conteudo), 'teste.csv')
+
+    assert resultado == NFECSVParser.processar_arquivo(conteudo, 'teste.csv', colunar=False)
+    assert resultado['status'] == 'ok'
+    assert resultado['total_notas'] == 100
+    assert [(c['mes'], c['total_notas']) for c in resultado['competencias']] == [(1, 34), (2, 33), (3, 33)]
+
+
+def _conteudo_csv(notas, encoding='utf-8'):
+    """CSV no layout da prefeitura com as notas (numero, valor, data de competência)"""
+    cabecalho = [
+        'Tipo de Registro', 'Nº da Nota Fiscal Eletrônica', 'Status da Nota Fiscal',
+        'Código de Verificação NF', 'Data Hora da Emissão da Nota Fiscal',
+        'CPF/CNPJ do Prestador', 'Razão Social do Prestador', 'Razão Social do Tomador',
+        'Valor dos Serviços', 'Data de Competência', 'Data de Cancelamento',
+        'Discriminação dos Serviços'
+    ]
+    linhas = [
+        ['2', numero, 'N', 'A', '', '31.710.936/0001-30', 'Empresa', f'Tomador {numero}', valor, data, '', 'Serviço']
+        for numero, valor, data in notas
+    ]
+    return "\n".join(";".join(linha) for linha in [cabecalho] + linhas).encode(encoding)
+
+
+def test_processamento_paralelo_em_processos():
+    """
+    Testa o pool de processos (max_workers=2) com bytes, streams e um arquivo
+    inválido: resultados na ordem da entrada, o arquivo inválido vira erro sem
+    afetar os demais, ao_concluir_arquivo recebe os índices certos e os totais
+    são os mesmos do processamento sequencial.
+    """
+    conteudos = [
+        _conteudo_csv([('1', '1.000,00', '05/01/2025'), ('2', '250,50', '10/02/2025')]),
+        _conteudo_csv([('3', '700,00', '15/03/2025')], encoding='latin-1'),
+        b'\x00\x01 isto nao e um csv',
+        _conteudo_csv([('4', '99,90', '20/01/2025')]),
+    ]
+
+    def arquivos():
+        # Bytes e streams alternados
+        return [
+            (conteudo if indice % 2 == 0 else io.BytesIO(conteudo), f'arquivo{indice}.csv')
+            for indice, conteudo in enumerate(conteudos)
+        ]
+
+    concluidos = []
+    paralelo = processar_multiplos_arquivos(
+        arquivos(), max_workers=2,
+        ao_concluir_arquivo=lambda indice, resultado: concluidos.append((indice, resultado['nome_arquivo']))
+    )
+    sequencial = processar_multiplos_arquivos(arquivos(), max_workers=1)
+
+    resultados = paralelo['arquivos_processados']
+    assert [r['nome_arquivo'] for r in resultados] == [f'arquivo{indice}.csv' for indice in range(4)]
+    assert [r['status'] for r in resultados] == ['ok', 'ok', 'erro', 'ok']
+    assert [r['total_notas'] for r in resultados] == [2, 1, 0, 1]
+    assert sorted(concluidos) == [(indice, f'arquivo{indice}.csv') for indice in range(4)]
+
+    assert paralelo['resumo'] == sequencial['resumo']
+    assert paralelo['resumo']['arquivos_com_erro'] == 1
+    assert paralelo['resumo']['total_importar'] == 2050.4
+    for resultado_paralelo, resultado_sequencial in zip(resultados, sequencial['arquivos_processados']):
+        assert resultado_paralelo['competencias'] == resultado_sequencial['competencias']
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
 
@@ -1,5 +1,41 @@
+import io
+import os
+import gzip
+import json
+import time
+import threading
+from decimal import Decimal
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+import jwt
+import numpy as np
+from sqlalchemy import event, insert
 import pytest
-from app.services import calcular_impostos
+from app.services import calcular_impostos, calcular_rbt12_janela, _indice_competencia, _filtro_periodo
+from app.resumo_mensal import calcular_indicadores_mensais
+from app.simples_nacional import aliquota_efetiva, aliquotas_efetivas, definir_anexo
+from app.recalculo_impostos import calcular_rbt12_vetorizado, recalcular_impostos
+from app.cache_csv import CacheResultadoCSV, PastaCacheInsegura, obter_cache
+from app.busca_clientes import _termos
+from app.consulta_cnpj import ServicoConsultaCNPJ
+from app import atualizacao_cadastral
+from app.atualizacao_cadastral import CAMPOS_RECEITA, _valores_receita, comparar_cadastro, atualizar_cadastros
+from app import cache_autenticacao
+from app.cache_autenticacao import CacheTTL
+from app.audit import GravadorAuditoria
+from app.consulta_logs import codificar_cursor, decodificar_cursor
+from app.resumo_logs import contar_registros
+from app import arquivo_logs
+from app.arquivo_logs import _Limitado
+from app.cnae_busca import IndiceCNAE
+from app.listagem_clientes import listar_clientes, ParametroInvalido
+from app.grafo_socios import carregar_socios_empresas, carregar_vinculos_empresa, carregar_empresas_do_socio
+from app.models import (db, Usuario, Cliente, Processamento, FaturamentoDetalhe, ItemExcluido, JobImportacao, Contador,
+                        Recibo, PreviewImportacao, Socio, LogAuditoria)
+from app import importacao_jobs
+from app.preview_importacao import (armazenar_preview, carregar_previews, descartar_previews, previews_nao_encontrados,
+                                    PreviewNaoEncontrado)
+from app.services import resolver_cliente_por_cnpj, resolver_cliente_por_cpf, resolver_clientes_por_cnpj, consolidar_faturamento_lote, verificar_preview_no_banco
 
 # Usamos pytest.mark.parametrize para testar múltiplos cenários com a mesma função de teste.
 # Isso torna o teste mais limpo e fácil de estender.
@@ -33,4 +69,914 @@ def test_calcular_impostos(faturamento, regime, imposto_esperado):
     imposto_calculado = calcular_impostos(faturamento, regime)
 
     # Compara o resultado com o valor esperado, usando pytest.approx para lidar com floats
-    assert imposto_calculado == pytest.approx(imposto_esperado)
\ No newline at end of file
+    assert imposto_calculado == pytest.approx(imposto_esperado)
+
+def test_calcular_rbt12_janela():
+    """
+    Testa a janela deslizante de RBT12: o RBT12 de um mês soma os 12 meses
+    anteriores e o RBT12 futuro inclui o próprio mês.
+    """
+
+    # Faturamento de 1.000 por mês de jan/2023 a dez/2024, com um mês sem movimento
+    totais = {}
+    for ano in (2023, 2024):
+        for mes in range(1, 13):
+            totais[_indice_competencia(ano, mes)] = Decimal('1000')
+    del totais[_indice_competencia(2023, 6)]
+
+    resultado = calcular_rbt12_janela(totais, [(2024, 1), (2024, 6), (2024, 7)])
+
+    # jan/2024: jan a dez/2023 (sem junho)
+    assert resultado[(2024, 1)] == (Decimal('11000'), Decimal('11000'))
+    # jun/2024: jun/2023 a mai/2024 (sem junho/2023); futuro: jul/2023 a jun/2024
+    assert resultado[(2024, 6)] == (Decimal('11000'), Decimal('12000'))
+    assert resultado[(2024, 7)] == (Decimal('12000'), Decimal('12000'))
+
+def test_calcular_indicadores_mensais():
+    """
+    Testa os indicadores gravados no resumo mensal: sem faturamento anterior
+    vale a primeira faixa; acima do limite vale a última faixa.
+    """
+
+    aliquota, aliquota_futura, fator_r = calcular_indicadores_mensais(Decimal('0'), Decimal('200000'))
+    assert aliquota == Decimal('0.06')
+    assert aliquota_futura == Decimal('0.0652')
+    assert fator_r == Decimal('0')
+
+    aliquota, _, fator_r = calcular_indicadores_mensais(Decimal('6000000'), Decimal('6000000'))
+    assert aliquota == Decimal('0.222')
+    assert fator_r == Decimal('140000')
+
+def test_motor_aliquotas_simples_nacional():
+    """
+    Testa a busca de faixa por bisect (limite inclusivo), o cálculo em lote
+    igual ao individual e a escolha do anexo pelos dados do CNAE.
+    """
+
+    assert aliquota_efetiva(Decimal('180000'), 'III') == Decimal('0.06')
+    assert aliquota_efetiva(Decimal('360000'), 'I') == (Decimal('360000') * Decimal('0.073') - Decimal('5940')) / Decimal('360000')
+    assert aliquota_efetiva(Decimal('0'), 'V') == Decimal('0.155')
+
+    valores = [Decimal('0'), Decimal('150000'), Decimal('180000.01'), Decimal('2500000'), Decimal('6000000')]
+    for anexo in ('I', 'II', 'III', 'IV', 'V'):
+        lote = aliquotas_efetivas(valores, anexo)
+        for valor, aliquota in zip(valores, lote):
+            assert aliquota == pytest.approx(float(aliquota_efetiva(valor, anexo)))
+
+    assert definir_anexo('I') == 'I'
+    assert definir_anexo(None) == 'III'
+    assert definir_anexo('III ou V', True) == 'III'
+    assert definir_anexo('III ou V', True, folha_12m=Decimal('20000'), rbt12=Decimal('100000')) == 'V'
+
+def test_calcular_rbt12_vetorizado():
+    """
+    Testa o RBT12 por somas acumuladas: a janela considera apenas os 12 meses
+    anteriores do mesmo cliente, mesmo com meses faltando.
+    """
+
+    cliente_ids = np.array([1, 1, 1, 1, 2, 2])
+    competencias = np.array([0, 1, 12, 13, 0, 5])
+    faturamentos = np.array([100, 200, 400, 800, 1000, 2000])
+
+    rbt12 = calcular_rbt12_vetorizado(cliente_ids, competencias, faturamentos)
+
+    # Cliente 1: mês 12 soma 0..11; mês 13 soma 1..12. Cliente 2 não vê o cliente 1
+    assert rbt12.tolist() == [0, 100, 300, 600, 0, 1000]
+
+def test_cache_resultado_csv(tmp_path):
+    """
+    Testa o cache de resultados do parser: a chave depende do conteúdo (não do
+    nome), só resultados 'ok' são guardados e, acima do limite, sai a entrada
+    acessada há mais tempo.
+    """
+
+    cache = CacheResultadoCSV(str(tmp_path), tamanho_maximo=10 ** 6)
+    chave = cache.chave(b'conteudo')
+    assert chave == cache.chave(io.BytesIO(b'conteudo'))
+    assert chave != cache.chave(b'outro conteudo')
+
+    cache.gravar(chave, {'status': 'ok', 'competencias': [1, 2]})
+    cache.gravar(cache.chave(b'erro'), {'status': 'erro'})
+    assert cache.obter(chave) == {'status': 'ok', 'competencias': [1, 2]}
+    assert cache.obter(cache.chave(b'erro')) is None
+
+    # Limite abaixo de três entradas: a terceira gravação remove a mais antiga
+    tamanho = os.path.getsize(os.path.join(str(tmp_path), chave + '.json'))
+    cache = CacheResultadoCSV(str(tmp_path / 'lru'), tamanho_maximo=tamanho * 3 - 1)
+    antiga, recente = cache.chave(b'a'), cache.chave(b'b')
+    cache.gravar(antiga, {'status': 'ok', 'competencias': [1, 2]})
+    cache.gravar(recente, {'status': 'ok', 'competencias': [1, 2]})
+    os.utime(os.path.join(cache.pasta, antiga + '.json'), (0, 0))
+    cache.gravar(cache.chave(b'c'), {'status': 'ok', 'competencias': [1, 2]})
+    assert cache.obter(antiga) is None
+    assert cache.obter(recente) is not None
+
+def test_cache_resultado_csv_pasta_segura(tmp_path, monkeypatch):
+    """
+    Testa a pasta do cache: o padrão fica na pasta de instância, com acesso só
+    do dono; uma pasta de outro usuário é recusada (cache desativado); e uma
+    entrada que não é JSON é descartada.
+    """
+    avisos = []
+    app = SimpleNamespace(config={'CSV_CACHE_TAMANHO_MB': 1}, instance_path=str(tmp_path / 'instancia'),
+                          logger=SimpleNamespace(warning=avisos.append))
+    cache = obter_cache(app)
+    assert cache.pasta == str(tmp_path / 'instancia' / 'cache_csv')
+    assert os.stat(cache.pasta).st_mode & 0o777 == 0o700
+
+    chave = cache.chave(b'conteudo')
+    with open(os.path.join(cache.pasta, chave + '.json'), 'wb') as entrada:
+        entrada.write(b'\x80\x05N.')  # pickle de None
+    assert cache.obter(chave) is None
+    assert not os.path.exists(os.path.join(cache.pasta, chave + '.json'))
+
+    if hasattr(os, 'getuid'):
+        monkeypatch.setattr(os, 'getuid', lambda: os.stat(cache.pasta).st_uid + 1)
+        with pytest.raises(PastaCacheInsegura):
+            CacheResultadoCSV(cache.pasta, 10 ** 6)
+        app.config['CSV_CACHE_DIR'] = str(tmp_path / 'outra')
+        os.makedirs(app.config['CSV_CACHE_DIR'])
+        assert obter_cache(app) is None and len(avisos) == 1
+
+def test_termos_busca_clientes():
+    """
+    Testa a normalização dos termos da busca de clientes: sem acentos e em
+    minúsculas; documentos digitados com pontuação viram um único termo.
+    """
+
+    assert _termos('  São JOÃO ') == ['sao', 'joao']
+    assert _termos('11.222.333/0001') == ['112223330001']
+    assert _termos('Padaria 2000') == ['padaria', '2000']
+    assert _termos('"*') == []
+
+
+def test_busca_clientes_sincronizada_com_o_cadastro(app_arquivo, cabecalho_admin, monkeypatch):
+    """
+    Testa a busca de clientes pela API: prefixo sem acentos, documento só com
+    dígitos, e a tabela de busca acompanhando inclusão, alteração, atualização
+    cadastral em lote (UPDATE fora do ORM) e exclusão.
+    """
+    cliente = app_arquivo.test_client()
+
+    def buscar(consulta):
+        resposta = cliente.get('/api/clientes/buscar', query_string={'q': consulta}, headers=cabecalho_admin)
+        return [item['nome'] for item in resposta.get_json()['resultados']]
+
+    empresa = _criar_cliente(tipo_pessoa='PJ', razao_social='Padaria São João', cnpj='11.222.333/0001-81',
+                             municipio='Curitiba')
+    _criar_cliente(tipo_pessoa='PF', nome_completo='João da Silva', cpf='529.982.247-25')
+    assert buscar('padar') == ['Padaria São João']
+    assert buscar('SAO jo') == ['Padaria São João']
+    assert sorted(buscar('joão')) == ['João da Silva', 'Padaria São João']
+    assert buscar('11222') == buscar('11.222.333/0001') == ['Padaria São João']
+    assert buscar('52998224725') == ['João da Silva']
+    assert buscar('xyz') == []
+
+    empresa.razao_social = 'Confeitaria Aurora'
+    db.session.commit()
+    assert buscar('padaria') == []
+    assert buscar('auro') == ['Confeitaria Aurora']
+
+    class FonteReceita:
+        def consultar(self, cnpj):
+            return {'cnpj': cnpj, 'razao_social': 'Mercado Boa Vista', 'municipio': 'Londrina'}
+
+    monkeypatch.setattr(atualizacao_cadastral, 'obter_servico_cnpj', lambda app: SimpleNamespace(
+        fonte=FonteReceita(), validade=timedelta(0), validade_nao_encontrado=timedelta(0)
+    ))
+    assert atualizar_cadastros(aplicar=True)['clientes_alterados'] == 1
+    db.session.commit()
+    assert buscar('aurora') == []
+    assert buscar('boa vis') == buscar('londrina') == ['Mercado Boa Vista']
+
+    db.session.delete(db.session.get(Cliente, empresa.id))
+    db.session.commit()
+    assert buscar('11222333000181') == []
+    assert buscar('mercado') == []
+
+def test_consulta_cnpj_agrupa_consultas_simultaneas():
+    """
+    Testa que consultas simultâneas do mesmo CNPJ fazem uma única chamada à
+    fonte e recebem o mesmo resultado (cache do banco desativado).
+    """
+
+    chamadas = []
+
+    class FonteLenta:
+        def consultar(self, cnpj):
+            chamadas.append(cnpj)
+            time.sleep(0.2)
+            return {'cnpj': cnpj, 'razao_social': 'EMPRESA'}
+
+    servico = ServicoConsultaCNPJ(FonteLenta(), validade=timedelta(0))
+    resultados = []
+    threads = [
+        threading.Thread(target=lambda: resultados.append(servico.consultar('11222333000181')))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert chamadas == ['11222333000181']
+    assert resultados == [{'cnpj': '11222333000181', 'razao_social': 'EMPRESA'}] * 5
+
+def test_comparar_cadastro_receita():
+    """
+    Testa a comparação do cadastro com a resposta da Receita: só os campos
+    diferentes são listados, e vazio e None são considerados iguais.
+    """
+
+    valores = _valores_receita({
+        'cnpj': '11222333000181',
+        'razao_social': 'EMPRESA NOVA LTDA',
+        'descricao_situacao_cadastral': 'BAIXADA',
+        'cnaes_secundarios': [{'codigo': 6201501, 'descricao': 'Desenvolvimento de software'}],
+        'capital_social': 1000
+    })
+    cliente = SimpleNamespace(**dict.fromkeys(CAMPOS_RECEITA))
+    for campo in CAMPOS_RECEITA:
+        setattr(cliente, campo, valores[campo])
+    cliente.razao_social = 'EMPRESA ANTIGA LTDA'
+    cliente.nome_fantasia = None  # A API devolve '' quando não há nome fantasia
+
+    assert comparar_cadastro(cliente, valores) == {
+        'razao_social': {'antes': 'EMPRESA ANTIGA LTDA', 'depois': 'EMPRESA NOVA LTDA'}
+    }
+    assert valores['situacao_cadastral'] == 'BAIXADA'
+    assert valores['cnae_secundarias'] == '["6201501 - Desenvolvimento de software"]'
+
+def test_cache_ttl_autenticacao():
+    """
+    Testa o cache da autenticação: entradas vencidas somem e, acima do
+    limite, a usada há mais tempo é descartada.
+    """
+
+    cache = CacheTTL(tamanho_maximo=2, validade=60)
+    cache.guardar(1, 'a')
+    cache.guardar(2, 'b')
+    assert cache.obter(1) == 'a'  # 1 passa a ser o mais recente
+    cache.guardar(3, 'c')
+    assert cache.obter(2) is None
+    assert cache.obter(1) == 'a' and cache.obter(3) == 'c'
+
+    cache.guardar(4, 'd', validade=0.01)
+    time.sleep(0.02)
+    assert cache.obter(4) is None
+
+def test_autenticacao_invalida_cache_do_usuario(app_arquivo, cabecalho_admin):
+    """
+    Testa o cache da autenticação pelo token_required: desativar, trocar a
+    senha ou excluir um usuário vale na próxima requisição (sem esperar a
+    validade do cache), e um token guardado não vale depois da expiração.
+    """
+    cliente = app_arquivo.test_client()
+    usuario = Usuario(username='maria', email='maria@teste.com', senha_hash='x', papel='USUARIO', nome='Maria')
+    db.session.add(usuario)
+    db.session.commit()
+    usuario_id = usuario.id
+
+    def cabecalho(expiracao):
+        token = jwt.encode({'sub': str(usuario_id), 'exp': expiracao}, os.environ['JWT_SECRET_KEY'], algorithm='HS256')
+        return {'Authorization': f'Bearer {token}'}
+
+    def eu(cabecalho_usuario):
+        resposta = cliente.get('/api/auth/me', headers=cabecalho_usuario)
+        return resposta.status_code, resposta.get_json().get('erro')
+
+    cabecalho_usuario = cabecalho(int(time.time()) + 3600)
+    assert eu(cabecalho_usuario) == (200, None)
+    assert cache_autenticacao._usuarios.obter(usuario_id) is not None
+
+    assert cliente.put(f'/api/auth/usuarios/{usuario_id}/toggle', headers=cabecalho_admin).status_code == 200
+    assert eu(cabecalho_usuario) == (401, 'Usuário inativo')
+    assert cliente.put(f'/api/auth/usuarios/{usuario_id}/toggle', headers=cabecalho_admin).status_code == 200
+    assert eu(cabecalho_usuario) == (200, None)
+
+    db.session.get(Usuario, usuario_id).senha_hash = 'nova'
+    db.session.commit()
+    assert cache_autenticacao._usuarios.obter(usuario_id) is None
+    assert eu(cabecalho_usuario) == (200, None)
+
+    # Token guardado no cache, mas vencido: volta a ser decodificado e é recusado
+    expiracao = int(time.time()) + 2
+    cabecalho_curto = cabecalho(expiracao)
+    assert eu(cabecalho_curto) == (200, None)
+    time.sleep(max(0, expiracao - time.time()) + 0.1)
+    assert eu(cabecalho_curto) == (401, 'Token expirado!')
+
+    assert cliente.delete(f'/api/auth/usuarios/{usuario_id}', headers=cabecalho_admin).status_code == 200
+    assert eu(cabecalho_usuario) == (401, 'Usuário não encontrado!')
+
+def test_gravador_auditoria_grava_em_lotes():
+    """
+    Testa a fila de auditoria: grava ao atingir o tamanho do lote, ao pedir a
+    descarga e ao encerrar, sem perder nem reordenar registros.
+    """
+
+    class GravadorMemoria(GravadorAuditoria):
+        def gravar(self, registros):
+            if registros:
+                self.lotes.append([registro['entidade_id'] for registro in registros])
+
+    gravador = GravadorMemoria(app=None, tamanho_lote=3, intervalo=60)
+    gravador.lotes = []
+    for i in range(7):
+        gravador.registrar({'entidade_id': i})
+    assert gravador.descarregar(timeout=5)
+    assert gravador.lotes == [[0, 1, 2], [3, 4, 5], [6]]
+
+    gravador.registrar({'entidade_id': 7})
+    gravador.encerrar()
+    assert gravador.lotes[-1] == [7]
+
+def test_cursor_logs_ida_e_volta():
+    """Testa o cursor da paginação de logs: volta à mesma posição e recusa texto inválido."""
+
+    log = SimpleNamespace(id=42, data_acao=datetime(2025, 3, 1, 10, 30, 5, 123456))
+    assert decodificar_cursor(codificar_cursor(log)) == (log.data_acao, 42)
+
+    for invalido in ('@@@', 'abc', codificar_cursor(SimpleNamespace(id='x', data_acao=log.data_acao))):
+        with pytest.raises(ValueError):
+            decodificar_cursor(invalido)
+
+def test_resumo_logs_agrupa_por_dia():
+    """Testa a contagem do resumo de logs: mesmo dia, ação, entidade e usuário somam na mesma linha."""
+
+    registros = [
+        {'usuario_id': 1, 'acao': 'CREATE', 'entidade': 'CLIENTE', 'data_acao': datetime(2025, 1, 1, 9, 0)},
+        {'usuario_id': 1, 'acao': 'CREATE', 'entidade': 'CLIENTE', 'data_acao': datetime(2025, 1, 1, 23, 59)},
+        {'usuario_id': 1, 'acao': 'CREATE', 'entidade': 'CLIENTE', 'data_acao': datetime(2025, 1, 2, 0, 0)},
+        {'usuario_id': 2, 'acao': 'CREATE', 'entidade': 'CLIENTE', 'data_acao': datetime(2025, 1, 1, 12, 0)},
+    ]
+    linhas = sorted(contar_registros(registros), key=lambda linha: (linha['dia'], linha['usuario_id']))
+    assert [(linha['dia'], linha['usuario_id'], linha['total']) for linha in linhas] == [
+        (date(2025, 1, 1), 1, 2), (date(2025, 1, 1), 2, 1), (date(2025, 1, 2), 1, 1)
+    ]
+
+def test_segmento_arquivo_le_so_parte_confirmada(tmp_path):
+    """Testa a leitura de um segmento de logs: blocos gzip acrescentados depois do manifesto são ignorados."""
+
+    caminho = tmp_path / 'segmento.jsonl.gz'
+    with gzip.open(caminho, 'at', encoding='utf-8') as arquivo:
+        arquivo.write(json.dumps({'id': 1}) + '\n')
+    with gzip.open(caminho, 'at', encoding='utf-8') as arquivo:
+        arquivo.write(json.dumps({'id': 2}) + '\n')
+    confirmado = caminho.stat().st_size
+    with gzip.open(caminho, 'at', encoding='utf-8') as arquivo:
+        arquivo.write(json.dumps({'id': 3}) + '\n')
+
+    with open(caminho, 'rb') as bruto:
+        with gzip.open(_Limitado(bruto, confirmado), 'rt', encoding='utf-8') as arquivo:
+            assert [json.loads(linha)['id'] for linha in arquivo] == [1, 2]
+
+def _criar_cliente(**dados):
+    cliente = Cliente(**dados)
+    db.session.add(cliente)
+    db.session.commit()
+    return cliente
+
+def test_resolver_cliente_por_documento(app):
+    """
+    Testa a busca de clientes pelo CNPJ/CPF: formatado ou só dígitos, pelas
+    colunas de dígitos mantidas na gravação (inclusive após alterar o documento).
+    """
+    empresa = _criar_cliente(tipo_pessoa='PJ', razao_social='EMPRESA LTDA', cnpj='11.222.333/0001-81')
+    pessoa = _criar_cliente(tipo_pessoa='PF', nome_completo='FULANO', cpf='123.456.789-09')
+
+    assert resolver_cliente_por_cnpj('11.222.333/0001-81') is empresa
+    assert resolver_cliente_por_cnpj('11222333000181') is empresa
+    assert resolver_cliente_por_cnpj('99.999.999/0001-99') is None
+    assert resolver_cliente_por_cnpj('') is None
+    assert resolver_cliente_por_cpf('12345678909') is pessoa
+    assert resolver_cliente_por_cpf('123.456.789-09') is pessoa
+    assert resolver_cliente_por_cpf(None) is None
+
+    assert resolver_clientes_por_cnpj(['11222333000181', '11.222.333/0001-81', '00000000000000']) == {
+        '11222333000181': empresa
+    }
+
+    empresa.cnpj = '44.555.666/0001-77'
+    db.session.commit()
+    assert resolver_cliente_por_cnpj('11222333000181') is None
+    assert resolver_cliente_por_cnpj('44555666000177') is empresa
+
+def test_indice_cnae_similaridade_por_trigramas():
+    """
+    Testa a faixa de similaridade da busca de CNAEs: palavras com erro de
+    digitação são encontradas pelas palavras do vocabulário com trigramas em comum.
+    """
+    indice = IndiceCNAE([
+        ('69206', 'Atividades de contabilidade', 'Contabilidade', 'Serviços', 'Profissionais'),
+        ('56112', 'Restaurantes e similares', 'Alimentação', 'Alimentação', 'Alojamento'),
+    ])
+
+    assert 'contabilidade' in indice._palavras_parecidas('cantabilidade')
+    assert 'similares' not in indice._palavras_parecidas('cantabilidade')
+    assert indice.buscar('cantabilidade') == [('69206', 40)]
+    assert indice.buscar('Restaurante') == [('56112', 100)]
+
+def _criar_usuario():
+    usuario = Usuario(username='admin', email='admin@teste.com', senha_hash='x', papel='ADMIN', nome='Admin')
+    db.session.add(usuario)
+    db.session.commit()
+    return usuario
+
+def _competencia_csv(mes, ano, *notas):
+    """Competência no formato do preview; cada nota é (numero_nf, valor)"""
+    return {
+        'mes': mes, 'ano': ano, 'total_notas': len(notas),
+        'notas': [{'numero_nf': numero, 'valor': valor, 'razao_social_tomador': 'TOMADOR'} for numero, valor in notas]
+    }
+
+def test_consolidar_faturamento_lote(app):
+    """
+    Testa a consolidação em lote: competência existente só é trocada se marcada
+    (indo para a lixeira), a mesma competência em dois arquivos do lote fica
+    com a do último, e o RBT12 das seguintes inclui as competências do lote.
+    """
+    usuario = _criar_usuario()
+    cliente = _criar_cliente(tipo_pessoa='PJ', razao_social='EMPRESA LTDA', cnpj='11.222.333/0001-81',
+                             regime_tributario='Simples Nacional')
+    db.session.add(Processamento(cliente_id=cliente.id, mes=12, ano=2024, faturamento_total=Decimal('200000'),
+                                 imposto_calculado=Decimal('0'), nome_arquivo_original='antigo.csv'))
+    db.session.add(Processamento(cliente_id=cliente.id, mes=1, ano=2025, faturamento_total=Decimal('500'),
+                                 imposto_calculado=Decimal('0'), nome_arquivo_original='antigo.csv'))
+    db.session.commit()
+
+    cliente_info = {'id': cliente.id}
+    arquivos = [
+        {'nome_arquivo': 'a.csv', 'cnpj': cliente.cnpj, 'cliente_info': cliente_info, 'id_temporario': 'a',
+         'competencias': [_competencia_csv(1, 2025, ('1', 700.0)), _competencia_csv(2, 2025, ('2', 1000.0))]},
+        {'nome_arquivo': 'b.csv', 'cnpj': cliente.cnpj, 'cliente_info': cliente_info, 'id_temporario': 'b',
+         'competencias': [_competencia_csv(2, 2025, ('3', 2000.0)), _competencia_csv(3, 2025, ('4', 3000.0))]},
+        {'nome_arquivo': 'c.csv', 'cnpj': '99999999000199', 'cliente_info': None, 'id_temporario': 'c',
+         'competencias': [_competencia_csv(1, 2025, ('5', 1.0))]},
+    ]
+    resultados = consolidar_faturamento_lote(arquivos, {'b': {'2_2025': True}}, usuario.id)
+    db.session.commit()
+
+    assert [(r['arquivo'], r.get('competencia'), r['status']) for r in resultados] == [
+        ('a.csv', '01/2025', 'ignorado'),
+        ('a.csv', '02/2025', 'ignorado'),
+        ('b.csv', '02/2025', 'sucesso'),
+        ('b.csv', '03/2025', 'sucesso'),
+        ('c.csv', None, 'erro'),
+    ]
+
+    processamentos = {
+        (p.ano, p.mes): p for p in Processamento.query.filter_by(cliente_id=cliente.id)
+    }
+    assert processamentos[(2025, 1)].faturamento_total == Decimal('500')
+    assert processamentos[(2025, 2)].faturamento_total == Decimal('2000')
+    assert [d.numero_nf for d in processamentos[(2025, 2)].detalhes] == ['3']
+    # RBT12 de 03/2025: dez/2024 + jan/2025 + fev/2025 (do próprio lote)
+    assert processamentos[(2025, 3)].imposto_calculado == (
+        Decimal('3000') * aliquota_efetiva(Decimal('202500'), 'III')
+    ).quantize(Decimal('0.01'))
+
+    # Substituição de uma competência existente marcada: a anterior vai para a lixeira
+    arquivos = [{'nome_arquivo': 'd.csv', 'cnpj': cliente.cnpj, 'cliente_info': cliente_info, 'id_temporario': 'd',
+                 'competencias': [_competencia_csv(1, 2025, ('6', 800.0))]}]
+    resultados = consolidar_faturamento_lote(arquivos, {'d': {'1_2025': True}}, usuario.id)
+    db.session.commit()
+
+    assert [r['status'] for r in resultados] == ['sucesso']
+    assert Processamento.query.filter_by(cliente_id=cliente.id, mes=1, ano=2025).one().faturamento_total == Decimal('800')
+    assert ItemExcluido.query.filter_by(tipo_entidade='PROCESSAMENTO').count() == 1
+
+def test_verificar_preview_notas_duplicadas(app):
+    """
+    Testa a verificação do preview no banco: competência existente, notas já
+    importadas (pelo numero_nf, inclusive o extraído da descrição) e CNPJ sem cadastro.
+    """
+    cliente = _criar_cliente(tipo_pessoa='PJ', razao_social='EMPRESA LTDA', cnpj='11.222.333/0001-81')
+    processamento = Processamento(cliente_id=cliente.id, mes=1, ano=2025, faturamento_total=Decimal('300'),
+                                  imposto_calculado=Decimal('0'), nome_arquivo_original='antigo.csv')
+    processamento.detalhes.append(FaturamentoDetalhe(descricao_servico='NF 10 - TOMADOR', valor=Decimal('100')))
+    processamento.detalhes.append(FaturamentoDetalhe(descricao_servico='Serviço', valor=Decimal('200'), numero_nf='11'))
+    db.session.add(processamento)
+    db.session.commit()
+
+    resultado = {'arquivos_processados': [
+        {'status': 'ok', 'cnpj': '11222333000181', 'avisos': [], 'competencias': [
+            _competencia_csv(1, 2025, ('10', 100.0), ('11', 200.0), ('12', 50.0)),
+            _competencia_csv(2, 2025, ('10', 100.0)),
+        ]},
+        {'status': 'ok', 'cnpj': '99.999.999/0001-99', 'avisos': [], 'competencias': []},
+        {'status': 'erro', 'cnpj': None, 'avisos': []},
+    ]}
+    verificar_preview_no_banco(resultado)
+
+    arquivo, sem_cadastro, com_erro = resultado['arquivos_processados']
+    janeiro, fevereiro = arquivo['competencias']
+    assert arquivo['cliente_info']['id'] == cliente.id
+    assert janeiro['ja_existe'] and janeiro['faturamento_anterior'] == 300.0
+    assert [nota['numero_nf'] for nota in janeiro['notas_duplicadas']] == ['10', '11']
+    assert janeiro['total_duplicadas'] == 2
+    assert not fevereiro['ja_existe'] and fevereiro['notas_duplicadas'] == []
+    assert sem_cadastro['status'] == 'nao_cadastrado' and sem_cadastro['precisa_cadastrar']
+    assert com_erro['status'] == 'erro'
+    assert len({a['id_temporario'] for a in resultado['arquivos_processados']}) == 3
+
+def _aguardar_job(cliente, cabecalho, job_id, limite=10):
+    """Consulta o job pela API até ele sair de PENDENTE/EXECUTANDO"""
+    fim = time.monotonic() + limite
+    while True:
+        dados = cliente.get(f'/api/importacao/jobs/{job_id}', headers=cabecalho).get_json()
+        if dados['status'] not in ('PENDENTE', 'EXECUTANDO') or time.monotonic() > fim:
+            return dados
+        time.sleep(0.02)
+
+def test_jobs_importacao_consultar_e_cancelar(app_arquivo, usuario_admin, cabecalho_admin, monkeypatch):
+    """
+    Testa os jobs em segundo plano: o andamento e o resultado são consultados
+    pela API, e o cancelamento pedido durante a execução é atendido pelo worker.
+    """
+    iniciado, liberar = threading.Event(), threading.Event()
+
+    def executar_teste(job, parametros):
+        progresso = importacao_jobs.ProgressoJob(job.id, [('a.csv', ['01/2025', '02/2025'])])
+        progresso.competencia_processada(0, 0)
+        iniciado.set()
+        liberar.wait(5)
+        progresso.competencia_processada(0, 1)
+        progresso.salvar(forcar=True)
+        return {'valor': parametros['valor']}
+
+    monkeypatch.setitem(importacao_jobs.EXECUTORES, 'TESTE', executar_teste)
+    cliente = app_arquivo.test_client()
+
+    # Execução completa
+    liberar.set()
+    job_id = importacao_jobs._submeter_job('TESTE', usuario_admin.id, {'valor': 42}).id
+    dados = _aguardar_job(cliente, cabecalho_admin, job_id)
+    assert dados['status'] == 'CONCLUIDO'
+    assert dados['resultado'] == {'valor': 42}
+    assert (dados['itens_processados'], dados['total_itens'], dados['percentual']) == (2, 2, 100.0)
+    assert [c['status'] for c in dados['progresso']['arquivos'][0]['competencias']] == ['processada', 'processada']
+
+    # Cancelamento durante a execução
+    iniciado.clear()
+    liberar.clear()
+    job_id = importacao_jobs._submeter_job('TESTE', usuario_admin.id, {'valor': 1}).id
+    assert iniciado.wait(5)
+    resposta = cliente.post(f'/api/importacao/jobs/{job_id}/cancelar', headers=cabecalho_admin)
+    assert resposta.status_code == 200 and resposta.get_json()['cancelamento_solicitado']
+    liberar.set()
+    assert _aguardar_job(cliente, cabecalho_admin, job_id)['status'] == 'CANCELADO'
+    assert cliente.post(f'/api/importacao/jobs/{job_id}/cancelar', headers=cabecalho_admin).status_code == 400
+
+    assert len(cliente.get('/api/importacao/jobs/', headers=cabecalho_admin).get_json()) == 2
+    assert cliente.get('/api/importacao/jobs/nao-existe', headers=cabecalho_admin).status_code == 404
+
+def test_jobs_orfaos_finalizados_pelo_heartbeat(app_arquivo, usuario_admin, cabecalho_admin, monkeypatch):
+    """
+    Testa a recuperação de jobs abandonados: só os ativos com heartbeat vencido
+    são finalizados (e têm a pasta removida); os de outro processo vivo, mesmo
+    criados antes deste processo, ficam intactos, e o worker não sobrescreve o
+    status de um job já finalizado pela recuperação.
+    """
+    monkeypatch.setattr(importacao_jobs, '_proxima_verificacao_orfaos', 0.0)
+    agora = datetime.utcnow()
+    vencido = agora - timedelta(seconds=importacao_jobs.PRAZO_HEARTBEAT + 60)
+
+    def criar_job(job_id, status, heartbeat, processo='outro-host:123', cancelamento_solicitado=False):
+        db.session.add(JobImportacao(id=job_id, tipo='PREVIEW', status=status, usuario_id=usuario_admin.id,
+                                     parametros='{"arquivos": []}', data_criacao=agora - timedelta(hours=1),
+                                     processo=processo, heartbeat=heartbeat,
+                                     cancelamento_solicitado=cancelamento_solicitado))
+        os.makedirs(importacao_jobs._pasta_job(app_arquivo, job_id))
+
+    criar_job('abandonado', 'EXECUTANDO', vencido)
+    criar_job('abandonado-cancelado', 'PENDENTE', vencido, cancelamento_solicitado=True)
+    criar_job('legado', 'EXECUTANDO', None, processo=None)
+    criar_job('concluido', 'CONCLUIDO', vencido)
+    criar_job('outro-worker', 'EXECUTANDO', agora)
+    criar_job('na-fila', 'PENDENTE', agora - timedelta(seconds=5))
+    criar_job('deste-processo', 'PENDENTE', vencido, processo=importacao_jobs._identificacao_processo())
+    db.session.commit()
+
+    # A thread de heartbeat renova os jobs ativos deste processo
+    importacao_jobs._renovar_heartbeat()
+
+    cliente = app_arquivo.test_client()
+    assert cliente.get('/api/importacao/jobs/', headers=cabecalho_admin).status_code == 200
+
+    db.session.expire_all()
+    jobs = {job.id: job for job in JobImportacao.query}
+    assert {job_id: (job.status, job.erro) for job_id, job in jobs.items()} == {
+        'abandonado': ('ERRO', importacao_jobs.MENSAGEM_JOB_INTERROMPIDO),
+        'abandonado-cancelado': ('CANCELADO', None),
+        'legado': ('ERRO', importacao_jobs.MENSAGEM_JOB_INTERROMPIDO),
+        'concluido': ('CONCLUIDO', None),
+        'outro-worker': ('EXECUTANDO', None),
+        'na-fila': ('PENDENTE', None),
+        'deste-processo': ('PENDENTE', None),
+    }
+    for job_id, job in jobs.items():
+        preservado = job_id in ('concluido', 'outro-worker', 'na-fila', 'deste-processo')
+        assert os.path.isdir(importacao_jobs._pasta_job(app_arquivo, job_id)) == preservado
+        assert (job.parametros is not None) == preservado
+
+    # O worker que volta depois da recuperação não troca o ERRO por CONCLUIDO
+    importacao_jobs._finalizar_job('abandonado', 'CONCLUIDO', resultado={})
+    db.session.expire_all()
+    assert db.session.get(JobImportacao, 'abandonado').status == 'ERRO'
+
+def test_recalculo_confere_com_a_consolidacao(app):
+    """
+    Testa a regra de regime compartilhada: logo após uma importação, o
+    recálculo não encontra diferenças (Lucro Presumido por calcular_impostos,
+    Simples Nacional e clientes sem regime pela tabela do anexo).
+    """
+    usuario = _criar_usuario()
+    clientes = [
+        _criar_cliente(tipo_pessoa='PJ', razao_social=f'EMPRESA {regime}', cnpj=cnpj, regime_tributario=regime)
+        for regime, cnpj in (('Lucro Presumido', '11222333000181'), ('Simples Nacional', '44555666000177'), (None, '77888999000100'))
+    ]
+    arquivos = [
+        {'nome_arquivo': f'{cliente.id}.csv', 'cnpj': cliente.cnpj, 'cliente_info': {'id': cliente.id},
+         'id_temporario': str(cliente.id),
+         'competencias': [_competencia_csv(mes, 2025, (str(mes), 8777.29 * mes)) for mes in range(1, 13)]}
+        for cliente in clientes
+    ]
+    consolidar_faturamento_lote(arquivos, {}, usuario.id)
+    db.session.commit()
+
+    janeiro = {p.cliente_id: p.imposto_calculado for p in Processamento.query.filter_by(mes=1, ano=2025)}
+    assert janeiro[clientes[0].id] == Decimal('1433.33')  # 8777.29 * 16,33%
+    assert janeiro[clientes[1].id] == janeiro[clientes[2].id] == Decimal('526.64')  # Anexo III, 6%
+
+    relatorio = recalcular_impostos()
+    assert relatorio['total_processamentos'] == 36
+    assert relatorio['processamentos_alterados'] == 0
+
+def test_competencia_inteira_e_filtro_de_periodo(app):
+    """
+    Testa a coluna competencia (ano * 12 + mes - 1): preenchida em INSERTs do
+    ORM e em lote, atualizada com ano/mês (Processamento e Recibo), e usada
+    pelo filtro de período, que inclui os meses das datas limite.
+    """
+    usuario = _criar_usuario()
+    cliente = _criar_cliente(tipo_pessoa='PJ', razao_social='EMPRESA LTDA', cnpj='11222333000181')
+    db.session.add_all([
+        Processamento(cliente_id=cliente.id, mes=mes, ano=ano, faturamento_total=Decimal('1'),
+                      imposto_calculado=Decimal('0'), nome_arquivo_original='x.csv')
+        for ano, mes in ((2024, 10), (2024, 11), (2024, 12))
+    ])
+    db.session.execute(insert(Processamento), [
+        {'cliente_id': cliente.id, 'mes': mes, 'ano': 2025, 'faturamento_total': Decimal('1'),
+         'imposto_calculado': Decimal('0'), 'nome_arquivo_original': 'x.csv'}
+        for mes in (1, 2, 3)
+    ])
+    db.session.commit()
+
+    processamentos = Processamento.query.order_by(Processamento.competencia).all()
+    assert [p.competencia for p in processamentos] == [_indice_competencia(p.ano, p.mes) for p in processamentos]
+    assert processamentos[0].competencia == 2024 * 12 + 9
+
+    periodo = _filtro_periodo(Processamento.competencia, date(2024, 11, 30), date(2025, 2, 1))
+    assert [(p.ano, p.mes) for p in Processamento.query.filter(periodo).order_by(Processamento.competencia)] == [
+        (2024, 11), (2024, 12), (2025, 1), (2025, 2)
+    ]
+
+    processamentos[0].ano, processamentos[0].mes = 2023, 1
+    contador = Contador(nome='CONTADOR', cpf='12345678909', crc='CRC', pix='pix', banco='banco',
+                        agencia='1', conta_corrente='1')
+    db.session.add(contador)
+    db.session.flush()
+    recibo = Recibo(cliente_id=cliente.id, contador_id=contador.id, mes=5, ano=2025, valor=Decimal('100'),
+                    usuario_emitente_id=usuario.id)
+    db.session.add(recibo)
+    db.session.commit()
+    assert processamentos[0].competencia == 2023 * 12
+    assert recibo.competencia == 2025 * 12 + 4
+
+    recibo.mes = 6
+    db.session.commit()
+    assert recibo.competencia == 2025 * 12 + 5
+
+def _arquivo_preview(id_temporario, cnpj, status='ok'):
+    """Arquivo no formato de verificar_preview_no_banco, com uma competência"""
+    return {'id_temporario': id_temporario, 'nome_arquivo': f'{id_temporario}.csv', 'cnpj': cnpj, 'status': status,
+            'competencias': [_competencia_csv(1, 2025, ('1', 100.0))]}
+
+def test_previews_armazenados_por_usuario_e_com_validade(app):
+    """
+    Testa o armazenamento dos previews: só arquivos ok/nao_cadastrado são
+    gravados, cada usuário só carrega os seus, os vencidos não são aceitos, e
+    o descarte mantém os arquivos cujo cliente continua sem cadastro.
+    """
+    dono = _criar_usuario()
+    outro = Usuario(username='outro', email='outro@teste.com', senha_hash='x', papel='USUARIO', nome='Outro')
+    db.session.add(outro)
+    cliente = _criar_cliente(tipo_pessoa='PJ', razao_social='EMPRESA LTDA', cnpj='11.222.333/0001-81')
+
+    resultado = armazenar_preview({'arquivos_processados': [
+        _arquivo_preview('a', '11.222.333/0001-81'),
+        _arquivo_preview('b', '99.999.999/0001-99', status='nao_cadastrado'),
+        _arquivo_preview('c', '11.222.333/0001-81', status='erro'),
+    ]}, dono.id)
+    db.session.commit()
+    assert datetime.fromisoformat(resultado['expira_em']) > datetime.utcnow() + timedelta(minutes=119)
+    assert sorted(p.id for p in PreviewImportacao.query) == ['a', 'b']
+
+    assert previews_nao_encontrados(['c', 'a', 'b'], dono.id) == ['c']
+    assert previews_nao_encontrados(['a', 'b'], outro.id) == ['a', 'b']
+    with pytest.raises(PreviewNaoEncontrado) as erro:
+        carregar_previews(['a'], outro.id)
+    assert erro.value.ids == ['a']
+
+    arquivos = carregar_previews(['b', 'a', 'b'], dono.id)
+    assert [(a['id_temporario'], a['cliente_info'] and a['cliente_info']['id']) for a in arquivos] == [
+        ('b', None), ('a', cliente.id)
+    ]
+    assert arquivos[1]['competencias'][0]['notas'][0]['numero_nf'] == '1'
+
+    descartar_previews(arquivos)
+    db.session.commit()
+    assert [p.id for p in PreviewImportacao.query] == ['b']
+
+    # Vencido: não é carregado e é removido quando outro preview é gravado
+    db.session.get(PreviewImportacao, 'b').data_expiracao = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert previews_nao_encontrados(['b'], dono.id) == ['b']
+    armazenar_preview({'arquivos_processados': [_arquivo_preview('d', '11.222.333/0001-81')]}, dono.id)
+    db.session.commit()
+    assert [p.id for p in PreviewImportacao.query] == ['d']
+
+def test_job_preview_e_consolidacao_pela_api(app_arquivo, usuario_admin, cabecalho_admin):
+    """
+    Testa a importação assíncrona de ponta a ponta: o job de preview grava o
+    preview no servidor e o job de consolidação cria o processamento a partir dele.
+    """
+    cliente_db = _criar_cliente(tipo_pessoa='PJ', razao_social='EMPRESA LTDA', cnpj='31.710.936/0001-30',
+                                regime_tributario='Lucro Presumido')
+    cabecalho = ['Tipo de Registro', 'Nº da Nota Fiscal Eletrônica', 'Status da Nota Fiscal',
+                 'Código de Verificação NF', 'Data Hora da Emissão da Nota Fiscal', 'CPF/CNPJ do Prestador',
+                 'Razão Social do Prestador', 'Razão Social do Tomador', 'Valor dos Serviços',
+                 'Data de Competência', 'Data de Cancelamento', 'Discriminação dos Serviços']
+    linhas = [
+        ['2', '101', 'N', 'A1', '', '31.710.936/0001-30', 'Empresa', 'Tomador A', '1.000,00', '05/01/2025', '', 'Serviço'],
+        ['2', '102', 'N', 'A2', '', '31.710.936/0001-30', 'Empresa', 'Tomador B', '500,50', '20/01/2025', '', 'Serviço'],
+    ]
+    conteudo = "\n".join(";".join(linha) for linha in [cabecalho] + linhas).encode('utf-8')
+    cliente = app_arquivo.test_client()
+
+    resposta = cliente.post('/api/faturamento/upload-preview?assincrono=1', headers=cabecalho_admin,
+                            data={'arquivos': (io.BytesIO(conteudo), 'janeiro.csv')},
+                            content_type='multipart/form-data')
+    assert resposta.status_code == 202
+    dados = _aguardar_job(cliente, cabecalho_admin, resposta.get_json()['id'])
+    assert dados['status'] == 'CONCLUIDO', dados.get('erro')
+    arquivo = dados['resultado']['arquivos_processados'][0]
+    assert arquivo['status'] == 'ok' and arquivo['cliente_info']['id'] == cliente_db.id
+    assert dados['progresso']['arquivos'][0]['status'] == 'concluido'
+    assert db.session.get(PreviewImportacao, arquivo['id_temporario']) is not None
+
+    resposta = cliente.post('/api/faturamento/consolidar?assincrono=1', headers=cabecalho_admin,
+                            json={'ids_temporarios': [arquivo['id_temporario']]})
+    assert resposta.status_code == 202
+    dados = _aguardar_job(cliente, cabecalho_admin, resposta.get_json()['id'])
+    assert dados['status'] == 'CONCLUIDO', dados.get('erro')
+
+    db.session.expire_all()
+    processamento = Processamento.query.filter_by(cliente_id=cliente_db.id, mes=1, ano=2025).one()
+    assert processamento.faturamento_total == Decimal('1500.50')
+    assert db.session.get(PreviewImportacao, arquivo['id_temporario']) is None
+
+    resposta = cliente.post('/api/faturamento/consolidar?assincrono=1', headers=cabecalho_admin,
+                            json={'ids_temporarios': [arquivo['id_temporario']]})
+    assert resposta.status_code == 404
+
+def _todas_as_paginas(parametros):
+    """Percorre a listagem pelo cursor e devolve os ids, página a página"""
+    paginas, cursor = [], None
+    while True:
+        itens, cursor = listar_clientes({**parametros, **({'cursor': cursor} if cursor else {})})
+        paginas.append([item['id'] for item in itens])
+        if cursor is None:
+            return paginas
+
+def test_listagem_clientes_cursor_e_campos(app):
+    """
+    Testa a listagem de clientes: as páginas pelo cursor (inclusive com
+    valores repetidos na ordenação e em ordem decrescente) cobrem a lista
+    inteira sem repetir itens, e fields= só aceita colunas expostas.
+    """
+    for razao_social in ('BETA', 'ALFA', 'BETA', 'GAMA', 'ALFA'):
+        _criar_cliente(tipo_pessoa='PJ', razao_social=razao_social, regime_tributario='Simples Nacional')
+    _criar_cliente(tipo_pessoa='PF', nome_completo='ALFA SILVA', cpf='529.982.247-25', email='a@teste.com')
+    _criar_cliente(tipo_pessoa=None, razao_social='ANTIGO')
+
+    for ordem in ('asc', 'desc'):
+        completa = [item['id'] for item in listar_clientes({'ordenar': 'nome', 'ordem': ordem})[0]]
+        paginas = _todas_as_paginas({'ordenar': 'nome', 'ordem': ordem, 'limite': '2'})
+        assert [len(pagina) for pagina in paginas] == [2, 2, 2, 1]
+        assert sum(paginas, []) == completa
+    assert completa[-2:] == [5, 2]  # Empates em ALFA desfeitos pelo id
+
+    pj = listar_clientes({'tipo_pessoa': 'pj', 'fields': 'razao_social, id,razao_social'})[0]
+    assert [set(item) for item in pj] == [{'id', 'razao_social'}] * 6
+    assert listar_clientes({'tipo_pessoa': 'PF'})[0] == [{
+        'id': 6, 'tipo_pessoa': 'PF', 'valor_honorarios': None, 'nome_completo': 'ALFA SILVA',
+        'cpf': '529.982.247-25', 'email': 'a@teste.com', 'telefone1': None
+    }]
+
+    for parametros in ({'fields': 'id,cnpj_digitos'}, {'fields': 'senha'}, {'ordenar': 'email'},
+                       {'limite': '0'}, {'limite': 'dez'}, {'cursor': 'nao-e-cursor'}, {'ativo': 'talvez'},
+                       {'tipo_pessoa': 'XX'}):
+        with pytest.raises(ParametroInvalido):
+            listar_clientes(parametros)
+
+def test_quadro_societario_em_uma_consulta(app):
+    """
+    Testa o carregamento dos sócios: as empresas pedidas vêm em uma única
+    consulta (inclusive as sem sócios), com o endereço do sócio montado, e a
+    consulta inversa lista as empresas de um sócio.
+    """
+    alfa = _criar_cliente(tipo_pessoa='PJ', razao_social='ALFA LTDA', cnpj='11.222.333/0001-81')
+    beta = _criar_cliente(tipo_pessoa='PJ', razao_social='BETA LTDA', cnpj='31.710.936/0001-30')
+    vazia = _criar_cliente(tipo_pessoa='PJ', razao_social='SEM SOCIOS')
+    maria = _criar_cliente(tipo_pessoa='PF', nome_completo='MARIA', cpf='529.982.247-25', logradouro='Rua A',
+                           numero='10', municipio='Curitiba', uf='PR', cep='80000-000')
+    joao = _criar_cliente(tipo_pessoa='PF', nome_completo='JOAO', cpf='111.444.777-35')
+    db.session.add_all([
+        Socio(empresa_id=alfa.id, socio_id=maria.id, percentual_participacao=Decimal('60'), cargo='Administradora'),
+        Socio(empresa_id=alfa.id, socio_id=joao.id, percentual_participacao=Decimal('40')),
+        Socio(empresa_id=beta.id, socio_id=maria.id, percentual_participacao=Decimal('100')),
+    ])
+    db.session.commit()
+    empresa_ids = [alfa.id, vazia.id, beta.id, alfa.id]
+
+    consultas = []
+    registrar = lambda *args: consultas.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', registrar)
+    try:
+        socios = carregar_socios_empresas(empresa_ids)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', registrar)
+    assert len(consultas) == 1
+
+    assert list(socios) == [alfa.id, vazia.id, beta.id]
+    assert socios[vazia.id] == []
+    assert [(s.nome, s.to_dict()['participacao_percentual']) for s in socios[alfa.id]] == [
+        ('MARIA', 60.0), ('JOAO', 40.0)
+    ]
+    assert socios[beta.id][0].endereco_completo == 'Rua A, 10, Curitiba, PR, CEP 80000-000'
+    assert socios[beta.id][0].cliente_id == maria.id
+
+    vinculos = carregar_vinculos_empresa(alfa.id)
+    assert [v.socio.nome_completo for v in vinculos] == ['MARIA', 'JOAO']
+    assert [e['razao_social'] for e in carregar_empresas_do_socio(maria.id)] == ['ALFA LTDA', 'BETA LTDA']
+    assert carregar_empresas_do_socio(vazia.id) == []
+
+def test_listagem_de_logs_sem_duplicados_apos_arquivamento_interrompido(app_arquivo, usuario_admin, cabecalho_admin):
+    """
+    Testa a listagem de logs quando o arquivamento parou depois de gravar o
+    manifesto e antes de remover os logs do banco: cada log aparece uma vez.
+    """
+    antigo = datetime.utcnow() - timedelta(days=400)
+
+    def logs_antigos():
+        return [LogAuditoria(id=i + 1, usuario_id=usuario_admin.id, acao='UPDATE', entidade='CLIENTE',
+                             data_acao=antigo + timedelta(minutes=i)) for i in range(3)]
+
+    db.session.add_all(logs_antigos())
+    db.session.add(LogAuditoria(usuario_id=usuario_admin.id, acao='UPDATE', entidade='CLIENTE'))
+    db.session.commit()
+
+    assert arquivo_logs.arquivar_logs(dias=365)['total'] == 3
+    # Os logs arquivados voltam ao banco, como se o DELETE não tivesse sido confirmado
+    db.session.add_all(logs_antigos())
+    db.session.commit()
+
+    cliente = app_arquivo.test_client()
+    for parametros in ('', '&entidade=CLIENTE', '&acao=UPDATE'):
+        logs = cliente.get(f'/api/logs/?per_page=10{parametros}', headers=cabecalho_admin).get_json()['logs']
+        assert sorted(log['id'] for log in logs) == [1, 2, 3, 4]
+
+def test_pasta_do_arquivo_de_logs(tmp_path, monkeypatch):
+    """
+    Testa a pasta padrão do arquivo de logs: fica na pasta de instância, salvo
+    quando só a pasta antiga (dentro do código-fonte) já tem um manifesto.
+    """
+    app = SimpleNamespace(config={}, instance_path=str(tmp_path / 'instancia'))
+    antiga = tmp_path / 'antiga'
+    monkeypatch.setattr(arquivo_logs, 'PASTA_ARQUIVO_ANTIGA', str(antiga))
+    nova = str(tmp_path / 'instancia' / 'arquivo_logs')
+    assert arquivo_logs.pasta_arquivo(app) == nova
+
+    antiga.mkdir()
+    (antiga / arquivo_logs.NOME_MANIFESTO).write_text('{}')
+    assert arquivo_logs.pasta_arquivo(app) == str(antiga)
+
+    os.makedirs(nova)
+    with open(os.path.join(nova, arquivo_logs.NOME_MANIFESTO), 'w') as manifesto:
+        manifesto.write('{}')
+    assert arquivo_logs.pasta_arquivo(app) == nova
+
+    app.config['AUDITORIA_ARQUIVO_DIR'] = str(tmp_path / 'configurada')
+    assert arquivo_logs.pasta_arquivo(app) == str(tmp_path / 'configurada')
@@ -271,7 +271,10 @@ const PreviewImportacao = ({ dadosPreview: dadosPreviewInicial, onConsolidacaoCo
       await new Promise(resolve => setTimeout(resolve, 1500));
       
       // Executa a consolidação real
-      const resultadoPromise = consolidarCSV(arquivosParaConsolidar, substituicoesPorCompetencia);
+      const resultadoPromise = consolidarCSV(
+        arquivosParaConsolidar.map(arquivo => arquivo.id_temporario),
+        substituicoesPorCompetencia
+      );
       
       // Aguarda ambos (progresso e API)
       const [_, resultado] = await Promise.all([progressoPromise, resultadoPromise]);
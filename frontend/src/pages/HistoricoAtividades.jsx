@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { History, Trash2, ArrowLeft, User, Calendar, Filter, Database, HardDrive, AlertTriangle } from 'lucide-react';
 
@@ -18,6 +18,8 @@ function HistoricoAtividades() {
     const [estatisticas, setEstatisticas] = useState(null);
     const [loadingLimpeza, setLoadingLimpeza] = useState(false);
     const [menuLimpezaAberto, setMenuLimpezaAberto] = useState(false);
+    // Cursor de cada página já alcançada (a página 1 não usa cursor)
+    const cursores = useRef({});
 
     useEffect(() => {
         carregarAtividades();
@@ -47,6 +49,8 @@ function HistoricoAtividades() {
             if (filtros.usuario_id) params.append('usuario_id', filtros.usuario_id);
             params.append('page', filtros.page);
             params.append('per_page', filtros.per_page);
+            if (filtros.page === 1) cursores.current = {};
+            if (cursores.current[filtros.page]) params.append('cursor', cursores.current[filtros.page]);
 
             const response = await fetch(`/api/atividades/?${params}`, {
                 headers: {
@@ -57,6 +61,7 @@ function HistoricoAtividades() {
             if (!response.ok) throw new Error('Erro ao carregar atividades');
 
             const data = await response.json();
+            if (data.proximo_cursor) cursores.current[filtros.page + 1] = data.proximo_cursor;
             setAtividades(data.atividades);
             setPaginacao({
                 total: data.total,
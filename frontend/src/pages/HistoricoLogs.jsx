@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { FileText, Filter, Download, Calendar, User, Activity, ArrowLeft } from 'lucide-react';
 
@@ -18,6 +18,8 @@ function HistoricoLogs() {
     const [entidades, setEntidades] = useState([]);
     const [estatisticas, setEstatisticas] = useState(null);
     const [paginacao, setPaginacao] = useState({});
+    // Cursor de cada página já alcançada (a página 1 não usa cursor)
+    const cursores = useRef({});
 
     useEffect(() => {
         carregarDados();
@@ -36,6 +38,8 @@ function HistoricoLogs() {
             Object.entries(filtros).forEach(([key, value]) => {
                 if (value) params.append(key, value);
             });
+            if (filtros.page === 1) cursores.current = {};
+            if (cursores.current[filtros.page]) params.append('cursor', cursores.current[filtros.page]);
 
             const response = await fetch(`/api/logs/?${params}`, {
                 headers: {
@@ -48,6 +52,7 @@ function HistoricoLogs() {
             }
 
             const data = await response.json();
+            if (data.proximo_cursor) cursores.current[filtros.page + 1] = data.proximo_cursor;
             setLogs(data.logs);
             setPaginacao({
                 total: data.total,
@@ -27,13 +27,14 @@ export const uploadPreviewCSV = async (arquivos) => {
 
 /**
  * Consolida os dados do CSV no banco de dados
- * @param {Object} dados - Dados processados do preview
+ * As notas ficam guardadas no servidor desde o preview: basta enviar os IDs
+ * @param {string[]} idsTemporarios - id_temporario dos arquivos do preview
  * @param {Object} substituicoes - Dict com substituições por competência {arquivo_id: {mes_ano: bool}}
  * @returns {Promise} Resultado da consolidação
  */
-export const consolidarCSV = async (dados, substituicoes = {}) => {
+export const consolidarCSV = async (idsTemporarios, substituicoes = {}) => {
   const response = await api.post('/faturamento/consolidar', {
-    arquivos: dados,
+    ids_temporarios: idsTemporarios,
     substituicoes
   });
   